@@ -15,6 +15,8 @@ from common_lib import sleep
 from global_vars import logger
 from membase.api import httplib2
 from custom_exceptions.exception import ServerUnavailableException
+from connections.rest_connection_pool import RestConnectionPool
+from connections.topology_cache import ClusterTopologyCache
 
 import requests
 
@@ -144,6 +146,12 @@ class RestConnection(object):
             nodes_self_url = self.baseUrl + "pools/default"
         else:
             nodes_self_url = self.baseUrl + 'nodes/self'
+        # Skip the reachability check if a live topology stream
+        # already reports the node as healthy
+        if not self.on_cloud \
+                and ClusterTopologyCache.get_node_status(self.ip, self.port) \
+                == ("active", "healthy"):
+            return
         # for Node is unknown to this cluster error
         node_unknown_msg = "Node is unknown to this cluster"
         unexpected_server_err_msg = "Unexpected server error, request logged"
@@ -183,17 +191,25 @@ class RestConnection(object):
                 print(e)
             return content, False
 
-    def _create_capi_headers(self, username=None, password=None, contentType='application/json', connection='close'):
+    def _create_capi_headers(self, username=None, password=None, contentType='application/json', connection=None):
         if username is None:
             username = self.username
         if password is None:
             password = self.password
+        if connection is None:
+            connection = self.__get_connection_header()
         authorization = base64.encodestring('%s:%s' % (username, password)).strip("\n")
         return {'Content-Type': contentType,
                 'Authorization': 'Basic %s' % authorization,
                 'Connection': connection,
                 'Accept': '*/*'}
 
+    @staticmethod
+    def __get_connection_header():
+        if RestConnectionPool.enabled:
+            return 'keep-alive'
+        return 'close'
+
     @staticmethod
     def get_auth(headers):
         key = 'Authorization'
@@ -206,10 +222,15 @@ class RestConnection(object):
     def _urllib_request(self, api, method='GET', params='', headers=None,
                         timeout=300, verify=False, session=None):
         if session is None:
-            session = requests.Session()
+            if RestConnectionPool.enabled:
+                session = RestConnectionPool.get_pool().get_session(
+                    api, headers)
+            else:
+                session = requests.Session()
         end_time = time.time() + timeout
         while True:
             try:
+                start_time = time.time()
                 if method == "GET":
                     response = session.get(api, params=params, headers=headers,
                                            timeout=timeout, verify=verify)
@@ -224,6 +245,9 @@ class RestConnection(object):
                                            timeout=timeout, verify=verify)
                 status = response.status_code
                 content = response.content
+                if RestConnectionPool.enabled:
+                    RestConnectionPool.get_pool().record_latency(
+                        method, api, (time.time() - start_time) * 1000)
                 if status in [200, 201, 202, 204]:
                     return True, content, response
                 else:
@@ -291,8 +315,13 @@ class RestConnection(object):
         end_time = time.time() + timeout
         while True:
             try:
-                response, content = httplib2.Http(timeout=timeout).request(
-                    api, method, params, headers)
+                if RestConnectionPool.enabled:
+                    response, content = \
+                        RestConnectionPool.get_pool().http_request(
+                            api, method, params, headers, timeout)
+                else:
+                    response, content = httplib2.Http(timeout=timeout) \
+                        .request(api, method, params, headers)
                 if response.status in [200, 201, 202, 204]:
                     return True, content, response
                 else:
@@ -344,7 +373,7 @@ class RestConnection(object):
                                             % (username, password)).strip("\n")
         return {'Content-Type': 'application/x-www-form-urlencoded',
                 'Authorization': 'Basic %s' % authorization,
-                'Connection': 'close',
+                'Connection': self.__get_connection_header(),
                 'Accept': '*/*'}
 
     def get_headers_for_content_type_json(self):
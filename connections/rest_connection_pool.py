@@ -0,0 +1,227 @@
+"""
+Process wide keep-alive HTTP connection pool used by RestConnection
+
+Plain http requests go through pooled httplib2.Http objects, each one
+holding a persistent connection per host. Https requests go through a
+shared requests.Session per (host, user), whose urllib3 pool keeps the
+TLS connections open, so the TLS session / handshake is reused. Sessions
+are not shared across users, so cookies set for one set of credentials
+are never sent with another.
+Number of sockets opened per host is bounded by max_connections_per_host.
+"""
+
+import base64
+import httplib
+import socket
+import time
+from Queue import Queue, Empty
+from threading import Lock
+from urlparse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from global_vars import logger
+from latency_histogram import LatencyHistogram
+from membase.api import httplib2
+from table_view import TableView
+
+
+class _HostPool(object):
+    """ Bounded pool of keep-alive connections for a single host """
+    def __init__(self, max_connections):
+        self.max_connections = max_connections
+        self.lock = Lock()
+        self.idle = Queue()
+        self.num_created = 0
+        # user -> requests.Session
+        self.sessions = dict()
+        self.requests = 0
+        self.reused = 0
+
+    def acquire(self, timeout):
+        try:
+            return self.idle.get_nowait()
+        except Empty:
+            pass
+        with self.lock:
+            if self.num_created < self.max_connections:
+                self.num_created += 1
+                return httplib2.Http(timeout=timeout)
+        # Wait for a connection to get released
+        return self.idle.get(timeout=timeout)
+
+    def release(self, http):
+        self.idle.put(http)
+
+    def discard(self, http):
+        for conn in http.connections.values():
+            conn.close()
+        http.connections.clear()
+
+
+class RestConnectionPool(object):
+    """
+    Per host connection pool shared across all RestConnection objects
+    """
+    # Set to False to fall back to one connection per request
+    enabled = True
+    max_connections_per_host = 8
+
+    __instance = None
+    __instance_lock = Lock()
+
+    def __init__(self):
+        self.log = logger.get("infra")
+        self.lock = Lock()
+        self.host_pools = dict()
+        # (method, endpoint) -> LatencyHistogram
+        self.latencies = dict()
+
+    @classmethod
+    def get_pool(cls):
+        with cls.__instance_lock:
+            if cls.__instance is None:
+                cls.__instance = cls()
+            return cls.__instance
+
+    def __host_pool(self, api):
+        parsed = urlparse(api)
+        host_key = "%s://%s" % (parsed.scheme, parsed.netloc)
+        with self.lock:
+            if host_key not in self.host_pools:
+                self.host_pools[host_key] = _HostPool(
+                    self.max_connections_per_host)
+            return self.host_pools[host_key]
+
+    def record_latency(self, method, api, latency_ms):
+        endpoint = (method, urlparse(api).path)
+        histogram = self.latencies.get(endpoint)
+        if histogram is None:
+            with self.lock:
+                histogram = self.latencies.setdefault(endpoint,
+                                                      LatencyHistogram())
+        histogram.record(latency_ms * 1000)
+
+    def http_request(self, api, method, params, headers, timeout):
+        """
+        Same as httplib2.Http(timeout).request() but over a pooled
+        keep-alive connection.
+        A stale keep-alive connection (closed by the server) is retried
+        once on a fresh connection.
+        :return: (response, content)
+        """
+        host_pool = self.__host_pool(api)
+        try:
+            http = host_pool.acquire(timeout)
+        except Empty:
+            raise socket.error("No free connection to %s within %ss"
+                               % (api, timeout))
+        start_time = time.time()
+        try:
+            for attempt in range(2):
+                reused = bool(http.connections)
+                http.timeout = timeout
+                for conn in http.connections.values():
+                    conn.timeout = timeout
+                    if conn.sock is not None:
+                        conn.sock.settimeout(timeout)
+                try:
+                    response, content = http.request(api, method, params,
+                                                     headers)
+                    break
+                except (socket.error, httplib.HTTPException):
+                    host_pool.discard(http)
+                    if not reused or attempt == 1:
+                        raise
+            with host_pool.lock:
+                host_pool.requests += 1
+                if reused:
+                    host_pool.reused += 1
+        except Exception:
+            host_pool.discard(http)
+            host_pool.release(http)
+            raise
+        if response.get("connection", "").lower() == "close":
+            host_pool.discard(http)
+        host_pool.release(http)
+        self.record_latency(method, api, (time.time() - start_time) * 1000)
+        return response, content
+
+    @staticmethod
+    def __user(headers):
+        """ :return: User of the Basic 'Authorization' header, if any """
+        auth = (headers or dict()).get("Authorization", "")
+        if not auth.startswith("Basic "):
+            return None
+        try:
+            return base64.b64decode(auth[6:]).split(":", 1)[0]
+        except TypeError:
+            return None
+
+    def get_session(self, api, headers=None):
+        """
+        :param headers: Request headers, to pick the session of the user
+                        in the 'Authorization' header
+        :return: requests.Session shared for the host of 'api' and user.
+                 Sessions keep up to max_connections_per_host TLS
+                 connections alive, blocking the callers beyond that
+        """
+        host_pool = self.__host_pool(api)
+        user = self.__user(headers)
+        with host_pool.lock:
+            session = host_pool.sessions.get(user)
+            if session is None:
+                adapter = HTTPAdapter(
+                    pool_connections=1,
+                    pool_maxsize=self.max_connections_per_host,
+                    pool_block=True)
+                session = requests.Session()
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                host_pool.sessions[user] = session
+            host_pool.requests += 1
+            return session
+
+    def close_all(self):
+        with self.lock:
+            host_pools = self.host_pools
+            self.host_pools = dict()
+        for host_pool in host_pools.values():
+            while True:
+                try:
+                    host_pool.discard(host_pool.idle.get_nowait())
+                except Empty:
+                    break
+            for session in host_pool.sessions.values():
+                session.close()
+
+    def get_stats(self):
+        stats = {"hosts": dict(), "endpoints": dict()}
+        for host_key, host_pool in self.host_pools.items():
+            stats["hosts"][host_key] = {
+                "connections": host_pool.num_created,
+                "requests": host_pool.requests,
+                "reused": host_pool.reused}
+        for (method, path), histogram in self.latencies.items():
+            stats["endpoints"]["%s %s" % (method, path)] = {
+                "count": histogram.total_count,
+                "mean_ms": histogram.mean() / 1000,
+                "p50_ms": histogram.percentile(50) / 1000.0,
+                "p99_ms": histogram.percentile(99) / 1000.0,
+                "max_ms": histogram.max / 1000.0}
+        return stats
+
+    def print_stats(self):
+        stats = self.get_stats()
+        table = TableView(self.log.info)
+        table.set_headers(["Endpoint", "Count", "Mean (ms)", "p50 (ms)",
+                           "p99 (ms)", "Max (ms)"])
+        for endpoint in sorted(stats["endpoints"].keys()):
+            e_stat = stats["endpoints"][endpoint]
+            table.add_row([endpoint, e_stat["count"],
+                           "%.2f" % e_stat["mean_ms"],
+                           "%.2f" % e_stat["p50_ms"],
+                           "%.2f" % e_stat["p99_ms"],
+                           "%.2f" % e_stat["max_ms"]])
+        table.display("REST latency per endpoint")
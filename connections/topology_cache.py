@@ -0,0 +1,344 @@
+"""
+Process wide cache of the cluster topology, fed by ns_server's streaming
+endpoints instead of polling
+
+ - /poolsStreaming/default gives the nodes list, from which the
+   node states and the services map are derived
+ - /pools/default/bucketsStreaming/<bucket> gives the bucket's
+   vBucketServerMap
+
+ns_server pushes a fresh payload over these long-lived requests whenever
+the topology changes. One background thread per stream keeps the latest
+payload and notifies the subscribers. A stream which is not connected
+is treated as stale, so that the getters return None and the callers
+fall back to the regular REST call.
+"""
+
+import json
+import threading
+import time
+
+import requests
+
+from Cb_constants import CbServer
+from global_vars import logger
+
+
+class TopologyEvent(object):
+    NODES = "nodes"
+    BUCKET = "bucket"
+
+
+class _Stream(object):
+    """ Long-lived streaming GET request, reconnected on failure """
+    # Payloads are separated by 4 new-lines on the streaming endpoints
+    PAYLOAD_SEPARATOR = "\n\n\n\n"
+    READ_TIMEOUT = 120
+    MAX_BACKOFF = 30
+
+    def __init__(self, url, auth, on_payload, name):
+        self.log = logger.get("infra")
+        self.url = url
+        self.auth = auth
+        self.on_payload = on_payload
+        self.name = name
+        self.connected = False
+        self.stopped = threading.Event()
+        self.response = None
+        self.thread = threading.Thread(target=self.__run, name=name)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.connected = False
+        response = self.response
+        if response is not None:
+            # Unblocks the reader thread
+            response.close()
+
+    def __read_payloads(self):
+        self.response = requests.get(
+            self.url, auth=self.auth, stream=True, verify=False,
+            timeout=(30, self.READ_TIMEOUT))
+        try:
+            if self.response.status_code != 200:
+                raise Exception("Status %s: %s"
+                                % (self.response.status_code,
+                                   self.response.text[:200]))
+            buf = ""
+            for chunk in self.response.iter_content(chunk_size=None):
+                if self.stopped.is_set():
+                    break
+                buf += chunk
+                while self.PAYLOAD_SEPARATOR in buf:
+                    payload, buf = buf.split(self.PAYLOAD_SEPARATOR, 1)
+                    if not payload.strip():
+                        continue
+                    # Marked live before the subscribers get notified
+                    self.connected = True
+                    self.on_payload(json.loads(payload))
+        finally:
+            self.connected = False
+            self.response.close()
+            self.response = None
+
+    def __run(self):
+        backoff = 1
+        while not self.stopped.is_set():
+            start_time = time.time()
+            try:
+                self.__read_payloads()
+            except Exception as e:
+                if self.stopped.is_set():
+                    break
+                self.log.debug("%s - Stream disconnected: %s" % (self.name, e))
+            if time.time() - start_time > self.MAX_BACKOFF:
+                backoff = 1
+            self.stopped.wait(backoff)
+            backoff = min(backoff * 2, self.MAX_BACKOFF)
+
+
+class ClusterTopologyCache(object):
+    """
+    Usage:
+        topology = ClusterTopologyCache.get(cluster.master)
+        services_map = topology.get_services_map()  # None if not live
+        topology.subscribe(callback)  # callback(event, key, data)
+    """
+    # How long the getters wait for the first payload of a new stream.
+    # Waited only once per stream, later calls fall back right away
+    FIRST_PAYLOAD_TIMEOUT = 10
+
+    # (master_ip, port) -> ClusterTopologyCache
+    __caches = dict()
+    __caches_lock = threading.Lock()
+
+    def __init__(self, server):
+        self.log = logger.get("infra")
+        self.server = server
+        self.lock = threading.Condition(threading.Lock())
+        # Incremented on every change
+        self.version = 0
+        self.nodes = None
+        self.services_map = None
+        # bucket_name -> vBucketServerMap
+        self.vbucket_maps = dict()
+        self.subscribers = list()
+        self.__pools_stream = None
+        # bucket_name -> _Stream
+        self.__bucket_streams = dict()
+        # Streams (None for the nodes stream / bucket_name) for which
+        # the first payload wait has timed out
+        self.__first_payload_timeouts = set()
+
+    @classmethod
+    def get(cls, server):
+        """
+        :param server: Any node of the cluster
+        :return: ClusterTopologyCache of the cluster, with its nodes
+                 stream started
+        """
+        key = (server.ip, str(server.port))
+        with cls.__caches_lock:
+            if key not in cls.__caches:
+                cls.__caches[key] = cls(server)
+                cls.__caches[key].__start_pools_stream()
+            return cls.__caches[key]
+
+    @classmethod
+    def stop_all(cls):
+        with cls.__caches_lock:
+            caches = cls.__caches.values()
+            cls.__caches = dict()
+        for cache in caches:
+            cache.stop()
+
+    @classmethod
+    def get_node_status(cls, ip, port):
+        """
+        :return: (clusterMembership, status) of the node as seen by any
+                 of the live caches. None if not known
+        """
+        with cls.__caches_lock:
+            caches = cls.__caches.values()
+        port = str(port)
+        for cache in caches:
+            if not cache.is_live():
+                continue
+            for node in cache.nodes or list():
+                node_ip, node_port = node["hostname"].rsplit(":", 1)
+                if node_ip != ip:
+                    continue
+                # 'hostname' carries the http port. With https the
+                # caller's port is the node's httpsMgmt port
+                if port in [node_port, str(node.get("ports", dict()).get(
+                        "httpsMgmt"))]:
+                    return node.get("clusterMembership"), node.get("status")
+        return None
+
+    def __base_url(self):
+        if CbServer.use_https:
+            return "https://%s:%s/" % (self.server.ip, CbServer.ssl_port)
+        return "http://%s:%s/" % (self.server.ip, self.server.port)
+
+    def __new_stream(self, api, on_payload, name):
+        stream = _Stream(self.__base_url() + api,
+                         (self.server.rest_username,
+                          self.server.rest_password),
+                         on_payload, name)
+        stream.start()
+        return stream
+
+    def __start_pools_stream(self):
+        self.__pools_stream = self.__new_stream(
+            "poolsStreaming/default", self.__on_pools_payload,
+            "topology_stream_%s" % self.server.ip)
+
+    def stop(self):
+        if self.__pools_stream is not None:
+            self.__pools_stream.stop()
+        with self.lock:
+            bucket_streams = self.__bucket_streams.values()
+            self.__bucket_streams = dict()
+        for stream in bucket_streams:
+            stream.stop()
+
+    def is_live(self, bucket_name=None):
+        if bucket_name is None:
+            return self.__pools_stream.connected
+        stream = self.__bucket_streams.get(bucket_name)
+        return stream is not None and stream.connected
+
+    # Subscription
+    def subscribe(self, callback):
+        """
+        :param callback: Called as callback(event, key, data) from the
+                         stream thread on every change, where
+                         event=TopologyEvent.NODES, key=None, data=nodes
+                         event=TopologyEvent.BUCKET, key=bucket_name,
+                         data=vBucketServerMap
+        """
+        with self.lock:
+            self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        with self.lock:
+            if callback in self.subscribers:
+                self.subscribers.remove(callback)
+
+    def __notify(self, event, key, data):
+        with self.lock:
+            self.version += 1
+            self.lock.notify_all()
+            subscribers = list(self.subscribers)
+        for callback in subscribers:
+            try:
+                callback(event, key, data)
+            except Exception as e:
+                self.log.error("Topology subscriber %s failed: %s"
+                               % (callback, e))
+
+    def wait_for_change(self, version, timeout):
+        """
+        Blocks till the topology version moves past 'version'
+        :return: Current version
+        """
+        end_time = time.time() + timeout
+        with self.lock:
+            while self.version == version and time.time() < end_time:
+                self.lock.wait(end_time - time.time())
+            return self.version
+
+    # Stream handlers
+    def __on_pools_payload(self, payload):
+        nodes = list()
+        for node in payload.get("nodes", list()):
+            node = dict(node)
+            if node["hostname"].startswith("127.0.0.1:"):
+                node["hostname"] = "%s:%s" % (
+                    self.server.ip, node["hostname"].split(":")[1])
+            nodes.append(node)
+        services_map = dict()
+        for node in nodes:
+            if node.get("clusterMembership") != "active":
+                continue
+            for service in node.get("services", list()):
+                services_map.setdefault(service, list()).append(
+                    node["hostname"])
+        with self.lock:
+            changed = nodes != self.nodes
+            self.nodes = nodes
+            self.services_map = services_map
+        if changed:
+            self.__notify(TopologyEvent.NODES, None, nodes)
+
+    def __on_bucket_payload(self, bucket_name, payload):
+        vbucket_map = payload.get("vBucketServerMap")
+        if vbucket_map is None:
+            return
+        with self.lock:
+            changed = vbucket_map != self.vbucket_maps.get(bucket_name)
+            self.vbucket_maps[bucket_name] = vbucket_map
+        if changed:
+            self.__notify(TopologyEvent.BUCKET, bucket_name, vbucket_map)
+
+    def __wait_for_first_payload(self, stream_key, is_ready):
+        end_time = time.time() + self.FIRST_PAYLOAD_TIMEOUT
+        with self.lock:
+            if stream_key in self.__first_payload_timeouts:
+                return
+            while not is_ready() and time.time() < end_time:
+                self.lock.wait(end_time - time.time())
+            if not is_ready():
+                self.log.debug("No payload from topology stream %s of %s "
+                               "in %ss" % (stream_key or "nodes",
+                                           self.server.ip,
+                                           self.FIRST_PAYLOAD_TIMEOUT))
+                self.__first_payload_timeouts.add(stream_key)
+
+    # Getters. Return None if the stream is not live
+    def get_nodes(self):
+        """ :return: List of node dicts, as in pools/default """
+        self.__wait_for_first_payload(None, lambda: self.nodes is not None)
+        return self.nodes if self.is_live() else None
+
+    def get_services_map(self):
+        """
+        :return: dict of {service: ["ip:port"]} for the active nodes
+        """
+        self.__wait_for_first_payload(
+            None, lambda: self.services_map is not None)
+        return self.services_map if self.is_live() else None
+
+    def watch_bucket(self, bucket_name):
+        """ Starts streaming the vbucket map of the bucket """
+        with self.lock:
+            if bucket_name in self.__bucket_streams:
+                return
+            self.__bucket_streams[bucket_name] = self.__new_stream(
+                "pools/default/bucketsStreaming/%s" % bucket_name,
+                lambda payload: self.__on_bucket_payload(bucket_name,
+                                                         payload),
+                "topology_stream_%s_%s" % (self.server.ip, bucket_name))
+
+    def unwatch_bucket(self, bucket_name):
+        with self.lock:
+            stream = self.__bucket_streams.pop(bucket_name, None)
+            self.vbucket_maps.pop(bucket_name, None)
+            self.__first_payload_timeouts.discard(bucket_name)
+        if stream is not None:
+            stream.stop()
+
+    def get_vbucket_server_map(self, bucket_name):
+        """
+        :return: vBucketServerMap of the bucket (serverList, vBucketMap,..)
+        """
+        self.watch_bucket(bucket_name)
+        self.__wait_for_first_payload(
+            bucket_name, lambda: bucket_name in self.vbucket_maps)
+        if not self.is_live(bucket_name):
+            return None
+        return self.vbucket_maps.get(bucket_name)
@@ -8,7 +8,6 @@ import copy
 import importlib
 import os.path
 import re
-import threading
 import datetime
 from random import sample, choice
 
@@ -50,8 +49,11 @@ from couchbase_helper.document import View
 from couchbase_helper.documentgenerator import doc_generator, \
     sub_doc_generator, sub_doc_generator_for_edit
 from couchbase_helper.durability_helper import BucketDurability
+from couchbase_helper.vbucket_seqno_snapshot import VbColumns, \
+    VbucketSeqnoSnapshot
 from error_simulation.cb_error import CouchbaseError
 from global_vars import logger
+from job_executor import JobExecutor
 
 from custom_exceptions.exception import StatsUnavailableException, \
     GetBucketInfoFailed
@@ -705,21 +707,22 @@ class DocLoaderUtils(object):
                                  DocLoaderUtils.perform_doc_loading_for_spec
         :return:
         """
-        c_validation_threads = list()
+        c_validation_jobs = list()
         crud_validation_function = \
             DocLoaderUtils.validate_crud_task_per_collection
+        executor = JobExecutor.get()
         for bucket_obj, scope_dict in doc_loading_task.loader_spec.items():
             for s_name, collection_dict in scope_dict["scopes"].items():
                 for c_name, c_dict in collection_dict["collections"].items():
-                    c_thread = threading.Thread(
-                        target=crud_validation_function,
-                        args=[bucket_obj, s_name, c_name, c_dict])
-                    c_thread.start()
-                    c_validation_threads.append(c_thread)
+                    c_validation_jobs.append(executor.submit(
+                        crud_validation_function,
+                        bucket_obj, s_name, c_name, c_dict))
 
-        # Wait for all threads to complete
-        for c_thread in c_validation_threads:
-            c_thread.join()
+        # Wait for all jobs to complete
+        for c_job in c_validation_jobs:
+            if c_job.exception() is not None:
+                DocLoaderUtils.log.error("CRUD validation failed: %s"
+                                         % c_job.exception())
 
         # Set doc_loading result based on the retry outcome
         doc_loading_task.result = True
@@ -2461,14 +2464,13 @@ class BucketUtils(ScopeUtils):
         # Create connection to master node for verifying cbstats
         stat_cmd = "all"
 
-        # Create Tasks to verify total items/replica count in the bucket
-        stats_tasks.append(self.task.async_wait_for_stats(
-            servers, bucket, stat_cmd,
-            'vb_replica_curr_items', '==', items * available_replicas,
-            timeout=timeout))
-        stats_tasks.append(self.task.async_wait_for_stats(
-            servers, bucket, stat_cmd,
-            'curr_items_tot', '==', items * (available_replicas + 1),
+        # Verify total items/replica count in the bucket using one task
+        stats_tasks.append(self.task.async_wait_for_multi_stats(
+            servers, bucket,
+            [(stat_cmd, 'vb_replica_curr_items', '==',
+              items * available_replicas),
+             (stat_cmd, 'curr_items_tot', '==',
+              items * (available_replicas + 1))],
             timeout=timeout))
         try:
             for task in stats_tasks:
@@ -2544,21 +2546,19 @@ class BucketUtils(ScopeUtils):
           timeout - Waiting the end of the thread. (str)
         """
         tasks = list()
-        for server in self.cluster_util.get_kv_nodes(cluster):
-            for bucket in buckets:
-                if bucket.bucketType == 'memcached':
-                    continue
-                if check_ep_items_remaining:
-                    dcp_cmd = "dcp"
-                    tasks.append(self.task.async_wait_for_stats(
-                        [server], bucket, dcp_cmd,
-                        'ep_dcp_items_remaining', "==", 0,
-                        timeout=timeout))
-                tasks.append(self.task.async_wait_for_stats(
-                    [server], bucket, cbstat_cmd,
-                    stat_name, comparison_condition, expected_val,
-                    timeout=timeout))
-                time.sleep(1)
+        kv_nodes = self.cluster_util.get_kv_nodes(cluster)
+        for bucket in buckets:
+            if bucket.bucketType == 'memcached':
+                continue
+            predicates = list()
+            if check_ep_items_remaining:
+                predicates.append(("dcp", 'ep_dcp_items_remaining', "==", 0))
+            predicates.append((cbstat_cmd, stat_name,
+                               comparison_condition, expected_val))
+            # Stats are validated on each node individually
+            tasks.append(self.task.async_wait_for_multi_stats(
+                kv_nodes, bucket, predicates, timeout=timeout,
+                per_node=True))
         for task in tasks:
             self.task.jython_task_manager.get_task_result(task)
 
@@ -3227,70 +3227,75 @@ class BucketUtils(ScopeUtils):
             allowedTimePeriodAbort=_config["allowedTimePeriodAbort"],
             bucket=bucket)
 
+    def get_vbucket_seqno_snapshot(self, servers, buckets,
+                                   with_failovers=True):
+        """
+        Collects the vbucket-seqno / failover stats of all the servers
+        in parallel
+        :return: VbucketSeqnoSnapshot object
+        """
+        return VbucketSeqnoSnapshot.collect(servers, buckets,
+                                            with_failovers=with_failovers)
+
+    def check_vbucket_consistency(self, snapshot, check_abs_high_seqno=False,
+                                  check_purge_seqno=False):
+        """
+        Method to check uuid is consistent on active and replica vbuckets
+        :param snapshot: VbucketSeqnoSnapshot object
+        """
+        fields = ["uuid"]
+        if check_abs_high_seqno:
+            fields.append("abs_high_seqno")
+        if check_purge_seqno:
+            fields.append("purge_seqno")
+        mismatches = snapshot.check_consistency(fields)
+        if mismatches:
+            raise Exception("\n ".join([""] + mismatches))
+
     def get_vbucket_seqnos(self, servers, buckets, skip_consistency=False,
                            per_node=True):
         """
         Method to get vbucket information from a cluster using cbstats
         """
-        new_vbucket_stats = self.data_collector.collect_vbucket_stats(
-            buckets, servers, collect_vbucket=False,
-            collect_vbucket_seqno=True, collect_vbucket_details=False,
-            perNode=per_node)
+        snapshot = self.get_vbucket_seqno_snapshot(servers, buckets)
         if not skip_consistency:
-            new_vbucket_stats = self.compare_per_node_for_vbucket_consistency(
-                new_vbucket_stats)
-        return new_vbucket_stats
+            self.check_vbucket_consistency(snapshot)
+            return snapshot.to_stats_map(per_node=False)
+        return snapshot.to_stats_map(per_node=per_node)
 
     def get_vbucket_seqnos_per_Node_Only(self, cluster, servers, buckets):
         """
         Method to get vbucket information from a cluster using cbstats
         """
         servers = self.cluster_util.get_kv_nodes(cluster, servers)
-        new_vbucket_stats = self.data_collector.collect_vbucket_stats(
-            buckets, servers, collect_vbucket=False,
-            collect_vbucket_seqno=True, collect_vbucket_details=False,
-            perNode=True)
-        self.compare_per_node_for_vbucket_consistency(new_vbucket_stats)
-        return new_vbucket_stats
+        snapshot = self.get_vbucket_seqno_snapshot(servers, buckets)
+        self.check_vbucket_consistency(snapshot)
+        return snapshot.to_stats_map(per_node=True)
 
     def compare_vbucket_seqnos(self, cluster, prev_vbucket_stats,
                                servers, buckets,
                                perNode=False, compare="=="):
         """
             Method to compare vbucket information to a previously stored value
+            :param prev_vbucket_stats: Stats returned by get_vbucket_seqnos()
+                                       or a VbucketSeqnoSnapshot
         """
-        # if self.withMutationOps:
-        #     compare = "<="
-        comp_map = dict()
-        comp_map["uuid"] = {'type': "string", 'operation': "=="}
-        comp_map["abs_high_seqno"] = {'type': "long", 'operation': compare}
-        comp_map["purge_seqno"] = {'type': "string", 'operation': compare}
+        comp_map = {"uuid": "==",
+                    "abs_high_seqno": compare,
+                    "purge_seqno": compare}
 
-        new_vbucket_stats = dict()
         self.log.debug("Begin Verification for vbucket seq_nos comparison")
         if perNode:
-            new_vbucket_stats = self.get_vbucket_seqnos_per_Node_Only(
-                cluster, servers, buckets)
-        else:
-            new_vbucket_stats = self.get_vbucket_seqnos(servers, buckets)
-        if not perNode:
-            compare_vbucket_seqnos_result = self.data_analyzer.compare_stats_dataset(
-                prev_vbucket_stats, new_vbucket_stats, "vbucket_id",
-                comparisonMap=comp_map)
-            isNotSame, summary, _ = self.result_analyzer.analyze_all_result(
-                compare_vbucket_seqnos_result, addedItems=False,
-                deletedItems=False, updatedItems=False)
-        else:
-            compare_vbucket_seqnos_result = self.data_analyzer.compare_per_node_stats_dataset(
-                prev_vbucket_stats, new_vbucket_stats, "vbucket_id",
-                comparisonMap=comp_map)
-            isNotSame, summary, _ = self.result_analyzer.analyze_per_node_result(
-                compare_vbucket_seqnos_result, addedItems=False,
-                deletedItems=False, updatedItems=False)
-        if not isNotSame:
-            raise Exception(summary)
+            servers = self.cluster_util.get_kv_nodes(cluster, servers)
+        snapshot = self.get_vbucket_seqno_snapshot(servers, buckets)
+        self.check_vbucket_consistency(snapshot)
+        mismatches = snapshot.compare(
+            VbucketSeqnoSnapshot.from_stats_map(prev_vbucket_stats),
+            comp_map, per_node=perNode)
+        if mismatches:
+            raise Exception("\n ".join([""] + mismatches))
         self.log.debug("End Verification for vbucket seq_nos comparison")
-        return new_vbucket_stats
+        return snapshot.to_stats_map(per_node=perNode)
 
     @staticmethod
     def compare_per_node_for_vbucket_consistency(map1, check_abs_high_seqno=False,
@@ -3601,15 +3606,11 @@ class BucketUtils(ScopeUtils):
         """
         Method to get failovers logs from a cluster using cbstats
         """
-        vbucketMap = self.data_collector.collect_vbucket_stats(
-            buckets, servers, collect_vbucket=True,
-            collect_vbucket_seqno=False, collect_vbucket_details=False,
-            perNode=True)
-        new_failovers_stats = self.data_collector.collect_failovers_stats(
-            buckets, servers, perNode=True)
-        new_failovers_stats = self.compare_per_node_for_failovers_consistency(
-            new_failovers_stats, vbucketMap)
-        return new_failovers_stats
+        snapshot = self.get_vbucket_seqno_snapshot(servers, buckets)
+        mismatches = snapshot.check_consistency(VbColumns.FAILOVER_FIELDS)
+        if mismatches:
+            raise Exception("\n ".join([""] + mismatches))
+        return snapshot.to_stats_map(per_node=False, failovers=True)
 
     def compare_failovers_logs(self, cluster, prev_failovers_stats,
                                servers, buckets,
@@ -3617,21 +3618,18 @@ class BucketUtils(ScopeUtils):
         """
         Method to compare failover log information to a previously stored value
         """
-        comp_map = dict()
-        comp_map["id"] = {'type': "string", 'operation': "=="}
-        comp_map["seq"] = {'type': "long", 'operation': "<="}
-        comp_map["num_entries"] = {'type': "string", 'operation': "<="}
+        comp_map = {"failover_uuid": "==",
+                    "failover_seq": "<=",
+                    "failover_entries": "<="}
 
         self.log.debug("Begin Verification for failovers logs comparison")
         servers = self.cluster_util.get_kv_nodes(cluster, servers)
         new_failovers_stats = self.get_failovers_logs(servers, buckets)
-        compare_failovers_result = self.data_analyzer.compare_stats_dataset(
-            prev_failovers_stats, new_failovers_stats, "vbucket_id", comp_map)
-        isNotSame, summary, result = self.result_analyzer.analyze_all_result(
-            compare_failovers_result, addedItems=False, deletedItems=False,
-            updatedItems=False)
-        if not isNotSame:
-            raise Exception(summary)
+        mismatches = new_failovers_stats.snapshot.compare(
+            VbucketSeqnoSnapshot.from_stats_map(prev_failovers_stats),
+            comp_map)
+        if mismatches:
+            raise Exception("\n ".join([""] + mismatches))
         self.log.debug("End Verification for failovers logs comparison")
         return new_failovers_stats
 
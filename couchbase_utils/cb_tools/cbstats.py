@@ -1,19 +1,128 @@
+import exceptions
 import re
+import socket
 import zlib
 import json
+from collections import namedtuple
+from threading import Lock
 
 from memcached.helper.data_helper import MemcachedClientHelper
 from BucketLib.bucket import Bucket
+from global_vars import logger
+
+
+# Typed records returned by the parsed stat APIs
+FailoverEntry = namedtuple("FailoverEntry", ["uuid", "seq"])
+
+
+class VbucketSeqno(object):
+    """ Parsed 'vbucket-seqno' stats of a single vbucket """
+    __slots__ = ("vb", "uuid", "high_seqno", "abs_high_seqno",
+                 "last_persisted_seqno", "purge_seqno",
+                 "last_persisted_snap_start", "last_persisted_snap_end",
+                 "high_completed_seqno", "high_prepared_seqno",
+                 "max_visible_seqno")
+
+    def __init__(self, vb):
+        for field in self.__slots__:
+            setattr(self, field, None)
+        self.vb = vb
+
+    def as_dict(self):
+        return dict([(field, getattr(self, field))
+                     for field in self.__slots__])
+
+    def __repr__(self):
+        return "VbucketSeqno(%s)" % ", ".join(
+            ["%s=%s" % (field, getattr(self, field))
+             for field in self.__slots__])
+
+
+class _PersistentClient(object):
+    """ Cached memcached connection for a (node, bucket) pair """
+    def __init__(self):
+        self.lock = Lock()
+        self.client = None
 
 
 class Cbstats:
+    # Errors after which a cached connection cannot be used anymore
+    CONNECTION_ERRORS = (socket.error, exceptions.EOFError, AssertionError)
 
-    def __init__(self, server, username=None, password=None):
+    # Process wide cache of persistent connections
+    __clients = dict()
+    __clients_lock = Lock()
+
+    def __init__(self, server, username=None, password=None,
+                 persistent=False):
+        """
+        :param server: Server object
+        :param username: Username for memcached auth. Defaults to the
+                         server's rest_username
+        :param password: Password for memcached auth
+        :param persistent: If True, one authenticated connection per
+                           (node, bucket) is kept open and shared across
+                           the Cbstats objects, instead of connecting for
+                           every stat call
+        """
         self.server = server
         self.port = server.port
         self.mc_port = server.memcached_port
         self.username = username or server.rest_username
         self.password = password or server.rest_password
+        self.persistent = persistent
+
+    def __new_client(self, bucket_name):
+        return MemcachedClientHelper.direct_client(
+            self.server, Bucket({"name": bucket_name}), 30,
+            self.username, self.password)
+
+    def __run_with_client(self, bucket_name, func):
+        """
+        Runs func(client) using a memcached client selected on the bucket.
+        In persistent mode, the cached connection is reused and
+        re-established once if it turns out to be broken
+        :return: Return value of func
+        """
+        if not self.persistent:
+            client = self.__new_client(bucket_name)
+            try:
+                return func(client)
+            finally:
+                client.close()
+
+        key = (self.server.ip, self.mc_port, bucket_name, self.username)
+        with Cbstats.__clients_lock:
+            if key not in Cbstats.__clients:
+                Cbstats.__clients[key] = _PersistentClient()
+            p_client = Cbstats.__clients[key]
+        with p_client.lock:
+            for attempt in range(2):
+                reused = p_client.client is not None
+                if not reused:
+                    p_client.client = self.__new_client(bucket_name)
+                try:
+                    return func(p_client.client)
+                except Cbstats.CONNECTION_ERRORS as e:
+                    p_client.client.close()
+                    p_client.client = None
+                    if not reused or attempt == 1:
+                        raise
+                    logger.get("infra").debug(
+                        "Stale stat connection to %s:%s (%s), reconnecting: "
+                        "%s" % (self.server.ip, self.mc_port, bucket_name, e))
+
+    @classmethod
+    def close_all_connections(cls):
+        """ Closes all the persistent connections """
+        with cls.__clients_lock:
+            p_clients = cls.__clients.values()
+            cls.__clients = dict()
+        for p_client in p_clients:
+            with p_client.lock:
+                if p_client.client is not None:
+                    p_client.client.close()
+                    p_client.client = None
 
     def __calculate_vbucket_num(self, doc_key, total_vbuckets):
         """
@@ -28,6 +137,12 @@ class Cbstats:
         """
         return (((zlib.crc32(doc_key)) >> 16) & 0x7fff) & (total_vbuckets-1)
 
+    @staticmethod
+    def __get_collection_details(client):
+        client.collections_supported = True
+        collection_details = json.loads(client.get_collections()[2])
+        return collection_details, client.stats("collections")
+
     def get_scopes(self, bucket):
         """
         Fetches list of scopes for the particular bucket
@@ -42,13 +157,8 @@ class Cbstats:
         """
         scope_data = dict()
 
-        client = MemcachedClientHelper.direct_client(
-            self.server, Bucket({"name": bucket.name}), 30,
-            self.username, self.password)
-        client.collections_supported = True
-        collection_details = json.loads(client.get_collections()[2])
-        collection_stats = client.stats("collections")
-        client.close()
+        collection_details, collection_stats = self.__run_with_client(
+            bucket.name, self.__get_collection_details)
         scope_data["manifest_uid"] = int(collection_stats["manifest_uid"])
         scope_data["count"] = 0
         for s_details in collection_details["scopes"]:
@@ -79,13 +189,8 @@ class Cbstats:
         """
         collection_data = dict()
 
-        client = MemcachedClientHelper.direct_client(
-            self.server, Bucket({"name": bucket.name}), 30,
-            self.username, self.password)
-        client.collections_supported = True
-        collection_details = json.loads(client.get_collections()[2])
-        collection_stats = client.stats("collections")
-        client.close()
+        collection_details, collection_stats = self.__run_with_client(
+            bucket.name, self.__get_collection_details)
 
         collection_data["count"] = 0
         collection_data["manifest_uid"] = collection_stats["manifest_uid"]
@@ -135,13 +240,143 @@ class Cbstats:
         # result = dict()
         if stat_name == "all":
             stat_name = ""
-        client = MemcachedClientHelper.direct_client(
-            self.server, Bucket({"name": bucket_name}), 30,
-            self.username, self.password)
-        output = client.stats(stat_name)
-        client.close()
+        output = self.__run_with_client(
+            bucket_name, lambda client: client.stats(stat_name))
         return output if key is None else output[key]
 
+    def get_stats_multi(self, bucket_name, stat_names):
+        """
+        Fetches multiple stat groups in a single round-trip over the
+        memcached connection.
+
+        :param bucket_name: Name of the bucket to get the stats
+        :param stat_names: List of stat_commands accepted by cbstats.
+                           "all" / "" fetches the default stats
+        :return: dict of {stat_name: {stat_key: value}}
+        """
+        groups = ["" if stat_name == "all" else stat_name
+                  for stat_name in stat_names]
+        output = self.__run_with_client(
+            bucket_name, lambda client: client.stats_multi(groups))
+        return dict([(stat_name, output[group])
+                     for stat_name, group in zip(stat_names, groups)])
+
+    def get_parsed_stats(self, bucket_name, stat_names):
+        """
+        Same as get_stats_multi(), but returns each stat group parsed
+        into typed structures:
+          vbucket-seqno - {vb_num: VbucketSeqno}
+          failovers     - {vb_num: [FailoverEntry]} (latest entry first)
+          vbucket       - {vb_num: vbucket_state}
+          checkpoint / vbucket-details / other per vbucket groups -
+                          {vb_num: {stat_name: value}}
+          other groups  - {stat_name: value}
+        Here vb_num is an int and numeric values are converted to int
+
+        :param bucket_name: Name of the bucket to get the stats
+        :param stat_names: List of stat_commands accepted by cbstats
+        :return: dict of {stat_name: parsed_stats}
+        """
+        output = self.get_stats_multi(bucket_name, stat_names)
+        result = dict()
+        for stat_name, stats in output.items():
+            group = stat_name.split(" ")[0]
+            if group == "vbucket-seqno":
+                result[stat_name] = self.parse_vbucket_seqno(stats)
+            elif group == "failovers":
+                result[stat_name] = self.parse_failovers(stats)
+            elif group == "vbucket":
+                result[stat_name] = dict(
+                    [(int(key.split("_")[1]), value)
+                     for key, value in stats.items()])
+            elif group in ["checkpoint", "vbucket-details"]:
+                result[stat_name] = self.parse_per_vbucket_stats(stats)
+            else:
+                result[stat_name] = dict(
+                    [(key, self.__to_number(value))
+                     for key, value in stats.items()])
+        return result
+
+    @staticmethod
+    def __to_number(value):
+        try:
+            return int(value)
+        except ValueError:
+            return value
+
+    @staticmethod
+    def parse_per_vbucket_stats(stats):
+        """
+        :param stats: Raw output of a per-vbucket stat group
+        :return: dict of format result[vb_num][stat_name] = value
+        """
+        result = dict()
+        for key, value in stats.items():
+            if not key.startswith("vb_"):
+                continue
+            vb_key, _, stat_name = key.partition(":")
+            vb_num = int(vb_key[3:])
+            if not stat_name:
+                # 'vb_N' itself holds the vbucket state
+                stat_name = "type"
+            try:
+                value = int(value)
+            except ValueError:
+                pass
+            result.setdefault(vb_num, dict())[stat_name] = value
+        return result
+
+    @staticmethod
+    def parse_vbucket_seqno(stats):
+        """
+        :param stats: Raw output of 'vbucket-seqno' stat group
+        :return: dict of {vb_num: VbucketSeqno}
+        """
+        result = dict()
+        fields = set(VbucketSeqno.__slots__)
+        for key, value in stats.items():
+            vb_key, _, stat_name = key.partition(":")
+            if stat_name not in fields or not vb_key.startswith("vb_"):
+                continue
+            vb_num = int(vb_key[3:])
+            if vb_num not in result:
+                result[vb_num] = VbucketSeqno(vb_num)
+            setattr(result[vb_num], stat_name, int(value))
+        return result
+
+    @staticmethod
+    def parse_failovers(stats):
+        """
+        :param stats: Raw output of 'failovers' stat group
+        :return: dict of {vb_num: [FailoverEntry]}, latest entry first
+        """
+        entries = dict()
+        for key, value in stats.items():
+            # Keys are of format vb_N:M:id / vb_N:M:seq / vb_N:num_entries
+            parts = key.split(":")
+            if len(parts) != 3 or parts[2] not in ["id", "seq"]:
+                continue
+            vb_num = int(parts[0][3:])
+            entry = entries.setdefault(vb_num, dict()).setdefault(
+                int(parts[1]), dict())
+            entry[parts[2]] = int(value)
+        result = dict()
+        for vb_num, vb_entries in entries.items():
+            result[vb_num] = [
+                FailoverEntry(vb_entries[index].get("id"),
+                              vb_entries[index].get("seq"))
+                for index in sorted(vb_entries.keys())]
+        return result
+
+    def vbucket_seqno_stats(self, bucket_name):
+        """
+        Typed version of vbucket_seqno()
+        :param bucket_name: Name of the bucket to get the stats
+        :return: dict of {vb_num: VbucketSeqno}
+        """
+        return self.parse_vbucket_seqno(
+            self.get_stats_memc(bucket_name, "vbucket-seqno"))
+
     def get_timings(self, bucket_name, command="raw"):
         """
         Fetches timings stat
@@ -199,12 +434,10 @@ class Cbstats:
         :output - Output for the cbstats command
         :error  - Buffer containing warnings/errors from the execution
         """
-        client = MemcachedClientHelper.direct_client(
-            self.server, Bucket(bucket_name), 30,
-            self.username, self.password)
-        output = client.stats("{} {}".format(stat_name, vbucket_num))
-        client.close()
-        return output
+        return self.__run_with_client(
+            bucket_name,
+            lambda client: client.stats("{} {}".format(stat_name,
+                                                       vbucket_num)))
 
     # Below are wrapper functions for above command executor APIs
     def all_stats(self, bucket_name, stat_name=""):
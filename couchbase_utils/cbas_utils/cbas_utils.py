@@ -25,15 +25,18 @@ from CbasLib.cbas_entity import Dataverse, CBAS_Scope, Link, Dataset, \
     CBAS_Collection, Synonym, CBAS_Index
 from remote.remote_util import RemoteMachineShellConnection, RemoteMachineHelper
 from common_lib import sleep
+from job_executor import JobExecutor
 from Queue import Queue
 from BucketLib.BucketOperations import BucketHelper
 from sdk_exceptions import SDKException
 from collections_helper.collections_spec_constants import MetaConstants, \
     MetaCrudParams
 from Jython_tasks.task import Task, RunQueriesTask
+from Jython_tasks.task_manager import TaskPriority
 from StatsLib.StatsOperations import StatsHelper
 from connections.Rest_Connection import RestConnection
 from Cb_constants import CbServer
+from table_view import TableView
 
 
 class BaseUtil(object):
@@ -279,30 +282,42 @@ class BaseUtil(object):
                     cbas_spec[key] = value
 
     def run_jobs_in_parallel(self, jobs, results, thread_count,
-                             async_run=False):
-
-        def consume_from_queue(jobs, results):
-            while not jobs.empty():
-                job = jobs.get()
-                try:
-                    results.append(job[0](**job[1]))
-                except Exception as e:
-                    self.log.error(str(e))
-                    results.append(False)
-                finally:
-                    jobs.task_done()
-
-        # start worker threads
-        if jobs.qsize() < thread_count:
-            thread_count = jobs.qsize()
-        for tc in range(1, thread_count + 1):
-            worker = Thread(
-                target=consume_from_queue,
-                name="cbas_worker_{0}".format(str(tc)),
-                args=(jobs, results,))
-            worker.start()
+                             async_run=False, timeout=None):
+        """
+        Runs the jobs on the shared JobExecutor
+        :param jobs: Queue of (func, kwargs) tuples
+        :param results: List to which the result of each job is appended,
+                        in order of completion. False for a failed job
+        :param thread_count: Max jobs of this call to run in parallel
+        :param async_run: If True, returns without waiting for the jobs.
+                          jobs.join() can be used to wait for them
+        :param timeout: Max seconds each job can run
+        :return: List of futures of the jobs, holding the actual
+                 exceptions of the failed jobs
+        """
+        def job_done(future):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                self.log.error(str(e))
+                results.append(False)
+            finally:
+                jobs.task_done()
+
+        executor = JobExecutor.get()
+        # Unique target per call, to bound the concurrency of this batch
+        target = "cbas_jobs_%s" % id(jobs)
+        futures = list()
+        while not jobs.empty():
+            func, kwargs = jobs.get()
+            future = executor.submit_job(func, kwargs=kwargs, target=target,
+                                         target_limit=max(thread_count, 1),
+                                         timeout=timeout)
+            future.add_done_callback(job_done)
+            futures.append(future)
         if not async_run:
             jobs.join()
+        return futures
 
     @staticmethod
     def get_kv_entity(cluster, bucket_util, bucket_cardinality=1,
@@ -1776,20 +1791,18 @@ class Dataset_Util(Link_Util):
         return False
 
     def wait_for_ingestion_all_datasets(self, cluster, bucket_util, timeout=600):
-
+        """
+        Waits for all the datasets to ingest the expected number of items.
+        Item counts of all pending datasets are fetched using a single
+        query per poll (see DatasetIngestionMonitor)
+        """
         self.refresh_dataset_item_count(bucket_util)
-        jobs = Queue()
-        results = []
         datasets = self.list_all_dataset_objs()
-        if len(datasets) > 0:
-            self.log.info("Waiting for data to be ingested into datasets")
-            for dataset in datasets:
-                jobs.put((
-                    self.wait_for_ingestion_complete,
-                    {"cluster": cluster, "dataset_name": dataset.full_name,
-                     "num_items": dataset.num_of_items, "timeout": timeout}))
-        self.run_jobs_in_parallel(jobs, results, 15, async_run=False)
-        return all(results)
+        if not datasets:
+            return True
+        self.log.info("Waiting for data to be ingested into datasets")
+        return DatasetIngestionMonitor(self, cluster, datasets,
+                                       timeout=timeout).run()
 
     def validate_cbas_dataset_items_count(
             self, cluster, dataset_name, expected_count, expected_mutated_count=0,
@@ -2608,16 +2621,10 @@ class Dataset_Util(Link_Util):
             self, cluster, bucket_util, timeout=600):
         self.refresh_dataset_item_count(bucket_util)
         datasets = self.list_all_dataset_objs()
-        jobs = Queue()
-        results = list()
-
-        for dataset in datasets:
-            jobs.put((self.wait_for_ingestion_complete,
-                      {"cluster": cluster, "dataset_name": dataset.full_name,
-                       "num_items": dataset.num_of_items, "timeout": timeout}))
-
-        self.run_jobs_in_parallel(jobs, results, 50, async_run=False)
-        return all(results)
+        if not datasets:
+            return True
+        return DatasetIngestionMonitor(self, cluster, datasets,
+                                       timeout=timeout).run()
 
     def refresh_dataset_item_count(self, bucket_util):
         datasets = self.list_all_dataset_objs()
@@ -4279,7 +4286,6 @@ class CbasUtil(UDFUtil):
         if not self.create_dataset_from_spec(cluster, cbas_spec, bucket_util):
             return False, "Failed at create dataset from spec"
 
-        jobs = Queue()
         results = list()
 
         # Connect link only when remote links are present, Local link is connected by default and
@@ -4299,8 +4305,6 @@ class CbasUtil(UDFUtil):
         if not all(results):
             return False, "Failed at connect_link"
 
-        results = []
-
         if wait_for_ingestion:
             # Wait for data ingestion only for datasets based on either local KV source or remote KV source,
             internal_datasets = self.list_all_dataset_objs(
@@ -4308,18 +4312,10 @@ class CbasUtil(UDFUtil):
             self.refresh_dataset_item_count(bucket_util)
             if len(internal_datasets) > 0:
                 self.log.info("Waiting for data to be ingested into datasets")
-                for dataset in internal_datasets:
-                    jobs.put((
-                        self.wait_for_ingestion_complete,
-                        {"cluster": cluster,
-                         "dataset_name": dataset.full_name,
-                         "num_items": dataset.num_of_items,
-                         "timeout": cbas_spec.get("api_timeout", 300)}))
-            self.run_jobs_in_parallel(jobs, results,
-                                      cbas_spec["max_thread_count"],
-                                      async_run=False)
-            if not all(results):
-                return False, "Failed at wait for ingestion"
+                if not DatasetIngestionMonitor(
+                        self, cluster, internal_datasets,
+                        timeout=cbas_spec.get("api_timeout", 300)).run():
+                    return False, "Failed at wait for ingestion"
 
         self.log.info("Creating Synonyms based on CBAS Spec")
         if not self.create_synonym_from_spec(cluster, cbas_spec):
@@ -4737,7 +4733,172 @@ class CbasUtil(UDFUtil):
         return new_servers
 
 
+class DatasetIngestionMonitor(object):
+    """
+    Waits for the ingestion into multiple datasets to complete.
+    On every poll, the item count of all the datasets still pending is
+    fetched using one query of the form
+      SELECT VALUE {"0": (SELECT VALUE COUNT(*) FROM ds_0)[0], ...}
+    (split in chunks of MAX_DATASETS_PER_QUERY datasets). A dataset is
+    dropped from the subsequent polls as soon as it has all its items.
+    Failed polls are retried until the timeout, and a failing chunk
+    falls back to one COUNT(*) query per dataset.
+    Ingestion rate and ETA are tracked per dataset for reporting.
+    """
+    MAX_DATASETS_PER_QUERY = 100
+    # Weight of the latest sample in the ingestion rate (EMA)
+    RATE_SMOOTHING = 0.5
+
+    def __init__(self, cbas_util, cluster, datasets, timeout=600,
+                 poll_interval=2, report_interval=30):
+        self.log = logger.get("test")
+        self.cbas_util = cbas_util
+        self.cluster = cluster
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.report_interval = report_interval
+        self.datasets = list(datasets)
+        self.polls = 0
+        # dataset full_name -> ingestion state
+        self.state = dict()
+        for dataset in self.datasets:
+            self.state[dataset.full_name] = {
+                "expected": dataset.num_of_items, "count": None,
+                "rate": None, "eta": None, "last_poll": None,
+                "completed_in": None}
+
+    def __count_query(self, datasets):
+        return "SELECT VALUE {%s};" % ", ".join(
+            ['"%s": (SELECT VALUE COUNT(*) FROM %s)[0]'
+             % (index, dataset.full_name)
+             for index, dataset in enumerate(datasets)])
+
+    def __execute(self, statement):
+        """
+        :return: Query results, None if the query failed / errored out
+        """
+        try:
+            status, _, errors, results, _ = \
+                self.cbas_util.execute_statement_on_cbas_util(
+                    self.cluster, statement)
+        except Exception as e:
+            # Ex: 503 'Request Rejected', retried on the next poll
+            self.log.warning("Count query failed: %s" % e)
+            return None
+        if status != "success" or not results:
+            self.log.warning("Count query failed: %s" % errors)
+            return None
+        return results
+
+    def fetch_counts(self, datasets):
+        """
+        Fetches the counts in chunks of MAX_DATASETS_PER_QUERY datasets.
+        If a chunk query fails (ex: one of the datasets got dropped), the
+        datasets of the chunk are counted one by one, so the other
+        datasets of the chunk are not held back.
+        :return: dict of dataset full_name -> item count.
+                 Datasets whose count could not be fetched are skipped
+        """
+        counts = dict()
+        for start in range(0, len(datasets), self.MAX_DATASETS_PER_QUERY):
+            chunk = datasets[start:start + self.MAX_DATASETS_PER_QUERY]
+            results = self.__execute(self.__count_query(chunk))
+            if results is not None:
+                for index, dataset in enumerate(chunk):
+                    counts[dataset.full_name] = results[0].get(str(index))
+                continue
+            for dataset in chunk:
+                results = self.__execute("SELECT VALUE COUNT(*) FROM %s;"
+                                         % dataset.full_name)
+                if results is not None:
+                    counts[dataset.full_name] = results[0]
+        return counts
+
+    def __update(self, full_name, count, now, start_time):
+        state = self.state[full_name]
+        if state["count"] is not None and now > state["last_poll"]:
+            sample_rate = (count - state["count"]) \
+                / float(now - state["last_poll"])
+            if state["rate"] is None:
+                state["rate"] = sample_rate
+            else:
+                state["rate"] = self.RATE_SMOOTHING * sample_rate \
+                    + (1 - self.RATE_SMOOTHING) * state["rate"]
+        state["count"] = count
+        state["last_poll"] = now
+        remaining = state["expected"] - count
+        if remaining == 0:
+            state["completed_in"] = now - start_time
+            state["eta"] = 0
+        elif state["rate"] and state["rate"] > 0 and remaining > 0:
+            state["eta"] = remaining / state["rate"]
+        else:
+            state["eta"] = None
+
+    def print_progress(self, pending):
+        table = TableView(self.log.info)
+        table.set_headers(["Dataset", "Expected", "Ingested",
+                           "Rate (items/s)", "ETA (s)"])
+        for dataset in sorted(pending, key=lambda ds: ds.full_name)[:50]:
+            state = self.state[dataset.full_name]
+            table.add_row([dataset.full_name, state["expected"],
+                           state["count"],
+                           "%.2f" % state["rate"]
+                           if state["rate"] is not None else "-",
+                           "%.1f" % state["eta"]
+                           if state["eta"] is not None else "-"])
+        table.display("Datasets pending ingestion: %s" % len(pending))
+
+    def run(self):
+        """
+        :return: True if all datasets ingested the expected num of items
+        """
+        start_time = time.time()
+        end_time = start_time + self.timeout
+        last_report = start_time
+        pending = list(self.datasets)
+        while pending:
+            counts = self.fetch_counts(pending)
+            self.polls += 1
+            now = time.time()
+            still_pending = list()
+            for dataset in pending:
+                count = counts.get(dataset.full_name)
+                if count is not None:
+                    self.__update(dataset.full_name, count, now, start_time)
+                if count == dataset.num_of_items:
+                    self.log.debug("Data ingestion completed for %s in %.2f "
+                                   "seconds" % (dataset.full_name,
+                                                now - start_time))
+                else:
+                    still_pending.append(dataset)
+            pending = still_pending
+            if not pending:
+                break
+            if now >= end_time:
+                break
+            if now - last_report >= self.report_interval:
+                self.print_progress(pending)
+                last_report = now
+            time.sleep(min(self.poll_interval, end_time - now))
+
+        for dataset in pending:
+            self.log.error("Dataset: {0} kv-items: {1} ds-items: {2}".format(
+                dataset.full_name, dataset.num_of_items,
+                self.state[dataset.full_name]["count"]))
+        if pending:
+            self.print_progress(pending)
+        self.log.info("Ingestion monitor: %s/%s datasets completed in %.2fs "
+                      "using %s polls" % (len(self.datasets) - len(pending),
+                                          len(self.datasets),
+                                          time.time() - start_time,
+                                          self.polls))
+        return not pending
+
+
 class FlushToDiskTask(Task):
+    priority_class = TaskPriority.BACKGROUND
+
     def __init__(self, cluster, cbas_util, datasets=[], run_infinitely=False,
                  interval=5):
         super(FlushToDiskTask, self).__init__("FlushToDiskTask")
@@ -4770,6 +4931,8 @@ class FlushToDiskTask(Task):
 
 
 class DisconnectConnectLinksTask(Task):
+    priority_class = TaskPriority.BACKGROUND
+
     def __init__(self, cluster, cbas_util, links, run_infinitely=False, interval=5):
         super(DisconnectConnectLinksTask, self).__init__(
             "DisconnectConnectLinksTask")
@@ -4810,6 +4973,8 @@ class DisconnectConnectLinksTask(Task):
 
 
 class KillProcessesInLoopTask(Task):
+    priority_class = TaskPriority.BACKGROUND
+
     def __init__(self, cluster, cbas_util, cluster_util, cbas_kill_count=0,
                  memcached_kill_count=0, interval=5, timeout=600):
         super(KillProcessesInLoopTask, self).__init__(
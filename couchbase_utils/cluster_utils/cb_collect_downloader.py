@@ -0,0 +1,220 @@
+"""
+Parallel download of the cbcollect zip files from the cluster nodes
+
+Files are streamed over SFTP by a bounded number of worker threads.
+An interrupted transfer resumes from the bytes already written locally,
+on a fresh sftp channel. The MD5 of the file is computed while streaming
+and verified against the md5sum computed on the node (concurrently with
+the download). Falls back to a size check if md5sum is not available.
+"""
+
+import os
+import threading
+import time
+from Queue import Queue, Empty
+
+import jarray
+from java.io import FileInputStream, FileOutputStream
+from java.security import MessageDigest
+
+from common_lib import humanbytes
+from global_vars import logger
+from remote.remote_util import RemoteMachineShellConnection
+from table_view import TableView
+
+
+class DownloadJob(object):
+    def __init__(self, name, server, remote_file, local_dir):
+        self.name = name
+        self.server = server
+        self.remote_file = remote_file
+        self.local_file = os.path.join(local_dir,
+                                       os.path.basename(remote_file))
+        self.status = False
+        self.error = None
+        self.size = 0
+        self.bytes_transferred = 0
+        self.resumed_from = 0
+        self.retries = 0
+        self.checksum = None
+        self.remote_checksum = None
+        self.elapsed = 0.0
+
+    @property
+    def throughput(self):
+        """ :return: Bytes per second transferred in this run """
+        return self.bytes_transferred / max(self.elapsed, 0.001)
+
+
+class CbCollectDownloader(object):
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, max_parallel=4, max_retries=3):
+        self.log = logger.get("infra")
+        self.max_parallel = max_parallel
+        self.max_retries = max_retries
+
+    @staticmethod
+    def __hex_digest(digest):
+        return "".join(["%02x" % (byte & 0xff) for byte in digest.digest()])
+
+    def __hash_local_prefix(self, job, digest):
+        """
+        Hash the partially downloaded local file, to resume the
+        transfer without losing the streaming checksum
+        """
+        if not os.path.exists(job.local_file):
+            return 0
+        buf = jarray.zeros(self.CHUNK_SIZE, 'b')
+        in_stream = FileInputStream(job.local_file)
+        total = 0
+        try:
+            while True:
+                num_read = in_stream.read(buf)
+                if num_read < 0:
+                    break
+                digest.update(buf, 0, num_read)
+                total += num_read
+        finally:
+            in_stream.close()
+        return total
+
+    def __remote_md5(self, job, result):
+        shell = RemoteMachineShellConnection(job.server)
+        try:
+            output, _ = shell.execute_command("md5sum %s" % job.remote_file)
+            if output and output[0].strip():
+                checksum = output[0].split()[0].strip("\\").lower()
+                if len(checksum) == 32:
+                    result["md5"] = checksum
+        except Exception as e:
+            self.log.debug("%s - md5sum failed: %s" % (job.name, e))
+        finally:
+            shell.disconnect()
+
+    def __stream(self, shell, job, digest, offset):
+        """
+        Stream the remote file from 'offset' into the local file
+        :return: Total bytes present in the local file
+        """
+        channel = shell.session.openChannel("sftp")
+        channel.connect()
+        out_stream = None
+        try:
+            job.size = channel.stat(job.remote_file).getSize()
+            if offset > job.size:
+                # Remote file changed, start afresh
+                raise ValueError("Local file larger than remote file")
+            in_stream = channel.get(job.remote_file, None, offset)
+            out_stream = FileOutputStream(job.local_file, offset > 0)
+            buf = jarray.zeros(self.CHUNK_SIZE, 'b')
+            while True:
+                num_read = in_stream.read(buf)
+                if num_read < 0:
+                    break
+                out_stream.write(buf, 0, num_read)
+                digest.update(buf, 0, num_read)
+                offset += num_read
+                job.bytes_transferred += num_read
+            in_stream.close()
+        finally:
+            if out_stream is not None:
+                out_stream.close()
+            channel.disconnect()
+        return offset
+
+    def __download(self, job):
+        md5_result = dict()
+        md5_thread = threading.Thread(target=self.__remote_md5,
+                                      args=(job, md5_result))
+        md5_thread.start()
+        start_time = time.time()
+        shell = RemoteMachineShellConnection(job.server)
+        try:
+            digest = MessageDigest.getInstance("MD5")
+            offset = self.__hash_local_prefix(job, digest)
+            job.resumed_from = offset
+            while True:
+                try:
+                    offset = self.__stream(shell, job, digest, offset)
+                    break
+                except ValueError:
+                    os.remove(job.local_file)
+                    digest.reset()
+                    offset = job.resumed_from = 0
+                except Exception as e:
+                    job.retries += 1
+                    if job.retries > self.max_retries:
+                        raise
+                    # Local file holds exactly the bytes hashed so far
+                    offset = os.path.getsize(job.local_file) \
+                        if os.path.exists(job.local_file) else 0
+                    self.log.warning("%s - Transfer interrupted at %s bytes "
+                                     "(%s). Resuming" % (job.name, offset, e))
+                    shell.disconnect()
+                    shell = RemoteMachineShellConnection(job.server)
+            job.checksum = self.__hex_digest(digest)
+            job.elapsed = time.time() - start_time
+            md5_thread.join()
+            job.remote_checksum = md5_result.get("md5")
+            if job.remote_checksum is not None:
+                job.status = job.remote_checksum == job.checksum
+                if not job.status:
+                    job.error = "Checksum mismatch %s != %s" \
+                                % (job.checksum, job.remote_checksum)
+            else:
+                job.status = offset == job.size and job.size > 0
+                if not job.status:
+                    job.error = "Size mismatch %s != %s" % (offset, job.size)
+        except Exception as e:
+            job.error = str(e)
+            job.elapsed = time.time() - start_time
+        finally:
+            shell.disconnect()
+            md5_thread.join()
+
+    def __worker(self, job_queue):
+        while True:
+            try:
+                job = job_queue.get_nowait()
+            except Empty:
+                break
+            self.log.info("%s - Copying %s to %s"
+                          % (job.name, job.remote_file, job.local_file))
+            self.__download(job)
+            if job.error:
+                self.log.error("%s - Failed to copy %s: %s"
+                               % (job.name, job.remote_file, job.error))
+
+    def download(self, jobs):
+        """
+        Download the files of all jobs, max_parallel at a time
+        :param jobs: List of DownloadJob objects
+        :return: True if all the files are downloaded and verified
+        """
+        job_queue = Queue()
+        for job in jobs:
+            job_queue.put(job)
+        workers = list()
+        for index in range(min(self.max_parallel, len(jobs))):
+            worker = threading.Thread(target=self.__worker,
+                                      args=(job_queue,),
+                                      name="cb_collect_download_%s" % index)
+            worker.start()
+            workers.append(worker)
+        for worker in workers:
+            worker.join()
+        self.print_stats(jobs)
+        return all([job.status for job in jobs])
+
+    def print_stats(self, jobs):
+        table = TableView(self.log.info)
+        table.set_headers(["Node", "Size", "Resumed from", "Retries",
+                           "Time (s)", "Throughput", "Verified"])
+        for job in jobs:
+            table.add_row([job.name, humanbytes(job.size),
+                           humanbytes(job.resumed_from), job.retries,
+                           "%.2f" % job.elapsed,
+                           "%s/s" % humanbytes(job.throughput),
+                           job.status])
+        table.display("cbcollect download stats")
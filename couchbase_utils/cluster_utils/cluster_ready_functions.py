@@ -14,7 +14,11 @@ from Cb_constants import constants, CbServer
 from Jython_tasks.task import MonitorActiveTask, FunctionCallTask
 from TestInput import TestInputSingleton, TestInputServer
 from cb_tools.cb_collectinfo import CbCollectInfo
+from cluster_utils.cb_collect_downloader import CbCollectDownloader, \
+    DownloadJob
+from cluster_utils.log_scanner import LogScanner
 from common_lib import sleep, humanbytes
+from connections.topology_cache import ClusterTopologyCache
 from couchbase_cli import CouchbaseCLI
 from global_vars import logger
 from membase.api.rest_client import RestConnection
@@ -693,8 +697,19 @@ class ClusterUtils:
 
     @staticmethod
     def get_services_map(cluster, reset=True):
-        if not reset:
-            return
+        """
+        :param reset: If True, the map is read using REST, so it reflects
+                      the topology changes just made by the caller.
+                      If False, the map streamed by ClusterTopologyCache
+                      is returned when available, which can lag behind
+                      a topology change
+        """
+        if not reset and not cluster.cloud_cluster:
+            services_map = ClusterTopologyCache.get(
+                cluster.master).get_services_map()
+            if services_map is not None:
+                return dict([(service, list(nodes))
+                             for service, nodes in services_map.items()])
         services_map = dict()
         rest = RestConnection(cluster.master)
         tem_map = rest.get_nodes_services()
@@ -1180,52 +1195,23 @@ class ClusterUtils:
 
     def check_for_panic_and_mini_dumps(self, servers):
         panic_str = "panic"
-        panic_count = 0
+        result = LogScanner().scan(servers, [panic_str], crash_dumps=True)
         for server in servers:
-            shell = RemoteMachineShellConnection(server)
-            output, error = shell.enable_diag_eval_on_non_local_hosts()
-            if output is not None:
-                if "ok" not in output:
-                    self.log.error(
-                        "Error in enabling diag/eval on non-local hosts on {}: Error: {}"
-                        .format(server.ip, error))
-                else:
-                    self.log.debug("Enabled diag/eval for non-local hosts from {}"
-                                   .format(server.ip))
-            else:
-                self.log.debug("Running in compatibility mode, not enabled diag/eval for non-local hosts")
-            _, dir_name = RestConnection(server).diag_eval(
-                'filename:absname(element(2, application:get_env(ns_server,error_logger_mf_dir))).')
-            log = str(dir_name) + '/*'
-            count, err = shell.execute_command("zgrep \"{0}\" {1} | wc -l".
-                                               format(panic_str, log))
-            if isinstance(count, list):
-                count = int(count[0])
-            else:
-                count = int(count)
-            if count > panic_count:
+            panic_trace = result.get_matches(server=server.ip)
+            if panic_trace:
                 self.log.warn("=== PANIC OBSERVED IN THE LOGS ON SERVER %s ==="
                               % server.ip)
-                panic_trace, _ = shell.execute_command("zgrep \"{0}\" {1}".
-                                                       format(panic_str, log))
-                self.log.error("\n {0}".format(panic_trace))
-                panic_count = count
-            os_info = shell.extract_remote_info()
-            if os_info.type.lower() == Windows.NAME:
-                # This is a fixed path in all windows systems inside couchbase
-                dir_name_crash = 'c://CrashDumps'
-            else:
-                dir_name_crash = str(dir_name) + '/../crash/'
-            core_dump_count, err = shell.execute_command(
-                "ls {0}| wc -l".format(dir_name_crash))
-            if isinstance(core_dump_count, list):
-                core_dump_count = int(core_dump_count[0])
-            else:
-                core_dump_count = int(core_dump_count)
+                self.log.error("\n {0}".format(
+                    "\n".join(["%s:%s %s" % (match.file, match.offset,
+                                              match.line)
+                               if match.offset is not None
+                               else "%s %s" % (match.file, match.line)
+                               for match in panic_trace])))
+            core_dump_count = result.crash_dumps.get(server.ip, 0)
             if core_dump_count > 0:
                 self.log.error("=== CORE DUMPS SEEN ON SERVER %s: %s crashes seen ==="
                                % (server.ip, core_dump_count))
-            shell.disconnect()
+        return result
 
     def create_stats_snapshot(self, master):
         self.log.debug("Triggering stats snapshot")
@@ -1268,16 +1254,16 @@ class ClusterUtils:
                 sleep(10, "CB collect still running", log_type="infra")
         return status
 
-    def copy_cb_collect_logs(self, rest, nodes, cluster, log_path):
+    def copy_cb_collect_logs(self, rest, nodes, cluster, log_path,
+                             max_parallel=4):
         status = True
         cb_collect_response = rest.ns_server_tasks("clusterLogsCollection")
         self.log.debug(cb_collect_response)
         node_ids = [node.id for node in nodes]
         if 'perNode' in cb_collect_response and len(node_ids) > 0 and 'path' \
                 in cb_collect_response['perNode'][node_ids[0]]:
+            jobs = list()
             for idx, node in enumerate(nodes):
-                self.log.info("%s: Copying cbcollect ZIP file to Client"
-                              % node_ids[idx])
                 server = [server for server in cluster.servers if
                           server.ip == node.ip][0]
                 remote_client = RemoteMachineShellConnection(server)
@@ -1289,26 +1275,25 @@ class ClusterUtils:
                         .replace(" ", "\\ ")
                     cb_collect_path = os.path.join("/cygdrive",
                                                    cb_collect_path)
-
-                remote_path = os.path.dirname(cb_collect_path)
-                cb_collect_file_name = os.path.basename(cb_collect_path)
-                zip_file_copied = remote_client.get_file(
-                    remote_path, cb_collect_file_name, log_path)
-                if zip_file_copied:
-                    remote_client.execute_command(
-                        "rm -f %s"
-                        % os.path.join(remote_path, cb_collect_file_name))
-                    cb_collect_size = int(os.path.getsize(
-                        os.path.join(log_path, cb_collect_file_name)))
-                    if cb_collect_size == 0:
+                remote_client.disconnect()
+                jobs.append(DownloadJob(node_ids[idx], server,
+                                        cb_collect_path, log_path))
+
+            CbCollectDownloader(max_parallel=max_parallel).download(jobs)
+            for job in jobs:
+                if job.status:
+                    remote_client = RemoteMachineShellConnection(job.server)
+                    remote_client.execute_command("rm -f %s"
+                                                  % job.remote_file)
+                    remote_client.disconnect()
+                    if job.size == 0:
                         status = False
                         self.log.critical("%s cb_collect zip file size: %s"
-                                          % (node.ip, cb_collect_size))
+                                          % (job.server.ip, job.size))
                 else:
                     status = False
                     self.log.error("%s - Failed to copy cb collect zip file"
-                                   % node_ids[idx])
-                remote_client.disconnect()
+                                   % job.name)
         return status
 
     def run_cb_collect(self, node, file_name,
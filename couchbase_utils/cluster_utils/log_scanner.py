@@ -0,0 +1,302 @@
+"""
+Cluster wide scanner for patterns (like 'panic') in the couchbase logs
+
+All nodes are scanned concurrently, with a single remote command per
+node which reads every log file once for all the patterns.
+Scan position (byte offset) and the match counts of every file are
+remembered process wide, so the subsequent scans only read the log data
+written after the previous scan. Files are tracked by inode, so a log
+file renamed during log rotation is not read again from the start.
+The matches found in a file are remembered along with its offset, so
+the matches / counts returned by a scan always cover the whole of the
+current log files, like a full zgrep would.
+
+Windows nodes are scanned in full (zgrep) on every scan, since the
+incremental scan relies on POSIX sh / stat.
+"""
+
+import re
+import threading
+from collections import namedtuple
+
+from global_vars import logger
+from membase.api.rest_client import RestConnection
+from platform_constants.os_constants import Windows
+from remote.remote_util import RemoteMachineShellConnection
+
+LogMatch = namedtuple("LogMatch", ["server", "service", "file", "offset",
+                                   "line", "timestamp"])
+
+
+class LogScanResult(object):
+    def __init__(self):
+        # All the matches in the current log files, including the ones
+        # found in the previous scans
+        self.matches = list()
+        # Matches found only by this scan
+        self.new_matches = list()
+        # server_ip -> {pattern: total_occurrences_in_all_scanned_files}
+        self.total_counts = dict()
+        # server_ip -> number of crash dumps
+        self.crash_dumps = dict()
+        # server_ip -> error string, for nodes which could not be scanned
+        self.errors = dict()
+
+    def get_matches(self, server=None, service=None, pattern=None):
+        return [match for match in self.matches
+                if (server is None or match.server == server)
+                and (service is None or match.service == service)
+                and (pattern is None or pattern in match.line)]
+
+    def count(self, server, pattern=None):
+        """
+        :return: Total occurrences of the pattern(s) on the server,
+                 including the ones found in the previous scans
+        """
+        counts = self.total_counts.get(server, dict())
+        if pattern is not None:
+            return counts.get(pattern, 0)
+        return sum(counts.values())
+
+
+class _FileState(object):
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+        # pattern -> number of lines matched so far
+        self.counts = dict()
+        # LogMatch objects of all the lines matched so far
+        self.matches = list()
+
+
+class LogScanner(object):
+    """
+    Usage:
+        result = LogScanner().scan(servers, ["panic"], crash_dumps=True)
+    """
+    TIMESTAMP_RE = re.compile(
+        r"\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(?:\.\d+)?"
+        r"(?:Z|[+-]\d{2}:?\d{2})?")
+    FILE_MARKER = "@@FILE"
+    CRASH_MARKER = "@@CRASH"
+
+    # server_ip -> log dir
+    __log_dirs = dict()
+    # (server_ip, patterns, file_id) -> _FileState
+    # Offsets are tracked per set of patterns, so that scanning a file for
+    # one pattern does not skip its contents for the others
+    __file_states = dict()
+    __lock = threading.Lock()
+
+    def __init__(self):
+        self.log = logger.get("infra")
+
+    @classmethod
+    def reset(cls):
+        """ Forget all remembered scan offsets """
+        with cls.__lock:
+            cls.__file_states = dict()
+            cls.__log_dirs = dict()
+
+    def get_log_dir(self, server, shell=None):
+        with self.__lock:
+            if server.ip in self.__log_dirs:
+                return self.__log_dirs[server.ip]
+        if shell is not None:
+            output, error = shell.enable_diag_eval_on_non_local_hosts()
+            if output is not None and "ok" not in output:
+                self.log.error("Error in enabling diag/eval on non-local "
+                               "hosts on %s: %s" % (server.ip, error))
+        _, dir_name = RestConnection(server).diag_eval(
+            'filename:absname(element(2, application:get_env('
+            'ns_server,error_logger_mf_dir))).')
+        dir_name = str(dir_name).strip('"')
+        with self.__lock:
+            self.__log_dirs[server.ip] = dir_name
+        return dir_name
+
+    @staticmethod
+    def service_name(file_path):
+        """ goxdcr.log.1 -> goxdcr, memcached.log.000001.txt -> memcached """
+        return file_path.split("/")[-1].split(".")[0]
+
+    def __file_states_for(self, server_ip, patterns):
+        with self.__lock:
+            return dict([(file_id, state)
+                         for (ip, p_key, file_id), state
+                         in self.__file_states.items()
+                         if ip == server_ip and p_key == patterns])
+
+    @staticmethod
+    def __quote(text):
+        return "'%s'" % text.replace("'", "'\\''")
+
+    def __scan_command(self, log_files, patterns, known_files, crash_dir):
+        """
+        Builds a shell script which prints, for every log file,
+        '@@FILE <file_id> <size> <offset> <path>' followed by the
+        'byte_offset:line' of the lines matching any of the patterns.
+        Only the data beyond the remembered offset of the file is read.
+        """
+        grep_args = " ".join(["-e %s" % self.__quote(pattern)
+                              for pattern in patterns])
+        case_stmt = " ".join(['%s) o=%s;;' % (self.__quote(file_id),
+                                              state.offset)
+                              for file_id, state in known_files.items()])
+        script = \
+            'for f in %s; do ' \
+            '[ -f "$f" ] || continue; ' \
+            'set -- $(stat -c "%%s %%i" "$f" 2>/dev/null || ' \
+            'echo "$(wc -c < "$f") $f"); s=$1; id=$2; o=0; ' \
+            'case "$id" in %s *) o=0;; esac; ' \
+            '[ "$o" -gt "$s" ] && o=0; ' \
+            'echo "%s $id $s $o $f"; ' \
+            '[ "$o" -eq "$s" ] && continue; ' \
+            'case "$f" in ' \
+            '*.gz) [ "$o" -eq 0 ] && zcat "$f" | grep -a -b -F %s;; ' \
+            '*) tail -c +$((o+1)) "$f" | head -c $((s-o)) ' \
+            '| grep -a -b -F %s;; ' \
+            'esac; done' \
+            % (" ".join(log_files), case_stmt, self.FILE_MARKER,
+               grep_args, grep_args)
+        if crash_dir:
+            script += '; echo "%s $(ls %s 2>/dev/null | wc -l)"' \
+                      % (self.CRASH_MARKER, crash_dir)
+        # Single command, so it works with the 'sudo' prefix as well
+        return "sh -c %s" % self.__quote(script)
+
+    def __parse_output(self, server_ip, output, patterns, result):
+        known_files = self.__file_states_for(server_ip, patterns)
+        file_states = dict()
+        file_state = None
+        file_offset = 0
+        service = None
+        for line in output:
+            if line.startswith(self.FILE_MARKER + " "):
+                _, file_id, size, offset, path = line.split(" ", 4)
+                file_state = known_files.get(file_id)
+                if file_state is None or int(offset) == 0:
+                    file_state = _FileState(path)
+                file_state.path = path
+                file_state.offset = int(size)
+                file_states[file_id] = file_state
+                file_offset = int(offset)
+                service = self.service_name(path)
+                continue
+            if line.startswith(self.CRASH_MARKER + " "):
+                result.crash_dumps[server_ip] = int(line.split()[1])
+                continue
+            if file_state is None or ":" not in line:
+                continue
+            byte_offset, text = line.split(":", 1)
+            if not byte_offset.isdigit():
+                continue
+            timestamp = self.TIMESTAMP_RE.search(text)
+            for pattern in patterns:
+                if pattern in text:
+                    file_state.counts[pattern] = \
+                        file_state.counts.get(pattern, 0) + 1
+            match = LogMatch(server_ip, service, file_state.path,
+                             file_offset + int(byte_offset), text,
+                             timestamp.group(0) if timestamp else None)
+            file_state.matches.append(match)
+            result.new_matches.append(match)
+
+        total_counts = dict([(pattern, 0) for pattern in patterns])
+        matches = list()
+        with self.__lock:
+            for file_id, file_state in file_states.items():
+                self.__file_states[(server_ip, patterns, file_id)] = \
+                    file_state
+                for pattern in patterns:
+                    total_counts[pattern] += file_state.counts.get(pattern, 0)
+                matches.extend(file_state.matches)
+        result.matches.extend(matches)
+        result.total_counts[server_ip] = total_counts
+
+    def __scan_windows_server(self, shell, server_ip, log_files, patterns,
+                              crash_dir, result):
+        """
+        Full scan of the log files using zgrep, without the offset
+        tracking (no POSIX sh / stat on windows nodes)
+        """
+        grep_args = " ".join(['-e "%s"' % pattern for pattern in patterns])
+        total_counts = dict([(pattern, 0) for pattern in patterns])
+        for log_file in log_files:
+            output, _ = shell.execute_command(
+                "zgrep -h -a -F %s %s" % (grep_args, log_file))
+            for text in output:
+                timestamp = self.TIMESTAMP_RE.search(text)
+                for pattern in patterns:
+                    if pattern in text:
+                        total_counts[pattern] += 1
+                match = LogMatch(server_ip, self.service_name(log_file),
+                                 log_file, None, text,
+                                 timestamp.group(0) if timestamp else None)
+                result.matches.append(match)
+                result.new_matches.append(match)
+        result.total_counts[server_ip] = total_counts
+        if crash_dir:
+            count, _ = shell.execute_command("ls %s | wc -l" % crash_dir)
+            result.crash_dumps[server_ip] = int(count[0]) if count else 0
+
+    def __scan_server(self, server, patterns, log_globs, crash_dumps,
+                      result):
+        shell = RemoteMachineShellConnection(server)
+        try:
+            log_dir = self.get_log_dir(server, shell)
+            log_files = list()
+            for log_glob in log_globs:
+                # Paths built from raw diag_eval output carry the quotes
+                log_glob = log_glob.replace('"', '')
+                if not log_glob.startswith("/"):
+                    log_glob = "%s/%s" % (log_dir, log_glob)
+                log_files.append(log_glob)
+            is_windows = \
+                shell.extract_remote_info().type.lower() == Windows.NAME
+            crash_dir = None
+            if crash_dumps:
+                if is_windows:
+                    # This is a fixed path in all windows systems
+                    crash_dir = 'c://CrashDumps'
+                else:
+                    crash_dir = log_dir + '/../crash/'
+            if is_windows:
+                self.__scan_windows_server(shell, server.ip, log_files,
+                                           patterns, crash_dir, result)
+                return
+            command = self.__scan_command(
+                log_files, patterns,
+                self.__file_states_for(server.ip, patterns), crash_dir)
+            output, _ = shell.execute_command(command)
+            self.__parse_output(server.ip, output, patterns, result)
+        except Exception as e:
+            self.log.error("Log scan failed on %s: %s" % (server.ip, e))
+            result.errors[server.ip] = str(e)
+        finally:
+            shell.disconnect()
+
+    def scan(self, servers, patterns, log_globs=None, crash_dumps=False):
+        """
+        Scan the logs of all servers concurrently
+        :param servers: List of TestInputServer objects
+        :param patterns: List of fixed strings to look for
+        :param log_globs: File globs within the log dir (or absolute
+                          paths) to scan. Defaults to all files ('*')
+        :param crash_dumps: If True, count the crash dumps on the servers
+        :return: LogScanResult object
+        """
+        result = LogScanResult()
+        patterns = tuple(patterns)
+        log_globs = log_globs or ["*"]
+        threads = list()
+        for server in servers:
+            thread = threading.Thread(
+                target=self.__scan_server,
+                args=(server, patterns, log_globs, crash_dumps, result),
+                name="log_scan_%s" % server.ip)
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        return result
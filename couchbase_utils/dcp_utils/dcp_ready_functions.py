@@ -4,6 +4,7 @@ import os
 from dcp_new.constants import *
 from memcacheConstants import *
 from dcp_bin_client import DcpClient
+from dcp_utils.dcp_stream_consumer import DcpStreamConsumer, ListSink
 from global_vars import logger
 import uuid
 from mc_bin_client import MemcachedError
@@ -19,8 +20,9 @@ class DCPUtils(object):
                  enable_stream_id=False, user="Administrator",
                  pwd="password", stream_req_info=False,
                  log_path=None, keep_logs=False, filter_file=None,
-                 vb_retry=10, failover_logging=False,
-                 keys=True, docs=False):
+                 failover_logging=False,
+                 keys=True, docs=False, flow_control_buffer=0,
+                 idle_timeout=10, sinks=None, collect_output=True):
         self.node = node
         self.bucket = bucket
         self.host = self.node.ip
@@ -46,12 +48,19 @@ class DCPUtils(object):
         self.log = logger.get("test")
         self.vbuckets = range(1024)
         self.filter_file = filter_file
-        self.vb_retry = vb_retry
         self.failover_logging = failover_logging
         self.vb_map = None
         self.keys = keys
         self.docs = docs
         self.output_string = list()
+        # 'connection_buffer_size' for the DCP connection. 0 - disabled
+        self.flow_control_buffer = flow_control_buffer
+        # Seconds without any DCP message after which streaming stops
+        self.idle_timeout = idle_timeout
+        # DcpSink objects receiving every DCP message of the streams
+        self.sinks = sinks or list()
+        # Keep formatted mutations in output_string (get_dcp_event output)
+        self.collect_output = collect_output
 
     def initialise_cluster_connections(self):
         self.dcp_client = self.connect()
@@ -132,6 +141,13 @@ class DCPUtils(object):
             response = dcp_client.general_control("enable_stream_id", "true")
             assert response['status'] == SUCCESS
             self.log.debug("Enabled Stream-ID")
+
+        if self.flow_control_buffer:
+            response = dcp_client.general_control(
+                "connection_buffer_size", str(self.flow_control_buffer))
+            assert response['status'] == SUCCESS
+            self.log.debug("Flow control buffer set to %s"
+                           % self.flow_control_buffer)
         return dcp_client
 
     def check_for_features(self, dcp_client):
@@ -165,12 +181,11 @@ class DCPUtils(object):
             else:
                 raise StandardError("Invalid host input", host, "Error origin:", errorOrigin)
 
-    def add_streams(self, vbuckets, start, end, uuid, retry_limit=15, filter=None):
+    def add_streams(self, vbuckets, start, end, uuid, filter=None):
         self.vb_list = vbuckets
         self.start_seq_no_list = start
         self.end_seq_no = end
         self.vb_uuid_list = uuid
-        self.vb_retry = retry_limit
         self.filter_file = filter
         filter_json = []
         streams = []
@@ -211,7 +226,6 @@ class DCPUtils(object):
                     vb_stream = {"id": self.vb_list[index],
                                  "complete": False,
                                  "keys_recvd": 0,
-                                 "timed-out": self.vb_retry,  # Counts the amount of times that vb_stream gets timed out
                                  "stream_open": True,  # Details whether a vb stream is open to avoid repeatedly closing
                                  "stream": stream,
                                  # Set the manifest so we assume _default scope and collection exist
@@ -408,73 +422,61 @@ class DCPUtils(object):
             output_string = str(DCP_Opcode_Dictionary[action]) + " -> " + output_string
             return seqno, output_string
 
-    def process_dcp_traffic(self, streams):
-        active_streams = len(streams)
+    def format_mutation(self, response):
+        formatted = self.handleMutation(response)
+        if formatted is not None:
+            return formatted[1]
+
+    def process_dcp_traffic(self, streams, sinks=None):
+        """
+        Consume all the given streams using DcpStreamConsumer
+        :param streams: vb_stream dicts returned by add_streams()
+        :param sinks: DcpSink objects receiving the DCP messages.
+                      Defaults to the sinks passed during init.
+        :return: List of formatted mutation / system event strings.
+                 Mutations are collected only if collect_output=True
+        """
+        sinks = list(self.sinks if sinks is None else sinks)
+        if self.collect_output:
+            sinks.append(ListSink(self.format_mutation, self.output_string))
+        consumer = DcpStreamConsumer(
+            streams, sinks,
+            flow_control_buffer=self.flow_control_buffer,
+            idle_timeout=self.idle_timeout)
+        for vb, response in consumer.events():
+            opcode = response['opcode']
+            if opcode in (CMD_MUTATION, CMD_DELETION, CMD_EXPIRATION):
+                if self.failover_logging:
+                    self.dcp_log_data.upsert_sequence_no(response['vbucket'],
+                                                         response['by_seqno'])
+                self.checkSnapshot(response['vbucket'],
+                                   vb['snap_end'],
+                                   response['by_seqno'],
+                                   vb['stream'])
+            elif opcode == CMD_SNAPSHOT_MARKER:
+                vb['snap_start'], vb['snap_end'] = self.handleMarker(response)
+            elif opcode == CMD_SYSTEM_EVENT:
+                vb['manifest'] = self.handleSystemEvent(response,
+                                                        vb['manifest'])
+                self.checkSnapshot(response['vbucket'],
+                                   vb['snap_end'],
+                                   response['by_seqno'],
+                                   vb['stream'])
+            elif opcode == CMD_STREAM_END:
+                self.log.info("Received stream end. Stream complete with " \
+                              "reason {}.".format(response['flags']))
+                self.dcp_log_data.push_sequence_no(response['vbucket'])
+            else:
+                self.log.info("Unexpected and unhandled opcode:{}".format(opcode))
+        for sink in sinks:
+            sink.close()
+        self.dcp_log_data.flush()
+        consumer.print_stats()
 
-        while active_streams > 0:
-            for vb in streams:
-                stream = vb['stream']
-                if not vb['complete']:
-                    if stream.has_response():
-                        response = stream.next_response()
-                        if response == None:
-                            vb['complete'] = True
-                            active_streams -= 1
-                            self.dcp_log_data.push_sequence_no(vb['id'])
-                            continue
-                        opcode = response['opcode']
-                        if (opcode == CMD_MUTATION or
-                                opcode == CMD_DELETION or
-                                opcode == CMD_EXPIRATION):
-                            seqno, output_string = self.handleMutation(response)
-                            self.output_string.append(output_string)
-                            if self.failover_logging:
-                                self.dcp_log_data.upsert_sequence_no(response['vbucket'],
-                                                                     response['by_seqno'])
-
-                            vb['timed-out'] = self.vb_retry
-
-                            self.checkSnapshot(response['vbucket'],
-                                               vb['snap_end'],
-                                               response['by_seqno'],
-                                               stream)
-                        elif opcode == CMD_SNAPSHOT_MARKER:
-                            vb['snap_start'], vb['snap_end'] = self.handleMarker(response)
-                        elif opcode == CMD_SYSTEM_EVENT:
-                            vb['manifest'] = self.handleSystemEvent(response,
-                                                                    vb['manifest'])
-                            self.checkSnapshot(response['vbucket'],
-                                               vb['snap_end'],
-                                               response['by_seqno'],
-                                               stream)
-                        elif opcode == CMD_STREAM_END:
-                            self.log.info("Received stream end. Stream complete with " \
-                                          "reason {}.".format(response['flags']))
-                            vb['complete'] = True
-                            active_streams -= 1
-                            self.dcp_log_data.push_sequence_no(response['vbucket'])
-                        else:
-                            self.log.info("Unexpected and unhandled opcode:{}".format(opcode))
-                    else:
-                        self.log.debug('No response')
-
-                if vb['complete']:
-                    # Second-tier timeout - after the stream close to allow other vbuckets to execute
-                    if vb['timed-out'] > 0:
-                        vb['complete'] = False
-                        active_streams += 1
-                        vb['timed-out'] -= 1
-                    else:
-                        if vb['stream_open']:
-                            # Need to close stream to vb - TODO: use a function of mc client instead of raw socket
-                            header = struct.pack(RES_PKT_FMT,
-                                                 REQ_MAGIC_BYTE,
-                                                 CMD_CLOSE_STREAM,
-                                                 0, 0, 0, vb['id'], 0, 0, 0)
-                            self.select_dcp_client(vb['id']).s.sendall(header)
-                            vb['stream_open'] = False
-                            if self.stream_req_info:
-                                self.log.info('Stream to vbucket(s) closed' % str(vb['id']))
+        # Close the streams which did not end within the idle timeout
+        for vb in streams:
+            if vb['stream_open']:
+                self.close_stream(vb)
 
         # Dump each VB manifest if collections were enabled
         if self.collections:
@@ -485,13 +487,24 @@ class DCPUtils(object):
                 break
         return self.output_string
 
+    def close_stream(self, vb):
+        # TODO: use a function of mc client instead of raw socket
+        header = struct.pack(RES_PKT_FMT,
+                             REQ_MAGIC_BYTE,
+                             CMD_CLOSE_STREAM,
+                             0, 0, 0, vb['id'], 0, 0, 0)
+        vb['stream'].client.s.sendall(header)
+        vb['stream_open'] = False
+        if self.stream_req_info:
+            self.log.info('Stream to vbucket %s closed' % vb['id'])
+
     def get_dcp_event(self, filter_file=None):
         self.filter_file = filter_file
         streams = self.add_streams(self.vbuckets,
                                    self.start_seq_no_list,
                                    self.end_seq_no,
                                    self.vb_uuid_list,
-                                   self.vb_retry, self.filter_file)
+                                   self.filter_file)
         output = self.process_dcp_traffic(streams)
         self.close_dcp_streams()
         return output
@@ -507,128 +520,236 @@ class DCPUtils(object):
 
 class LogData(object):
     """ Class to control instance of data for vbuckets
-        If internal use is requested, 'None' should be passed into dirpath"""
+        If internal use is requested, 'None' should be passed into dirpath
+
+        External logs are kept in a single append-only segment file
+        (logs/dcp_log.seg) holding one JSON record per line. Records are
+        buffered and written in batches, and the file offsets of the
+        records of every vbucket are tracked so a vbucket's state can be
+        rebuilt without reading the whole segment. Once the segment grows
+        beyond COMPACT_MIN_RECORDS and COMPACT_RATIO times the live
+        vbuckets, it is compacted into one 'state' record per vbucket."""
+
+    SEGMENT_FILE = "dcp_log.seg"
+    # Number of buffered records after which the buffer gets written
+    FLUSH_RECORDS = 1024
+    COMPACT_MIN_RECORDS = 16384
+    COMPACT_RATIO = 4
 
     def __init__(self, dirpath, vbucket_list, keep_logs):
         self.dictstore = {}
+        self.pending_records = []
+        # vb -> file offsets of the vbucket's records in the segment
+        self.offsets = {}
+        # vb -> number of old_seq_no entries already written to segment
+        self.pushed_old_seq_nos = {}
+        self.num_records = 0
         if dirpath is not None:
             # Create with external file logging
             self.external = True
             self.path = os.path.join(dirpath, os.path.normpath('logs/'))
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path)
+            self.segment_path = os.path.join(self.path, self.SEGMENT_FILE)
             if keep_logs:
-                reset_list = []
-                preset_list = []
-                for vb in vbucket_list:
-                    if os.path.exists(self.get_path(vb)):
-                        preset_list.append(vb)
-                    else:
-                        reset_list.append(vb)
-                self.setup_log_preset(preset_list)
+                self.setup_log_preset(vbucket_list)
+                reset_list = [vb for vb in vbucket_list
+                              if str(vb) not in self.dictstore]
             else:
+                if os.path.exists(self.segment_path):
+                    os.remove(self.segment_path)
                 reset_list = vbucket_list
             self.reset(reset_list)
+            self.flush()
         else:
             self.external = False
 
-
     def setup_log_preset(self, vb_list):
         """ Used when --keep-logs is triggered, to move external data to dictstore """
-        external_data = self.get_all_external(vb_list)
-        for key in external_data.keys():
-            self.dictstore[str(key)] = external_data[key]
-
-    def get_path(self, vb):
-        """ Retrieves path to log file for inputted virtual bucket number """
-        # Make directory if it doesn't exist
+        if not os.path.exists(self.segment_path):
+            self.__import_json_logs(vb_list)
+        self.__load_segment()
+        vb_list = set([str(vb) for vb in vb_list])
+        for vb in self.dictstore.keys():
+            if vb not in vb_list:
+                del self.dictstore[vb]
+
+    def __import_json_logs(self, vb_list):
+        """ Convert logs of the older per vbucket JSON file format """
+        for vb in vb_list:
+            path_string = os.path.join(self.path, '{}.json'.format(vb))
+            if os.path.exists(path_string):
+                with open(path_string, 'r') as vb_log:
+                    self.__append({'vb': str(vb), 'op': 'state',
+                                   'data': json.load(vb_log)})
+        self.flush()
+
+    def __load_segment(self):
+        """ Replay the segment to rebuild dictstore and the offsets """
+        self.dictstore = {}
+        self.offsets = {}
+        self.num_records = 0
+        if not os.path.exists(self.segment_path):
+            return
+        offset = 0
+        valid_upto = 0
+        with open(self.segment_path, 'rb') as segment:
+            for line in segment:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Partially written tail record
+                    break
+                self.__apply(record)
+                self.offsets.setdefault(record['vb'], []).append(offset)
+                self.num_records += 1
+                offset += len(line)
+                valid_upto = offset
+        if valid_upto != os.path.getsize(self.segment_path):
+            with open(self.segment_path, 'r+b') as segment:
+                segment.truncate(valid_upto)
+        for vb, data in self.dictstore.items():
+            self.pushed_old_seq_nos[vb] = len(data.get('old_seq_no') or [])
+
+    def __apply(self, record):
+        vb = record['vb']
+        op = record['op']
+        if op == 'reset':
+            self.dictstore[vb] = {}
+        elif op == 'state':
+            self.dictstore[vb] = record['data']
+        elif op == 'failover':
+            self.dictstore.setdefault(vb, {})['failover_log'] = \
+                record['failover_log']
+        elif op == 'seq_no':
+            data = self.dictstore.setdefault(vb, {})
+            if record['old_seq_no']:
+                data['old_seq_no'] = (data.get('old_seq_no') or []) \
+                    + record['old_seq_no']
+            data['seq_no'] = record['seq_no']
+
+    def __append(self, record):
+        self.pending_records.append(record)
+        if len(self.pending_records) >= self.FLUSH_RECORDS:
+            self.flush()
+
+    def flush(self):
+        """ Write the buffered records to the segment file """
+        if not self.external or not self.pending_records:
+            return
+        with open(self.segment_path, 'ab') as segment:
+            segment.seek(0, os.SEEK_END)
+            offset = segment.tell()
+            lines = []
+            for record in self.pending_records:
+                line = json.dumps(record) + "\n"
+                self.offsets.setdefault(record['vb'], []).append(offset)
+                offset += len(line)
+                lines.append(line)
+            segment.write("".join(lines))
+        self.num_records += len(self.pending_records)
+        self.pending_records = []
+        if self.num_records > max(self.COMPACT_MIN_RECORDS,
+                                  self.COMPACT_RATIO * len(self.offsets)):
+            self.compact()
+
+    def compact(self):
+        """ Rewrite the segment with a single state record per vbucket """
+        if not self.external:
+            return
+        self.pending_records = []
+        tmp_path = self.segment_path + ".tmp"
+        offsets = {}
+        offset = 0
+        with open(tmp_path, 'wb') as segment:
+            for vb in sorted(self.dictstore.keys()):
+                line = json.dumps({'vb': vb, 'op': 'state',
+                                   'data': self.dictstore[vb]}) + "\n"
+                segment.write(line)
+                offsets[vb] = [offset]
+                offset += len(line)
+        os.rename(tmp_path, self.segment_path)
+        self.offsets = offsets
+        self.num_records = len(offsets)
+        for vb, data in self.dictstore.items():
+            self.pushed_old_seq_nos[vb] = len(data.get('old_seq_no') or [])
+
+    def get_path(self, vb=None):
+        """ Retrieves path to the log segment holding the virtual bucket data """
         if self.external:
-            fullpath = os.path.join(self.path, os.path.normpath('{}.json'.format(vb)))
-            dirname = os.path.dirname(fullpath)
-            if dirname and not os.path.exists(dirname):
-                os.mkdir(dirname)
-            elif os.path.isdir(dirname):
-                pass  # Confirms that directory exists
-            else:
-                raise IOError("Cannot create directory inside a file")
-
-            return fullpath
-
+            return self.segment_path
         else:
             raise RuntimeError('LogData specified as internal, no external path')
 
     def reset(self, vb_list):
-        """ Clears/makes files for list of virtual bucket numbers"""
+        """ Clears data for list of virtual bucket numbers"""
         for vb in vb_list:
             self.dictstore[str(vb)] = {}
+            self.pushed_old_seq_nos[str(vb)] = 0
             if self.external:
-                path_string = self.get_path(vb)
-                with open(path_string, 'w') as f:
-                    json.dump({}, f)
+                self.__append({'vb': str(vb), 'op': 'reset'})
 
     def upsert_failover(self, vb, failover_log):
         """ Insert / update failover log """
-        if str(vb) in self.dictstore.keys():
-            self.dictstore[str(vb)]['failover_log'] = failover_log
+        vb = str(vb)
+        if vb in self.dictstore:
+            self.dictstore[vb]['failover_log'] = failover_log
         else:
-            self.dictstore[str(vb)] = {'failover_log': failover_log}
+            self.dictstore[vb] = {'failover_log': failover_log}
 
         if self.external:
-            path_string = self.get_path(vb)
-
-            with open(path_string, 'r') as vb_log:
-                data = json.load(vb_log)
-
-            data['failover_log'] = failover_log
-
-            with open(path_string, 'w') as vb_log:
-                json.dump(data, vb_log)
+            self.__append({'vb': vb, 'op': 'failover',
+                           'failover_log': failover_log})
 
     def upsert_sequence_no(self, vb, seq_no):
         """ Insert / update sequence number, and move old sequence number to appropriate list """
-        if str(vb) in self.dictstore.keys():
-            if 'seq_no' in self.dictstore[str(vb)].keys():
-                if 'old_seq_no' in self.dictstore[str(vb)].keys():
-                    old_seq_no = self.dictstore[str(vb)]['old_seq_no']
-                else:
-                    old_seq_no = []
-                old_seq_no.append(self.dictstore[str(vb)]['seq_no'])
-                self.dictstore[str(vb)]['old_seq_no'] = old_seq_no
-            self.dictstore[str(vb)]['seq_no'] = seq_no
-        else:
+        data = self.dictstore.get(str(vb))
+        if data is None:
             self.dictstore[str(vb)] = {'seq_no': seq_no}
+            return
+        if 'seq_no' in data:
+            old_seq_no = data.get('old_seq_no')
+            if old_seq_no is None:
+                old_seq_no = data['old_seq_no'] = []
+            old_seq_no.append(data['seq_no'])
+        data['seq_no'] = seq_no
 
     def push_sequence_no(self, vb):
-        """ Push sequence number and old sequence number to external JSON files """
+        """ Push sequence number and the old sequence numbers not yet
+            written, to the external log segment """
         if self.external:
-            path_string = self.get_path(vb)
-
-            with open(path_string, 'r') as vb_log:
-                data = json.load(vb_log)
-
-            data['old_seq_no'] = self.dictstore[str(vb)].get('old_seq_no')
-
-            data['seq_no'] = self.dictstore[str(vb)].get('seq_no')
-
-            with open(path_string, 'w') as vb_log:
-                json.dump(data, vb_log)
+            vb = str(vb)
+            data = self.dictstore.get(vb, {})
+            old_seq_no = data.get('old_seq_no') or []
+            pushed = self.pushed_old_seq_nos.get(vb, 0)
+            self.__append({'vb': vb, 'op': 'seq_no',
+                           'seq_no': data.get('seq_no'),
+                           'old_seq_no': old_seq_no[pushed:]})
+            self.pushed_old_seq_nos[vb] = len(old_seq_no)
 
     def get_all(self, vb_list):
         """ Return a dictionary where keys are vbuckets and the data is the total JSON for that vbucket """
         read_dict = {}
         for vb in vb_list:
-            if str(vb) in self.dictstore.keys():
+            if str(vb) in self.dictstore:
                 read_dict[str(vb)] = self.dictstore[str(vb)]
 
         return read_dict
 
     def get_all_external(self, vb_list):
-        read_dict = {}
         if self.external:
-            for vb in vb_list:
-                path_string = self.get_path(vb)
-                if os.path.exists(path_string):
-                    with open(path_string, 'r') as vb_log:
-                        data = json.load(vb_log)
-                    read_dict[str(vb)] = data
+            self.flush()
+            read_dict = {}
+            saved_dictstore = self.dictstore
+            self.dictstore = read_dict
+            try:
+                with open(self.segment_path, 'rb') as segment:
+                    for vb in vb_list:
+                        for offset in self.offsets.get(str(vb), []):
+                            segment.seek(offset)
+                            self.__apply(json.loads(segment.readline()))
+            finally:
+                self.dictstore = saved_dictstore
             return read_dict
         else:
             raise IOError("No external files setup")
@@ -0,0 +1,373 @@
+"""
+Event driven consumer for DCP streams opened over DcpClient connections
+
+All vbucket streams of all the DcpClient connections are multiplexed
+using select() on the client sockets. Frames are demultiplexed to
+their stream using the opaque of the stream request, NOOPs are answered
+and buffer acknowledgements are sent back when flow control is enabled
+on the connection. Received DCP messages are handed over to pluggable
+sinks and also yielded to the caller through the events() generator.
+"""
+
+import select
+import struct
+import time
+
+from global_vars import logger
+from memcacheConstants import ALT_REQ_MAGIC_BYTE, ALT_RES_MAGIC_BYTE, \
+    ALT_RES_PKT_FMT, CMD_DELETION, CMD_EXPIRATION, CMD_MUTATION, \
+    CMD_SNAPSHOT_MARKER, CMD_STREAM_END, CMD_SYSTEM_EVENT, CMD_UPR_ACK, \
+    CMD_UPR_NOOP, DCP_Opcode_Dictionary, MIN_RECV_PACKET, REQ_MAGIC_BYTE, \
+    REQ_PKT_FMT, RES_MAGIC_BYTE, RES_PKT_FMT
+
+MUTATION_OPCODES = (CMD_MUTATION, CMD_DELETION, CMD_EXPIRATION)
+# Messages accounted against the connection's flow control buffer
+FLOW_CONTROLLED_OPCODES = MUTATION_OPCODES + (CMD_SNAPSHOT_MARKER,
+                                              CMD_SYSTEM_EVENT,
+                                              CMD_STREAM_END)
+
+
+class DcpSink(object):
+    """
+    Base class for the consumers of the DCP events.
+    on_event() gets called for every DCP message received on a stream
+    """
+    def on_event(self, vb_stream, response):
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+
+class CounterSink(DcpSink):
+    """ Counts the received messages per opcode and mutations per vbucket """
+    def __init__(self):
+        self.opcode_count = dict()
+        self.vb_mutations = dict()
+
+    def on_event(self, vb_stream, response):
+        opcode = response['opcode']
+        self.opcode_count[opcode] = self.opcode_count.get(opcode, 0) + 1
+        if opcode in MUTATION_OPCODES:
+            vb = response['vbucket']
+            self.vb_mutations[vb] = self.vb_mutations.get(vb, 0) + 1
+
+    def count(self, opcode):
+        return self.opcode_count.get(opcode, 0)
+
+    @property
+    def mutations(self):
+        return sum(self.vb_mutations.values())
+
+
+class SeqnoTrackerSink(DcpSink):
+    """
+    Tracks the last seen seqno and snapshot of every vbucket.
+    Sequence numbers are also recorded into the given LogData object
+    """
+    def __init__(self, log_data=None):
+        self.log_data = log_data
+        # vb -> last received by_seqno
+        self.seqnos = dict()
+        # vb -> (snap_start, snap_end)
+        self.snapshots = dict()
+        self.ended_vbuckets = set()
+
+    def on_event(self, vb_stream, response):
+        opcode = response['opcode']
+        if opcode in MUTATION_OPCODES or opcode == CMD_SYSTEM_EVENT:
+            vb = response['vbucket']
+            self.seqnos[vb] = response['by_seqno']
+            if self.log_data is not None and opcode != CMD_SYSTEM_EVENT:
+                self.log_data.upsert_sequence_no(vb, response['by_seqno'])
+        elif opcode == CMD_SNAPSHOT_MARKER:
+            self.snapshots[response['vbucket']] = (
+                int(response['snap_start_seqno']),
+                int(response['snap_end_seqno']))
+        elif opcode == CMD_STREAM_END:
+            self.ended_vbuckets.add(response['vbucket'])
+
+
+class FileSink(DcpSink):
+    """
+    Writes one line per mutation into the given file, so the stream
+    content does not have to be held in memory
+    """
+    def __init__(self, file_path, formatter=None, mode="w"):
+        self.file_path = file_path
+        self.formatter = formatter or self.default_format
+        self.lines_written = 0
+        self.fp = open(file_path, mode)
+
+    @staticmethod
+    def default_format(response):
+        return "%s vb:%s seqno:%s key:%s" \
+               % (DCP_Opcode_Dictionary[response['opcode']],
+                  response['vbucket'], response['by_seqno'], response['key'])
+
+    def on_event(self, vb_stream, response):
+        if response['opcode'] in MUTATION_OPCODES:
+            line = self.formatter(response)
+            if line is not None:
+                self.fp.write(line + "\n")
+                self.lines_written += 1
+
+    def close(self):
+        if not self.fp.closed:
+            self.fp.close()
+
+
+class ListSink(DcpSink):
+    """ Keeps the formatted mutations in memory (legacy output format) """
+    def __init__(self, formatter, output=None):
+        self.formatter = formatter
+        self.output = output if output is not None else list()
+
+    def on_event(self, vb_stream, response):
+        if response['opcode'] in MUTATION_OPCODES:
+            line = self.formatter(response)
+            if line is not None:
+                self.output.append(line)
+
+
+class _Connection(object):
+    """ Per DcpClient state of the consumer """
+    def __init__(self, client, flow_control_buffer):
+        self.client = client
+        self.flow_control_buffer = flow_control_buffer
+        self.unacked_bytes = 0
+        # opaque -> vb_stream
+        self.streams = dict()
+
+    def read_frame(self):
+        """
+        Blocking read of one full frame from the client socket.
+        Unlike MemcachedClient._recvMsg, the flexible framing extras
+        length of the alternative magic packets is preserved here.
+        :return: (opcode, keylen, extlen, dtype, status, cas, body,
+                  opaque, frameextralen, magic, frame_length)
+        """
+        header = self.__recv(MIN_RECV_PACKET)
+        magic = ord(header[0])
+        if magic in (ALT_REQ_MAGIC_BYTE, ALT_RES_MAGIC_BYTE):
+            _, opcode, frameextralen, keylen, extlen, dtype, status, \
+                bodylen, opaque, cas = struct.unpack(ALT_RES_PKT_FMT, header)
+        else:
+            _, opcode, keylen, extlen, dtype, status, \
+                bodylen, opaque, cas = struct.unpack(RES_PKT_FMT, header)
+            frameextralen = 0
+        body = self.__recv(bodylen) if bodylen else ""
+        return (opcode, keylen, extlen, dtype, status, cas, body, opaque,
+                frameextralen, magic, MIN_RECV_PACKET + bodylen)
+
+    def __recv(self, length):
+        data = ""
+        while len(data) < length:
+            chunk = self.client.s.recv(length - len(data))
+            if chunk == "":
+                raise EOFError("Got empty data (remote died?). from %s"
+                               % self.client.host)
+            data += chunk
+        return data
+
+    def has_buffered_data(self):
+        # SSL sockets may hold already decrypted data not seen by select()
+        pending = getattr(self.client.s, "pending", None)
+        return pending is not None and pending() > 0
+
+    def account(self, num_bytes):
+        """
+        Records the received bytes and acknowledges them to the producer
+        once half of the flow control buffer is consumed
+        """
+        if not self.flow_control_buffer:
+            return
+        self.unacked_bytes += num_bytes
+        if self.unacked_bytes >= self.flow_control_buffer / 2:
+            self.send_buffer_ack()
+
+    def send_buffer_ack(self):
+        if self.unacked_bytes == 0:
+            return
+        # Buffer acknowledgements don't have a response from the server
+        self.client.s.sendall(
+            struct.pack(REQ_PKT_FMT, REQ_MAGIC_BYTE, CMD_UPR_ACK,
+                        0, 4, 0, 0, 4, 0, 0)
+            + struct.pack(">I", self.unacked_bytes))
+        self.unacked_bytes = 0
+
+    def send_noop_response(self, opaque):
+        self.client.s.sendall(
+            struct.pack(RES_PKT_FMT, RES_MAGIC_BYTE, CMD_UPR_NOOP,
+                        0, 0, 0, 0, 0, opaque, 0))
+
+
+class DcpStreamConsumer(object):
+    """
+    Multiplexes all given vbucket streams and dispatches the received
+    messages to the sinks.
+
+    Usage:
+        consumer = DcpStreamConsumer(streams, [CounterSink()])
+        for vb_stream, response in consumer.events():
+            ...
+    or consumer.run() when only the sinks are of interest.
+    """
+    def __init__(self, streams, sinks=None, flow_control_buffer=0,
+                 idle_timeout=10, poll_interval=1):
+        """
+        :param streams: List of vb_stream dicts as returned by
+                        DCPUtils.add_streams()
+        :param sinks: List of DcpSink objects
+        :param flow_control_buffer: 'connection_buffer_size' set on the
+                                    connections. 0 means flow control is
+                                    disabled and no buffer acks are sent
+        :param idle_timeout: Stop consuming if no message is received on
+                             any of the streams for these many seconds
+        :param poll_interval: Max time to block in a single select() call
+        """
+        self.log = logger.get("infra")
+        self.sinks = list(sinks or [])
+        self.idle_timeout = idle_timeout
+        self.poll_interval = poll_interval
+        self.streams = streams
+        # socket -> _Connection
+        self.connections = dict()
+        for vb_stream in streams:
+            stream = vb_stream['stream']
+            client = stream.client
+            if client.s not in self.connections:
+                self.connections[client.s] = _Connection(client,
+                                                         flow_control_buffer)
+            self.connections[client.s].streams[stream.opaque] = vb_stream
+
+        self.events_received = 0
+        self.bytes_received = 0
+        self.mutations_received = 0
+        self.start_time = None
+        self.end_time = None
+
+    @property
+    def active_streams(self):
+        return len([vb_stream for vb_stream in self.streams
+                    if not vb_stream['complete']])
+
+    def __dispatch(self, vb_stream, response, num_bytes):
+        self.events_received += 1
+        self.bytes_received += num_bytes
+        opcode = response['opcode']
+        if opcode in MUTATION_OPCODES:
+            self.mutations_received += 1
+            vb_stream['keys_recvd'] = vb_stream.get('keys_recvd', 0) + 1
+        elif opcode == CMD_STREAM_END:
+            vb_stream['complete'] = True
+            vb_stream['stream_open'] = False
+        for sink in self.sinks:
+            sink.on_event(vb_stream, response)
+        return vb_stream, response
+
+    def __queued_events(self):
+        """
+        Responses read by DcpClient while waiting for the stream request
+        responses are queued on the respective StreamRequest ops
+        """
+        for connection in self.connections.values():
+            for opaque, vb_stream in connection.streams.items():
+                op = vb_stream['stream'].op
+                while not op.queue.empty():
+                    response = op.queue.get()
+                    if response is not None:
+                        yield self.__dispatch(vb_stream, response, 0)
+
+    def __read_event(self, connection):
+        """
+        Reads one frame from the connection
+        :return: (vb_stream, response) for stream messages, else None
+        """
+        (opcode, keylen, extlen, dtype, status, cas, body, opaque,
+         frameextralen, magic, frame_length) = connection.read_frame()
+        if opcode == CMD_UPR_NOOP \
+                and magic in (REQ_MAGIC_BYTE, ALT_REQ_MAGIC_BYTE):
+            connection.send_noop_response(opaque)
+            return None
+
+        vb_stream = connection.streams.get(opaque)
+        if vb_stream is None:
+            self.log.debug("Ignoring opcode %s with unknown opaque %s"
+                           % (DCP_Opcode_Dictionary.get(opcode, hex(opcode)),
+                              opaque))
+            return None
+        if opcode in FLOW_CONTROLLED_OPCODES:
+            connection.account(frame_length)
+        response = vb_stream['stream'].op.formated_response(
+            opcode, keylen, extlen, dtype, status, cas, body, opaque,
+            frameextralen)
+        return self.__dispatch(vb_stream, response, frame_length)
+
+    def events(self):
+        """
+        Generator yielding (vb_stream, response) for every DCP message
+        received on the streams, until all streams end or the connections
+        stay idle for idle_timeout seconds
+        """
+        self.start_time = time.time()
+        try:
+            for event in self.__queued_events():
+                yield event
+
+            last_activity = time.time()
+            while self.active_streams > 0:
+                sockets = [sock for sock, connection
+                           in self.connections.items()
+                           if connection.streams]
+                ready = [sock for sock in sockets
+                         if self.connections[sock].has_buffered_data()]
+                if not ready:
+                    ready = select.select(sockets, [], [],
+                                          self.poll_interval)[0]
+                if not ready:
+                    if time.time() - last_activity > self.idle_timeout:
+                        self.log.debug("No DCP message for %ss. Active "
+                                       "streams: %s"
+                                       % (self.idle_timeout,
+                                          self.active_streams))
+                        break
+                    continue
+                last_activity = time.time()
+                for sock in ready:
+                    event = self.__read_event(self.connections[sock])
+                    if event is not None:
+                        yield event
+        finally:
+            for connection in self.connections.values():
+                connection.send_buffer_ack()
+            self.end_time = time.time()
+
+    def run(self):
+        """
+        Consume all streams, dispatching the messages only to the sinks
+        :return: Number of messages received
+        """
+        for _ in self.events():
+            pass
+        for sink in self.sinks:
+            sink.close()
+        return self.events_received
+
+    def get_stats(self):
+        end_time = self.end_time or time.time()
+        elapsed = max(end_time - (self.start_time or end_time), 0.000001)
+        return {"events": self.events_received,
+                "mutations": self.mutations_received,
+                "bytes": self.bytes_received,
+                "elapsed": elapsed,
+                "events_per_sec": self.events_received / elapsed,
+                "bytes_per_sec": self.bytes_received / elapsed}
+
+    def print_stats(self):
+        stats = self.get_stats()
+        self.log.info("DCP consumer: %s events (%s mutations), %s bytes in "
+                      "%.2fs - %.2f events/s, %.2f bytes/s"
+                      % (stats["events"], stats["mutations"], stats["bytes"],
+                         stats["elapsed"], stats["events_per_sec"],
+                         stats["bytes_per_sec"]))
@@ -6,6 +6,7 @@ from global_vars import logger
 from membase.api.rest_client import RestConnection
 from EventingLib.EventingOperations_Rest import EventingHelper
 from remote.remote_util import RemoteMachineShellConnection
+from cluster_utils.log_scanner import LogScanner
 from BucketLib.BucketOperations import BucketHelper
 
 
@@ -36,6 +37,7 @@ class EventingUtils:
         self.cookies = cookies
         self.bucket_helper = BucketHelper(self.master)
         self.print_eventing_handler_code_in_logs = print_eventing_handler_code_in_logs
+        self.panic_count = 0
 
     def create_save_function_body(self, appname, appcode, description="Sample Description",
                                   checkpoint_interval=20000, cleanup_timers=False,
@@ -323,38 +325,21 @@ class EventingUtils:
         panic_str = "panic"
         if not self.eventing_nodes:
             return None
+        result = LogScanner().scan(self.eventing_nodes, [panic_str],
+                                   log_globs=["eventing.log*"],
+                                   crash_dumps=True)
         for eventing_node in self.eventing_nodes:
-            shell = RemoteMachineShellConnection(eventing_node)
-            _, dir_name = RestConnection(eventing_node).diag_eval(
-                'filename:absname(element(2, application:get_env(ns_server,error_logger_mf_dir))).')
-            eventing_log = str(dir_name) + '/eventing.log*'
-            count, err = shell.execute_command("zgrep \"{0}\" {1} | wc -l".
-                                               format(panic_str, eventing_log))
-            if isinstance(count, list):
-                count = int(count[0])
-            else:
-                count = int(count)
+            count = result.count(eventing_node.ip, panic_str)
             if count > self.panic_count:
                 self.log.info("===== PANIC OBSERVED IN EVENTING LOGS ON SERVER {0}=====".format(eventing_node.ip))
-                panic_trace, _ = shell.execute_command("zgrep \"{0}\" {1}".
-                                                       format(panic_str, eventing_log))
-                self.log.info("\n {0}".format(panic_trace))
+                panic_trace = [match.line for match in
+                               result.get_matches(server=eventing_node.ip)]
+                self.log.info("\n {0}".format("\n".join(panic_trace)))
                 self.panic_count = count
-            os_info = shell.extract_remote_info()
-            if os_info.type.lower() == "windows":
-                # This is a fixed path in all windows systems inside couchbase
-                dir_name_crash = 'c://CrashDumps'
-            else:
-                dir_name_crash = str(dir_name) + '/../crash/'
-            core_dump_count, err = shell.execute_command("ls {0}| wc -l".format(dir_name_crash))
-            if isinstance(core_dump_count, list):
-                core_dump_count = int(core_dump_count[0])
-            else:
-                core_dump_count = int(core_dump_count)
+            core_dump_count = result.crash_dumps.get(eventing_node.ip, 0)
             if core_dump_count > 0:
                 self.log.info("===== CORE DUMPS SEEN ON EVENTING NODES, SERVER {0} : {1} crashes seen =====".format(
                          eventing_node.ip, core_dump_count))
-            shell.disconnect()
 
     def print_execution_and_failure_stats(self,name):
         out_event_execution = self.eventing_helper.get_event_execution_stats(name)
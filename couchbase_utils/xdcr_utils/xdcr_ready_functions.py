@@ -5,6 +5,7 @@ from global_vars import logger
 from custom_exceptions.exception import XDCRException
 from membase.api.rest_client import RestConnection
 from remote.remote_util import RemoteMachineShellConnection
+from cluster_utils.log_scanner import LogScanner
 from couchbase_helper.documentgenerator import doc_generator
 from bucket_utils.bucket_ready_functions import BucketUtils
 from cluster_utils.cluster_ready_functions import ClusterUtils, CBCluster
@@ -302,37 +303,39 @@ class XDCRUtils:
             and returns the number of occurances
             @param goxdcr_log: goxdcr log location on the server
         """
-        if not goxdcr_log:
-            goxdcr_log = self.get_goxdcr_log_dir(server) \
-                         + '/goxdcr.log*'
-
         shell = RemoteMachineShellConnection(server)
         info = shell.extract_remote_info().type.lower()
-        if info == "windows":
-            matches = []
+        if info != "windows":
+            shell.disconnect()
+            # Incremental scan, only the log data written since the
+            # previous scan is read. Count stays the total occurrences
+            result = LogScanner().scan([server], [str],
+                                       log_globs=[goxdcr_log or 'goxdcr.log*'])
+            count = result.count(server.ip, str)
             if print_matches:
-                matches, err = shell.execute_command("grep \"{0}\" {1}".
-                                                     format(str, goxdcr_log))
+                matches = [match.line for match
+                           in result.get_matches(server=server.ip)]
                 if matches:
                     self.log.debug(matches)
+                return matches, count
+            return count
 
-            count, err = shell.execute_command("grep \"{0}\" {1} | wc -l".
-                                               format(str, goxdcr_log))
-        else:
-            matches = []
-            if print_matches:
-                matches, err = shell.execute_command("zgrep \"{0}\" {1}".
-                                                     format(str, goxdcr_log))
-                if matches:
-                    self.log.debug(matches)
+        if not goxdcr_log:
+            goxdcr_log = self.get_goxdcr_log_dir(server) \
+                         + '/goxdcr.log*'
+        matches = []
+        if print_matches:
+            matches, err = shell.execute_command("grep \"{0}\" {1}".
+                                                 format(str, goxdcr_log))
+            if matches:
+                self.log.debug(matches)
 
-            count, err = shell.execute_command("zgrep \"{0}\" {1} | wc -l".
-                                               format(str, goxdcr_log))
+        count, err = shell.execute_command("grep \"{0}\" {1} | wc -l".
+                                           format(str, goxdcr_log))
         if isinstance(count, list):
             count = int(count[0])
         else:
             count = int(count)
-        print(count)
         shell.disconnect()
         if print_matches:
             return matches, count
@@ -117,11 +117,21 @@ class BucketHelper(RestConnection):
         return None if not bucket.vbuckets else bucket.vbuckets
 
     def _get_vbuckets(self, servers, bucket_name='default'):
-        target_server = list()
         if bucket_name is None:
             bucket_name = self.get_buckets_json()[0]["name"]
         bucket_to_check = self.get_bucket_json(bucket_name)
-        bucket_servers = bucket_to_check["vBucketServerMap"]["serverList"]
+        return self.map_vbuckets_to_servers(
+            servers, bucket_to_check["vBucketServerMap"])
+
+    @staticmethod
+    def map_vbuckets_to_servers(servers, vbucket_server_map):
+        """
+        :param servers: List of servers to map the vbuckets to
+        :param vbucket_server_map: Bucket's 'vBucketServerMap'
+        :return: dict of {server: {'active_vb': [], 'replica_vb': []}}
+        """
+        target_server = list()
+        bucket_servers = vbucket_server_map["serverList"]
         bucket_servers = [ip.split(":")[0] for ip in bucket_servers]
 
         vbuckets_servers = dict()
@@ -136,7 +146,7 @@ class BucketHelper(RestConnection):
                     target_server.append(tem_server)
 
         target_server_len = len(target_server)
-        for vb_num, vb_map in enumerate(bucket_to_check["vBucketServerMap"]["vBucketMap"]):
+        for vb_num, vb_map in enumerate(vbucket_server_map["vBucketMap"]):
             for index, vb_index in enumerate(vb_map):
                 if index >= target_server_len:
                     continue
@@ -29,10 +29,11 @@ from Cb_constants import constants, CbServer, DocLoading
 from CbasLib.CBASOperations import CBASHelper
 from CbasLib.cbas_entity import Dataverse, CBAS_Collection, Dataset, Synonym, \
     CBAS_Index, CBAS_UDF
-from Jython_tasks.task_manager import TaskManager
+from Jython_tasks.task_manager import TaskManager, TaskPriority
 from cb_tools.cbstats import Cbstats
 from collections_helper.collections_spec_constants import MetaConstants
 from common_lib import sleep
+from connections.topology_cache import ClusterTopologyCache, TopologyEvent
 from couchbase_helper.document import DesignDocument
 from couchbase_helper.documentgenerator import BatchedDocumentGenerator, \
     SubdocDocumentGenerator
@@ -46,17 +47,20 @@ from custom_exceptions.exception import \
     CompactViewFailed, SetViewInfoNotFound, FailoverFailedException, \
     BucketFlushFailed
 from membase.api.rest_client import RestConnection
+from membase.helper.rebalance_monitor import RebalanceMonitor
 from remote.remote_util import RemoteUtilHelper, RemoteMachineShellConnection
 from sdk_exceptions import SDKException
 from table_view import TableView, plot_graph
 from gsiLib.GsiHelper_Rest import GsiHelper
 from capella.capella_utils import CapellaUtils
-from TestInput import TestInputServer
+from TestInput import TestInputServer, TestInputSingleton
 from capellaAPI.CapellaAPI import CapellaAPI
 # from cluster_utils.cluster_ready_functions import CBCluster
 
 
 class Task(Callable):
+    priority_class = TaskPriority.GENERAL
+
     def __init__(self, thread_name):
         self.thread_name = thread_name
         self.exception = None
@@ -294,6 +298,9 @@ class RebalanceTaskCapella(Task):
 
 
 class RebalanceTask(Task):
+    priority_class = TaskPriority.MONITOR
+    POLL_INTERVAL = 10
+
     def __init__(self, cluster, to_add=[], to_remove=[],
                  use_hostnames=False, services=None,
                  check_vbucket_shuffling=True,
@@ -311,6 +318,10 @@ class RebalanceTask(Task):
         self.services = services
         self.monitor_vbuckets_shuffling = False
         self.check_vbucket_shuffling = check_vbucket_shuffling
+        # Bucket whose vbucket map is checked for shuffling
+        self.shuffle_check_bucket = None
+        self.vbucket_shuffle_error = None
+        self.topology = None
         self.result = False
         self.retry_get_process_num = retry_get_process_num
         self.server_groups_to_add = dict()
@@ -344,9 +355,10 @@ class RebalanceTask(Task):
         # Update the nodes_in_cluster value
         self.cluster.nodes_in_cluster = self.servers
 
-        self.retry_get_progress = 0
         self.use_hostnames = use_hostnames
-        self.previous_progress = 0
+        self.rebalance_monitor = None
+        # Samples of the rebalance progress, set once the rebalance ends
+        self.rebalance_trend = list()
         self.old_vbuckets = dict()
         self.thread_used = "Rebalance_task"
 
@@ -423,8 +435,11 @@ class RebalanceTask(Task):
                 non_swap_servers = set(self.servers) - set(
                     self.to_remove) - set(self.to_add)
                 if self.check_vbucket_shuffling:
-                    self.old_vbuckets = BucketHelper(
-                        self.servers[0])._get_vbuckets(non_swap_servers, None)
+                    bucket_helper = BucketHelper(self.servers[0])
+                    self.shuffle_check_bucket = \
+                        bucket_helper.get_buckets_json()[0]["name"]
+                    self.old_vbuckets = bucket_helper._get_vbuckets(
+                        non_swap_servers, self.shuffle_check_bucket)
                 if self.old_vbuckets and self.check_vbucket_shuffling:
                     self.monitor_vbuckets_shuffling = True
                 if self.monitor_vbuckets_shuffling \
@@ -443,6 +458,11 @@ class RebalanceTask(Task):
                 if self.monitor_vbuckets_shuffling:
                     self.test_log.debug("Will monitor vbucket shuffling for "
                                         "swap rebalance")
+                    # Check every vbucket map change pushed by ns_server,
+                    # instead of the map seen at each poll
+                    self.topology = ClusterTopologyCache.get(self.servers[0])
+                    self.topology.watch_bucket(self.shuffle_check_bucket)
+                    self.topology.subscribe(self.__on_topology_change)
             self.state = "add_nodes"
             self.add_nodes()
             self.state = "triggering"
@@ -471,6 +491,10 @@ class RebalanceTask(Task):
             self.result = False
             self.test_log.error(str(e))
             return self.result
+        finally:
+            if self.topology is not None:
+                self.topology.unsubscribe(self.__on_topology_change)
+                self.topology.unwatch_bucket(self.shuffle_check_bucket)
         self.complete_task()
         self.result = True
         self.log.critical("Nodes in cluster: %s" % [node.ip for node in self.cluster.nodes_in_cluster])
@@ -583,103 +607,161 @@ class RebalanceTask(Task):
                             ejectedNodes=ejectedNodes)
         self.start_time = time.time()
 
+    def __get_vbucket_shuffle_error(self, new_vbuckets):
+        """
+        :param new_vbuckets: Output of BucketHelper._get_vbuckets()
+        :return: Error message if the vbuckets on the non-swap nodes
+                 have moved, else None
+        """
+        non_swap_servers = set(self.servers) - set(
+            self.to_remove) - set(self.to_add)
+        for vb_type in ["active_vb", "replica_vb"]:
+            for srv in non_swap_servers:
+                if set(self.old_vbuckets[srv][vb_type]) != set(
+                        new_vbuckets[srv][vb_type]):
+                    return "%s vBuckets were shuffled on %s! " \
+                           "Expected: %s, Got: %s" \
+                           % (vb_type, srv.ip,
+                              self.old_vbuckets[srv][vb_type],
+                              new_vbuckets[srv][vb_type])
+        return None
+
+    def __on_topology_change(self, event, bucket_name, vbucket_server_map):
+        if event != TopologyEvent.BUCKET \
+                or bucket_name != self.shuffle_check_bucket \
+                or self.vbucket_shuffle_error is not None:
+            return
+        non_swap_servers = set(self.servers) - set(
+            self.to_remove) - set(self.to_add)
+        self.vbucket_shuffle_error = self.__get_vbucket_shuffle_error(
+            BucketHelper.map_vbuckets_to_servers(non_swap_servers,
+                                                 vbucket_server_map))
+
+    def save_rebalance_trend(self):
+        """
+        Prints the vbucket move stats and saves the progress samples
+        as json under the test's logs folder
+        """
+        self.rebalance_monitor.print_stats()
+        self.rebalance_trend = self.rebalance_monitor.time_series()
+        log_path = "/tmp"
+        if TestInputSingleton.input is not None:
+            log_path = TestInputSingleton.input.param("logs_folder", "/tmp")
+        file_path = os.path.join(log_path, "%s_trend.json" % self.thread_name)
+        try:
+            self.rebalance_monitor.save_time_series(file_path)
+            self.test_log.debug("Rebalance trend saved to %s" % file_path)
+        except (IOError, OSError) as e:
+            self.test_log.warning("Unable to save rebalance trend: %s" % e)
+
     def check(self):
-        self.poll = True
-        while self.poll:
-            self.poll = False
-            try:
-                if self.monitor_vbuckets_shuffling:
-                    non_swap_servers = set(self.servers) - set(
-                        self.to_remove) - set(self.to_add)
-                    new_vbuckets = BucketHelper(self.servers[0])._get_vbuckets(
-                        non_swap_servers, None)
-                    for vb_type in ["active_vb", "replica_vb"]:
-                        for srv in non_swap_servers:
-                            if set(self.old_vbuckets[srv][vb_type]) != set(
-                                    new_vbuckets[srv][vb_type]):
-                                msg = "%s vBuckets were shuffled on %s! " \
-                                      "Expected: %s, Got: %s" \
-                                      % (vb_type, srv.ip,
-                                         self.old_vbuckets[srv][vb_type],
-                                         new_vbuckets[srv][vb_type])
-                                self.test_log.error(msg)
-                                raise Exception(msg)
-                (status, progress) = self.rest._rebalance_status_and_progress(
-                        self.prev_rebalance_status_id)
-                self.test_log.info("Rebalance - status: %s, progress: %s",
-                                   status,
-                                   progress)
-                # if ServerUnavailableException
-                if progress == -100:
-                    self.retry_get_progress += 1
-                elif self.previous_progress != progress:
-                    self.previous_progress = progress
-                    self.retry_get_progress = 0
-                else:
-                    self.retry_get_progress += 1
-            except RebalanceFailedException as ex:
-                self.result = False
-                raise ex
-            # catch and set all unexpected exceptions
-            except Exception as e:
-                self.result = False
-                raise e
-            if self.rest.is_cluster_mixed():
-                """ for mix cluster, rebalance takes longer """
-                self.test_log.debug("Rebalance in mix cluster")
-                self.retry_get_process_num *= 2
-            # we need to wait for status to be 'none'
-            # (i.e. rebalance actually finished and not just 'running' and at 100%)
-            # before we declare ourselves done
-            if progress != -1 and status != 'none':
-                if self.retry_get_progress < self.retry_get_process_num:
-                    self.log.debug("Wait before next rebalance progress check")
-                    sleep(10, log_type="infra")
-                    self.poll = True
-                else:
+        if self.rebalance_monitor is None:
+            # Time without any vbucket movement tolerated before
+            # the rebalance is treated as hung
+            self.rebalance_monitor = RebalanceMonitor(
+                self.rest, self.prev_rebalance_status_id,
+                min_stall_time=self.retry_get_process_num
+                * self.POLL_INTERVAL)
+        # Trend is saved for the failed / hung rebalances as well
+        try:
+            self.poll = True
+            while self.poll:
+                self.poll = False
+                try:
+                    if self.monitor_vbuckets_shuffling:
+                        if self.topology is not None and self.topology.is_live(
+                                self.shuffle_check_bucket):
+                            # Map changes are validated by __on_topology_change
+                            msg = self.vbucket_shuffle_error
+                        else:
+                            non_swap_servers = set(self.servers) - set(
+                                self.to_remove) - set(self.to_add)
+                            msg = self.__get_vbucket_shuffle_error(
+                                BucketHelper(self.servers[0])._get_vbuckets(
+                                    non_swap_servers,
+                                    self.shuffle_check_bucket))
+                        if msg:
+                            self.test_log.error(msg)
+                            raise Exception(msg)
+                    (status, progress) = self.rebalance_monitor.poll()
+                    self.test_log.info(
+                        "Rebalance - status: %s, progress: %s, %s",
+                        status, progress, self.rebalance_monitor.status_line())
+                except RebalanceFailedException as ex:
                     self.result = False
-                    self.rest.print_UI_logs()
-                    raise RebalanceFailedException(
-                        "seems like rebalance hangs. please check logs!")
-            else:
-                success_cleaned = []
-                for removed in self.to_remove:
-                    try:
-                        rest = RestConnection(removed)
-                    except ServerUnavailableException, e:
-                        self.test_log.error(e)
-                        continue
-                    start = time.time()
-                    while time.time() - start < 30:
+                    raise ex
+                # catch and set all unexpected exceptions
+                except Exception as e:
+                    self.result = False
+                    raise e
+                # we need to wait for status to be 'none'
+                # (i.e. rebalance actually finished and not just 'running' and at 100%)
+                # before we declare ourselves done
+                if progress != -1 and status != 'none':
+                    if not self.rebalance_monitor.is_stalled():
+                        self.log.debug("Wait before next rebalance "
+                                       "progress check")
+                        sleep(self.POLL_INTERVAL, log_type="infra")
+                        self.poll = True
+                    else:
+                        self.result = False
+                        self.rest.print_UI_logs()
+                        raise RebalanceFailedException(
+                            "seems like rebalance hangs. No vbucket movement "
+                            "in %ds. please check logs!"
+                            % (time.time()
+                               - self.rebalance_monitor.last_movement_time))
+                else:
+                    success_cleaned = []
+                    for removed in self.to_remove:
                         try:
-                            if 'pools' in rest.get_pools_info() and \
-                                    (len(rest.get_pools_info()["pools"]) == 0):
-                                success_cleaned.append(removed)
-                                break
-                        except (ServerUnavailableException, IncompleteRead), e:
+                            rest = RestConnection(removed)
+                        except ServerUnavailableException, e:
                             self.test_log.error(e)
+                            continue
+                        end_time = time.time() + 30
+                        while time.time() < end_time:
+                            try:
+                                pools_info = rest.get_pools_info()
+                                if 'pools' in pools_info and \
+                                        len(pools_info["pools"]) == 0:
+                                    success_cleaned.append(removed)
+                                    break
+                            except (ServerUnavailableException, IncompleteRead), e:
+                                self.test_log.error(e)
+                            time.sleep(1)
 
-                for node in set(self.to_remove) - set(success_cleaned):
-                    self.test_log.error(
-                        "Node {0}:{1} was not cleaned after removing from cluster"
-                        .format(node.ip, node.port))
-                    self.result = False
+                    for node in set(self.to_remove) - set(success_cleaned):
+                        self.test_log.error(
+                            "Node {0}:{1} was not cleaned after removing from cluster"
+                            .format(node.ip, node.port))
+                        self.result = False
 
-                self.test_log.info(
-                    "Rebalance completed with progress: {0}% in {1} sec"
-                    .format(progress, time.time() - self.start_time))
-                self.result = True
-                return
+                    self.test_log.info(
+                        "Rebalance completed with progress: {0}% in {1} sec"
+                        .format(progress, time.time() - self.start_time))
+                    self.result = True
+                    return
+        finally:
+            self.save_rebalance_trend()
 
 
 class GenericLoadingTask(Task):
+    priority_class = TaskPriority.LOADER
+
     def __init__(self, cluster, bucket, client, batch_size=1,
                  timeout_secs=5, time_unit="seconds", compression=None,
                  retries=5,
                  suppress_error_table=False, sdk_client_pool=None,
                  scope=CbServer.default_scope,
                  collection=CbServer.default_collection,
-                 preserve_expiry=None, sdk_retry_strategy=None):
+                 preserve_expiry=None, sdk_retry_strategy=None,
+                 lean_results=False):
+        """
+        :param lean_results: If True, batch ops return the number of
+                             successful keys instead of per key dicts
+                             and the failures are not deep copied
+        """
         super(GenericLoadingTask, self).__init__("Loadgen_task_%s_%s_%s_%s"
                                                  % (bucket, scope, collection,
                                                     time.time()))
@@ -699,6 +781,7 @@ class GenericLoadingTask(Task):
         self.docs_loaded = 0
         self.preserve_expiry = preserve_expiry
         self.sdk_retry_strategy = sdk_retry_strategy
+        self.lean_results = lean_results
 
     def call(self):
         self.start_task()
@@ -717,6 +800,22 @@ class GenericLoadingTask(Task):
     def next(self):
         raise NotImplementedError
 
+    def __new_success_result(self):
+        return 0 if self.lean_results else dict()
+
+    def __mark_success(self, success, key, failed_doc):
+        """ Moves a key verified after failure to the success result """
+        if self.lean_results:
+            return success + 1
+        success[key] = failed_doc
+        success[key].pop("error")
+        return success
+
+    def __batch_result(self, success, fail):
+        if self.lean_results:
+            return success, fail
+        return success, copy.deepcopy(fail)
+
     # start of batch methods
     def batch_create(self, key_val, client=None, persist_to=0,
                      replicate_to=0,
@@ -728,7 +827,7 @@ class GenericLoadingTask(Task):
             key_val -- array of key/value dicts to load size = self.batch_size
             client -- optional client to use for data loading
         """
-        success = dict()
+        success = self.__new_success_result()
         fail = dict()
         try:
             client = client or self.client
@@ -737,7 +836,8 @@ class GenericLoadingTask(Task):
                 persist_to=persist_to, replicate_to=replicate_to,
                 timeout=self.timeout, time_unit=self.time_unit,
                 doc_type=doc_type, durability=durability,
-                sdk_retry_strategy=self.sdk_retry_strategy)
+                sdk_retry_strategy=self.sdk_retry_strategy,
+                lean=self.lean_results)
             if fail:
                 failed_item_table = None
                 if not self.suppress_error_table:
@@ -750,11 +850,11 @@ class GenericLoadingTask(Task):
                     Thread.sleep(self.timeout)
 #                     self.test_log.debug("Reading values {0} after failure"
 #                                         .format(fail.keys()))
-                    read_map, _ = self.batch_read(fail.keys())
+                    read_map, _ = self.batch_read(fail.keys(), lean=False)
                     for key, value in fail.items():
                         if key in read_map and read_map[key]["cas"] != 0:
-                            success[key] = value
-                            success[key].pop("error")
+                            success = self.__mark_success(success, key,
+                                                          value)
                             fail.pop(key)
                         elif not self.suppress_error_table:
                             failed_item_table.add_row([key, value['error']])
@@ -766,15 +866,15 @@ class GenericLoadingTask(Task):
                                               % (self.client.bucket.name,
                                                  self.scope,
                                                  self.collection))
-            return success, copy.deepcopy(fail)
+            return self.__batch_result(success, fail)
         except Exception as error:
             self.test_log.error(error)
-        return success, copy.deepcopy(fail)
+        return self.__batch_result(success, fail)
 
     def batch_update(self, key_val, client=None, persist_to=0,
                      replicate_to=0,
                      doc_type="json", durability="", skip_read_on_error=False):
-        success = dict()
+        success = self.__new_success_result()
         fail = dict()
         try:
             client = client or self.client
@@ -784,7 +884,8 @@ class GenericLoadingTask(Task):
                 timeout=self.timeout, time_unit=self.time_unit,
                 doc_type=doc_type, durability=durability,
                 preserve_expiry=self.preserve_expiry,
-                sdk_retry_strategy=self.sdk_retry_strategy)
+                sdk_retry_strategy=self.sdk_retry_strategy,
+                lean=self.lean_results)
 
             if fail:
                 key_val = dict(key_val)
@@ -798,12 +899,12 @@ class GenericLoadingTask(Task):
                     Thread.sleep(self.timeout)
                     self.test_log.debug("Reading values {0} after failure"
                                         .format(fail.keys()))
-                    read_map, _ = self.batch_read(fail.keys())
+                    read_map, _ = self.batch_read(fail.keys(), lean=False)
                     for key, value in fail.items():
                         if key in read_map and read_map[key]["cas"] != 0 \
                                 and value == read_map[key]["value"]:
-                            success[key] = value
-                            success[key].pop("error")
+                            success = self.__mark_success(success, key,
+                                                          value)
                             fail.pop(key)
                         elif not self.suppress_error_table:
                             failed_item_table.add_row([key, value['error']])
@@ -815,16 +916,16 @@ class GenericLoadingTask(Task):
                                               % (self.client.bucket.name,
                                                  self.scope,
                                                  self.collection))
-            return success, copy.deepcopy(fail)
+            return self.__batch_result(success, fail)
         except Exception as error:
             self.test_log.error(error)
-        return success, copy.deepcopy(fail)
+        return self.__batch_result(success, fail)
 
     def batch_replace(self, key_val, client=None, persist_to=0,
                       replicate_to=0,
                       doc_type="json", durability="",
                       skip_read_on_error=False):
-        success = dict()
+        success = self.__new_success_result()
         fail = dict()
         try:
             client = client or self.client
@@ -834,7 +935,8 @@ class GenericLoadingTask(Task):
                 timeout=self.timeout, time_unit=self.time_unit,
                 doc_type=doc_type, durability=durability,
                 preserve_expiry=self.preserve_expiry,
-                sdk_retry_strategy=self.sdk_retry_strategy)
+                sdk_retry_strategy=self.sdk_retry_strategy,
+                lean=self.lean_results)
             if fail:
                 if not self.suppress_error_table:
                     failed_item_table = TableView(self.test_log.info)
@@ -846,11 +948,11 @@ class GenericLoadingTask(Task):
                     Thread.sleep(self.timeout)
                     self.test_log.debug("Reading values {0} after failure"
                                         .format(fail.keys()))
-                    read_map, _ = self.batch_read(fail.keys())
+                    read_map, _ = self.batch_read(fail.keys(), lean=False)
                     for key, value in fail.items():
                         if key in read_map and read_map[key]["cas"] != 0:
-                            success[key] = value
-                            success[key].pop("error")
+                            success = self.__mark_success(success, key,
+                                                          value)
                             fail.pop(key)
                         elif not self.suppress_error_table:
                             failed_item_table.add_row([key, value['error']])
@@ -862,10 +964,10 @@ class GenericLoadingTask(Task):
                                               % (self.client.bucket.name,
                                                  self.scope,
                                                  self.collection))
-            return success, copy.deepcopy(fail)
+            return self.__batch_result(success, fail)
         except Exception as error:
             self.test_log.error(error)
-        return success, copy.deepcopy(fail)
+        return self.__batch_result(success, fail)
 
     def batch_delete(self, key_val, client=None, persist_to=None,
                      replicate_to=None,
@@ -878,7 +980,8 @@ class GenericLoadingTask(Task):
             timeout=self.timeout,
             time_unit=self.time_unit,
             durability=durability,
-            sdk_retry_strategy=self.sdk_retry_strategy)
+            sdk_retry_strategy=self.sdk_retry_strategy,
+            lean=self.lean_results)
         if fail and not self.suppress_error_table:
             failed_item_view = TableView(self.test_log.info)
             failed_item_view.set_headers(["Delete Key", "Exception"])
@@ -896,7 +999,8 @@ class GenericLoadingTask(Task):
             exp=exp,
             timeout=self.timeout,
             time_unit=self.time_unit,
-            sdk_retry_strategy=self.sdk_retry_strategy)
+            sdk_retry_strategy=self.sdk_retry_strategy,
+            lean=self.lean_results)
         if fail and not self.suppress_error_table:
             failed_item_view = TableView(self.test_log.info)
             failed_item_view.set_headers(["Touch Key", "Exception"])
@@ -908,12 +1012,19 @@ class GenericLoadingTask(Task):
                                         self.collection))
         return success, fail
 
-    def batch_read(self, keys, client=None):
+    def batch_read(self, keys, client=None, lean=None):
+        """
+        :param lean: Overrides the task's lean_results for this read.
+                     Reads done to verify failed keys need per key results
+        """
         client = client or self.client
+        if lean is None:
+            lean = self.lean_results
         success, fail = client.get_multi(
             keys, timeout=self.timeout,
             time_unit=self.time_unit,
-            sdk_retry_strategy=self.sdk_retry_strategy)
+            sdk_retry_strategy=self.sdk_retry_strategy,
+            lean=lean)
         if fail and not self.suppress_error_table:
             failed_item_view = TableView(self.test_log.info)
             failed_item_view.set_headers(["Read Key", "Exception"])
@@ -1077,7 +1188,8 @@ class LoadDocumentsTask(GenericLoadingTask):
                  collection=CbServer.default_collection,
                  track_failures=True,
                  skip_read_success_results=False,
-                 preserve_expiry=None, sdk_retry_strategy=None):
+                 preserve_expiry=None, sdk_retry_strategy=None,
+                 lean_results=False):
 
         super(LoadDocumentsTask, self).__init__(
             cluster, bucket, client, batch_size=batch_size,
@@ -1088,7 +1200,8 @@ class LoadDocumentsTask(GenericLoadingTask):
             sdk_client_pool=sdk_client_pool,
             scope=scope, collection=collection,
             preserve_expiry=preserve_expiry,
-            sdk_retry_strategy=sdk_retry_strategy)
+            sdk_retry_strategy=sdk_retry_strategy,
+            lean_results=lean_results)
         self.thread_name = "LoadDocs_%s_%s_%s_%s_%s_%s" \
                            % (task_identifier,
                               op_type,
@@ -1115,6 +1228,7 @@ class LoadDocumentsTask(GenericLoadingTask):
         self.durability = durability
         self.fail = dict()
         self.success = dict()
+        self.success_count = 0
         self.skip_read_on_error = skip_read_on_error
         self.track_failures = track_failures
         self.skip_read_success_results = skip_read_success_results
@@ -1186,10 +1300,17 @@ class LoadDocumentsTask(GenericLoadingTask):
             success, fail = self.batch_read(dict(key_value).keys())
             if self.track_failures:
                 self.fail.update(fail)
-            if not self.skip_read_success_results:
+            if not (self.skip_read_success_results or self.lean_results):
                 self.success.update(success)
         else:
             self.set_exception(Exception("Bad operation: %s" % self.op_type))
+            if self.sdk_client_pool is not None:
+                self.sdk_client_pool.release_client(self.client)
+                self.client = None
+            return
+
+        self.success_count += \
+            success if self.lean_results else len(success)
 
         if self.sdk_client_pool is not None:
             self.sdk_client_pool.release_client(self.client)
@@ -1337,6 +1458,8 @@ class LoadSubDocumentsTask(GenericLoadingTask):
 
 
 class Durability(Task):
+    priority_class = TaskPriority.COORDINATOR
+
     def __init__(self, cluster, task_manager, bucket, clients, generator,
                  op_type, exp, exp_unit="seconds", flag=0,
                  persist_to=0, replicate_to=0, time_unit="seconds",
@@ -1825,6 +1948,8 @@ class Durability(Task):
 
 
 class LoadDocumentsGeneratorsTask(Task):
+    priority_class = TaskPriority.COORDINATOR
+
     def __init__(self, cluster, task_manager, bucket, clients, generators,
                  op_type, exp, exp_unit="seconds", random_exp=False, flag=0,
                  persist_to=0, replicate_to=0, time_unit="seconds",
@@ -1839,7 +1964,13 @@ class LoadDocumentsGeneratorsTask(Task):
                  monitor_stats=["doc_ops"],
                  track_failures=True,
                  preserve_expiry=None,
-                 sdk_retry_strategy=None):
+                 sdk_retry_strategy=None,
+                 lean_results=False):
+        """
+        :param lean_results: If True, doc loading tasks only count the
+                             successful keys. 'success' will be empty
+                             and 'success_count' holds the total count
+        """
         super(LoadDocumentsGeneratorsTask, self).__init__(
             "LoadDocsGen_%s_%s_%s_%s_%s"
             % (bucket, scope, collection, task_identifier, time.time()))
@@ -1873,6 +2004,7 @@ class LoadDocumentsGeneratorsTask(Task):
         self.collection = collection
         self.preserve_expiry = preserve_expiry
         self.sdk_retry_strategy = sdk_retry_strategy
+        self.lean_results = lean_results
         if isinstance(op_type, list):
             self.op_types = op_type
         else:
@@ -1885,6 +2017,7 @@ class LoadDocumentsGeneratorsTask(Task):
         self.track_failures = track_failures
         self.fail = dict()
         self.success = dict()
+        self.success_count = 0
         self.print_ops_rate_tasks = list()
 
     def call(self):
@@ -1942,6 +2075,7 @@ class LoadDocumentsGeneratorsTask(Task):
                     self.test_log.error(e)
                 finally:
                     self.success.update(task.success)
+                    self.success_count += task.success_count
                     if self.track_failures:
                         self.fail.update(task.fail)
                         if task.fail.__len__() != 0:
@@ -2008,12 +2142,15 @@ class LoadDocumentsGeneratorsTask(Task):
                 scope=self.scope, collection=self.collection,
                 track_failures=self.track_failures,
                 preserve_expiry=self.preserve_expiry,
-                sdk_retry_strategy=self.sdk_retry_strategy)
+                sdk_retry_strategy=self.sdk_retry_strategy,
+                lean_results=self.lean_results)
             tasks.append(task)
         return tasks
 
 
 class LoadSubDocumentsGeneratorsTask(Task):
+    priority_class = TaskPriority.COORDINATOR
+
     def __init__(self, cluster, task_manager, bucket, clients,
                  generators,
                  op_type, exp, create_paths=False,
@@ -2202,6 +2339,8 @@ class LoadSubDocumentsGeneratorsTask(Task):
 
 
 class ContinuousDocOpsTask(Task):
+    priority_class = TaskPriority.BACKGROUND
+
     def __init__(self, cluster, task_manager, bucket, clients, generator,
                  op_type="update", exp=0, flag=0, persist_to=0, replicate_to=0,
                  durability="", time_unit="seconds",
@@ -2457,6 +2596,8 @@ class LoadDocumentsForDgmTask(LoadDocumentsGeneratorsTask):
 
 
 class ValidateDocumentsTask(GenericLoadingTask):
+    priority_class = TaskPriority.VALIDATOR
+
     def __init__(self, cluster, bucket, client, generator, op_type, exp,
                  flag=0, proxy_client=None, batch_size=1,
                  timeout_secs=30, time_unit="seconds",
@@ -2687,6 +2828,8 @@ class ValidateDocumentsTask(GenericLoadingTask):
 
 
 class DocumentsValidatorTask(Task):
+    priority_class = TaskPriority.COORDINATOR
+
     def __init__(self, cluster, task_manager, bucket, clients, generators,
                  op_type, exp, flag=0, batch_size=1,
                  timeout_secs=60, time_unit="seconds",
@@ -2820,7 +2963,19 @@ class DocumentsValidatorTask(Task):
         return tasks
 
 
-class StatsWaitTask(Task):
+class MultiStatsWaitTask(Task):
+    """
+    Waits for multiple (stat_cmd, stat, comparison, value) predicates
+    on a bucket using a single stat fetch per node per poll.
+    All nodes are fetched in parallel and all the stat groups required
+    by the predicates are pipelined in one round-trip per node.
+
+    Polling interval adapts to the observed values. It shrinks while
+    the pending stats keep changing (converging) and grows up to
+    max_poll_interval while they stay unchanged.
+    """
+    priority_class = TaskPriority.MONITOR
+
     EQUAL = '=='
     NOT_EQUAL = '!='
     LESS_THAN = '<'
@@ -2828,116 +2983,176 @@ class StatsWaitTask(Task):
     GREATER_THAN = '>'
     GREATER_THAN_EQ = '>='
 
-    def __init__(self, servers, bucket, stat_cmd, stat, comparison,
-                 value, timeout=300):
-        super(StatsWaitTask, self).__init__("StatsWaitTask_%s_%s_%s"
-                                            % (bucket.name,
-                                               stat,
-                                               str(time.time())))
+    min_poll_interval = 0.5
+    max_poll_interval = 5
+
+    def __init__(self, servers, bucket, predicates, timeout=300,
+                 per_node=False, task_name=None):
+        """
+        :param servers: Servers to fetch the stats from
+        :param bucket: Bucket object
+        :param predicates: List of (stat_cmd, stat, comparison, value).
+                           stat_cmd can be 'all', 'dcp' or 'checkpoint'.
+                           For 'checkpoint' the stat is summed across
+                           the vbuckets of the node
+        :param timeout: Max time to wait for all predicates to pass
+        :param per_node: If True, each predicate has to pass on every
+                         node individually. Otherwise the stat values
+                         are summed across the nodes before comparing
+        """
+        if task_name is None:
+            task_name = "MultiStatsWaitTask_%s_%s_%s" \
+                        % (bucket.name,
+                           "_".join([p[1] for p in predicates]),
+                           str(time.time()))
+        super(MultiStatsWaitTask, self).__init__(task_name)
         self.servers = servers
         self.bucket = bucket
-        self.statCmd = stat_cmd
-        self.stat = stat
-        self.comparison = comparison
-        self.value = value
+        self.predicates = list(predicates)
+        self.per_node = per_node
         self.stop = False
         self.timeout = timeout
         self.cbstatObjList = list()
+        self.stat_calls = 0
+
+        for stat_cmd, _, _, _ in self.predicates:
+            if stat_cmd not in ["all", "dcp", "checkpoint"]:
+                raise Exception("Not supported. Implement the stat call")
 
     def call(self):
         self.start_task()
         start_time = time.time()
         timeout = start_time + self.timeout
         for server in self.servers:
-            self.cbstatObjList.append(Cbstats(server))
-        try:
-            while not self.stop and time.time() < timeout:
-                if self.statCmd in ["all", "dcp"]:
-                    self._get_all_stats_and_compare()
-                elif self.statCmd == "checkpoint":
-                    if self.bucket.bucketType != Bucket.Type.MEMBASE:
-                        self.stop = True
-                        break
-                    self._get_checkpoint_stats_and_compare()
-                else:
-                    raise Exception("Not supported. Implement the stat call")
-        finally:
-            pass
-        if time.time() > timeout:
-            self.set_exception("Could not verify stat {} within timeout {}"
-                               .format(self.stat, self.timeout))
+            self.cbstatObjList.append(Cbstats(server, persistent=True))
+
+        if self.bucket.bucketType != Bucket.Type.MEMBASE:
+            # Checkpoint stats are not available for other bucket types
+            self.predicates = [p for p in self.predicates
+                               if p[0] != "checkpoint"]
+
+        poll_interval = self.min_poll_interval
+        prev_values = None
+        pending = list(self.predicates)
+        while pending and not self.stop and time.time() < timeout:
+            node_stats = self._fetch_stats(pending)
+            if node_stats is None:
+                break
+            values = self._get_values(pending, node_stats)
+            pending = [p for p in pending
+                       if not self._is_satisfied(p, values[p[:2]])]
+            if not pending:
+                break
 
+            if prev_values is not None:
+                changed = [p for p in pending
+                           if values[p[:2]] != prev_values.get(p[:2])]
+                if changed:
+                    poll_interval = max(self.min_poll_interval,
+                                        poll_interval / 2.0)
+                else:
+                    poll_interval = min(self.max_poll_interval,
+                                        poll_interval * 2)
+            prev_values = values
+            for stat_cmd, stat, comparison, value in pending:
+                self.log.debug("Not Ready: %s %s %s. Received: %s for "
+                               "bucket '%s'"
+                               % (stat, comparison, value,
+                                  values[(stat_cmd, stat)],
+                                  self.bucket.name))
+            sleep(min(poll_interval, max(0, timeout - time.time())),
+                  "Wait before next stat check", log_type="infra")
+
+        if not self.stop and pending:
+            self.set_exception("Could not verify stat(s) {} within timeout {}"
+                               .format(", ".join([p[1] for p in pending]),
+                                       self.timeout))
+        self.test_log.debug("All stats ready for bucket '%s' using %s stat "
+                            "calls in %.2fs"
+                            % (self.bucket.name, self.stat_calls,
+                               time.time() - start_time))
         self.complete_task()
 
-    def _get_all_stats_and_compare(self):
-        stat_result = 0
-        val_dict = dict()
-        retry = 10
-        while retry > 0:
-            try:
-                for cb_stat_obj in self.cbstatObjList:
-                    tem_stat = cb_stat_obj.all_stats(self.bucket.name,
-                                                     stat_name=self.statCmd)
-                    val_dict[cb_stat_obj.server.ip] = tem_stat[self.stat]
-                    if self.stat in tem_stat:
-                        stat_result += int(tem_stat[self.stat])
-                break
-            except Exception as error:
-                if retry > 0:
-                    retry -= 1
-                    sleep(5, "MC is down. Retrying.. %s" % str(error))
-                    continue
-                self.set_exception(error)
-                self.stop = True
-
-        if not self._compare(self.comparison, str(stat_result), self.value):
-            self.log.debug("Not Ready: %s %s %s %s. "
-                           "Received: %s for bucket '%s'"
-                           % (self.stat, stat_result, self.comparison,
-                              self.value, val_dict, self.bucket.name))
-            self.log.debug("Wait before next StatWaitTask check")
-            sleep(5, log_type="infra")
-        else:
-            self.test_log.debug("Ready: %s %s %s %s. "
-                                "Received: %s for bucket '%s'"
-                                % (self.stat, stat_result, self.comparison,
-                                   self.value, val_dict, self.bucket.name))
-            self.stop = True
+    def _fetch_stats(self, predicates, retry=10):
+        """
+        Fetches the stat groups required by the predicates from all nodes
+        in parallel
+        :return: dict of {server_ip: {stat_cmd: stats}} or None on failure
+        """
+        stat_cmds = sorted(set([p[0] for p in predicates]))
+        while True:
+            node_stats = dict()
+            errors = list()
 
-    def _get_checkpoint_stats_and_compare(self):
-        stat_result = 0
-        val_dict = dict()
-        retry = 5
-        while retry > 0:
-            try:
-                for cb_stat_obj in self.cbstatObjList:
-                    tem_stat = cb_stat_obj.checkpoint_stats(self.bucket.name)
-                    node_stat_val = 0
-                    for vb in tem_stat:
-                        node_stat_val += tem_stat[vb][self.stat]
-                    val_dict[cb_stat_obj.server.ip] = node_stat_val
-                    stat_result += node_stat_val
-                break
-            except Exception as error:
-                if retry > 0:
-                    retry -= 1
-                    sleep(5, "MC is down. Retrying.. %s" % str(error))
-                    continue
-                self.set_exception(error)
-                self.stop = True
-        if not self._compare(self.comparison, str(stat_result), self.value):
-            self.test_log.debug("Not Ready: %s %s %s %s. "
-                                "Received: %s for bucket '%s'"
-                                % (self.stat, stat_result, self.comparison,
-                                   self.value, val_dict, self.bucket.name))
-            self.log.debug("Wait before next StatWaitTask check")
-            sleep(5, log_type="infra")
-        else:
-            self.test_log.debug("Ready: %s %s %s %s. "
-                                "Received: %s for bucket '%s'"
-                                % (self.stat, stat_result, self.comparison,
-                                   self.value, val_dict, self.bucket.name))
+            def fetch(cb_stat_obj):
+                try:
+                    node_stats[cb_stat_obj.server.ip] = \
+                        cb_stat_obj.get_stats_multi(self.bucket.name,
+                                                    stat_cmds)
+                except Exception as e:
+                    errors.append(e)
+
+            threads = list()
+            for cb_stat_obj in self.cbstatObjList:
+                thread = threading.Thread(target=fetch, args=[cb_stat_obj])
+                thread.start()
+                threads.append(thread)
+            for thread in threads:
+                thread.join()
+            self.stat_calls += len(self.cbstatObjList)
+            if not errors:
+                return node_stats
+            if retry > 0:
+                retry -= 1
+                sleep(5, "MC is down. Retrying.. %s" % str(errors[0]))
+                continue
             self.stop = True
+            self.set_exception(errors[0])
+            return None
+
+    def _get_values(self, predicates, node_stats):
+        """
+        :return: dict of {(stat_cmd, stat): value}. Value is either the
+                 sum across nodes, or {server_ip: value} in per_node mode.
+                 Value is None if the stat is missing
+        """
+        values = dict()
+        for stat_cmd, stat, _, _ in predicates:
+            per_node_val = dict()
+            for server_ip, stats in node_stats.items():
+                stats = stats[stat_cmd]
+                if stat_cmd == "checkpoint":
+                    node_val = 0
+                    for vb, vb_stats in Cbstats.parse_per_vbucket_stats(
+                            stats).items():
+                        if stat not in vb_stats:
+                            self.log.warning(
+                                "Checkpoint stat '%s' missing for vb %s "
+                                "on %s, bucket '%s'"
+                                % (stat, vb, server_ip, self.bucket.name))
+                            node_val = None
+                            break
+                        node_val += vb_stats[stat]
+                elif stat in stats:
+                    node_val = int(stats[stat])
+                else:
+                    node_val = None
+                per_node_val[server_ip] = node_val
+            if self.per_node:
+                values[(stat_cmd, stat)] = per_node_val
+            elif None in per_node_val.values():
+                values[(stat_cmd, stat)] = None
+            else:
+                values[(stat_cmd, stat)] = sum(per_node_val.values())
+        return values
+
+    def _is_satisfied(self, predicate, value):
+        _, _, comparison, expected_val = predicate
+        if self.per_node:
+            return all([self._compare(comparison, str(node_val),
+                                      expected_val)
+                        for node_val in value.values()])
+        return self._compare(comparison, str(value), expected_val)
 
     def _compare(self, cmp_type, a, b):
         if isinstance(b, (int, long)) and a.isdigit():
@@ -2945,16 +3160,31 @@ class StatsWaitTask(Task):
         elif isinstance(b, (int, long)) and not a.isdigit():
             return False
         self.test_log.debug("Comparing %s %s %s" % (a, cmp_type, b))
-        if (cmp_type == StatsWaitTask.EQUAL and a == b) or \
-                (cmp_type == StatsWaitTask.NOT_EQUAL and a != b) or \
-                (cmp_type == StatsWaitTask.LESS_THAN_EQ and a <= b) or \
-                (cmp_type == StatsWaitTask.GREATER_THAN_EQ and a >= b) or \
-                (cmp_type == StatsWaitTask.LESS_THAN and a < b) or \
-                (cmp_type == StatsWaitTask.GREATER_THAN and a > b):
+        if (cmp_type == self.EQUAL and a == b) or \
+                (cmp_type == self.NOT_EQUAL and a != b) or \
+                (cmp_type == self.LESS_THAN_EQ and a <= b) or \
+                (cmp_type == self.GREATER_THAN_EQ and a >= b) or \
+                (cmp_type == self.LESS_THAN and a < b) or \
+                (cmp_type == self.GREATER_THAN and a > b):
             return True
         return False
 
 
+class StatsWaitTask(MultiStatsWaitTask):
+    """ Waits for a single stat, summed across the given servers """
+    def __init__(self, servers, bucket, stat_cmd, stat, comparison,
+                 value, timeout=300):
+        super(StatsWaitTask, self).__init__(
+            servers, bucket, [(stat_cmd, stat, comparison, value)],
+            timeout=timeout,
+            task_name="StatsWaitTask_%s_%s_%s" % (bucket.name, stat,
+                                                   str(time.time())))
+        self.statCmd = stat_cmd
+        self.stat = stat
+        self.comparison = comparison
+        self.value = value
+
+
 class ViewCreateTask(Task):
     def __init__(self, server, design_doc_name, view,
                  bucket="default", with_query=True,
@@ -3446,6 +3676,7 @@ class RunQueriesTask(Task):
                 -- Unprepared query eg:
                 select count(*) from {0} where mutated > 0;
     """
+    priority_class = TaskPriority.COORDINATOR
 
     def __init__(self, cluster, queries, task_manager, helper, query_type,
                  run_infinitely=False, parallelism=1, is_prepared=True,
@@ -3675,6 +3906,8 @@ class BuildIndexTask(Task):
 
 
 class MonitorIndexTask(Task):
+    priority_class = TaskPriority.MONITOR
+
     def __init__(self, server, bucket, index_name, n1ql_helper=None,
                  retry_time=2, timeout=240):
         super(MonitorIndexTask, self).__init__("build_index_task_%s_%s"
@@ -3770,6 +4003,8 @@ class DropIndexTask(Task):
 
 
 class PrintBucketStats(Task):
+    priority_class = TaskPriority.BACKGROUND
+
     def __init__(self, cluster, bucket, monitor_stats=list(), sleep=1):
         super(PrintBucketStats, self).__init__("PrintBucketStats_%s_%s"
                                                % (bucket.name, time.time()))
@@ -4055,6 +4290,8 @@ class BucketCreateFromSpecTask(Task):
 
 
 class MutateDocsFromSpecTask(Task):
+    priority_class = TaskPriority.COORDINATOR
+
     def __init__(self, cluster, task_manager, loader_spec,
                  sdk_client_pool,
                  batch_size=500,
@@ -4261,6 +4498,8 @@ class MutateDocsFromSpecTask(Task):
         return tasks
 
 class CompareIndexKVData(Task):
+    priority_class = TaskPriority.VALIDATOR
+
     def __init__(self, cluster, server, task_manager,
                  sdk_client_pool, query, bucket, scope, collection, index_name, offset, field='body',
                  track_failures=True):
@@ -4334,6 +4573,8 @@ class CompareIndexKVData(Task):
         return keys
 
 class ValidateDocsFromSpecTask(Task):
+    priority_class = TaskPriority.COORDINATOR
+
     def __init__(self, cluster, task_manager, loader_spec,
                  sdk_client_pool, check_replica=False,
                  batch_size=500,
@@ -4478,6 +4719,7 @@ class MonitorActiveTask(Task):
             progress reached wait_progress value
             task was not found by pid(believe that it's over)
     """
+    priority_class = TaskPriority.MONITOR
 
     def __init__(self, server, type, target_value, wait_progress=100,
                  num_iterations=100, wait_task=True):
@@ -4593,6 +4835,7 @@ class MonitorDBFragmentationTask(Task):
         kicks in a warning is sent and it is best user to use lower value
         as this can lead to infinite monitoring.
     """
+    priority_class = TaskPriority.MONITOR
 
     def __init__(self, server, fragmentation_value=10, bucket_name="default",
                  get_view_frag=False):
@@ -4643,6 +4886,8 @@ class MonitorDBFragmentationTask(Task):
 
 
 class AutoFailoverNodesFailureTask(Task):
+    priority_class = TaskPriority.COORDINATOR
+
     def __init__(self, task_manager, master, servers_to_fail, failure_type,
                  timeout, pause=0, expect_auto_failover=True, timeout_buffer=3,
                  check_for_failover=True, failure_timers=None,
@@ -5865,6 +6110,7 @@ class MonitorViewFragmentationTask(Task):
     value higher than level at which auto_compaction kicks in a warning is sent and
     it is best user to use lower value as this can lead to infinite monitoring.
     """
+    priority_class = TaskPriority.MONITOR
 
     def __init__(self, server, design_doc_name, fragmentation_value=10,
                  bucket="default"):
@@ -6219,6 +6465,7 @@ class MonitorBucketCompaction(Task):
     """
     Monitors bucket compaction status from start to complete
     """
+    priority_class = TaskPriority.MONITOR
 
     def __init__(self, cluster, bucket, timeout=300):
         """
@@ -1,30 +1,214 @@
 import threading
-from java.util.concurrent import Executors, TimeUnit, CancellationException
+import time
+from java.util.concurrent import Callable, Executors, TimeUnit, \
+    CancellationException, ForkJoinPool
 from threading import InterruptedException
 
 from common_lib import sleep
 from global_vars import logger
+from table_view import TableView
+
+
+class TaskPriority(object):
+    """
+    Priority classes understood by the TaskManager in 'priority'
+    scheduler mode. Tasks declare their class using the
+    'priority_class' attribute. Each class runs in its own pool, so a
+    busy class cannot starve the others. Tasks are not ordered by
+    precedence across the classes.
+
+    MONITOR / VALIDATOR / GENERAL / LOADER pools have a concurrency cap
+    and are meant for tasks which do not wait on other tasks.
+    COORDINATOR (tasks waiting on the sub-tasks they schedule) and
+    BACKGROUND (periodic / continuous tasks) pools are not capped, so
+    they never hold a capped pool's threads or starve each other
+    """
+    MONITOR = "monitor"
+    VALIDATOR = "validator"
+    GENERAL = "general"
+    LOADER = "loader"
+    COORDINATOR = "coordinator"
+    BACKGROUND = "background"
+
+    CAPPED = [MONITOR, VALIDATOR, GENERAL, LOADER]
+    UNCAPPED = [COORDINATOR, BACKGROUND]
+    ALL = CAPPED + UNCAPPED
+
+
+class SchedulerMode(object):
+    FIXED = "fixed"
+    PRIORITY = "priority"
+
+
+class _ClassMetrics(object):
+    """ Queue-depth / latency counters for a single priority class """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.submitted = 0
+        self.started = 0
+        self.completed = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.total_run_time = 0.0
+        self.max_run_time = 0.0
+
+    def task_started(self, wait_time):
+        with self.lock:
+            self.started += 1
+            self.total_wait_time += wait_time
+            self.max_wait_time = max(self.max_wait_time, wait_time)
+
+    def task_completed(self, run_time):
+        with self.lock:
+            self.completed += 1
+            self.total_run_time += run_time
+            self.max_run_time = max(self.max_run_time, run_time)
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                "submitted": self.submitted,
+                "queued": self.submitted - self.started,
+                "running": self.started - self.completed,
+                "completed": self.completed,
+                "avg_wait_time": (self.total_wait_time / self.started
+                                  if self.started else 0.0),
+                "max_wait_time": self.max_wait_time,
+                "avg_run_time": (self.total_run_time / self.completed
+                                 if self.completed else 0.0),
+                "max_run_time": self.max_run_time}
+
+
+class _ScheduledTask(Callable):
+    """
+    Wraps the actual task to record queue wait / run latency.
+    Returns the task's own result so future.get() stays unchanged
+    """
+    def __init__(self, task, metrics):
+        self.task = task
+        self.metrics = metrics
+        self.submit_time = time.time()
+
+    def call(self):
+        start_time = time.time()
+        self.metrics.task_started(start_time - self.submit_time)
+        try:
+            return self.task.call()
+        finally:
+            self.metrics.task_completed(time.time() - start_time)
+
+
+class _FutureBlocker(ForkJoinPool.ManagedBlocker):
+    """
+    Waits on a future. Lets a ForkJoinPool add a spare worker while one
+    of its workers is blocked on a task result
+    """
+    def __init__(self, future):
+        self.future = future
+
+    def block(self):
+        try:
+            self.future.get()
+        except Exception:
+            # Raised again by the caller's own future.get()
+            pass
+        return True
+
+    def isReleasable(self):
+        return self.future.isDone()
 
 
 class TaskManager:
-    def __init__(self, number_of_threads=10):
+    def __init__(self, number_of_threads=10, scheduler=SchedulerMode.FIXED,
+                 class_concurrency=None):
+        """
+        :param number_of_threads: Total number of worker threads
+        :param scheduler: SchedulerMode.FIXED - Single fixed thread pool
+                          SchedulerMode.PRIORITY - One pool per
+                          TaskPriority class, with a concurrency cap for
+                          the TaskPriority.CAPPED classes, so long running
+                          loaders cannot starve monitor / validation tasks
+        :param class_concurrency: dict of {TaskPriority: max_threads} for
+                                  the capped classes.
+                                  Used only with SchedulerMode.PRIORITY
+        """
         self.log = logger.get("infra")
         self.log.info("Initiating TaskManager with %d threads"
                       % number_of_threads)
         self.number_of_threads = number_of_threads
-        self.pool = Executors.newFixedThreadPool(self.number_of_threads)
+        self.scheduler = scheduler
         self.futures = dict()
+        self.pools = dict()
+        self.metrics = dict()
+        if self.scheduler == SchedulerMode.PRIORITY:
+            self.class_concurrency = self.__get_class_concurrency(
+                class_concurrency)
+            for p_class in TaskPriority.CAPPED:
+                self.pools[p_class] = Executors.newWorkStealingPool(
+                    self.class_concurrency[p_class])
+            for p_class in TaskPriority.UNCAPPED:
+                self.pools[p_class] = Executors.newCachedThreadPool()
+            for p_class in TaskPriority.ALL:
+                self.metrics[p_class] = _ClassMetrics()
+            self.log.info("Priority scheduler concurrency: %s"
+                          % self.class_concurrency)
+            self.pool = None
+        else:
+            self.pool = Executors.newFixedThreadPool(self.number_of_threads)
+
+    def __get_class_concurrency(self, class_concurrency):
+        """
+        Fills the per-class caps not given by the caller.
+        Loaders get half of the threads, the rest is split across the
+        remaining capped classes with a minimum of one thread per class
+        """
+        class_concurrency = dict(
+            [(p_class, cap)
+             for p_class, cap in (class_concurrency or dict()).items()
+             if p_class in TaskPriority.CAPPED])
+        remaining = [p_class for p_class in TaskPriority.CAPPED
+                     if p_class not in class_concurrency]
+        if TaskPriority.LOADER in remaining:
+            class_concurrency[TaskPriority.LOADER] = \
+                max(1, self.number_of_threads // 2)
+            remaining.remove(TaskPriority.LOADER)
+        if remaining:
+            spare = self.number_of_threads - sum(class_concurrency.values())
+            per_class = max(1, spare // len(remaining))
+            for p_class in remaining:
+                class_concurrency[p_class] = per_class
+        return class_concurrency
+
+    @staticmethod
+    def get_priority_class(task):
+        p_class = getattr(task, "priority_class", None)
+        if p_class not in TaskPriority.ALL:
+            p_class = TaskPriority.GENERAL
+        return p_class
 
     def add_new_task(self, task):
-        future = self.pool.submit(task)
+        if self.scheduler == SchedulerMode.PRIORITY:
+            p_class = self.get_priority_class(task)
+            metrics = self.metrics[p_class]
+            with metrics.lock:
+                metrics.submitted += 1
+            future = self.pools[p_class].submit(_ScheduledTask(task, metrics))
+            self.log.info("Added new task: %s, priority_class: %s"
+                          % (task.thread_name, p_class))
+        else:
+            future = self.pool.submit(task)
+            self.log.info("Added new task: %s" % task.thread_name)
         self.futures[task.thread_name] = future
-        self.log.info("Added new task: %s" % task.thread_name)
 
     def get_task_result(self, task):
         self.log.debug("Getting task result for %s" % task.thread_name)
         future = self.futures[task.thread_name]
         result = False
         try:
+            if self.scheduler == SchedulerMode.PRIORITY:
+                # A capped pool's worker waiting here gets compensated
+                # with a spare thread, instead of holding the pool
+                ForkJoinPool.managedBlock(_FutureBlocker(future))
             result = future.get()
         except CancellationException:
             self.log.warning("%s is already cancelled" % task.thread_name)
@@ -57,22 +241,65 @@ class TaskManager:
             self.log.debug("Stopping task %s" % task.thread_name)
             future.cancel(True)
 
+    def get_scheduler_metrics(self):
+        """
+        :return: dict of {priority_class: metrics_dict} with queue depth,
+                 running count and wait / run latency (in seconds).
+                 Empty dict in SchedulerMode.FIXED
+        """
+        stats = dict()
+        for p_class, metrics in self.metrics.items():
+            stats[p_class] = metrics.as_dict()
+            pool = self.pools[p_class]
+            if p_class in TaskPriority.UNCAPPED:
+                stats[p_class]["pool_queued"] = pool.getQueue().size()
+                stats[p_class]["steals"] = 0
+                continue
+            stats[p_class]["pool_queued"] = \
+                pool.getQueuedSubmissionCount() + pool.getQueuedTaskCount()
+            stats[p_class]["steals"] = pool.getStealCount()
+        return stats
+
+    def print_scheduler_metrics(self):
+        stats = self.get_scheduler_metrics()
+        if not stats:
+            return
+        table = TableView(self.log.info)
+        table.set_headers(["Class", "Cap", "Queued", "Running", "Completed",
+                           "Avg wait", "Max wait", "Avg run", "Steals"])
+        for p_class in TaskPriority.ALL:
+            c_stat = stats[p_class]
+            table.add_row([p_class, self.class_concurrency.get(p_class, "-"),
+                           c_stat["queued"], c_stat["running"],
+                           c_stat["completed"],
+                           "%.3fs" % c_stat["avg_wait_time"],
+                           "%.3fs" % c_stat["max_wait_time"],
+                           "%.3fs" % c_stat["avg_run_time"],
+                           c_stat["steals"]])
+        table.display("TaskManager scheduler metrics")
+
     def shutdown_task_manager(self, timeout=5):
         self.shutdown(timeout)
 
     def shutdown(self, timeout):
         self.log.info("Running TaskManager shutdown")
-        self.pool.shutdown()
+        self.print_scheduler_metrics()
+        pools = self.pools.values() if self.pool is None else [self.pool]
+        for pool in pools:
+            self.__shutdown_pool(pool, timeout)
+
+    def __shutdown_pool(self, pool, timeout):
+        pool.shutdown()
         try:
-            if not self.pool.awaitTermination(timeout, TimeUnit.SECONDS):
-                self.pool.shutdownNow()
+            if not pool.awaitTermination(timeout, TimeUnit.SECONDS):
+                pool.shutdownNow()
                 self.log.debug("TaskManager shutdown forcefully")
-                if not self.pool.awaitTermination(timeout, TimeUnit.SECONDS):
+                if not pool.awaitTermination(timeout, TimeUnit.SECONDS):
                     self.log.error("Pool did not terminate")
         except InterruptedException as ex:
             self.log.error(ex)
             # (Re-)Cancel if current thread also interrupted
-            self.pool.shutdownNow()
+            pool.shutdownNow()
             # Preserve interrupt status
             threading.currentThread().interrupt()
 
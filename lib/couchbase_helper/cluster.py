@@ -142,7 +142,8 @@ class ServerTasks(object):
                             monitor_stats=["doc_ops"],
                             track_failures=True,
                             preserve_expiry=None,
-                            sdk_retry_strategy=None):
+                            sdk_retry_strategy=None,
+                            lean_results=False):
         clients = list()
         if active_resident_threshold == 100:
             if not task_identifier:
@@ -180,7 +181,8 @@ class ServerTasks(object):
                     monitor_stats=monitor_stats,
                     track_failures=track_failures,
                     preserve_expiry=preserve_expiry,
-                    sdk_retry_strategy=sdk_retry_strategy)
+                    sdk_retry_strategy=sdk_retry_strategy,
+                    lean_results=lean_results)
             else:
                 majority_value = (bucket.replicaNumber + 1) / 2 + 1
 
@@ -628,6 +630,31 @@ class ServerTasks(object):
         self.jython_task_manager.add_new_task(_task)
         return _task
 
+    def async_wait_for_multi_stats(self, servers, bucket, predicates,
+                                   timeout=60, per_node=False):
+        """
+        Asynchronously wait for multiple stats using a single stat fetch
+        per node for every poll
+
+        Parameters:
+          servers    - Servers to fetch the stats from
+          bucket     - Bucket object
+          predicates - List of (stat_cmd, stat, comparison, value)
+          timeout    - Timeout for stat verification task
+          per_node   - If True, each predicate is validated per node.
+                       Otherwise stat values are summed across the nodes
+
+        Returns:
+          MultiStatsWaitTask - Task future that is a handle to the task
+        """
+        self.log.debug("Starting MultiStatsWaitTask for %s on bucket %s"
+                       % ([p[1] for p in predicates], bucket.name))
+        _task = jython_tasks.MultiStatsWaitTask(servers, bucket, predicates,
+                                                timeout=timeout,
+                                                per_node=per_node)
+        self.jython_task_manager.add_new_task(_task)
+        return _task
+
     def async_monitor_db_fragmentation(self, server, bucket_name,
                                        fragmentation,
                                        get_view_frag=False):
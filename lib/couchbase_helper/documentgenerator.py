@@ -10,6 +10,8 @@ from random import choice
 from string import ascii_uppercase, ascii_lowercase, digits
 
 from data import FIRST_NAMES, LAST_NAMES, DEPT, LANGUAGES
+from couchbase_helper.vbucket_key_index import TargetVbucketKeys, \
+    VBucketKeyIndex
 
 from com.couchbase.client.java.json import JsonObject
 from java.lang import String
@@ -20,6 +22,72 @@ from reactor.util.function import Tuples
 letters = ascii_uppercase + ascii_lowercase + digits
 
 
+def index_hash(seed, index):
+    """
+    32-bit hash of (seed, index) used by the fast generation mode
+    in place of reseeding random.Random for every document
+    """
+    h = (seed ^ (index * 0x9E3779B1)) & 0xffffffff
+    h ^= h >> 16
+    h = (h * 0x85EBCA6B) & 0xffffffff
+    h ^= h >> 13
+    h = (h * 0xC2B2AE35) & 0xffffffff
+    h ^= h >> 16
+    return h
+
+
+class DocBodyCache(object):
+    """
+    Document bodies precomputed per size bucket for the fast generation
+    mode. With a random source string, each size holds 'variants'
+    bodies sliced at different offsets of the source.
+    Once max_bytes worth of bodies are cached, new bodies are sliced
+    from the source on every call instead.
+    """
+    def __init__(self, doc_size, source=None, size_buckets=32, variants=16,
+                 max_bytes=64 * 1024 * 1024):
+        self.doc_size = doc_size
+        self.source = source
+        self.size_buckets = size_buckets
+        self.granularity = max(1, doc_size // size_buckets)
+        self.variants = variants if source else 1
+        self.stride = 0
+        if source:
+            self.stride = max(1, (len(source) - doc_size) // self.variants)
+        self.max_bytes = max_bytes
+        self.cached_bytes = 0
+        self.bodies = dict()
+
+    def __deepcopy__(self, memo):
+        # Cached bodies are derived state, copies start with empty cache
+        return DocBodyCache(self.doc_size, self.source,
+                            size_buckets=self.size_buckets,
+                            variants=self.variants,
+                            max_bytes=self.max_bytes)
+
+    def bucket_size(self, size):
+        """ Rounds the size down to its size bucket """
+        return size - size % self.granularity
+
+    def get(self, size, variant=0):
+        """
+        :return: java.lang.String body of the given size, so that
+                 JsonObject.put() does not convert it for every doc
+        """
+        key = (size, variant % self.variants)
+        body = self.bodies.get(key)
+        if body is None:
+            if self.source is None:
+                body = String('a' * size)
+            else:
+                offset = key[1] * self.stride
+                body = String(self.source[offset:offset + size])
+            if self.cached_bytes + size <= self.max_bytes:
+                self.bodies[key] = body
+                self.cached_bytes += size
+        return body
+
+
 def doc_generator(key, start, end,
                   key_size=8, mix_key_size=False,
                   doc_size=256, doc_type="json",
@@ -27,7 +95,7 @@ def doc_generator(key, start, end,
                   mutation_type="ADD", mutate=0,
                   randomize_doc_size=False, randomize_value=False,
                   randomize=False,
-                  deep_copy=False):
+                  deep_copy=False, fast_mode=False):
 
     # Defaults to JSON doc_type
     template_obj = JsonObject.create()
@@ -66,7 +134,8 @@ def doc_generator(key, start, end,
             randomize_doc_size=randomize_doc_size,
             randomize_value=randomize_value,
             randomize=randomize,
-            deep_copy=deep_copy)
+            deep_copy=deep_copy,
+            fast_mode=fast_mode)
     return DocumentGenerator(key, template_obj,
                              start=start, end=end,
                              key_size=key_size, mix_key_size=mix_key_size,
@@ -75,7 +144,8 @@ def doc_generator(key, start, end,
                              randomize_doc_size=randomize_doc_size,
                              randomize_value=randomize_value,
                              randomize=randomize,
-                             deep_copy=deep_copy)
+                             deep_copy=deep_copy,
+                             fast_mode=fast_mode)
 
 
 def sub_doc_generator(key, start, end, doc_size=256,
@@ -160,6 +230,7 @@ class KVGenerator(object):
         self.doc_size = 256
         self.body = [''.rjust(self.doc_size, 'a')][0]
         self.deep_copy = False
+        self.fast_mode = False
 
     def has_next(self):
         return self.itr < self.end
@@ -183,7 +254,81 @@ class KVGenerator(object):
         return self.end - self.start
 
 
-class DocumentGenerator(KVGenerator):
+class _FastDocGenerator(object):
+    """
+    fast_mode engine shared by DocumentGenerator and
+    DocumentGeneratorForTargetVbucket. Every doc gets a new JsonObject
+    with values derived from the doc index (without reseeding random)
+    and bodies from a DocBodyCache
+    """
+    def _init_fast_mode(self):
+        self._seed = zlib.crc32(self.name) & 0xffffffff
+        # Template fields copied into each new doc
+        self._template_fields = [(name, self.template.get(name))
+                                 for name in self.template.getNames()]
+        self._has_body = self.template.containsKey("body")
+        self._random_fields = list()
+        if self.randomize:
+            self._random_fields = [(name, self.kwargs[name])
+                                   for name, _ in self._template_fields
+                                   if name in self.kwargs]
+        source = None
+        if self.randomize_value:
+            source = self.random_string \
+                * (self.doc_size // self.len_random_string + 2)
+        self._body_cache = DocBodyCache(self.doc_size, source)
+
+    def _next_fast(self):
+        h = index_hash(self._seed, self.itr)
+        doc_key = self.next_key()
+        doc = JsonObject.create()
+        for name, value in self._template_fields:
+            doc.put(name, value)
+        for pos, (name, values) in enumerate(self._random_fields):
+            if callable(values):
+                t_val = values()
+            elif name == "key":
+                t_val = doc_key
+            else:
+                t_val = values[index_hash(h, pos) % len(values)]
+            doc.put(name, t_val)
+
+        if self._has_body:
+            doc_size = self.doc_size
+            if self.randomize_doc_size:
+                doc_size = self._body_cache.bucket_size(
+                    h % (self.doc_size + 1))
+            doc.put("body", self._body_cache.get(doc_size, h >> 16))
+
+        if self.doc_type.lower().find("binary") != -1:
+            return doc_key, String(str(doc)).getBytes(StandardCharsets.UTF_8)
+        if self.doc_type.lower().find("string") != -1:
+            return doc_key, String(str(doc))
+        return doc_key, doc
+
+    def next_batch(self, batch_size, skip_value=False):
+        """
+        Generates up to batch_size docs at once
+        :param batch_size: Max number of docs to generate
+        :param skip_value: If True, only keys are generated
+        :return: List of Tuples(key, value) as expected by SDK bulk ops
+        """
+        key_val = list()
+        add_doc = key_val.append
+        tuple_of = Tuples.of
+        end = min(self.end, self.itr + batch_size)
+        if skip_value:
+            while self.itr < end:
+                add_doc(tuple_of(self.next_key(), ""))
+        else:
+            next_doc = self._next_fast
+            while self.itr < end:
+                key, val = next_doc()
+                add_doc(tuple_of(key, val))
+        return key_val
+
+
+class DocumentGenerator(KVGenerator, _FastDocGenerator):
     """ An idempotent document generator."""
     def __init__(self, key_prefix, template, *args, **kwargs):
         """Initializes the document generator
@@ -203,7 +348,10 @@ class DocumentGenerator(KVGenerator):
             *args: Each arg is list for the corresponding param in the template
                    In the above example age[2] appears in the 3rd document
             *kwargs: Special constrains for the document generator,
-                     currently start and end are supported
+                     currently start and end are supported.
+                     fast_mode=True creates a new JsonObject per doc
+                     with values derived from the doc index (without
+                     reseeding random) and bodies from a DocBodyCache
         """
         self.args = args
         self.kwargs = kwargs
@@ -251,6 +399,11 @@ class DocumentGenerator(KVGenerator):
                                           for _ in range(4*1024))][0]
             self.len_random_string = len(self.random_string)
 
+        if 'fast_mode' in kwargs:
+            self.fast_mode = kwargs['fast_mode']
+        if self.fast_mode:
+            self._init_fast_mode()
+
     def next_key(self):
         if self.name == "random_keys":
             seed_hash = self.name + '-' + str(abs(self.itr))
@@ -281,6 +434,8 @@ class DocumentGenerator(KVGenerator):
     def next(self):
         if self.itr >= self.end:
             raise StopIteration
+        if self.fast_mode:
+            return self._next_fast()
         else:
             template = self.template
         # Assigning  self.template to template without
@@ -327,7 +482,6 @@ class DocumentGenerator(KVGenerator):
         doc_key = self.next_key()
         return doc_key, template
 
-
 class SubdocDocumentGenerator(KVGenerator):
     """ An idempotent document generator."""
 
@@ -352,7 +506,6 @@ class SubdocDocumentGenerator(KVGenerator):
         self.doc_type = "json"
         self.doc_keys = dict()
         self.doc_keys_len = 0
-        self.key_counter = 0
         self.key_size = 0
         self.target_vbucket = None
         self.vbuckets = None
@@ -379,21 +532,23 @@ class SubdocDocumentGenerator(KVGenerator):
             self.key_size = kwargs['key_size']
 
         if self.target_vbucket:
-            self.key_counter = self.start
             self.create_key_for_vbucket()
 
     def create_key_for_vbucket(self):
-        while self.doc_keys_len < self.end:
-            doc_key = super(SubdocDocumentGenerator,
-                            self).next_key(self.key_counter)
-            tem_vb = (((zlib.crc32(doc_key)) >> 16) & 0x7fff) & \
-                     (self.vbuckets-1)
-            if tem_vb in self.target_vbucket:
-                self.doc_keys.update({self.start+self.doc_keys_len: doc_key})
-                self.doc_keys_len += 1
-            self.key_counter += 1
+        # Keys are resolved lazily from the shared key->vbucket index
+        self.doc_keys = TargetVbucketKeys(
+            VBucketKeyIndex.get(self.name, self.key_size, self.vbuckets),
+            self.target_vbucket, self.start, self.end)
+        self.doc_keys_len = len(self.doc_keys)
         self.end = self.start + self.doc_keys_len
 
+    @property
+    def key_counter(self):
+        """ Key index next to the last key generated for target vbuckets """
+        if not self.doc_keys:
+            return self.start
+        return self.doc_keys.get_key_index(self.end - 1) + 1
+
     def next_key(self):
         if self.target_vbucket is not None:
             doc_key = self.doc_keys[self.itr]
@@ -437,7 +592,7 @@ class SubdocDocumentGenerator(KVGenerator):
         return doc_key, return_val
 
 
-class DocumentGeneratorForTargetVbucket(KVGenerator):
+class DocumentGeneratorForTargetVbucket(KVGenerator, _FastDocGenerator):
     """ An idempotent document generator."""
     def __init__(self, name, template, *args, **kwargs):
         """Initializes the document generator
@@ -457,7 +612,8 @@ class DocumentGeneratorForTargetVbucket(KVGenerator):
             *args: Each arg is list for the corresponding param in the template
                    In the above example age[2] appears in the 3rd document
             *kwargs: Special constrains for the document generator,
-                     currently start and end are supported
+                     currently start and end are supported.
+                     fast_mode works as in DocumentGenerator
         """
         self.args = args
         self.kwargs = kwargs
@@ -466,7 +622,6 @@ class DocumentGeneratorForTargetVbucket(KVGenerator):
         self.doc_keys = dict()
         self.doc_keys_len = 0
         self.key_size = 0
-        self.key_counter = 1
 
         KVGenerator.__init__(self, name)
 
@@ -512,21 +667,29 @@ class DocumentGeneratorForTargetVbucket(KVGenerator):
         if 'deep_copy' in kwargs:
             self.deep_copy = kwargs['deep_copy']
 
-        self.key_counter = self.start
         self.create_key_for_vbucket()
 
+        if 'fast_mode' in kwargs:
+            self.fast_mode = kwargs['fast_mode']
+        if self.fast_mode:
+            self._init_fast_mode()
+
     def create_key_for_vbucket(self):
-        while self.doc_keys_len < self.end:
-            doc_key = super(DocumentGeneratorForTargetVbucket,
-                            self).next_key(self.key_counter)
-            tem_vb = (((zlib.crc32(doc_key)) >> 16) & 0x7fff) & \
-                (self.vbuckets-1)
-            if tem_vb in self.target_vbucket:
-                self.doc_keys.update({self.start+self.doc_keys_len: doc_key})
-                self.doc_keys_len += 1
-            self.key_counter += 1
+        # Keys are resolved lazily from the shared key->vbucket index
+        # instead of hashing and storing every key upfront
+        self.doc_keys = TargetVbucketKeys(
+            VBucketKeyIndex.get(self.name, self.key_size, self.vbuckets),
+            self.target_vbucket, self.start, self.end)
+        self.doc_keys_len = len(self.doc_keys)
         self.end = self.start + self.doc_keys_len
 
+    @property
+    def key_counter(self):
+        """ Key index next to the last key generated for target vbuckets """
+        if not self.doc_keys:
+            return self.start
+        return self.doc_keys.get_key_index(self.end - 1) + 1
+
     """
     Creates the next generated document and increments the iterator.
     Returns:
@@ -540,6 +703,8 @@ class DocumentGeneratorForTargetVbucket(KVGenerator):
     def next(self):
         if self.itr > self.end:
             raise StopIteration
+        if self.fast_mode:
+            return self._next_fast()
         template = self.template
         if self.deep_copy:
             template = copy.deepcopy(self.template)
@@ -612,6 +777,11 @@ class BatchedDocumentGenerator(object):
         return self._doc_gen.has_next()
 
     def next_batch(self, skip_value=False):
+        if getattr(self._doc_gen, "fast_mode", False):
+            key_val = self._doc_gen.next_batch(self._batch_size, skip_value)
+            self.count = len(key_val)
+            return key_val
+
         self.count = 0
         key_val = []
         # Value is not required for
@@ -0,0 +1,204 @@
+"""
+Query workload driver with a fixed pool of worker threads
+
+Two modes are supported:
+ - Closed loop (qps=None): each of the num_workers threads runs queries
+   back to back, so 'num_workers' queries are always in flight.
+ - Open loop (qps=N): a scheduler thread issues N queries per second
+   irrespective of the response times. Latency is measured from the
+   scheduled time of the query, so a saturated cluster shows up as
+   latency instead of silently lowering the request rate.
+   Queries which cannot be queued because all the workers are busy
+   are counted as 'skipped'.
+
+Query execution is delegated to a QueryBackend (N1QL / CBAS / ...).
+"""
+
+import random
+import threading
+import time
+from Queue import Queue, Empty, Full
+
+from global_vars import logger
+from latency_histogram import LatencyHistogram
+from table_view import TableView
+
+
+class QueryBackend(object):
+    """
+    Executes one query. Implementations plug in the actual service call.
+    """
+    # Result categories
+    SUCCESS = "success"
+    FAILED = "failed"
+    TIMEOUT = "timeout"
+    CANCELLED = "cancelled"
+    REJECTED = "rejected"
+    ERROR = "error"
+
+    def run_query(self, query, client_context_id):
+        """
+        :return: One of the result categories
+        """
+        raise NotImplementedError()
+
+    def classify_error(self, exception):
+        """
+        :return: Result category for the exception raised by run_query()
+        """
+        error = str(exception)
+        if "TimeoutException" in error:
+            return self.TIMEOUT
+        if "RequestCanceledException" in error:
+            return self.CANCELLED
+        if "CouchbaseException" in error:
+            return self.REJECTED
+        return self.ERROR
+
+
+class QueryLoadStats(object):
+    """ Thread safe counters of the query results """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = dict()
+
+    def increment(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def get(self, name):
+        return self.counters.get(name, 0)
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counters)
+
+
+class QueryLoadEngine(object):
+    def __init__(self, backend, queries, num_workers=10, qps=None,
+                 name="query_load"):
+        """
+        :param backend: QueryBackend object
+        :param queries: List of query templates. Each query to run is
+                        picked randomly from this list
+        :param num_workers: Number of worker threads
+        :param qps: Target queries per second (open loop).
+                    None means closed loop with num_workers concurrency
+        :param name: Used for thread names and client_context_ids
+        """
+        self.log = logger.get("test")
+        self.backend = backend
+        self.queries = list(queries)
+        self.num_workers = num_workers
+        self.qps = qps
+        self.name = name
+        self.stats = QueryLoadStats()
+        # query -> LatencyHistogram
+        self.latencies = dict([(query, LatencyHistogram())
+                               for query in self.queries])
+        self.__stop = threading.Event()
+        self.__queue = Queue(maxsize=num_workers)
+        self.__threads = list()
+        self.__query_id = 0
+        self.__query_id_lock = threading.Lock()
+        self.start_time = None
+
+    def __next_context_id(self):
+        with self.__query_id_lock:
+            self.__query_id += 1
+            return "%s_%s" % (self.name, self.__query_id)
+
+    def __execute(self, query, start_time):
+        self.stats.increment("submitted")
+        try:
+            result = self.backend.run_query(query, self.__next_context_id())
+        except Exception as e:
+            result = self.backend.classify_error(e)
+        self.latencies[query].record((time.time() - start_time) * 1000000)
+        self.stats.increment(result)
+
+    def __closed_loop_worker(self):
+        while not self.__stop.is_set():
+            self.__execute(random.choice(self.queries), time.time())
+
+    def __open_loop_worker(self):
+        while not self.__stop.is_set():
+            try:
+                query, scheduled_time = self.__queue.get(timeout=1)
+            except Empty:
+                continue
+            self.__execute(query, scheduled_time)
+
+    def __scheduler(self):
+        interval = 1.0 / self.qps
+        next_time = time.time()
+        while not self.__stop.is_set():
+            delay = next_time - time.time()
+            if delay > 0:
+                self.__stop.wait(delay)
+                continue
+            try:
+                self.__queue.put_nowait((random.choice(self.queries),
+                                         next_time))
+            except Full:
+                self.stats.increment("skipped")
+            next_time += interval
+
+    def start(self):
+        self.start_time = time.time()
+        target = self.__closed_loop_worker if self.qps is None \
+            else self.__open_loop_worker
+        for index in range(self.num_workers):
+            thread = threading.Thread(
+                target=target, name="%s_worker_%s" % (self.name, index))
+            thread.daemon = True
+            thread.start()
+            self.__threads.append(thread)
+        if self.qps is not None:
+            thread = threading.Thread(target=self.__scheduler,
+                                      name="%s_scheduler" % self.name)
+            thread.daemon = True
+            thread.start()
+            self.__threads.append(thread)
+
+    def stop(self, timeout=60):
+        self.__stop.set()
+        for thread in self.__threads:
+            thread.join(timeout)
+        self.__threads = list()
+
+    def is_running(self):
+        return bool(self.__threads) and not self.__stop.is_set()
+
+    def status_line(self):
+        stats = self.stats.snapshot()
+        elapsed = max(time.time() - (self.start_time or time.time()), 1)
+        return "%s queries submitted, %s failed, %s passed, %s rejected, " \
+               "%s cancelled, %s timeout, %s errored, %s skipped, " \
+               "%.2f queries/sec" \
+               % (stats.get("submitted", 0),
+                  stats.get(QueryBackend.FAILED, 0),
+                  stats.get(QueryBackend.SUCCESS, 0),
+                  stats.get(QueryBackend.REJECTED, 0),
+                  stats.get(QueryBackend.CANCELLED, 0),
+                  stats.get(QueryBackend.TIMEOUT, 0),
+                  stats.get(QueryBackend.ERROR, 0),
+                  stats.get("skipped", 0),
+                  stats.get("submitted", 0) / elapsed)
+
+    def print_stats(self):
+        self.log.info("%s: %s" % (self.name, self.status_line()))
+        table = TableView(self.log.info)
+        table.set_headers(["Query", "Count", "Mean (ms)", "p50 (ms)",
+                           "p95 (ms)", "p99 (ms)", "Max (ms)"])
+        for query in sorted(self.latencies.keys()):
+            histogram = self.latencies[query]
+            if histogram.total_count == 0:
+                continue
+            table.add_row([query[:60], histogram.total_count,
+                           "%.2f" % (histogram.mean() / 1000),
+                           "%.2f" % (histogram.percentile(50) / 1000.0),
+                           "%.2f" % (histogram.percentile(95) / 1000.0),
+                           "%.2f" % (histogram.percentile(99) / 1000.0),
+                           "%.2f" % (histogram.max / 1000.0)])
+        table.display("%s latency per query" % self.name)
@@ -0,0 +1,185 @@
+"""
+Linear time comparison of query results (N1QL / SQL / expected results)
+
+Every row is canonicalised and reduced to a stable md5 digest of its
+repr():
+ - dicts become tuples of items sorted on the keys, so the key order of
+   a row does not matter
+ - unicode strings are utf-8 encoded (u"a" == "a" like in python)
+ - integral floats / Decimals are reduced to int (1.0 == 1 like in python)
+ - booleans are reduced to int (True == 1 like in python), as SQL returns
+   1 / 0 where N1QL returns true / false
+ - tuples / sets are treated as lists (sets are sorted)
+ - nested lists can optionally be sorted, for unordered array values
+
+The digests of both sides are diffed as a multiset, with a single
+net count per digest (+1 actual, -1 expected). Only the rows whose digest
+is currently unbalanced are kept, so matching rows are never
+materialised and the memory is bound by the mismatches (plus the skew
+between the two sides while streaming).
+
+Rows can be fed in pages as they arrive, ex: from paged query responses,
+through add_actual() / add_expected().
+For ordered results (ORDER BY) the rows are also paired by position and
+the first mismatching position is recorded.
+"""
+
+import hashlib
+from collections import deque
+from decimal import Decimal
+
+ACTUAL = 1
+EXPECTED = -1
+
+
+def canonical_value(value, sort_lists=False):
+    """
+    :param value: Row / value to canonicalise
+    :param sort_lists: Sort the nested lists, for unordered array values
+    :return: Value made of tuples, lists and scalars whose repr() is
+             identical for all the values comparing equal
+    """
+    if isinstance(value, dict):
+        return tuple(sorted((canonical_value(key), canonical_value(val,
+                                                                   sort_lists))
+                            for key, val in value.iteritems()))
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+    if isinstance(value, (list, tuple, set, frozenset)):
+        values = [canonical_value(val, sort_lists) for val in value]
+        if sort_lists or isinstance(value, (set, frozenset)):
+            values.sort()
+        return values
+    if isinstance(value, Decimal):
+        value = float(value)
+    if isinstance(value, float) and value.is_integer() \
+            or isinstance(value, (bool, long)):
+        return int(value)
+    return value
+
+
+def row_digest(row, sort_lists=False):
+    """ :return: Stable md5 digest of the canonical form of the row """
+    return hashlib.md5(repr(canonical_value(row, sort_lists))).digest()
+
+
+class ResultDiff(object):
+    def __init__(self, ordered=False, key=None, sort_lists=False):
+        """
+        :param ordered: Rows must also match position wise
+        :param key: Function applied on each row before the hashing,
+                    to compare only a part of the rows.
+                    Reported rows are the original ones
+        :param sort_lists: Compare the nested lists as unordered
+        """
+        self.ordered = ordered
+        self.key = key
+        self.sort_lists = sort_lists
+        self.actual_count = 0
+        self.expected_count = 0
+        # digest -> net count (actual - expected), only non-zero values
+        self.__balance = dict()
+        # digest -> one of the rows with the digest, for non-zero balance
+        self.__rows = dict()
+        # Ordered mode: (digest, row) of the side which is ahead
+        self.__pending = deque()
+        self.__pending_side = None
+        self.__position = 0
+        # (position, expected_row, actual_row)
+        self.first_mismatch = None
+
+    def __digest(self, row):
+        if self.key is not None:
+            return row_digest(self.key(row), self.sort_lists)
+        return row_digest(row, self.sort_lists)
+
+    def __add(self, rows, side):
+        balance = self.__balance
+        kept_rows = self.__rows
+        count = 0
+        for row in rows:
+            count += 1
+            digest = self.__digest(row)
+            net = balance.get(digest, 0) + side
+            if net:
+                balance[digest] = net
+                kept_rows.setdefault(digest, row)
+            else:
+                del balance[digest]
+                del kept_rows[digest]
+            if self.ordered:
+                self.__pair(digest, row, side)
+        if side == ACTUAL:
+            self.actual_count += count
+        else:
+            self.expected_count += count
+
+    def __pair(self, digest, row, side):
+        if not self.__pending or self.__pending_side == side:
+            self.__pending.append((digest, row))
+            self.__pending_side = side
+            return
+        other_digest, other_row = self.__pending.popleft()
+        if other_digest != digest and self.first_mismatch is None:
+            if side == ACTUAL:
+                self.first_mismatch = (self.__position, other_row, row)
+            else:
+                self.first_mismatch = (self.__position, row, other_row)
+        self.__position += 1
+
+    def add_actual(self, rows):
+        """ :param rows: Iterable of actual rows (ex: a page of results) """
+        self.__add(rows, ACTUAL)
+        return self
+
+    def add_expected(self, rows):
+        """ :param rows: Iterable of expected rows """
+        self.__add(rows, EXPECTED)
+        return self
+
+    def is_equal(self):
+        if self.__balance:
+            return False
+        if self.ordered:
+            return self.first_mismatch is None and not self.__pending
+        return True
+
+    def mismatch_position(self):
+        """
+        :return: First position where the ordered results differ,
+                 None if they match
+        """
+        if self.first_mismatch is not None:
+            return self.first_mismatch[0]
+        if self.ordered and self.__pending:
+            return self.__position
+        if self.__balance:
+            return min(self.actual_count, self.expected_count)
+        return None
+
+    def __rows_by_side(self, side, limit):
+        rows = list()
+        for digest, net in self.__balance.iteritems():
+            if net * side > 0:
+                rows.extend([self.__rows[digest]] * min(abs(net), limit))
+                if len(rows) >= limit:
+                    return rows[:limit]
+        return rows
+
+    def missing(self, limit=None):
+        """ :return: Expected rows not found in the actual result """
+        return self.__rows_by_side(EXPECTED, limit or self.expected_count)
+
+    def extra(self, limit=None):
+        """ :return: Actual rows not found in the expected result """
+        return self.__rows_by_side(ACTUAL, limit or self.actual_count)
+
+    def summary(self, limit=5):
+        msg = "actual rows: %s, expected rows: %s" \
+              % (self.actual_count, self.expected_count)
+        if self.first_mismatch is not None:
+            position, expected_row, actual_row = self.first_mismatch
+            msg += ", first mismatch position :: %s, expected :: %s, " \
+                   "actual :: %s" % (position, expected_row, actual_row)
+        return msg + ", missing :: %s, extra :: %s" \
+            % (self.missing(limit), self.extra(limit))
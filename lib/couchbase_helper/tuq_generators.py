@@ -1,4 +1,5 @@
-import copy
+import ast
+import bisect
 import datetime
 import json
 import os
@@ -13,11 +14,21 @@ from com.couchbase.client.java.json import JsonObject
 
 
 class TuqGenerators(object):
+    # WHERE conditions which can be served by an index on full_set
+    INDEX_OPS = {ast.Eq: "eq", ast.Lt: "lt", ast.LtE: "le",
+                 ast.Gt: "gt", ast.GtE: "ge"}
+
     def __init__(self, log, full_set):
         self.log = log
         self.full_set = full_set
         self.query = None
         self.type_args = {}
+        # Generated clause -> compiled function of 'doc'
+        self._compiled = {}
+        # attr -> (sorted values, full_set positions) or None if the
+        # attr cannot be indexed. Rebuilt if the full_set size changes
+        self._indexes = {}
+        self._indexed_size = len(full_set)
         self.nests = self._all_nested_objects(full_set[0])
         self.type_args['str'] = [attr[0] for attr in full_set[0].iteritems()
                             if isinstance(attr[1], unicode)]
@@ -324,35 +335,183 @@ class TuqGenerators(object):
                         else:
                             select_clause = select_clause + '"%s" : %s,' %([at.replace('"','') for at in re.compile('"\w+"').findall(attr)][0], attr)
                     select_clause = select_clause + '}'
+        select = self._compile(select_clause)
         if where_clause:
-            result = [eval(select_clause) for doc in self.full_set if eval(where_clause)]
+            where = self._compile(where_clause)
+            candidates = self._indexed_candidates(where_clause)
+            if candidates is not None:
+                docs = [self.full_set[pos] for pos in candidates]
+            else:
+                docs = self.full_set
+            result = [select(doc) for doc in docs if where(doc)]
         else:
-            result = [eval(select_clause) for doc in self.full_set]
+            result = [select(doc) for doc in self.full_set]
         if self.distinct:
-            result = [dict(y) for y in set(tuple(x.items()) for x in result)]
+            result = self._distinct(result)
         if unnest_clause:
             unnest_attr = unnest_clause[5:-2]
+            unnest = self._compile(unnest_clause)
             if unnest_attr in self.aliases:
+                # Rows share the values with full_set, like the ones
+                # without UNNEST. Only the top level is copied
                 def res_generator():
                     for doc in result:
-                        doc_temp = copy.deepcopy(doc)
+                        doc_temp = dict(doc)
                         del doc_temp[unnest_attr]
-                        for item in eval(unnest_clause):
-                            doc_to_append = copy.deepcopy(doc_temp)
-                            doc_to_append[unnest_attr] = copy.deepcopy(item)
+                        for item in unnest(doc):
+                            doc_to_append = dict(doc_temp)
+                            doc_to_append[unnest_attr] = item
                             yield doc_to_append
                 result = list(res_generator())
             else:
-                result = [item for doc in result for item in eval(unnest_clause)]
-        if self._create_groups()[0]:
+                result = [item for doc in result for item in unnest(doc)]
+        if self._get_group_attrs():
             result = self._group_results(result)
         if self.aggr_fns:
-            if not self._create_groups()[0] or len(result) == 0:
+            if not self._get_group_attrs() or len(result) == 0:
                 for fn_name, params in self.aggr_fns.iteritems():
                     if fn_name == 'COUNT':
                         result = [{params['alias'] : len(result)}]
         return result
 
+    def _compile(self, clause):
+        """
+        :param clause: Generated python expression of 'doc'
+        :return: Function of doc evaluating the clause, compiled once
+        """
+        func = self._compiled.get(clause)
+        if func is None:
+            func = eval("lambda doc: (\n%s\n)" % clause.strip())
+            self._compiled[clause] = func
+        return func
+
+    def _get_index(self, attr):
+        """
+        :return: (sorted values, positions in full_set) of the top level
+                 attribute. None if some doc lacks it or its values are
+                 not all numbers / all strings
+        """
+        if len(self.full_set) != self._indexed_size:
+            self._indexes = {}
+            self._indexed_size = len(self.full_set)
+        if attr in self._indexes:
+            return self._indexes[attr]
+        index = None
+        entries = []
+        kinds = set()
+        for pos, doc in enumerate(self.full_set):
+            try:
+                value = doc[attr]
+            except (KeyError, TypeError):
+                break
+            kinds.add(self._value_kind(value))
+            if None in kinds or len(kinds) > 1:
+                break
+            entries.append((value, pos))
+        else:
+            entries.sort()
+            index = ([value for value, _ in entries],
+                     [pos for _, pos in entries])
+        self._indexes[attr] = index
+        return index
+
+    @staticmethod
+    def _value_kind(value):
+        if isinstance(value, basestring):
+            return "string"
+        if isinstance(value, (int, long, float)) \
+                and not isinstance(value, bool):
+            return "number"
+        return None
+
+    def _parse_index_condition(self, condition):
+        """
+        :return: (attr, op, literal) for 'doc["attr"] <op> literal',
+                 else None
+        """
+        if not isinstance(condition, ast.Compare) \
+                or len(condition.ops) != 1 \
+                or type(condition.ops[0]) not in self.INDEX_OPS:
+            return None
+        left = condition.left
+        if not isinstance(left, ast.Subscript) \
+                or not isinstance(left.value, ast.Name) \
+                or left.value.id != "doc" \
+                or not isinstance(left.slice, ast.Index) \
+                or not isinstance(left.slice.value, ast.Str):
+            return None
+        try:
+            literal = ast.literal_eval(condition.comparators[0])
+        except ValueError:
+            return None
+        if self._value_kind(literal) is None:
+            return None
+        return (left.slice.value.s, self.INDEX_OPS[type(condition.ops[0])],
+                literal)
+
+    def _indexed_candidates(self, where_clause):
+        """
+        Narrows down the docs to evaluate the WHERE clause on, using the
+        most selective of its top level 'doc["attr"] <op> literal'
+        conditions which are AND-ed
+        :return: Sorted positions in full_set of the candidate docs.
+                 None if no condition can use an index
+        """
+        try:
+            tree = ast.parse(where_clause.strip(), mode="eval").body
+        except SyntaxError:
+            return None
+        if isinstance(tree, ast.BoolOp) and isinstance(tree.op, ast.And):
+            conditions = tree.values
+        else:
+            conditions = [tree]
+        best = None
+        for condition in conditions:
+            parsed = self._parse_index_condition(condition)
+            if parsed is None:
+                continue
+            attr, op, literal = parsed
+            index = self._get_index(attr)
+            if index is None or not index[0] \
+                    or self._value_kind(index[0][0]) \
+                    != self._value_kind(literal):
+                continue
+            values, positions = index
+            if op == "eq":
+                bounds = (bisect.bisect_left(values, literal),
+                          bisect.bisect_right(values, literal))
+            elif op == "lt":
+                bounds = (0, bisect.bisect_left(values, literal))
+            elif op == "le":
+                bounds = (0, bisect.bisect_right(values, literal))
+            elif op == "gt":
+                bounds = (bisect.bisect_right(values, literal), len(values))
+            else:
+                bounds = (bisect.bisect_left(values, literal), len(values))
+            if best is None or bounds[1] - bounds[0] < best[1][1] - best[1][0]:
+                best = (positions, bounds)
+        if best is None:
+            return None
+        positions, (start, end) = best
+        # Keep the full_set order of the docs
+        return sorted(positions[start:end])
+
+    @staticmethod
+    def _distinct(result):
+        """ :return: Rows without the duplicates, in the first seen order """
+        seen = set()
+        distinct = []
+        for row in result:
+            try:
+                key = tuple(sorted(row.items()))
+                hash(key)
+            except (AttributeError, TypeError):
+                key = json.dumps(row, sort_keys=True, default=str)
+            if key not in seen:
+                seen.add(key)
+                distinct.append(row)
+        return distinct
+
     def _order_clause_greater_than_select(self, select_clause):
         order_clause = self._get_order_clause()
         if not order_clause:
@@ -439,7 +598,7 @@ class TuqGenerators(object):
                                                          if params['field'] == att_name[1:-1]][0])
             if order_clause.find(',"') != -1:
                 order_clause = order_clause.replace(',"', '"')
-            key = lambda doc: eval(order_clause)
+            key = self._compile(order_clause)
         try:
             result = sorted(result, key=key, reverse=reverse)
         except:
@@ -467,53 +626,50 @@ class TuqGenerators(object):
             result = result[:int(limit_clause)]
         return result
 
-    def _create_groups(self):
+    def _get_group_attrs(self):
         if self.query.find('GROUP BY') == -1:
-            return 0, None
+            return None
         group_clause = re.sub(r'ORDER BY.*', '', re.sub(r'.*GROUP BY', '', self.query)).strip()
         if not group_clause:
-            return 0, None
-        attrs = group_clause.split(',')
-        attrs = [attr.strip() for attr in attrs]
-        if len(attrs) == 2:
-            groups = set([(doc[attrs[0]],doc[attrs[1]])  for doc in self.full_set])
-        elif len(attrs) == 1:
-            if attrs[0].find('.') != -1:
-                if len(attrs[0].split('.')) > 2:
-                    groups = set([doc[attrs[0].split('.')[1]][attrs[0].split('.')[2]]
-                              for doc in self.full_set])
-                else:
-                    groups = set([doc[attrs[0].split('.')[0]][attrs[0].split('.')[1]]
-                              for doc in self.full_set])
-            else:
-                groups = set([doc[attrs[0]]  for doc in self.full_set])
-        return attrs, groups
+            return None
+        return [attr.strip() for attr in group_clause.split(',')]
 
     def _group_results(self, result):
-        attrs, groups = self._create_groups()
+        """
+        Aggregates the rows per group in a single pass over them.
+        Only the groups having rows are returned
+        """
+        attrs = self._get_group_attrs()
         for fn_name, params in self.aggr_fns.iteritems():
             if fn_name == 'COUNT':
-                result = [{attrs[0] : group[0], attrs[1] : group[1],
-                                params['alias'] : len([doc for doc in result
-                                if doc[attrs[0]]==group[0] and doc[attrs[1]]==group[1]])}
-                          for group in groups]
-                result = [doc for doc in result if doc[params['alias']] > 0]
+                counts = {}
+                for doc in result:
+                    group = tuple(doc[attr] for attr in attrs)
+                    counts[group] = counts.get(group, 0) + 1
+                result = []
+                for group, count in counts.iteritems():
+                    row = dict(zip(attrs, group))
+                    row[params['alias']] = count
+                    result.append(row)
             if fn_name == 'MIN':
-                if isinstance(list(groups)[0], tuple):
-                    result = [{attrs[0] : group[0], attrs[1] : group[1],
-                                    params['alias'] : min([doc[params['field']] for doc in result
-                                    if doc[attrs[0]]==group[0] and doc[attrs[1]]==group[1]])}
-                              for group in groups]
+                if len(attrs) > 1:
+                    value_attr = params['field']
                 else:
                     if attrs[0] in self.aliases.itervalues():
                         attrs[0] = self.get_alias_for(attrs[0]).replace(',', '')
-                    result = [{attrs[0] : group,
-                                params['alias'] : min([doc[params['alias']] for doc in result
-                                if doc[attrs[0]]==group])}
-                          for group in groups]
-        else:
-            result = [dict(y) for y in set(tuple(x.items()) for x in result)]
-        return result
+                    value_attr = params['alias']
+                mins = {}
+                for doc in result:
+                    group = tuple(doc[attr] for attr in attrs)
+                    value = doc[value_attr]
+                    if group not in mins or value < mins[group]:
+                        mins[group] = value
+                result = []
+                for group, value in mins.iteritems():
+                    row = dict(zip(attrs, group))
+                    row[params['alias']] = value
+                    result.append(row)
+        return self._distinct(result)
 
     def get_alias_for(self, value_search):
         for key, value in self.aliases.iteritems():
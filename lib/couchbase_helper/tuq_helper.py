@@ -3,6 +3,7 @@ import time
 import random
 
 from common_lib import sleep
+from couchbase_helper.result_diff import ResultDiff
 from couchbase_helper.tuq_generators import TuqGenerators
 from couchbase_helper.tuq_generators import JsonGenerator
 from membase.api.rest_client import RestConnection
@@ -431,15 +432,18 @@ class N1QLHelper:
         return all_docs_list
 
     def _verify_results(self, actual_result, expected_result, missing_count = 1, extra_count = 1):
+        diff = ResultDiff(ordered=True)
         self.log.info("Analyzing Actual Result")
-        actual_result = self._gen_dict(actual_result)
+        diff.add_actual(self._iter_values(actual_result))
         self.log.info("Analyzing Expected Result")
-        expected_result = self._gen_dict(expected_result)
-        if len(actual_result) != len(expected_result):
-            raise Exception("Results are incorrect.Actual num %s. Expected num: %s.\n" % (len(actual_result), len(expected_result)))
+        diff.add_expected(self._iter_values(expected_result))
+        if diff.actual_count != diff.expected_count:
+            raise Exception("Results are incorrect.Actual num %s. Expected num: %s.\n%s"
+                            % (diff.actual_count, diff.expected_count,
+                               diff.summary(max(missing_count, extra_count))))
         msg = "The number of rows match but the results mismatch, please check"
-        if actual_result != expected_result:
-            raise Exception(msg)
+        if not diff.is_equal():
+            raise Exception(msg + "\n" + diff.summary())
 
     def _verify_results_rqg(self, subquery, aggregate=False, n1ql_result=[], sql_result=[], hints=["a1"], aggregate_pushdown=False):
         new_n1ql_result = []
@@ -460,15 +464,15 @@ class N1QLHelper:
         if check:
             actual_result = self._gen_dict(n1ql_result)
 
-        actual_result = sorted(actual_result)
-        expected_result = sorted(sql_result)
-
-        if len(actual_result) != len(expected_result):
-            extra_msg = self._get_failure_message(expected_result, actual_result)
-            raise Exception("Results are incorrect. Actual num %s. Expected num: %s. :: %s \n" % (len(actual_result), len(expected_result), extra_msg))
+        if len(actual_result) != len(sql_result):
+            extra_msg = self._get_failure_message(sql_result, actual_result)
+            raise Exception("Results are incorrect. Actual num %s. Expected num: %s. :: %s \n" % (len(actual_result), len(sql_result), extra_msg))
 
         msg = "The number of rows match but the results mismatch, please check"
         if subquery:
+            # Rows of both sides differ in shape, paired after sorting
+            actual_result = sorted(actual_result)
+            expected_result = sorted(sql_result)
             for x, y in zip(actual_result, expected_result):
                 if aggregate:
                     productId = x['ABC'][0]['$1']
@@ -487,8 +491,11 @@ class N1QLHelper:
                     extra_msg = self._get_failure_message(expected_result, actual_result)
                     raise Exception(msg+"\n "+extra_msg)
         else:
-            if self._sort_data(actual_result) != self._sort_data(expected_result):
-                extra_msg = self._get_failure_message(expected_result, actual_result)
+            # Rows are compared on their sorted field names, as _sort_data()
+            diff = ResultDiff(key=sorted).add_actual(actual_result)
+            diff.add_expected(sql_result)
+            if not diff.is_equal():
+                extra_msg = self._get_failure_message(diff.missing(5), diff.extra(5))
                 raise Exception(msg+"\n "+extra_msg)
 
     def _sort_data(self, result):
@@ -511,17 +518,24 @@ class N1QLHelper:
             actual_result = []
         if check:
             actual_result = self._gen_dict(n1ql_result)
-        actual_result = sorted(actual_result)
-        expected_result = sorted(sql_result)
 
-        if len(actual_result) != len(expected_result):
-            extra_msg = self._get_failure_message(expected_result, actual_result)
-            raise Exception("Results are incorrect. Actual num %s. Expected num: %s.:: %s \n" % (len(actual_result), len(expected_result), extra_msg))
-        if not self._result_comparison_analysis(actual_result, expected_result):
+        if len(actual_result) != len(sql_result):
+            extra_msg = self._get_failure_message(sql_result, actual_result)
+            raise Exception("Results are incorrect. Actual num %s. Expected num: %s.:: %s \n" % (len(actual_result), len(sql_result), extra_msg))
+        # Rows are matched on primary_key_id and compared on their fields
+        diff = ResultDiff(key=self._crud_row_key)
+        diff.add_actual(actual_result).add_expected(sql_result)
+        if not diff.is_equal():
             msg = "The number of rows match but the results mismatch, please check"
-            extra_msg = self._get_failure_message(expected_result, actual_result)
+            extra_msg = self._get_failure_message(diff.missing(5), diff.extra(5))
             raise Exception(msg+"\n "+extra_msg)
 
+    def _crud_row_key(self, row):
+        if "primary_key_id" not in row:
+            # Unique key, so the row is always reported as a mismatch
+            return "missing primary_key_id", id(row)
+        return row["primary_key_id"], sorted(row)
+
     def _get_failure_message(self, expected_result, actual_result):
         if expected_result is None:
             expected_result = []
@@ -584,21 +598,11 @@ class N1QLHelper:
             msg = "the number of results do not match :: sql = {0}, n1ql = {1}".format(len(sql_result), len(n1ql_result))
             extra_msg = self._get_failure_message(sql_result, n1ql_result)
             raise Exception(msg+"\n"+extra_msg)
-        n1ql_result = self._gen_dict_n1ql_func_result(n1ql_result)
-        n1ql_result = sorted(n1ql_result)
-        sql_result = self._gen_dict_n1ql_func_result(sql_result)
-        sql_result = sorted(sql_result)
-        if len(sql_result) == 0 and len(n1ql_result) == 0:
-            return
-        if sql_result != n1ql_result:
-            i = 0
-            for sql_value, n1ql_value in zip(sql_result, n1ql_result):
-                if sql_value != n1ql_value:
-                    break
-                i = i + 1
-            num_results = len(sql_result)
-            last_idx = min(i+5, num_results)
-            msg = "mismatch in results :: result length :: {3}, first mismatch position :: {0}, sql value :: {1}, n1ql value :: {2} ".format(i, sql_result[i:last_idx], n1ql_result[i:last_idx], num_results)
+        diff = ResultDiff()
+        diff.add_actual(self._gen_dict_n1ql_func_result(n1ql_result))
+        diff.add_expected(self._gen_dict_n1ql_func_result(sql_result))
+        if not diff.is_equal():
+            msg = "mismatch in results :: result length :: {0}, sql value :: {1}, n1ql value :: {2} ".format(diff.expected_count, diff.missing(5), diff.extra(5))
             raise Exception(msg)
 
     def _convert_to_number(self, val):
@@ -628,15 +632,8 @@ class N1QLHelper:
             self.log.info(" example key {0}".format(different_values[0]))
 
     def check_missing_and_extra(self, actual, expected):
-        missing = []
-        extra = []
-        for item in actual:
-            if not (item in expected):
-                extra.append(item)
-        for item in expected:
-            if not (item in actual):
-                missing.append(item)
-        return missing, extra
+        diff = ResultDiff().add_actual(actual).add_expected(expected)
+        return diff.missing(), diff.extra()
 
     def build_url(self, version):
         info = self.shell.extract_remote_info()
@@ -963,12 +960,13 @@ class N1QLHelper:
         return int(res['results'][0]['$1'])
 
     def _gen_dict(self, result):
-        result_set = []
-        if result is not None and len(result) > 0:
+        return list(self._iter_values(result))
+
+    def _iter_values(self, result):
+        if result is not None:
             for val in result:
                 for key in val.keys():
-                    result_set.append(val[key])
-        return result_set
+                    yield val[key]
 
     def _gen_dict_n1ql_func_result(self, result):
         result_set = [val[key] for val in result for key in val.keys()]
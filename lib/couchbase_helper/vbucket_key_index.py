@@ -0,0 +1,294 @@
+"""
+Key -> vbucket index for generating documents targeting specific vbuckets
+
+Keys generated by KVGenerator.next_key() are of the form
+'<prefix>-<zero_padded_index>'. Instead of hashing every candidate key
+one by one for every generator, key indexes are hashed in batches
+(the crc32 of the constant '<prefix>-<padding>' part is computed once
+per digit-length range) and the matching key indexes are stored as
+compact int arrays per vbucket. The arrays are persisted on disk so
+the same index can be reused across generators and test runs.
+"""
+
+import json
+import os
+import sys
+import tempfile
+import zlib
+from array import array
+from bisect import bisect_left
+from heapq import merge
+from threading import Lock
+
+from global_vars import logger
+
+
+def get_vbucket_for_key(key, vbuckets=1024):
+    return (((zlib.crc32(key)) >> 16) & 0x7fff) & (vbuckets - 1)
+
+
+class VBucketKeyIndex(object):
+    """
+    Per vbucket sorted arrays of key indexes, for keys generated using
+    a given key_prefix / key_size combination.
+    Each vbucket tracks the key index up to which it has been scanned,
+    so only the vbuckets actually requested are ever built.
+    """
+    # Array type for storing key indexes (4 bytes per key)
+    TYPE_CODE = "i"
+    # Number of key indexes hashed per batch
+    SCAN_BATCH = 1 << 16
+
+    # Process wide cache of loaded indexes
+    __indexes = dict()
+    __indexes_lock = Lock()
+
+    def __init__(self, key_prefix, key_size, vbuckets=1024, index_dir=None):
+        self.log = logger.get("infra")
+        self.key_prefix = key_prefix
+        self.key_size = key_size
+        self.vbuckets = vbuckets
+        self.pad_width = key_size - len(key_prefix) - 1
+        self.lock = Lock()
+        # vbucket -> array of matching key indexes (sorted)
+        self.vb_keys = dict()
+        # vbucket -> key index up to which the vbucket is scanned
+        self.scanned_upto = dict()
+        # vbucket -> length of vb_keys already persisted on disk
+        self.__persisted = dict()
+
+        self.index_dir = None
+        if index_dir is not False:
+            self.index_dir = os.path.join(
+                index_dir or os.path.join(tempfile.gettempdir(),
+                                          "vbucket_key_index"),
+                "%s_k%s_vb%s" % (key_prefix, key_size, vbuckets))
+            self.__load()
+
+    @classmethod
+    def get(cls, key_prefix, key_size, vbuckets=1024, index_dir=None):
+        """
+        Returns the shared index object for the given key format
+        """
+        map_key = (key_prefix, key_size, vbuckets, index_dir)
+        with cls.__indexes_lock:
+            if map_key not in cls.__indexes:
+                cls.__indexes[map_key] = cls(key_prefix, key_size,
+                                             vbuckets, index_dir)
+            return cls.__indexes[map_key]
+
+    def __deepcopy__(self, memo):
+        # Index is shared across generator copies
+        return self
+
+    def key_for_index(self, key_index):
+        return "%s-%s" % (self.key_prefix,
+                          str(abs(key_index)).zfill(self.pad_width))
+
+    def __digit_ranges(self, start, end):
+        """
+        Splits [start, end) into ranges having the same number of digits,
+        so that all keys within a range share the same padded prefix
+        """
+        while start < end:
+            num_digits = len(str(start))
+            range_end = min(end, 10 ** num_digits)
+            yield start, range_end, num_digits
+            start = range_end
+
+    def __scan(self, vbuckets, start, end):
+        """
+        Hash key indexes [start, end) and append the ones belonging
+        to any of the given vbuckets
+        """
+        vb_mask = self.vbuckets - 1
+        crc32 = zlib.crc32
+        targets = dict()
+        for vb in vbuckets:
+            targets[vb] = self.vb_keys[vb].append
+        for r_start, r_end, num_digits in self.__digit_ranges(start, end):
+            prefix_crc = crc32("%s-%s" % (
+                self.key_prefix, "0" * max(0, self.pad_width - num_digits)))
+            for key_index in xrange(r_start, r_end):
+                vb = ((crc32(str(key_index), prefix_crc) >> 16) & 0x7fff) \
+                    & vb_mask
+                if vb in targets:
+                    targets[vb](key_index)
+        for vb in vbuckets:
+            self.scanned_upto[vb] = end
+
+    def build(self, vbuckets, upto):
+        """
+        Make sure all given vbuckets are scanned up to key index 'upto'
+        :return bool: True if the index got extended
+        """
+        extended = False
+        with self.lock:
+            for vb in vbuckets:
+                if vb not in self.vb_keys:
+                    self.vb_keys[vb] = array(self.TYPE_CODE)
+                    self.scanned_upto[vb] = 0
+            pending = [vb for vb in vbuckets if self.scanned_upto[vb] < upto]
+            while pending:
+                scan_from = min([self.scanned_upto[vb] for vb in pending])
+                scan_to = min(upto, scan_from + self.SCAN_BATCH)
+                self.__scan([vb for vb in pending
+                             if self.scanned_upto[vb] == scan_from],
+                            scan_from, scan_to)
+                extended = True
+                pending = [vb for vb in pending
+                           if self.scanned_upto[vb] < upto]
+        return extended
+
+    def iter_key_indexes(self, vbuckets, start=0):
+        """
+        Lazily yields the key indexes >= start, in increasing order,
+        for keys belonging to any of the given vbuckets.
+        The index gets extended in SCAN_BATCH steps as required.
+        """
+        vbuckets = sorted(set(vbuckets))
+        lo = start
+        while True:
+            hi = lo + self.SCAN_BATCH
+            if self.build(vbuckets, hi):
+                self.save()
+            chunks = list()
+            with self.lock:
+                for vb in vbuckets:
+                    vb_keys = self.vb_keys[vb]
+                    chunks.append(vb_keys[bisect_left(vb_keys, lo):
+                                          bisect_left(vb_keys, hi)])
+            for key_index in merge(*chunks):
+                yield key_index
+            lo = hi
+
+    def save(self):
+        """
+        Persist the newly scanned key indexes.
+        Vbucket files are append only, meta file is rewritten.
+        """
+        if self.index_dir is None:
+            return
+        with self.lock:
+            if not os.path.isdir(self.index_dir):
+                os.makedirs(self.index_dir)
+            for vb, vb_keys in self.vb_keys.items():
+                persisted = self.__persisted.get(vb, 0)
+                if len(vb_keys) > persisted:
+                    with open(self.__vb_file(vb),
+                              "ab" if persisted else "wb") as fp:
+                        # Drop any tail not recorded in meta file
+                        fp.truncate(persisted * vb_keys.itemsize)
+                        fp.seek(0, os.SEEK_END)
+                        vb_keys[persisted:].tofile(fp)
+                self.__persisted[vb] = len(vb_keys)
+            meta = {"byteorder": sys.byteorder,
+                    "scanned_upto": self.scanned_upto,
+                    "num_keys": self.__persisted}
+            tmp_file = self.__meta_file() + ".tmp"
+            with open(tmp_file, "w") as fp:
+                json.dump(meta, fp)
+            os.rename(tmp_file, self.__meta_file())
+
+    def __meta_file(self):
+        return os.path.join(self.index_dir, "meta.json")
+
+    def __vb_file(self, vb):
+        return os.path.join(self.index_dir, "vb_%s.idx" % vb)
+
+    def __load(self):
+        if not os.path.exists(self.__meta_file()):
+            return
+        try:
+            with open(self.__meta_file()) as fp:
+                meta = json.load(fp)
+            for vb, num_keys in meta["num_keys"].items():
+                vb = int(vb)
+                vb_keys = array(self.TYPE_CODE)
+                if num_keys:
+                    with open(self.__vb_file(vb), "rb") as fp:
+                        vb_keys.fromfile(fp, num_keys)
+                if meta["byteorder"] != sys.byteorder:
+                    vb_keys.byteswap()
+                self.vb_keys[vb] = vb_keys
+                self.scanned_upto[vb] = meta["scanned_upto"][str(vb)]
+                self.__persisted[vb] = num_keys
+        except (IOError, ValueError, KeyError, EOFError) as e:
+            self.log.warning("Ignoring corrupt vbucket key index %s: %s"
+                             % (self.index_dir, e))
+            self.vb_keys = dict()
+            self.scanned_upto = dict()
+            self.__persisted = dict()
+
+
+class TargetVbucketKeys(object):
+    """
+    Lazy replacement for the {doc_index: doc_key} dict used by the
+    target vbucket generators. Keys are resolved from the shared
+    VBucketKeyIndex as and when they are accessed, so no per-key
+    state is kept in memory apart from the iterator position.
+    """
+    def __init__(self, key_index, target_vbuckets, start, num_keys,
+                 key_start=None):
+        """
+        :param key_index: VBucketKeyIndex object
+        :param target_vbuckets: List of target vbuckets
+        :param start: Doc index of the first key (generator's start)
+        :param num_keys: Number of keys to generate
+        :param key_start: Key index from which to start the key search.
+                          Defaults to 'start'
+        """
+        self.key_index = key_index
+        self.target_vbuckets = list(target_vbuckets)
+        self.start = start
+        self.num_keys = num_keys
+        self.key_start = start if key_start is None else key_start
+        self.__iter = None
+        self.__pos = None
+
+    def __len__(self):
+        return self.num_keys
+
+    def __nonzero__(self):
+        return self.num_keys > 0
+
+    __bool__ = __nonzero__
+
+    def __contains__(self, doc_index):
+        return self.start <= doc_index < self.start + self.num_keys
+
+    def __reset_cursor(self, pos):
+        self.__iter = self.key_index.iter_key_indexes(self.target_vbuckets,
+                                                      self.key_start)
+        for _ in xrange(pos):
+            next(self.__iter)
+        self.__pos = pos
+
+    def get_key_index(self, doc_index):
+        """
+        :return: Key index (counter value) of the given doc_index
+        """
+        if doc_index not in self:
+            raise KeyError(doc_index)
+        pos = doc_index - self.start
+        if self.__pos is None or pos < self.__pos:
+            self.__reset_cursor(0)
+        while self.__pos < pos:
+            next(self.__iter)
+            self.__pos += 1
+        key_index = next(self.__iter)
+        self.__pos += 1
+        return key_index
+
+    def __getitem__(self, doc_index):
+        return self.key_index.key_for_index(self.get_key_index(doc_index))
+
+    def __iter__(self):
+        return iter(xrange(self.start, self.start + self.num_keys))
+
+    def keys(self):
+        return list(self)
+
+    def __deepcopy__(self, memo):
+        return TargetVbucketKeys(self.key_index, self.target_vbuckets,
+                                 self.start, self.num_keys, self.key_start)
@@ -0,0 +1,416 @@
+"""
+Columnar snapshot of the vbucket-seqno and failover stats of a cluster
+
+For every (bucket, node) the stats are held in arrays indexed by the
+vbucket id, one array per stat. All nodes are read in parallel, with a
+single memcached round-trip per node and bucket for 'vbucket',
+'vbucket-seqno' and 'failovers' stats.
+Comparisons work column-wise: identical columns are accepted with a
+single array comparison and only the differing columns are walked to
+report the mismatching vbuckets.
+
+Snapshots can be saved to / loaded from a file, to compare the cluster
+state against a stored baseline.
+"""
+
+import json
+import operator
+import threading
+import time
+from array import array
+from itertools import izip
+
+from BucketLib.bucket import Bucket
+from cb_tools.cbstats import Cbstats, VbucketSeqno
+
+
+class VbucketStatsMap(dict):
+    """
+    Nested stats dict in the format returned by DataCollector, which also
+    carries the snapshot it was built from. Passing this back for the
+    comparison avoids converting the dict back into columns.
+    """
+    def __init__(self, stats, snapshot):
+        super(VbucketStatsMap, self).__init__(stats)
+        self.snapshot = snapshot
+
+
+class VbColumns(object):
+    """
+    Stats of all the vbuckets of a bucket on a single node.
+    vbuckets not present on the node have the state 'missing'
+    """
+    SEQNO_FIELDS = tuple([field for field in VbucketSeqno.__slots__
+                          if field != "vb"])
+    FAILOVER_FIELDS = ("failover_uuid", "failover_seq", "failover_entries")
+    FIELDS = SEQNO_FIELDS + FAILOVER_FIELDS
+    # Unsigned 64 bit values, stored as signed longs
+    UUID_FIELDS = ("uuid", "failover_uuid")
+    # Field names used in the failover stats dicts of DataCollector
+    FAILOVER_STAT_NAMES = {"failover_uuid": "id",
+                           "failover_seq": "seq",
+                           "failover_entries": "num_entries"}
+
+    MISSING = 0
+    STATES = ["missing", "active", "replica", "pending", "dead"]
+
+    def __init__(self, num_vbuckets):
+        self.num_vbuckets = num_vbuckets
+        self.state = array('b', [self.MISSING]) * num_vbuckets
+        self.columns = dict([(field, array('l', [0]) * num_vbuckets)
+                             for field in self.FIELDS])
+
+    @staticmethod
+    def to_signed(value):
+        return value - (1 << 64) if value >= (1 << 63) else value
+
+    @staticmethod
+    def to_unsigned(value):
+        return value + (1 << 64) if value < 0 else value
+
+    def set(self, vb_num, field, value):
+        if field in self.UUID_FIELDS:
+            value = self.to_signed(value)
+        self.columns[field][vb_num] = value
+
+    def get(self, vb_num, field):
+        value = self.columns[field][vb_num]
+        if field in self.UUID_FIELDS:
+            value = self.to_unsigned(value)
+        return value
+
+    def vbuckets(self):
+        """ :return: List of vbucket ids present on the node """
+        return [vb_num for vb_num, state in enumerate(self.state)
+                if state != self.MISSING]
+
+    def fill(self, states, seqnos, failovers):
+        """
+        :param states: {vb_num: state} as parsed by Cbstats
+        :param seqnos: {vb_num: VbucketSeqno} as parsed by Cbstats
+        :param failovers: {vb_num: [FailoverEntry]} as parsed by Cbstats
+        """
+        for vb_num, state in states.items():
+            self.state[vb_num] = self.STATES.index(state) \
+                if state in self.STATES else self.MISSING
+        for vb_num, seqno in seqnos.items():
+            if self.state[vb_num] == self.MISSING:
+                continue
+            for field in self.SEQNO_FIELDS:
+                value = getattr(seqno, field)
+                if value is not None:
+                    self.set(vb_num, field, value)
+        for vb_num, entries in failovers.items():
+            if self.state[vb_num] == self.MISSING or not entries:
+                continue
+            self.set(vb_num, "failover_uuid", entries[0].uuid or 0)
+            self.set(vb_num, "failover_seq", entries[0].seq or 0)
+            self.set(vb_num, "failover_entries", len(entries))
+
+    def as_stats(self, fields=None, failover_names=False):
+        """
+        :return: dict of {'vb_N': {stat_name: value_str}}
+        """
+        fields = fields or self.SEQNO_FIELDS
+        result = dict()
+        for vb_num in self.vbuckets():
+            stats = dict()
+            for field in fields:
+                name = self.FAILOVER_STAT_NAMES.get(field, field) \
+                    if failover_names else field
+                stats[name] = str(self.get(vb_num, field))
+            stats["state"] = self.STATES[self.state[vb_num]]
+            result["vb_%s" % vb_num] = stats
+        return result
+
+    def to_json(self):
+        data = dict([(field, column.tolist())
+                     for field, column in self.columns.items()])
+        data["state"] = self.state.tolist()
+        return data
+
+    @classmethod
+    def from_json(cls, data):
+        columns = cls(len(data["state"]))
+        columns.state = array('b', data["state"])
+        for field in cls.FIELDS:
+            if field in data:
+                columns.columns[field] = array('l', data[field])
+        return columns
+
+
+class VbucketSeqnoSnapshot(object):
+    COMPARE_OPS = {"==": operator.eq, "!=": operator.ne,
+                   "<=": operator.le, ">=": operator.ge,
+                   "<": operator.lt, ">": operator.gt}
+    # Node name used for the stats without the per node level
+    CLUSTER = "cluster"
+
+    def __init__(self):
+        self.timestamp = time.time()
+        # bucket_name -> node_ip -> VbColumns
+        self.buckets = dict()
+        # node_ip -> error string, for nodes which failed to return stats
+        self.errors = dict()
+        self.__merged = dict()
+
+    # Collection
+    @staticmethod
+    def __collect_node(server, buckets, with_failovers, snapshot, lock):
+        stat_names = ["vbucket", "vbucket-seqno"]
+        if with_failovers:
+            stat_names.append("failovers")
+        cbstat = Cbstats(server, persistent=True)
+        try:
+            for bucket in buckets:
+                stats = cbstat.get_parsed_stats(bucket.name, stat_names)
+                vb_nums = stats["vbucket"].keys() \
+                    + stats["vbucket-seqno"].keys()
+                num_vbuckets = max([bucket.num_vbuckets or 0]
+                                   + [vb_num + 1 for vb_num in vb_nums])
+                columns = VbColumns(num_vbuckets)
+                columns.fill(stats["vbucket"], stats["vbucket-seqno"],
+                             stats.get("failovers", dict()))
+                with lock:
+                    snapshot.buckets[bucket.name][server.ip] = columns
+        except Exception as e:
+            with lock:
+                snapshot.errors[server.ip] = str(e)
+
+    @classmethod
+    def collect(cls, servers, buckets, with_failovers=True):
+        """
+        Reads the stats from all the servers concurrently
+        :param servers: List of KV nodes
+        :param buckets: List of Bucket objects. Memcached buckets are skipped
+        :param with_failovers: Collect the failover log stats as well
+        :return: VbucketSeqnoSnapshot object
+        """
+        snapshot = cls()
+        buckets = [bucket for bucket in buckets
+                   if bucket.bucketType != Bucket.Type.MEMCACHED]
+        for bucket in buckets:
+            snapshot.buckets[bucket.name] = dict()
+        lock = threading.Lock()
+        threads = list()
+        for server in servers:
+            thread = threading.Thread(
+                target=cls.__collect_node,
+                args=(server, buckets, with_failovers, snapshot, lock),
+                name="vb_seqno_snapshot_%s" % server.ip)
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        if snapshot.errors:
+            raise Exception("Failed to collect vbucket stats: %s"
+                            % snapshot.errors)
+        return snapshot
+
+    def merged(self, bucket_name):
+        """
+        :return: VbColumns of the bucket with the stats of each vbucket
+                 taken from its active copy (or from the first node
+                 holding the vbucket, if there is no active copy)
+        """
+        if bucket_name in self.__merged:
+            return self.__merged[bucket_name]
+        nodes = self.buckets[bucket_name]
+        num_vbuckets = max([columns.num_vbuckets
+                            for columns in nodes.values()] or [0])
+        merged = VbColumns(num_vbuckets)
+        active = VbColumns.STATES.index("active")
+        for node in sorted(nodes.keys()):
+            columns = nodes[node]
+            for vb_num, state in enumerate(columns.state):
+                if state == VbColumns.MISSING:
+                    continue
+                merged_state = merged.state[vb_num]
+                if merged_state == VbColumns.MISSING \
+                        or (state == active and merged_state != active):
+                    merged.state[vb_num] = state
+                    for field in VbColumns.FIELDS:
+                        merged.columns[field][vb_num] = \
+                            columns.columns[field][vb_num]
+        self.__merged[bucket_name] = merged
+        return merged
+
+    # Comparison
+    @staticmethod
+    def __diff_vbuckets(column1, column2, op, vb_filter=None):
+        """
+        :return: vbucket ids for which 'column1[vb] op column2[vb]' fails
+        """
+        if column1 == column2 and op(0, 0):
+            return list()
+        return [vb_num for vb_num, (val1, val2)
+                in enumerate(izip(column1, column2))
+                if not op(val1, val2)
+                and (vb_filter is None or vb_filter[vb_num])]
+
+    def check_consistency(self, fields=("uuid",)):
+        """
+        Checks the given fields are same for all the copies of
+        each vbucket across the nodes
+        :param fields: VbColumns field names to check
+        :return: List of mismatch strings. Empty if consistent
+        """
+        mismatches = list()
+        for bucket_name in sorted(self.buckets.keys()):
+            merged = self.merged(bucket_name)
+            for node, columns in sorted(self.buckets[bucket_name].items()):
+                present = [state != VbColumns.MISSING
+                           for state in columns.state]
+                for field in fields:
+                    column = columns.columns[field]
+                    merged_column = merged.columns[field][:len(column)]
+                    for vb_num in self.__diff_vbuckets(
+                            merged_column, column, operator.eq, present):
+                        mismatches.append(
+                            "bucket %s, vbucket %s :: %s %s, Change in "
+                            "node %s (%s) :: %s %s"
+                            % (bucket_name, vb_num, field,
+                               merged.get(vb_num, field), node,
+                               VbColumns.STATES[columns.state[vb_num]],
+                               field, columns.get(vb_num, field)))
+        return mismatches
+
+    @classmethod
+    def __compare_columns(cls, label, old, new, comp_map):
+        mismatches = list()
+        for vb_num in cls.__diff_vbuckets(old.state, new.state,
+                                          cls.__both_present):
+            mismatches.append("%s, vbucket %s :: %s" % (
+                label, vb_num,
+                "Deleted" if new.state[vb_num] == VbColumns.MISSING
+                else "Added"))
+        num_vbuckets = min(old.num_vbuckets, new.num_vbuckets)
+        present = [o_state != VbColumns.MISSING
+                   and n_state != VbColumns.MISSING
+                   for o_state, n_state in izip(old.state, new.state)]
+        for field, compare in comp_map.items():
+            old_column = old.columns[field][:num_vbuckets]
+            new_column = new.columns[field][:num_vbuckets]
+            for vb_num in cls.__diff_vbuckets(
+                    old_column, new_column, cls.COMPARE_OPS[compare],
+                    present):
+                mismatches.append(
+                    "%s, vbucket %s :: Expected %s %s %s, Actual %s"
+                    % (label, vb_num, field, compare,
+                       old.get(vb_num, field), new.get(vb_num, field)))
+        return mismatches
+
+    @staticmethod
+    def __both_present(state1, state2):
+        return (state1 == VbColumns.MISSING) == (state2 == VbColumns.MISSING)
+
+    def compare(self, old_snapshot, comp_map, per_node=False):
+        """
+        Compares this snapshot against an older one
+        :param old_snapshot: VbucketSeqnoSnapshot taken earlier
+        :param comp_map: dict of {field: operation}, where the check is
+                         'old_value <operation> new_value'.
+                         Ex: {"uuid": "==", "abs_high_seqno": "<="}
+        :param per_node: If True, compares the copies on each node.
+                         Else compares the vbuckets across the cluster
+        :return: List of mismatch strings. Empty if no mismatch
+        """
+        mismatches = list()
+        for bucket_name in sorted(old_snapshot.buckets.keys()):
+            if bucket_name not in self.buckets:
+                mismatches.append("bucket %s :: Deleted" % bucket_name)
+                continue
+            old_nodes = old_snapshot.buckets[bucket_name]
+            if not per_node or old_nodes.keys() == [self.CLUSTER]:
+                mismatches.extend(self.__compare_columns(
+                    "bucket %s" % bucket_name,
+                    old_snapshot.merged(bucket_name),
+                    self.merged(bucket_name), comp_map))
+                continue
+            new_nodes = self.buckets[bucket_name]
+            for node in sorted(set(old_nodes.keys()) & set(new_nodes.keys())):
+                mismatches.extend(self.__compare_columns(
+                    "bucket %s, node %s" % (bucket_name, node),
+                    old_nodes[node], new_nodes[node], comp_map))
+        return mismatches
+
+    # Conversion to / from the DataCollector dict format
+    def to_stats_map(self, per_node=True, failovers=False):
+        """
+        :param per_node: If True, returns {bucket: {node: {vb_N: stats}}}
+                         Else returns {bucket: {vb_N: stats}} with the
+                         stats of the active copies
+        :param failovers: If True, the stats are the latest failover
+                          entry (id, seq, num_entries) instead of the
+                          vbucket-seqno stats
+        :return: VbucketStatsMap object
+        """
+        fields = VbColumns.FAILOVER_FIELDS if failovers \
+            else VbColumns.SEQNO_FIELDS
+        stats = dict()
+        for bucket_name, nodes in self.buckets.items():
+            if per_node:
+                stats[bucket_name] = dict(
+                    [(node, columns.as_stats(fields, failovers))
+                     for node, columns in nodes.items()])
+            else:
+                stats[bucket_name] = self.merged(bucket_name).as_stats(
+                    fields, failovers)
+        return VbucketStatsMap(stats, self)
+
+    @classmethod
+    def from_stats_map(cls, stats_map):
+        """
+        Builds a snapshot from the vbucket-seqno / failovers stats dict
+        returned by DataCollector (with or without the per node level)
+        """
+        snapshot = getattr(stats_map, "snapshot", None)
+        if snapshot is not None:
+            return snapshot
+        snapshot = cls()
+        stat_fields = dict([(name, field) for field, name
+                            in VbColumns.FAILOVER_STAT_NAMES.items()])
+        stat_fields.update([(field, field) for field in VbColumns.FIELDS])
+        for bucket_name, bucket_stats in stats_map.items():
+            per_node = bucket_stats \
+                and not bucket_stats.keys()[0].startswith("vb_")
+            nodes = bucket_stats if per_node \
+                else {cls.CLUSTER: bucket_stats}
+            snapshot.buckets[bucket_name] = dict()
+            for node, vb_stats in nodes.items():
+                vb_nums = [int(key[3:]) for key in vb_stats.keys()]
+                columns = VbColumns(max(vb_nums or [-1]) + 1)
+                active = VbColumns.STATES.index("active")
+                for key, stats in vb_stats.items():
+                    vb_num = int(key[3:])
+                    state = stats.get("state", "active")
+                    columns.state[vb_num] = VbColumns.STATES.index(state) \
+                        if state in VbColumns.STATES else active
+                    for name, value in stats.items():
+                        if name in stat_fields:
+                            columns.set(vb_num, stat_fields[name],
+                                        int(value))
+                snapshot.buckets[bucket_name][node] = columns
+        return snapshot
+
+    # Storage
+    def save(self, file_path):
+        data = {"timestamp": self.timestamp, "buckets": dict()}
+        for bucket_name, nodes in self.buckets.items():
+            data["buckets"][bucket_name] = dict(
+                [(node, columns.to_json())
+                 for node, columns in nodes.items()])
+        with open(file_path, "w") as fp:
+            json.dump(data, fp)
+
+    @classmethod
+    def load(cls, file_path):
+        with open(file_path) as fp:
+            data = json.load(fp)
+        snapshot = cls()
+        snapshot.timestamp = data["timestamp"]
+        for bucket_name, nodes in data["buckets"].items():
+            snapshot.buckets[str(bucket_name)] = dict(
+                [(str(node), VbColumns.from_json(columns))
+                 for node, columns in nodes.items()])
+        return snapshot
@@ -165,7 +165,7 @@ class DcpClient(MemcachedClient):
 
         # start generator and pass to dcpStream class
         generator = __generator(response)
-        return DcpStream(generator, vbucket)
+        return DcpStream(generator, vbucket, op=op, client=self)
 
     def get_stream(self, vbucket):
         """ for use by external clients to get stream
@@ -281,10 +281,14 @@ class DcpClient(MemcachedClient):
 class DcpStream(object):
     """ DcpStream class manages a stream generator that yields mutations """
 
-    def __init__(self, generator, vbucket):
+    def __init__(self, generator, vbucket, op=None, client=None):
 
         self.__generator = generator
         self.vbucket = vbucket
+        # StreamRequest op and DcpClient on which the stream is opened
+        self.op = op
+        self.client = client
+        self.opaque = op.opaque if op is not None else None
         response = self.__generator.next()
         assert response is not None
 
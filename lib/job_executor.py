@@ -0,0 +1,203 @@
+"""
+Process wide, bounded thread pool for the fan-out of utility jobs
+(creating / dropping entities, validations, ...)
+
+Worker threads are created on demand up to max_workers and reused across
+the calls. Every submitted job returns a concurrent.futures.Future, so
+the results / exceptions can be fetched with the usual future APIs
+(result(), exception(), cancel(), wait(), as_completed()).
+
+On top of the plain pool it supports:
+ - target: Jobs submitted with the same target (ex: a node's ip) run
+           at most 'target_limit' at a time. Remaining ones wait in a
+           queue without holding a worker thread
+ - timeout: Max run time of the job in seconds. The future fails with
+            TimeoutError once it is crossed. Python threads cannot be
+            interrupted, so the job runs to completion in the background
+            and its result is discarded
+"""
+
+import heapq
+import threading
+import time
+from collections import deque
+
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError, \
+    wait
+
+from global_vars import logger
+
+
+class _Job(object):
+    __slots__ = ("future", "func", "args", "kwargs", "target", "timeout")
+
+    def __init__(self, func, args, kwargs, target, timeout):
+        self.future = Future()
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.target = target
+        self.timeout = timeout
+
+
+class JobExecutor(object):
+    max_workers = 64
+
+    __instance = None
+    __instance_lock = threading.Lock()
+
+    def __init__(self, max_workers=None):
+        """
+        :param max_workers: Max number of worker threads.
+                            Defaults to JobExecutor.max_workers
+        """
+        self.log = logger.get("infra")
+        self.__pool = ThreadPoolExecutor(
+            max_workers=max_workers or self.max_workers)
+        self.__lock = threading.Condition(threading.Lock())
+        # target -> max jobs to run in parallel
+        self.__target_limits = dict()
+        # target -> number of jobs submitted to the pool
+        self.__target_running = dict()
+        # target -> deque of jobs waiting for a slot
+        self.__target_pending = dict()
+        # Heap of (deadline, id, job) for the running jobs with timeout
+        self.__deadlines = list()
+        self.__watchdog = None
+
+    @classmethod
+    def get(cls):
+        """ :return: Process wide JobExecutor object """
+        with cls.__instance_lock:
+            if cls.__instance is None:
+                cls.__instance = cls()
+            return cls.__instance
+
+    # Submission
+    def submit(self, func, *args, **kwargs):
+        """ Same as ThreadPoolExecutor.submit() """
+        return self.submit_job(func, args=args, kwargs=kwargs)
+
+    def submit_job(self, func, args=(), kwargs=None, target=None,
+                   target_limit=None, timeout=None):
+        """
+        :param func: Callable to run
+        :param args: Positional args for func
+        :param kwargs: Keyword args for func
+        :param target: Key (ex: node ip) used to limit the concurrency
+        :param target_limit: Max jobs of the 'target' to run in parallel.
+                             None means no limit. The limit is dropped
+                             once the target has no jobs left, so it has
+                             to be passed with every submission
+        :param timeout: Max seconds the job can run
+        :return: concurrent.futures.Future object
+        """
+        job = _Job(func, args, kwargs or dict(), target, timeout)
+        if target is None:
+            self.__pool.submit(self.__run, job)
+            return job.future
+        with self.__lock:
+            if target_limit is not None:
+                self.__target_limits[target] = target_limit
+            limit = self.__target_limits.get(target)
+            running = self.__target_running.get(target, 0)
+            if limit is not None and running >= limit:
+                self.__target_pending.setdefault(target, deque()).append(job)
+                return job.future
+            self.__target_running[target] = running + 1
+        self.__pool.submit(self.__run, job)
+        return job.future
+
+    def run_jobs(self, jobs, target=None, target_limit=None, timeout=None):
+        """
+        Runs all the jobs and waits for them to complete
+        :param jobs: List of (func, args, kwargs) tuples
+        :return: List of futures in the order of the jobs
+        """
+        futures = [self.submit_job(func, args, kwargs, target=target,
+                                   target_limit=target_limit,
+                                   timeout=timeout)
+                   for func, args, kwargs in jobs]
+        wait(futures)
+        return futures
+
+    # Execution
+    def __run(self, job):
+        try:
+            if not job.future.set_running_or_notify_cancel():
+                return
+            if job.timeout is not None:
+                self.__add_deadline(job)
+            try:
+                result = job.func(*job.args, **job.kwargs)
+            except BaseException as e:
+                self.__complete(job, exception=e)
+            else:
+                self.__complete(job, result=result)
+        finally:
+            self.__release(job)
+
+    def __complete(self, job, result=None, exception=None):
+        """ Sets the outcome, unless the job has timed out already """
+        with self.__lock:
+            if job.future.done():
+                return False
+            if exception is not None:
+                job.future.set_exception(exception)
+            else:
+                job.future.set_result(result)
+            return True
+
+    def __release(self, job):
+        if job.target is None:
+            return
+        with self.__lock:
+            pending = self.__target_pending.get(job.target)
+            if pending:
+                # Hand over the slot to the next job of the target
+                next_job = pending.popleft()
+            else:
+                next_job = None
+                self.__target_running[job.target] -= 1
+                if self.__target_running[job.target] == 0:
+                    # Targets can be unique per batch (ex: cbas_jobs_<id>),
+                    # so nothing is kept once the target goes idle
+                    del self.__target_running[job.target]
+                    self.__target_pending.pop(job.target, None)
+                    self.__target_limits.pop(job.target, None)
+        if next_job is not None:
+            self.__pool.submit(self.__run, next_job)
+
+    # Timeouts
+    def __add_deadline(self, job):
+        with self.__lock:
+            heapq.heappush(self.__deadlines,
+                           (time.time() + job.timeout, id(job), job))
+            if self.__watchdog is None:
+                self.__watchdog = threading.Thread(
+                    target=self.__watch_deadlines, name="job_executor_watchdog")
+                self.__watchdog.daemon = True
+                self.__watchdog.start()
+            self.__lock.notify()
+
+    def __watch_deadlines(self):
+        while True:
+            with self.__lock:
+                while self.__deadlines \
+                        and self.__deadlines[0][2].future.done():
+                    heapq.heappop(self.__deadlines)
+                if not self.__deadlines:
+                    self.__lock.wait(60)
+                    continue
+                deadline, _, job = self.__deadlines[0]
+                delay = deadline - time.time()
+                if delay > 0:
+                    self.__lock.wait(delay)
+                    continue
+                heapq.heappop(self.__deadlines)
+            if self.__complete(job, exception=TimeoutError(
+                    "Job %s timed out after %ss"
+                    % (getattr(job.func, "__name__", job.func),
+                       job.timeout))):
+                self.log.warning("Job %s crossed its timeout of %ss"
+                                 % (job.func, job.timeout))
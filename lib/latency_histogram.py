@@ -0,0 +1,68 @@
+"""
+Latency histogram shared by the workload drivers and the REST pool
+"""
+
+import threading
+
+
+class LatencyHistogram(object):
+    """
+    HDR style histogram of latencies in microseconds.
+    Values below 2^SUB_BUCKET_BITS are recorded exactly and the bigger
+    values with SUB_BUCKET_BITS-1 bits of precision (< 1.6% error),
+    independent of the magnitude of the value.
+    """
+    SUB_BUCKET_BITS = 7
+    SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+    HALF_SUB_BUCKETS = SUB_BUCKETS >> 1
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # bucket_index -> count
+        self.counts = dict()
+        self.total_count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    @classmethod
+    def bucket_index(cls, value):
+        if value < cls.SUB_BUCKETS:
+            return value
+        shift = value.bit_length() - cls.SUB_BUCKET_BITS
+        return cls.SUB_BUCKETS + (shift - 1) * cls.HALF_SUB_BUCKETS \
+            + (value >> shift) - cls.HALF_SUB_BUCKETS
+
+    @classmethod
+    def bucket_upper_bound(cls, index):
+        if index < cls.SUB_BUCKETS:
+            return index
+        shift = (index - cls.SUB_BUCKETS) // cls.HALF_SUB_BUCKETS + 1
+        sub_bucket = (index - cls.SUB_BUCKETS) % cls.HALF_SUB_BUCKETS \
+            + cls.HALF_SUB_BUCKETS
+        return ((sub_bucket + 1) << shift) - 1
+
+    def record(self, latency_us):
+        latency_us = max(int(latency_us), 0)
+        index = self.bucket_index(latency_us)
+        with self.lock:
+            self.counts[index] = self.counts.get(index, 0) + 1
+            self.total_count += 1
+            self.total += latency_us
+            self.max = max(self.max, latency_us)
+            if self.min is None or latency_us < self.min:
+                self.min = latency_us
+
+    def percentile(self, percent):
+        with self.lock:
+            target = self.total_count * percent / 100.0
+            seen = 0
+            for index in sorted(self.counts.keys()):
+                seen += self.counts[index]
+                if seen >= target:
+                    return min(self.bucket_upper_bound(index), self.max)
+        return 0
+
+    def mean(self):
+        return self.total / float(self.total_count) if self.total_count \
+            else 0.0
@@ -68,11 +68,185 @@ class MemcachedError(exceptions.Exception):
         return "<MemcachedError #%d ``%s''>" % (self.status, self.msg)
 
 
+# Jython sockets / struct do not reliably support recv_into on memoryview
+# slices or unpack_from on a bytearray, so plain recv() and str copies are
+# used there instead
+_JYTHON = sys.platform.startswith("java")
+
+
+def _to_bytes(data):
+    if isinstance(data, (bytes, bytearray, buffer, memoryview)):
+        return data
+    return data.encode()
+
+
+class _RequestBuffer(object):
+    """
+    Buffer into which the requests are encoded back to back, so that a
+    whole batch of requests goes out with a single send
+    """
+    HEADER = struct.Struct(REQ_PKT_FMT)
+
+    def __init__(self):
+        self.buf = bytearray()
+
+    def __len__(self):
+        return len(self.buf)
+
+    def append(self, cmd, key, val, opaque, extras=b"", cas=0, dtype=0,
+               vbucket=0, fmt=REQ_PKT_FMT, magic=REQ_MAGIC_BYTE,
+               extended_meta_data=b"", extras_length=None):
+        """ Encodes one request at the end of the buffer """
+        key = _to_bytes(key)
+        extras = _to_bytes(extras)
+        val = _to_bytes(val)
+        extended_meta_data = _to_bytes(extended_meta_data)
+        # delWithMeta expects the extras length to be the overall
+        # packet length, hence the override
+        if extras_length is None:
+            extras_length = len(extras)
+        header = self.HEADER if fmt == REQ_PKT_FMT else struct.Struct(fmt)
+        buf = self.buf
+        buf += header.pack(magic, cmd, len(key), extras_length, dtype,
+                           vbucket, len(extras) + len(key) + len(val)
+                           + len(extended_meta_data), opaque, cas)
+        buf += extras
+        buf += key
+        buf += val
+        if extended_meta_data:
+            buf += extended_meta_data
+
+    def clear(self):
+        # No memoryview of the buffer must be alive at this point
+        del self.buf[:]
+
+
+class _ResponseReader(object):
+    """
+    Decodes the responses read from the socket with recv_into into a
+    reusable buffer. Bodies are sliced out of the buffer with a single
+    copy, instead of growing a string per recv() call.
+    On Jython, plain recv() is used and copied into the buffer.
+
+    Single responses are read with exact sizes, so nothing past the
+    response is consumed from the socket (DCP consumers read the same
+    socket directly). Pipelined responses are read greedily, with as
+    few recv calls as the socket allows.
+    """
+    HEADER = struct.Struct(RES_PKT_FMT)
+    ALT_HEADER = struct.Struct(ALT_RES_PKT_FMT)
+
+    def __init__(self, sock, host, size=64 * 1024):
+        self.sock = sock
+        self.host = host
+        self.buf = bytearray(size)
+        self.view = None if _JYTHON else memoryview(self.buf)
+        # Unread data is buf[start:end]
+        self.start = 0
+        self.end = 0
+
+    def buffered(self):
+        return self.end - self.start
+
+    def __make_room(self, size):
+        """ Makes sure 'size' bytes fit after self.start """
+        if self.start + size <= len(self.buf):
+            return
+        pending = self.end - self.start
+        if size > len(self.buf):
+            buf = bytearray(max(size, 2 * len(self.buf)))
+        else:
+            buf = self.buf
+        buf[:pending] = self.buf[self.start:self.end]
+        if buf is not self.buf:
+            self.buf = buf
+            self.view = None if _JYTHON else memoryview(buf)
+        self.start = 0
+        self.end = pending
+
+    def __recv(self, max_bytes):
+        if _JYTHON:
+            data = self.sock.recv(max_bytes)
+            num_bytes = len(data)
+            self.buf[self.end:self.end + num_bytes] = data
+        else:
+            num_bytes = self.sock.recv_into(self.view[self.end:], max_bytes)
+        if num_bytes == 0:
+            raise exceptions.EOFError(
+                "Got empty data (remote died?). from {0}".format(self.host))
+        self.end += num_bytes
+
+    def __fill(self, size, greedy):
+        """ Reads till 'size' unread bytes are buffered """
+        self.__make_room(size)
+        while self.end - self.start < size:
+            if greedy:
+                self.__recv(len(self.buf) - self.end)
+            else:
+                self.__recv(size - (self.end - self.start))
+
+    def read_available(self):
+        """ Buffers the data the socket has, once it is readable """
+        self.__make_room(self.buffered() + 16 * 1024)
+        self.__recv(len(self.buf) - self.end)
+
+    def __unpack(self, header, start):
+        if _JYTHON:
+            return header.unpack(bytes(self.buf[start:start + header.size]))
+        return header.unpack_from(self.buf, start)
+
+    def read_response(self, greedy=False):
+        """
+        :return: (cmd, errcode, opaque, cas, keylen, extralen, dtype, body)
+                 where body excludes the flexible framing extras
+        """
+        if self.end - self.start < MIN_RECV_PACKET:
+            self.__fill(MIN_RECV_PACKET, greedy)
+        start = self.start
+        magic = self.buf[start]
+        if magic == ALT_RES_MAGIC_BYTE or magic == ALT_REQ_MAGIC_BYTE:
+            _, cmd, framing_len, keylen, extralen, dtype, errcode, \
+                remaining, opaque, cas = \
+                self.__unpack(self.ALT_HEADER, start)
+        else:
+            assert magic == RES_MAGIC_BYTE or magic == REQ_MAGIC_BYTE, \
+                "Got magic: 0x%x" % magic
+            _, cmd, keylen, extralen, dtype, errcode, remaining, opaque, \
+                cas = self.__unpack(self.HEADER, start)
+            framing_len = 0
+        start += MIN_RECV_PACKET
+        self.start = start
+        if self.end - start < remaining:
+            self.__fill(remaining, greedy)
+            start = self.start
+        if _JYTHON:
+            body = bytes(self.buf[start + framing_len:start + remaining])
+        else:
+            body = self.view[start + framing_len:start + remaining].tobytes()
+        start += remaining
+        if start == self.end:
+            self.start = self.end = 0
+        else:
+            self.start = start
+        return cmd, errcode, opaque, cas, keylen, extralen, dtype, body
+
+
 class MemcachedClient(KeepRefs):
     """Simple memcached client."""
 
     vbucketId = 0
 
+    # Requests bigger than this are sent while draining the responses, so
+    # that a server blocked on sending the responses cannot stall the send
+    PIPELINE_SEND_SIZE = 256 * 1024
+    # Max requests / bytes sent per round-trip by the multi key APIs
+    PIPELINE_BATCH_SIZE = 4096
+    PIPELINE_BATCH_BYTES = 4 * 1024 * 1024
+
+    # key -> vbucket hash, independent of the vbucket count
+    KEY_HASH_CACHE_SIZE = 100000
+    _key_hash_cache = dict()
+
     def __init__(self, host='127.0.0.1', port=11211, timeout=30):
         super(MemcachedClient, self).__init__()
         self.host = host
@@ -81,6 +255,7 @@ class MemcachedClient(KeepRefs):
             self.port = CbServer.ssl_memcached_port
         self.timeout = timeout
         self._createConn()
+        self._reset_buffers()
         self.r = random.Random()
         self.vbucket_count = 1024
         self.feature_flag = set()
@@ -109,9 +284,19 @@ class MemcachedClient(KeepRefs):
             self.s.settimeout(self.timeout)
             return self.s.connect_ex((self.host, self.port, 0, 0))
 
+    def _reset_buffers(self):
+        # select() cannot see the data an SSL socket already decrypted,
+        # and is not reliable for SSL sockets on Jython, so big requests
+        # are sent with plain sendall() there
+        self._select_send = not (_JYTHON or CbServer.use_https)
+        self._requests = _RequestBuffer()
+        self._reader = _ResponseReader(self.s, self.host)
+
     def reconnect(self):
         self.s.close()
-        return self._createConn()
+        status = self._createConn()
+        self._reset_buffers()
+        return status
 
     def close(self):
         self.s.close()
@@ -125,97 +310,128 @@ class MemcachedClient(KeepRefs):
                       vbucketId=self.vbucketId, scope=scope, collection=collection,
                       extended_meta_data=extended_meta_data, extraHeaderLength=extraHeaderLength)
 
-    def _sendMsg(self, cmd, key, val, opaque, extraHeader='', cas=0,
-                 dtype=0, vbucketId=0,
-                 fmt=REQ_PKT_FMT, magic=REQ_MAGIC_BYTE, scope=None, collection=None, extended_meta_data='',
-                 extraHeaderLength=None):
+    def _queueMsg(self, cmd, key, val, opaque, extraHeader='', cas=0,
+                  dtype=0, vbucketId=0,
+                  fmt=REQ_PKT_FMT, magic=REQ_MAGIC_BYTE, scope=None, collection=None, extended_meta_data='',
+                  extraHeaderLength=None):
+        """Encode a request into the request buffer, to be sent by _flush()."""
         if collection:
             key = self._encodeCollectionId(key, scope, collection)
-        # a little bit unfortunate but the delWithMeta command expects the extra data length to be the
-        # overall packet length (28 in that case) so we need a facility to support that
-        if extraHeaderLength is None:
-            extraHeaderLength = len(extraHeader)
-
-        msg = struct.pack(fmt, magic,
-                          cmd, len(key), extraHeaderLength, dtype, vbucketId,
-                          len(key) + len(extraHeader) + len(val) + len(extended_meta_data), opaque, cas)
+        self._requests.append(cmd, key, val, opaque, extraHeader, cas, dtype,
+                              vbucketId, fmt, magic, extended_meta_data,
+                              extraHeaderLength)
 
+    def _flush(self):
+        """Send all the buffered requests."""
+        requests = self._requests
         try:
-            key = key.encode()
-        except AttributeError:
-            pass
-
-        try:
-            extraHeader = extraHeader.encode()
-        except AttributeError:
-            pass
+            if len(requests) <= self.PIPELINE_SEND_SIZE \
+                    or not self._select_send:
+                self.s.sendall(bytes(requests.buf) if _JYTHON
+                               else requests.buf)
+                return
+            # Keep reading the responses while sending, else both the
+            # sides can block on full socket buffers
+            view = memoryview(requests.buf)
+            try:
+                sent = 0
+                while sent < len(view):
+                    readable, writable, _ = select.select(
+                        [self.s], [self.s], [], self.timeout)
+                    if not readable and not writable:
+                        raise socket.timeout("Timed out sending to {0}"
+                                             .format(self.host))
+                    if readable:
+                        self._reader.read_available()
+                    if writable:
+                        sent += self.s.send(view[sent:])
+            finally:
+                del view
+        finally:
+            requests.clear()
 
-        try:
-            val = val.encode()
-        except AttributeError:
-            pass
+    def _sendMsg(self, cmd, key, val, opaque, extraHeader='', cas=0,
+                 dtype=0, vbucketId=0,
+                 fmt=REQ_PKT_FMT, magic=REQ_MAGIC_BYTE, scope=None, collection=None, extended_meta_data='',
+                 extraHeaderLength=None):
+        self._queueMsg(cmd, key, val, opaque, extraHeader, cas, dtype,
+                       vbucketId, fmt, magic, scope, collection,
+                       extended_meta_data, extraHeaderLength)
+        self._flush()
 
-        try:
-            extended_meta_data = extended_meta_data.encode()
-        except AttributeError:
-            pass
+    def _recvMsg(self, greedy=False):
+        return self._reader.read_response(greedy)
 
-        self.s.sendall(msg + extraHeader + key + val + extended_meta_data)
-
-    def _recvMsg(self):
-        response = b""
-        while len(response) < MIN_RECV_PACKET:
-            data = self.s.recv(MIN_RECV_PACKET - len(response))
-            if data == b'':
-                raise exceptions.EOFError("Got empty data (remote died?). from {0}".format(self.host))
-            response += data
-
-        assert len(response) == MIN_RECV_PACKET
-
-        # Peek at the magic so we can support alternative-framing
-        magic = struct.unpack(b">B", response[0:1])[0]
-        assert (magic in (
-            RES_MAGIC_BYTE, REQ_MAGIC_BYTE, ALT_RES_MAGIC_BYTE, ALT_REQ_MAGIC_BYTE)), "Got magic: 0x%x" % magic
-
-        cmd = 0
-        keylen = 0
-        extralen = 0
-        dtype = 0
-        errcode = 0
-        remaining = 0
-        opaque = 0
-        cas = 0
-        if magic == ALT_RES_MAGIC_BYTE or magic == ALT_REQ_MAGIC_BYTE:
-            magic, cmd, keylen, extralen, dtype, errcode, remaining, opaque, cas = \
-                struct.unpack(ALT_RES_PKT_FMT, response)
+    def _responseError(self, errcode, rv):
+        if self.error_map is None:
+            msg = rv
         else:
-            magic, cmd, keylen, extralen, dtype, errcode, remaining, opaque, cas = \
-                struct.unpack(RES_PKT_FMT, response)
-
-        rv = b""
-        while remaining > 0:
-            data = self.s.recv(remaining)
-            if data == b'':
-                raise exceptions.EOFError("Got empty data (remote died?). from {0}".format(self.host))
-            rv += data
-            remaining -= len(data)
-
-        return cmd, errcode, opaque, cas, keylen, extralen, dtype, rv
+            err = self.error_map['errors'].get(errcode, rv)
+            msg = "{name} : {desc} : {rv}".format(rv=rv, **err)
+        return MemcachedError(errcode, msg)
 
     def _handleKeyedResponse(self, myopaque):
         cmd, errcode, opaque, cas, keylen, extralen, dtype, rv = self._recvMsg()
         assert myopaque is None or opaque == myopaque, \
             "expected opaque %x, got %x" % (myopaque, opaque)
         if errcode != 0:
-            if self.error_map is None:
-                msg = rv
-            else:
-                err = self.error_map['errors'].get(errcode, rv)
-                msg = "{name} : {desc} : {rv}".format(rv=rv, **err)
-
-            raise MemcachedError(errcode, msg)
+            raise self._responseError(errcode, rv)
         return cmd, opaque, cas, keylen, extralen, rv
 
+    def _pipeline(self, requests, quiet=False, scope=None, collection=None):
+        """Send the requests in batches of PIPELINE_BATCH_SIZE requests
+        (or PIPELINE_BATCH_BYTES), one send per batch, and route the
+        responses back by opaque.
+
+        requests is an iterable of (cmd, key, val, extraHeader, vbucketId).
+        Quiet commands only respond on failure (or on hit for GETQ), so
+        each batch of them is terminated with a NOOP.
+
+        Returns a list of (index, response) where index is the position of
+        the request and response is a _recvMsg() tuple."""
+        terminal = 0xffffffff
+        responses = []
+        # Without select(), batches must stay small enough to be sent
+        # before the server blocks on the unread responses
+        batch_bytes = self.PIPELINE_BATCH_BYTES if self._select_send \
+            else self.PIPELINE_SEND_SIZE
+        requests = iter(requests)
+        index = 0
+        while True:
+            pending = set()
+            try:
+                for cmd, key, val, extra, vbucketId in requests:
+                    self._queueMsg(cmd, key, val, index, extra,
+                                   vbucketId=vbucketId, scope=scope,
+                                   collection=collection)
+                    pending.add(index)
+                    index += 1
+                    if len(pending) == self.PIPELINE_BATCH_SIZE \
+                            or len(self._requests) >= batch_bytes:
+                        break
+            except Exception:
+                # Drop the partially encoded batch
+                self._requests.clear()
+                raise
+            if not pending:
+                return responses
+            if quiet:
+                self._queueMsg(memcacheConstants.CMD_NOOP, '', '', terminal)
+            self._flush()
+
+            while True:
+                response = self._recvMsg(greedy=True)
+                opaque = response[2]
+                if quiet and opaque == terminal:
+                    break
+                assert opaque in pending, \
+                    "unexpected opaque %x in pipelined responses" % opaque
+                responses.append((opaque, response))
+                if not quiet:
+                    pending.remove(opaque)
+                    if not pending:
+                        break
+
     def _handleSingleResponse(self, myopaque):
         cmd, opaque, cas, keylen, extralen, data = self._handleKeyedResponse(myopaque)
         return opaque, cas, data
@@ -705,43 +921,44 @@ class MemcachedClient(KeepRefs):
         self._set_vbucket(key, vbucket, scope=scope, collection=collection)
         return self._doCmd(memcacheConstants.CMD_EVICT_KEY, key, '', scope=scope, collection=collection)
 
-    def getMulti(self, keys, vbucket=-1, scope=None, collection=None):
+    def getMulti(self, keys, vbucket=-1, scope=None, collection=None, errors=None):
         """Get values for any available keys in the given iterable.
 
-        Returns a dict of matched keys to their values."""
+        Returns a dict of matched keys to their values.
+        If an errors dict is given, the failed keys are recorded in it
+        (key -> MemcachedError) instead of raising the first failure."""
         scope, collection = self.collection_name(scope, collection)
 
-        opaqued = dict(enumerate(keys))
-        terminal = len(opaqued) + 10
-        # Send all of the keys in quiet
-        vbs = set()
-        for k, v in opaqued.items():
-            self._set_vbucket(v, vbucket, scope=scope, collection=collection)
-            vbs.add(self.vbucketId)
-            self._sendCmd(memcacheConstants.CMD_GETQ, v, '', k, scope=scope, collection=collection)
+        keys = list(keys)
+        requests = []
+        for key in keys:
+            self._set_vbucket(key, vbucket, scope=scope, collection=collection)
+            requests.append((memcacheConstants.CMD_GETQ, key, '', '',
+                             self.vbucketId))
 
-        for vb in vbs:
-            self.vbucketId = vb
-            self._sendCmd(memcacheConstants.CMD_NOOP, '', '', terminal)
-
-        # Handle the response
         rv = {}
-        for vb in vbs:
-            self.vbucketId = vb
-            done = False
-            while not done:
-                opaque, cas, data = self._handleSingleResponse(None)
-                if opaque != terminal:
-                    rv[opaqued[opaque]] = self.__parseGet((opaque, cas, data))
+        error = None
+        for index, response in self._pipeline(requests, quiet=True,
+                                              scope=scope,
+                                              collection=collection):
+            _, errcode, opaque, cas, _, _, _, data = response
+            if errcode != 0:
+                if errors is not None:
+                    errors[keys[index]] = self._responseError(errcode, data)
                 else:
-                    done = True
-
+                    error = error or self._responseError(errcode, data)
+                continue
+            rv[keys[index]] = self.__parseGet((opaque, cas, data))
+        if error is not None:
+            raise error
         return rv
 
-    def setMulti(self, exp, flags, items, vbucket=-1, scope=None, collection=None):
+    def setMulti(self, exp, flags, items, vbucket=-1, scope=None, collection=None, errors=None):
         """Multi-set (using setq).
 
-        Give me (key, value) pairs."""
+        Give me (key, value) pairs.
+        Returns the list of failures. If an errors dict is given, the
+        failed keys are recorded in it as well (key -> MemcachedError)."""
 
         # If this is a dict, convert it to a pair generator
         scope, collection = self.collection_name(scope, collection)
@@ -749,33 +966,67 @@ class MemcachedClient(KeepRefs):
         if hasattr(items, 'items'):
             items = iter(items.items())
 
-        opaqued = dict(enumerate(items))
-        terminal = len(opaqued) + 10
         extra = struct.pack(SET_PKT_FMT, flags, exp)
+        keys = []
+        requests = []
+        for key, val in items:
+            self._set_vbucket(key, vbucket, scope=scope, collection=collection)
+            keys.append(key)
+            requests.append((memcacheConstants.CMD_SETQ, key, val, extra,
+                             self.vbucketId))
 
-        # Send all of the keys in quiet
-        vbs = set()
-        for opaque, kv in opaqued.items():
-            self._set_vbucket(kv[0], vbucket, scope=scope, collection=collection)
-            vbs.add(self.vbucketId)
-            self._sendCmd(memcacheConstants.CMD_SETQ, kv[0], kv[1], opaque, extra, scope=scope, collection=collection)
+        failed = []
+        for index, response in self._pipeline(requests, quiet=True,
+                                              scope=scope,
+                                              collection=collection):
+            errcode, data = response[1], response[7]
+            if errcode != 0:
+                failed.append(self._responseError(errcode, data))
+                if errors is not None:
+                    errors[keys[index]] = failed[-1]
 
-        for vb in vbs:
-            self.vbucketId = vb
-            self._sendCmd(memcacheConstants.CMD_NOOP, '', '', terminal)
+        return failed
 
-        # Handle the response
-        failed = []
-        for vb in vbs:
-            self.vbucketId = vb
-            done = False
-            while not done:
-                try:
-                    opaque, cas, data = self._handleSingleResponse(None)
-                    done = opaque == terminal
-                except MemcachedError as e:
-                    failed.append(e)
+    def setWithMetaMulti(self, items, options=2, vbucket=-1, scope=None, collection=None):
+        """Pipelined setWithMeta.
 
+        Give me (key, value, flags, seqno, remote_cas) tuples.
+        Returns a dict of the failed keys to their MemcachedError."""
+        scope, collection = self.collection_name(scope, collection)
+        # Same extras as _doMetaCmd, where the expiry is not carried
+        items = ((key, val, struct.pack('>IIQQI', flags, 0, seqno,
+                                        remote_cas, options))
+                 for key, val, flags, seqno, remote_cas in items)
+        return self._metaMulti(memcacheConstants.CMD_SET_WITH_META, items,
+                               vbucket, scope, collection)
+
+    def delWithMetaMulti(self, items, options=0, vbucket=-1, scope=None, collection=None):
+        """Pipelined del_with_meta.
+
+        Give me (key, exp, flags, seqno, cas) tuples.
+        Returns a dict of the failed keys to their MemcachedError."""
+        scope, collection = self.collection_name(scope, collection)
+        items = ((key, '', struct.pack(
+                    memcacheConstants.EXTENDED_META_CMD_FMT, flags, exp,
+                    seqno, cas, options, 0))
+                 for key, exp, flags, seqno, cas in items)
+        return self._metaMulti(memcacheConstants.CMD_DELETE_WITH_META, items,
+                               vbucket, scope, collection)
+
+    def _metaMulti(self, cmd, items, vbucket, scope, collection):
+        keys = []
+        requests = []
+        for key, val, extra in items:
+            self._set_vbucket(key, vbucket, scope=scope, collection=collection)
+            keys.append(key)
+            requests.append((cmd, key, val, extra, self.vbucketId))
+
+        failed = {}
+        for index, response in self._pipeline(requests, scope=scope,
+                                              collection=collection):
+            errcode, data = response[1], response[7]
+            if errcode != 0:
+                failed[keys[index]] = self._responseError(errcode, data)
         return failed
 
     def collection_name(self, scope, collection):
@@ -800,6 +1051,45 @@ class MemcachedClient(KeepRefs):
                 done = True
         return rv
 
+    def stats_multi(self, groups):
+        """
+        Get stats for multiple stat groups in a single round-trip.
+        All STAT requests are written at once and the responses are
+        collected in the request order (memcached answers in order).
+        :param groups: List of stat groups. '' for the default stats
+        :return: dict of {group: {stat_key: value}}
+        """
+        opaques = list()
+        for index, group in enumerate(groups):
+            opaque = (self.r.randint(0, 2 ** 31) + index) & 0xffffffff
+            opaques.append(opaque)
+            self._queueMsg(memcacheConstants.CMD_STAT, group, '', opaque,
+                           vbucketId=self.vbucketId)
+        self._flush()
+
+        rv = dict()
+        error = None
+        for group, opaque in zip(groups, opaques):
+            stats = dict()
+            while True:
+                _, errcode, r_opaque, _, klen, _, _, data = \
+                    self._recvMsg(greedy=True)
+                assert r_opaque == opaque, \
+                    "expected opaque %x, got %x" % (opaque, r_opaque)
+                if errcode != 0:
+                    # Failed group has no terminator. Keep reading the
+                    # rest so the connection stays in sync
+                    if error is None:
+                        error = MemcachedError(errcode, data)
+                    break
+                if not klen:
+                    break
+                stats[data[0:klen].decode()] = data[klen:].decode()
+            rv[group] = stats
+        if error is not None:
+            raise error
+        return rv
+
     def noop(self):
         """Send a noop command."""
         return self._doCmd(memcacheConstants.CMD_NOOP, '', '')
@@ -926,7 +1216,13 @@ class MemcachedClient(KeepRefs):
 
     def _set_vbucket(self, key, vbucket=-1, scope=None, collection=None):
         if not vbucket or vbucket < 0:
-            self.vbucketId = (((zlib.crc32(key.encode())) >> 16) & 0x7fff) & (self.vbucket_count - 1)
+            key_hash = self._key_hash_cache.get(key)
+            if key_hash is None:
+                key_hash = ((zlib.crc32(key.encode())) >> 16) & 0x7fff
+                if len(self._key_hash_cache) >= self.KEY_HASH_CACHE_SIZE:
+                    self._key_hash_cache.clear()
+                self._key_hash_cache[key] = key_hash
+            self.vbucketId = key_hash & (self.vbucket_count - 1)
         else:
             self.vbucketId = vbucket
 
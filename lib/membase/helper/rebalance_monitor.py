@@ -0,0 +1,306 @@
+"""
+Rebalance progress tracking based on the vbucket moves
+
+Each poll reads the rebalance task from pools/default/tasks and records
+a sample with the overall progress and the 'detailedProgress' of the
+bucket being rebalanced (vbuckets left / docs transferred per node).
+From the samples the monitor derives the vbucket move throughput per
+node and per bucket, the expected time to completion and stalls.
+
+A rebalance is considered stalled when nothing moved (progress,
+vbuckets, docs or the bucket being rebalanced) for longer than
+STALL_FACTOR times the average interval between the movements seen so
+far, bounded by [min_stall_time, max_stall_time]. So a slow but moving
+rebalance is not flagged, while a fast one which stops is caught early.
+The caller's min_stall_time is never cut down by max_stall_time, and is
+the limit until the first movement is seen.
+"""
+
+import json
+import time
+from collections import namedtuple
+
+from custom_exceptions.exception import RebalanceFailedException, \
+    ServerUnavailableException
+from global_vars import logger
+from table_view import TableView
+
+RebalanceSample = namedtuple(
+    "RebalanceSample",
+    ["timestamp", "status", "progress", "bucket", "bucket_number",
+     "buckets_count", "vbuckets_left", "docs_transferred", "per_node"])
+
+
+class RebalanceMonitor(object):
+    STALL_FACTOR = 10
+    # Samples used for the current rate / ETA computation
+    RATE_WINDOW = 60
+
+    def __init__(self, rest, status_id=None, min_stall_time=300,
+                 max_stall_time=1800):
+        """
+        :param rest: RestConnection to the cluster
+        :param status_id: statusId of the previous rebalance task. A task
+                          with a different statusId marks the monitored
+                          rebalance as done
+        :param min_stall_time: Minimum seconds without any movement
+                               before the rebalance is considered stalled
+        :param max_stall_time: Max seconds without any movement.
+                               Never lower than min_stall_time
+        """
+        self.log = logger.get("test")
+        self.rest = rest
+        self.status_id = status_id
+        self.min_stall_time = min_stall_time
+        self.max_stall_time = max(max_stall_time, min_stall_time)
+        self.samples = list()
+        self.start_time = time.time()
+        self.last_movement_time = self.start_time
+        self.num_movements = 0
+        self.unavailable_since = None
+        # bucket -> {"vbuckets": total vbuckets to move, "start": ts,
+        #            "end": ts, "docs": docs transferred}
+        self.bucket_stats = dict()
+        # node -> {"vbuckets_moved": n, "docs_transferred": n}
+        self.node_stats = dict()
+
+    @staticmethod
+    def __get_rebalance_task(tasks):
+        for task in tasks:
+            if task.get("type") == "rebalance":
+                return task
+        return dict()
+
+    @staticmethod
+    def __parse_detailed_progress(task):
+        """
+        :return: (vbuckets_left, docs_transferred, per_node) where per_node
+                 is {node: (vbuckets_left, docs_transferred)}
+        """
+        per_node = dict()
+        vbuckets_left = 0
+        docs_transferred = 0
+        detailed = task.get("detailedProgress", dict())
+        for node, progress in detailed.get("perNode", dict()).items():
+            node_vbs = 0
+            node_docs = 0
+            for direction in ["ingoing", "outgoing"]:
+                stats = progress.get(direction, dict())
+                node_vbs += stats.get("activeVBucketsLeft", 0) \
+                    + stats.get("replicaVBucketsLeft", 0)
+                node_docs += stats.get("docsTransferred", 0)
+            per_node[node.split("@")[-1]] = (node_vbs, node_docs)
+            # Each move is counted as outgoing on one node and
+            # ingoing on the other
+            vbuckets_left += node_vbs
+            docs_transferred += node_docs
+        return vbuckets_left // 2, docs_transferred // 2, per_node
+
+    def __fetch_task(self):
+        """
+        :return: Rebalance task dict. None if it could not be fetched
+        :raises RebalanceFailedException: If the rebalance failed
+        """
+        api = self.rest.baseUrl + "pools/default/tasks"
+        try:
+            status, content, _ = self.rest._http_request(api)
+            tasks = json.loads(content) if status else None
+        except (ServerUnavailableException, ValueError) as e:
+            self.log.error("Failed to get rebalance task: %s" % e)
+            tasks = None
+        if tasks is None:
+            return None
+        task = self.__get_rebalance_task(tasks)
+        if "errorMessage" in task:
+            msg = "%s - rebalance failed" % task
+            self.log.error(msg)
+            self.rest.print_UI_logs()
+            raise RebalanceFailedException(msg)
+        return task
+
+    def poll(self):
+        """
+        Reads the rebalance task and records a sample
+        :return: (status, progress) as returned by
+                 RestConnection._rebalance_status_and_progress()
+        :raises RebalanceFailedException: If the rebalance failed
+        """
+        task = self.__fetch_task()
+        if task is None:
+            if self.unavailable_since is None:
+                self.unavailable_since = time.time()
+            return None, -100
+        self.unavailable_since = None
+        rebalance_status = task.get("status")
+        if rebalance_status is None:
+            return None, -1
+        progress = 100
+        if rebalance_status == "running":
+            if self.status_id is not None \
+                    and task.get("statusId", self.status_id) \
+                    != self.status_id:
+                # Monitored rebalance is done and a new task is running
+                self.log.warning("Previous rebalance with status id '%s' "
+                                 "changed to '%s'"
+                                 % (self.status_id, task["statusId"]))
+                rebalance_status = "none"
+            else:
+                progress = round(task.get("progress", 0), 2)
+        else:
+            # Failure message may get updated after the task stops
+            time.sleep(5)
+            task = self.__fetch_task() or task
+            rebalance_status = "none"
+        self.__record(task, rebalance_status, progress)
+        return rebalance_status, progress
+
+    def __record(self, task, rebalance_status, progress):
+        now = time.time()
+        detailed = task.get("detailedProgress", dict())
+        vbuckets_left, docs_transferred, per_node = \
+            self.__parse_detailed_progress(task)
+        sample = RebalanceSample(
+            now, rebalance_status, progress, detailed.get("bucket"),
+            detailed.get("bucketNumber"), detailed.get("bucketsCount"),
+            vbuckets_left, docs_transferred, per_node)
+        prev = self.samples[-1] if self.samples else None
+        self.samples.append(sample)
+        if prev is None:
+            self.__track_bucket(sample, None)
+            return
+        if (sample.progress, sample.bucket, sample.vbuckets_left,
+                sample.docs_transferred) \
+                != (prev.progress, prev.bucket, prev.vbuckets_left,
+                    prev.docs_transferred):
+            self.num_movements += 1
+            self.last_movement_time = now
+        self.__track_bucket(sample, prev)
+        if sample.bucket != prev.bucket:
+            return
+        for node, (node_vbs, node_docs) in sample.per_node.items():
+            prev_vbs, prev_docs = prev.per_node.get(node, (node_vbs,
+                                                           node_docs))
+            stats = self.node_stats.setdefault(
+                node, {"vbuckets_moved": 0, "docs_transferred": 0})
+            stats["vbuckets_moved"] += max(prev_vbs - node_vbs, 0)
+            stats["docs_transferred"] += max(node_docs - prev_docs, 0)
+
+    def __track_bucket(self, sample, prev):
+        if prev is not None and prev.bucket is not None \
+                and prev.bucket != sample.bucket:
+            self.bucket_stats[prev.bucket]["end"] = sample.timestamp
+            self.bucket_stats[prev.bucket]["vbuckets_left"] = 0
+        if sample.bucket is None:
+            return
+        stats = self.bucket_stats.setdefault(
+            sample.bucket, {"vbuckets": sample.vbuckets_left,
+                            "vbuckets_left": sample.vbuckets_left,
+                            "docs": 0, "start": sample.timestamp,
+                            "end": None})
+        stats["vbuckets"] = max(stats["vbuckets"], sample.vbuckets_left)
+        stats["vbuckets_left"] = sample.vbuckets_left
+        stats["docs"] = max(stats["docs"], sample.docs_transferred)
+        if sample.status == "none" and stats["end"] is None:
+            stats["end"] = sample.timestamp
+
+    def move_rate(self, window=RATE_WINDOW):
+        """
+        :return: vbuckets moved per second over the last 'window' seconds
+                 of the bucket being rebalanced
+        """
+        if len(self.samples) < 2:
+            return 0.0
+        last = self.samples[-1]
+        first = last
+        for sample in reversed(self.samples):
+            if sample.bucket != last.bucket \
+                    or last.timestamp - sample.timestamp > window:
+                break
+            first = sample
+        elapsed = last.timestamp - first.timestamp
+        if elapsed <= 0:
+            return 0.0
+        return max(first.vbuckets_left - last.vbuckets_left, 0) / elapsed
+
+    def eta(self):
+        """
+        :return: Estimated seconds to complete the rebalance, based on the
+                 overall progress rate. None if it cannot be estimated
+        """
+        if len(self.samples) < 2:
+            return None
+        last = self.samples[-1]
+        elapsed = last.timestamp - self.start_time
+        if last.progress <= 0 or elapsed <= 0:
+            return None
+        return (100 - last.progress) * elapsed / last.progress
+
+    def stall_time_limit(self):
+        """
+        :return: Seconds without any movement after which the rebalance
+                 is considered stalled
+        """
+        if self.num_movements == 0:
+            return self.min_stall_time
+        avg_interval = (self.last_movement_time - self.start_time) \
+            / self.num_movements
+        return min(max(self.STALL_FACTOR * avg_interval,
+                       self.min_stall_time),
+                   self.max_stall_time)
+
+    def is_stalled(self):
+        now = time.time()
+        if self.unavailable_since is not None \
+                and now - self.unavailable_since > self.min_stall_time:
+            return True
+        return now - self.last_movement_time > self.stall_time_limit()
+
+    def status_line(self):
+        eta = self.eta()
+        return "vb move rate: %.2f/s, ETA: %s" \
+               % (self.move_rate(),
+                  "%ds" % eta if eta is not None else "unknown")
+
+    def time_series(self):
+        """ :return: List of dicts, one per recorded sample """
+        return [dict(sample._asdict(),
+                     timestamp=round(sample.timestamp - self.start_time, 3))
+                for sample in self.samples]
+
+    def save_time_series(self, file_path):
+        with open(file_path, "w") as fp:
+            json.dump({"start_time": self.start_time,
+                       "samples": self.time_series(),
+                       "buckets": self.bucket_stats,
+                       "nodes": self.node_stats}, fp)
+
+    def progress_trend(self):
+        """ :return: Progress values, usable with table_view.plot_graph """
+        return [sample.progress for sample in self.samples]
+
+    def print_stats(self):
+        table = TableView(self.log.info)
+        table.set_headers(["Bucket", "vBuckets moved", "Docs transferred",
+                           "Time (s)", "vBuckets / sec"])
+        for bucket, stats in sorted(self.bucket_stats.items()):
+            end_time = stats["end"] or (self.samples[-1].timestamp
+                                        if self.samples else time.time())
+            elapsed = max(end_time - stats["start"], 0.001)
+            vbuckets_moved = stats["vbuckets"] - stats["vbuckets_left"]
+            table.add_row([bucket, vbuckets_moved, stats["docs"],
+                           "%.2f" % elapsed,
+                           "%.2f" % (vbuckets_moved / elapsed)])
+        table.display("Rebalance vbucket moves per bucket")
+
+        if not self.node_stats:
+            return
+        elapsed = max((self.samples[-1].timestamp if self.samples
+                       else time.time()) - self.start_time, 0.001)
+        table = TableView(self.log.info)
+        table.set_headers(["Node", "vBuckets moved", "Docs transferred",
+                           "vBuckets / sec"])
+        for node, stats in sorted(self.node_stats.items()):
+            table.add_row([node, stats["vbuckets_moved"],
+                           stats["docs_transferred"],
+                           "%.2f" % (stats["vbuckets_moved"] / elapsed)])
+        table.display("Rebalance vbucket moves per node")
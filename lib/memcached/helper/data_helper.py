@@ -1,10 +1,14 @@
 import zlib
 from TestInput import TestInputServer
 
+from concurrent.futures import wait
+
 from BucketLib.BucketOperations import BucketHelper
 from common_lib import sleep
 from global_vars import logger
+from job_executor import JobExecutor
 from mc_bin_client import MemcachedClient, MemcachedError
+from memcacheConstants import ERR_NOT_MY_VBUCKET
 from membase.api.rest_client import RestConnection
 from Cb_constants.CBServer import CbServer
 
@@ -74,6 +78,10 @@ class MemcachedClientHelper(object):
 
 
 class VBucketAwareMemcached(object):
+    # Times the keys hitting NOT_MY_VBUCKET are re-routed after
+    # refreshing the vbucket map
+    MAX_REROUTES = 5
+
     def __init__(self, rest, bucket, info=None, collections=None):
         self.info = info or dict({"ip": rest.ip, "port": rest.port,
                                   "username": rest.username,
@@ -95,8 +103,8 @@ class VBucketAwareMemcached(object):
         self.vBucketMap = v
         self.vBucketMapReplica = r
 
-    def request_map(self, rest, bucket):
-        memcacheds = {}
+    def request_map(self, rest, bucket, memcacheds=None):
+        memcacheds = dict(memcacheds or {})
         vb_map = {}
         vb_map_replica = {}
         vb_ready = BucketHelper(self.info).vbucket_map_ready(bucket, 60)
@@ -176,3 +184,85 @@ class VBucketAwareMemcached(object):
 
     def done(self):
         [self.memcacheds[ip].close() for ip in self.memcacheds]
+
+    def refresh_vbucket_map(self):
+        """
+        Re-reads the vbucket map, reusing the open connections.
+        Connections are created only for the nodes new to the map
+        """
+        self.memcacheds, self.vBucketMap, self.vBucketMapReplica = \
+            self.request_map(self.rest, self.bucket, self.memcacheds)
+
+    def __group_by_node(self, keys):
+        """ :return: dict of {"ip:port" of the active node: [keys]} """
+        groups = dict()
+        for key in keys:
+            server_str = self.vBucketMap[self._get_vBucket_id(key)]
+            groups.setdefault(server_str, list()).append(key)
+        return groups
+
+    def __fan_out(self, keys, node_op):
+        """
+        Runs node_op(client, node_keys, errors) on each node, in parallel,
+        for the keys owned by the node. Keys failing with NOT_MY_VBUCKET
+        are re-routed after refreshing the vbucket map
+        :return: (merged results of node_op, dict of failed key -> error)
+        """
+        executor = JobExecutor.get()
+        results = dict()
+        errors = dict()
+        pending = keys
+        for attempt in range(self.MAX_REROUTES + 1):
+            futures = list()
+            for server_str, node_keys in self.__group_by_node(pending).items():
+                client = self.memcacheds[server_str]
+                node_errors = dict()
+                # One job at a time per connection
+                futures.append((node_errors, executor.submit_job(
+                    node_op, args=(client, node_keys, node_errors),
+                    target="vbucket_aware_mc_%s" % id(client),
+                    target_limit=1)))
+            wait([future for _, future in futures])
+
+            pending = list()
+            for node_errors, future in futures:
+                results.update(future.result())
+                for key, error in node_errors.items():
+                    if error.status == ERR_NOT_MY_VBUCKET:
+                        pending.append(key)
+                    errors[key] = error
+            if not pending or attempt == self.MAX_REROUTES:
+                break
+            self.log.debug("%s keys hit NOT_MY_VBUCKET, refreshing the "
+                           "vbucket map of %s" % (len(pending), self.bucket))
+            sleep(1, "Wait before re-routing the keys", log_type="infra")
+            self.refresh_vbucket_map()
+            for key in pending:
+                errors.pop(key)
+        return results, errors
+
+    def get_multi(self, keys, scope=None, collection=None):
+        """
+        Pipelined get of the keys, from all the active nodes in parallel
+        :param keys: Iterable of keys
+        :return: (dict of {key: (flags, cas, value)} for the found keys,
+                  dict of {key: MemcachedError} for the failed keys)
+        """
+        def node_op(client, node_keys, node_errors):
+            return client.getMulti(node_keys, scope=scope,
+                                   collection=collection, errors=node_errors)
+        return self.__fan_out(list(keys), node_op)
+
+    def set_multi(self, exp, flags, items, scope=None, collection=None):
+        """
+        Pipelined set of the items, to all the active nodes in parallel
+        :param items: dict of {key: value}
+        :return: dict of {key: MemcachedError} for the failed keys
+        """
+        def node_op(client, node_keys, node_errors):
+            client.setMulti(exp, flags,
+                            [(key, items[key]) for key in node_keys],
+                            scope=scope, collection=collection,
+                            errors=node_errors)
+            return dict()
+        return self.__fan_out(list(items.keys()), node_op)[1]
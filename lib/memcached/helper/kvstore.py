@@ -3,6 +3,9 @@ import random
 import zlib
 import time
 import copy
+import heapq
+from array import array
+
 
 class KVStore(object):
     def __init__(self, num_locks=16):
@@ -238,3 +241,343 @@ class Partition(object):
 
     def __hash__(self):
         return self.part_id.__hash__()
+
+
+class KeyInterner(object):
+    """
+    Maps generator style keys '<prefix>-<digits>' to a (family, index)
+    pair, where family identifies the (prefix, number_of_digits) format.
+    Such keys need not be stored as strings, since the key can be
+    re-created from the family and the integer index.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.families = list()
+        self.family_ids = dict()
+
+    def intern(self, key):
+        """
+        :return: (family_id, index) or None for non-generator keys
+        """
+        prefix, sep, digits = key.rpartition("-")
+        if not sep or not digits.isdigit():
+            return None
+        family = (prefix, len(digits))
+        family_id = self.family_ids.get(family)
+        if family_id is None:
+            with self.lock:
+                family_id = self.family_ids.get(family)
+                if family_id is None:
+                    family_id = len(self.families)
+                    self.families.append(family)
+                    self.family_ids[family] = family_id
+        return family_id, int(digits)
+
+    def key(self, family_id, index):
+        prefix, num_digits = self.families[family_id]
+        return "%s-%s" % (prefix, str(index).zfill(num_digits))
+
+
+class CompactKVStore(KVStore):
+    """
+    Memory compact KVStore for tracking millions of documents.
+    Generator keys are interned as (family, index) and the per key
+    state / expiry / flag / CAS / timestamp are packed into typed arrays
+    (see CompactPartition). Keys are partitioned on the generator index.
+
+    :param store_values: If False, doc values are not retained and
+                         get_valid() / get_key()["value"] return None.
+                         Validation is expected to regenerate values
+                         using the document generator
+    """
+    def __init__(self, num_locks=16, store_values=False):
+        self.interner = KeyInterner()
+        self.store_values = store_values
+        super(CompactKVStore, self).__init__(num_locks)
+
+    def reset(self):
+        self.cache = {}
+        for itr in range(self.num_locks):
+            self.cache[itr] = {"lock": threading.Lock(),
+                               "partition": CompactPartition(
+                                   itr, self.num_locks, self.interner,
+                                   self.store_values)}
+
+    def _hash(self, key):
+        interned = self.interner.intern(key)
+        if interned is None:
+            return zlib.crc32(key) % self.num_locks
+        return interned[1] % self.num_locks
+
+
+class CompactPartition(object):
+    """
+    Partition storing the key state in typed arrays instead of dicts.
+
+    The slot of an interned key is 'index // num_partitions' within its
+    key family. Slots are stored in fixed size chunks of typed arrays,
+    allocated on first use, so sparse or very large generator indexes
+    only cost the chunks actually touched.
+    Keys which are not generator keys use a dict fallback.
+    Keys with expiry are tracked in a heap ordered on expiry time, so
+    expiring keys costs O(log n) per expired key instead of a scan.
+    """
+    ABSENT = 0
+    VALID = 1
+    DELETED = 2
+    EXPIRED = 3
+
+    CHUNK_BITS = 7
+    CHUNK_SIZE = 1 << CHUNK_BITS
+    CHUNK_MASK = CHUNK_SIZE - 1
+
+    FIELDS = ["state", "expires", "flag", "cas", "timestamp"]
+
+    def __init__(self, part_id, num_partitions, interner, store_values=False):
+        self.part_id = part_id
+        self.num_partitions = num_partitions
+        self.interner = interner
+        self.store_values = store_values
+        # family_id -> {chunk_num: chunk}, see __new_chunk()
+        self.__families = dict()
+        # Fallback for non-generator keys: key -> [state, exp, flag, cas, ts]
+        self.__other_keys = dict()
+        # (family_id, slot) -> value. Used only with store_values
+        self.__values = dict()
+        # Heap of (expiry_time, family_id, slot)
+        self.__exp_heap = list()
+        self.__num_valid = 0
+        self.__num_deleted = 0
+
+    @classmethod
+    def __new_chunk(cls):
+        # CAS is stored signed, 'l' is 64 bit on Jython / 64-bit CPython
+        return {"state": array("b", [0]) * cls.CHUNK_SIZE,
+                "expires": array("d", [0]) * cls.CHUNK_SIZE,
+                "flag": array("l", [0]) * cls.CHUNK_SIZE,
+                "cas": array("l", [0]) * cls.CHUNK_SIZE,
+                "timestamp": array("d", [0]) * cls.CHUNK_SIZE}
+
+    def __locate(self, key, create=False):
+        """
+        :return: (family_id, slot) for interned keys / (None, key) otherwise.
+                 (None, None) if the key is not known and create=False
+        """
+        interned = self.interner.intern(key)
+        if interned is None:
+            if key not in self.__other_keys:
+                if not create:
+                    return None, None
+                self.__other_keys[key] = [self.ABSENT, 0, 0, 0, 0]
+            return None, key
+        family_id, index = interned
+        slot = index // self.num_partitions
+        chunk_num = slot >> self.CHUNK_BITS
+        chunks = self.__families.get(family_id)
+        if chunks is None:
+            if not create:
+                return None, None
+            chunks = self.__families[family_id] = dict()
+        if chunk_num not in chunks:
+            if not create:
+                return None, None
+            chunks[chunk_num] = self.__new_chunk()
+        return family_id, slot
+
+    def __get(self, family_id, slot, field):
+        if family_id is None:
+            return self.__other_keys[slot][self.FIELDS.index(field)]
+        return self.__families[family_id][slot >> self.CHUNK_BITS][field][
+            slot & self.CHUNK_MASK]
+
+    def __put(self, family_id, slot, **fields):
+        if family_id is None:
+            record = self.__other_keys[slot]
+            for index, field in enumerate(self.FIELDS):
+                if field in fields:
+                    record[index] = fields[field]
+            return
+        chunk = self.__families[family_id][slot >> self.CHUNK_BITS]
+        offset = slot & self.CHUNK_MASK
+        for field, value in fields.items():
+            chunk[field][offset] = value
+
+    def __state(self, key):
+        """ :return: (family_id, slot, state) of the key """
+        family_id, slot = self.__locate(key)
+        if slot is None:
+            return None, None, self.ABSENT
+        return family_id, slot, self.__get(family_id, slot, "state")
+
+    def __set_state(self, family_id, slot, state):
+        old_state = self.__get(family_id, slot, "state")
+        if old_state == self.VALID:
+            self.__num_valid -= 1
+        elif old_state in [self.DELETED, self.EXPIRED]:
+            self.__num_deleted -= 1
+        if state == self.VALID:
+            self.__num_valid += 1
+        elif state in [self.DELETED, self.EXPIRED]:
+            self.__num_deleted += 1
+        self.__put(family_id, slot, state=state)
+
+    def __expire_due_keys(self):
+        """ Move all keys with expiry time in the past to EXPIRED state """
+        now = time.time()
+        while self.__exp_heap and self.__exp_heap[0][0] < now:
+            exp, family_id, slot = heapq.heappop(self.__exp_heap)
+            # Skip stale heap entries of keys updated / deleted later
+            if self.__get(family_id, slot, "state") == self.VALID \
+                    and self.__get(family_id, slot, "expires") == exp:
+                self.__set_state(family_id, slot, self.EXPIRED)
+
+    def __iter_slots(self, states):
+        for family_id, chunks in self.__families.items():
+            for chunk_num, chunk in chunks.items():
+                base_slot = chunk_num << self.CHUNK_BITS
+                chunk_states = chunk["state"]
+                for offset in xrange(self.CHUNK_SIZE):
+                    if chunk_states[offset] in states:
+                        yield family_id, base_slot + offset
+        for key, record in self.__other_keys.items():
+            if record[0] in states:
+                yield None, key
+
+    def __key(self, family_id, slot):
+        if family_id is None:
+            return slot
+        return self.interner.key(family_id,
+                                 slot * self.num_partitions + self.part_id)
+
+    def __key_set(self, *states):
+        self.__expire_due_keys()
+        return [self.__key(family_id, slot)
+                for family_id, slot in self.__iter_slots(states)]
+
+    def set(self, key, value, exp=0, flag=0, cas=0):
+        family_id, slot = self.__locate(key, create=True)
+        if exp != 0:
+            exp = (time.time() + exp)
+            heapq.heappush(self.__exp_heap, (exp, family_id, slot))
+        self.__set_state(family_id, slot, self.VALID)
+        self.__put(family_id, slot, expires=exp, flag=flag, cas=cas,
+                   timestamp=time.time())
+        if self.store_values:
+            self.__values[(family_id, slot)] = value
+
+    def delete(self, key):
+        family_id, slot, state = self.__state(key)
+        if state == self.VALID:
+            self.__set_state(family_id, slot, self.DELETED)
+            self.__put(family_id, slot, timestamp=time.time())
+
+    def get_timestamp(self, key):
+        family_id, slot, state = self.__state(key)
+        if state == self.ABSENT:
+            return 0
+        return self.__get(family_id, slot, "timestamp")
+
+    def get_cas(self, key):
+        family_id, slot, state = self.__state(key)
+        if state == self.ABSENT:
+            return None
+        return self.__get(family_id, slot, "cas")
+
+    def get_key(self, key):
+        family_id, slot, state = self.__state(key)
+        if state != self.VALID:
+            return None
+        return {"value": self.__values.get((family_id, slot)),
+                "expires": self.__get(family_id, slot, "expires"),
+                "flag": self.__get(family_id, slot, "flag")}
+
+    def get_valid(self, key):
+        self.__expire_due_keys()
+        family_id, slot, state = self.__state(key)
+        if state == self.VALID:
+            return self.__values.get((family_id, slot))
+        return None
+
+    def get_deleted(self, key):
+        self.__expire_due_keys()
+        family_id, slot, state = self.__state(key)
+        if state in [self.DELETED, self.EXPIRED]:
+            return self.__values.get((family_id, slot))
+        return None
+
+    def get_random_valid_key(self):
+        try:
+            return random.choice(self.valid_key_set())
+        except IndexError:
+            return None
+
+    def get_random_deleted_key(self):
+        try:
+            return random.choice(self.deleted_key_set())
+        except IndexError:
+            return None
+
+    def get_flag(self, key):
+        self.__expire_due_keys()
+        family_id, slot, state = self.__state(key)
+        if state == self.VALID:
+            return self.__get(family_id, slot, "flag")
+        return None
+
+    def valid_key_set(self):
+        return self.__key_set(self.VALID)
+
+    def deleted_key_set(self):
+        return self.__key_set(self.DELETED, self.EXPIRED)
+
+    def expired_key_set(self):
+        return self.__key_set(self.EXPIRED)
+
+    def merge(self, partition):
+        """
+        merges a partition with self
+
+        arguments:
+            partition -- type CompactPartition
+        """
+        for family_id, slot in list(partition.__iter_slots([self.VALID])):
+            key = partition.__key(family_id, slot)
+            dst_family_id, dst_slot = self.__locate(key, create=True)
+            self.__set_state(dst_family_id, dst_slot, self.VALID)
+            exp = partition.__get(family_id, slot, "expires")
+            self.__put(dst_family_id, dst_slot, expires=exp,
+                       flag=partition.__get(family_id, slot, "flag"),
+                       cas=partition.__get(family_id, slot, "cas"),
+                       timestamp=partition.__get(family_id, slot,
+                                                 "timestamp"))
+            if exp != 0:
+                heapq.heappush(self.__exp_heap,
+                               (exp, dst_family_id, dst_slot))
+            if self.store_values:
+                self.__values[(dst_family_id, dst_slot)] = \
+                    partition.__values.get((family_id, slot))
+
+    def has_valid_keys(self):
+        return self.__num_valid > 0
+
+    def has_deleted_keys(self):
+        return self.__num_deleted > 0
+
+    def expired(self, key):
+        family_id, slot, state = self.__state(key)
+        if state == self.ABSENT:
+            raise Exception("Key: %s is not a valid key" % key)
+        self.__expire_due_keys()
+        return self.__get(family_id, slot, "state") == self.EXPIRED
+
+    def __len__(self):
+        self.__expire_due_keys()
+        return self.__num_valid
+
+    def __eq__(self, other):
+        if isinstance(other, CompactPartition):
+            return self.part_id == other.part_id
+        return False
+
+    def __hash__(self):
+        return self.part_id.__hash__()
@@ -11,6 +11,8 @@ import os
 import com.couchbase.client.core.deps.io.netty.handler.ssl.util.InsecureTrustManagerFactory \
     as InsecureTrustManagerFactory
 import time
+from collections import OrderedDict
+from threading import Condition
 
 from _threading import Lock
 
@@ -62,6 +64,56 @@ from constants.sdk_constants.java_client import SDKConstants
 from global_vars import logger
 from sdk_utils.java_sdk import SDKOptions
 from sdk_exceptions import SDKException
+from table_view import TableView
+
+
+class _BucketClientShard(object):
+    """
+    Clients of a single bucket. Each bucket is its own shard with an
+    independent condition variable, so acquire / release on one bucket
+    never contends with the other buckets in the pool
+    """
+    def __init__(self, servers, username, password, compression_settings):
+        self.cond = Condition(Lock())
+        # Client creation params, used to re-create evicted clients
+        self.servers = servers
+        self.username = username
+        self.password = password
+        self.compression_settings = compression_settings
+        # id(client) -> client. OrderedDict gives O(1) pop of any client
+        self.idle_clients = OrderedDict()
+        self.busy_clients = dict()
+        # col_name -> {"client": SDKClient, "counter": int}
+        self.col_clients = dict()
+        # col_name -> id(client) last used for that collection
+        self.affinity = dict()
+        # id(client) -> last health check timestamp
+        self.last_health_check = dict()
+        # Clients being created by create_clients()
+        self.creating = 0
+
+        # Counters
+        self.acquired = 0
+        self.affinity_hits = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.evictions = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def all_clients(self):
+        return list(self.idle_clients.values()) \
+            + list(self.busy_clients.values())
+
+    def is_empty(self):
+        """
+        :return: True if the shard has no clients left, including the
+                 ones being prepared for a collection
+        """
+        return not self.idle_clients and not self.busy_clients \
+            and self.creating == 0 \
+            and all(entry["client"] is not None
+                    for entry in self.col_clients.values())
 
 
 class SDKClientPool(object):
@@ -69,9 +121,17 @@ class SDKClientPool(object):
     Client pool manager for list of SDKClients per bucket which can be
     reused / shared across multiple tasks
     """
-    def __init__(self):
+    def __init__(self, health_check_interval=60):
+        """
+        :param health_check_interval: Min. time (in seconds) between two
+                                      diagnostics based health checks of
+                                      the same idle client. None to disable
+        """
         self.log = logger.get("infra")
         self.clients = dict()
+        self.health_check_interval = health_check_interval
+        # Guards only the bucket_name -> shard mapping
+        self.__shard_lock = Lock()
 
     def shutdown(self):
         """
@@ -79,11 +139,18 @@ class SDKClientPool(object):
         :return None:
         """
         self.log.debug("Closing clients from SDKClientPool")
-        for bucket_name, bucket_dict in self.clients.items():
-            for client in bucket_dict["idle_clients"] \
-                          + bucket_dict["busy_clients"]:
-                client.close()
-        self.clients = dict()
+        self.print_stats()
+        with self.__shard_lock:
+            shards = self.clients
+            self.clients = dict()
+        for bucket_name, shard in shards.items():
+            with shard.cond:
+                for client in shard.all_clients():
+                    client.close()
+                shard.idle_clients.clear()
+                shard.busy_clients.clear()
+                shard.col_clients.clear()
+                shard.cond.notify_all()
 
     def create_clients(self, bucket, servers,
                        req_clients=1,
@@ -103,20 +170,77 @@ class SDKClientPool(object):
         :param compression_settings: Same as expected by SDKClient class
         :return:
         """
-        if bucket.name not in self.clients:
-            self.clients[bucket.name] = dict()
-            self.clients[bucket.name]["lock"] = Lock()
-            self.clients[bucket.name]["idle_clients"] = list()
-            self.clients[bucket.name]["busy_clients"] = list()
-
-        for _ in range(req_clients):
-            self.clients[bucket.name]["idle_clients"].append(SDKClient(
-                servers, bucket,
-                username=username, password=password,
-                compression_settings=compression_settings))
+        with self.__shard_lock:
+            if bucket.name not in self.clients:
+                self.clients[bucket.name] = _BucketClientShard(
+                    servers, username, password, compression_settings)
+            shard = self.clients[bucket.name]
+            with shard.cond:
+                shard.creating += req_clients
+
+        # Connections are created outside the shard lock
+        new_clients = list()
+        try:
+            for _ in range(req_clients):
+                new_clients.append(SDKClient(
+                    servers, bucket, username=username, password=password,
+                    compression_settings=compression_settings))
+        finally:
+            with shard.cond:
+                shard.creating -= req_clients
+                for client in new_clients:
+                    shard.idle_clients[id(client)] = client
+                shard.cond.notify_all()
+
+    def __is_client_healthy(self, client):
+        """
+        Checks the SDK diagnostics report of the given client.
+        :return bool: False if any KV endpoint is not in CONNECTED state
+        """
+        try:
+            endpoints = client.cluster.diagnostics().endpoints()
+            for endpoint in endpoints.get(ServiceType.KV) or []:
+                if str(endpoint.state()) != "CONNECTED":
+                    self.log.warning("Unhealthy SDK endpoint %s: %s"
+                                     % (endpoint.remote(), endpoint.state()))
+                    return False
+        except Exception as e:
+            self.log.warning("Diagnostics failed for SDK client: %s" % e)
+            return False
+        return True
+
+    def __health_check_idle_client(self, shard, client):
+        """
+        Health check for the given idle client (owned by the caller, not
+        present in the shard) if the health_check_interval has elapsed.
+        Unhealthy client will be closed and replaced with a new one.
+        :return client: Healthy SDKClient object
+        """
+        if self.health_check_interval is None:
+            return client
+        now = time.time()
+        last_check = shard.last_health_check.get(id(client), 0)
+        if now - last_check < self.health_check_interval:
+            return client
+        shard.last_health_check.pop(id(client), None)
+        if not self.__is_client_healthy(client):
+            self.log.warning("Evicting unhealthy SDK client for bucket %s"
+                             % client.bucket.name)
+            try:
+                client.close()
+            except Exception as e:
+                self.log.warning("Failed to close evicted client: %s" % e)
+            client = SDKClient(shard.servers, client.bucket,
+                               username=shard.username,
+                               password=shard.password,
+                               compression_settings=shard.compression_settings)
+            shard.evictions += 1
+        shard.last_health_check[id(client)] = time.time()
+        return client
 
     def get_client_for_bucket(self, bucket, scope=CbServer.default_scope,
-                              collection=CbServer.default_collection):
+                              collection=CbServer.default_collection,
+                              timeout=None):
         """
         API to get a client which can be used for SDK operations further
         by a callee.
@@ -125,27 +249,111 @@ class SDKClientPool(object):
         :param bucket: Bucket object for which the client has to selected
         :param scope: Scope name to select for client operation
         :param collection: Collection name to select for client operation
-        :return client: Instance of SDKClient object
+        :param timeout: Max time (in seconds) to wait for a free client.
+                        None - Wait until a client gets released
+        :return client: Instance of SDKClient object.
+                        None in case of timeout
         """
         client = None
         col_name = scope + collection
-        if bucket.name not in self.clients:
+        shard = self.clients.get(bucket.name)
+        if shard is None:
             return client
-        while client is None:
-            self.clients[bucket.name]["lock"].acquire()
-            if col_name in self.clients[bucket.name]:
-                # Increment tasks' reference counter using this client object
-                client = self.clients[bucket.name][col_name]["client"]
-                self.clients[bucket.name][col_name]["counter"] += 1
-            elif self.clients[bucket.name]["idle_clients"]:
-                client = self.clients[bucket.name]["idle_clients"].pop()
+        start_time = time.time()
+        waited = False
+        reserved = False
+        with shard.cond:
+            while True:
+                if col_name in shard.col_clients:
+                    col_entry = shard.col_clients[col_name]
+                    if col_entry["client"] is not None:
+                        # Increment tasks' reference counter using this
+                        # client object
+                        col_entry["counter"] += 1
+                        client = col_entry["client"]
+                        break
+                    # Else, client for this collection is being prepared
+                elif shard.idle_clients:
+                    client_id = shard.affinity.get(col_name)
+                    if client_id in shard.idle_clients:
+                        shard.affinity_hits += 1
+                        client = shard.idle_clients.pop(client_id)
+                    else:
+                        client = shard.idle_clients.popitem(last=False)[1]
+                    # Reserve the collection slot before releasing the lock
+                    # for the health check, so parallel callers of the same
+                    # collection wait for this client
+                    shard.col_clients[col_name] = {"client": None,
+                                                   "counter": 1}
+                    reserved = True
+                    break
+                if shard.is_empty():
+                    # All clients got evicted without a replacement
+                    raise Exception("No SDK clients left in the pool for "
+                                    "bucket %s" % bucket.name)
+                remaining = None
+                if timeout is not None:
+                    remaining = timeout - (time.time() - start_time)
+                    if remaining <= 0:
+                        shard.timeouts += 1
+                        self.log.warning(
+                            "Timeout waiting for SDK client for %s:%s"
+                            % (bucket.name, col_name))
+                        return None
+                waited = True
+                shard.cond.wait(remaining)
+
+            wait_time = time.time() - start_time
+            shard.acquired += 1
+            if waited:
+                shard.waits += 1
+                shard.total_wait_time += wait_time
+                shard.max_wait_time = max(shard.max_wait_time, wait_time)
+            if not reserved:
+                # Shared client for an already active collection
+                return client
+
+        # Health check / reconnect happens outside the shard lock
+        try:
+            client = self.__health_check_idle_client(shard, client)
+            if client.scope_name != scope \
+                    or client.collection_name != collection:
                 client.select_collection(scope, collection)
-                self.clients[bucket.name]["busy_clients"].append(client)
-                # Create scope/collection reference using the client object
-                self.clients[bucket.name][col_name] = dict()
-                self.clients[bucket.name][col_name]["client"] = client
-                self.clients[bucket.name][col_name]["counter"] = 1
-            self.clients[bucket.name]["lock"].release()
+        except Exception:
+            # Client may be closed / half-recreated by the health check,
+            # so drop it from the pool instead of handing it out again
+            self.log.warning("Dropping SDK client for bucket %s from pool"
+                             % bucket.name)
+            try:
+                client.close()
+            except Exception as e:
+                self.log.warning("Failed to close dropped client: %s" % e)
+            replacement = None
+            try:
+                replacement = SDKClient(
+                    shard.servers, bucket, username=shard.username,
+                    password=shard.password,
+                    compression_settings=shard.compression_settings)
+            except Exception as e:
+                self.log.error("Failed to replace dropped SDK client for "
+                               "bucket %s: %s" % (bucket.name, e))
+            with shard.cond:
+                shard.col_clients.pop(col_name)
+                shard.last_health_check.pop(id(client), None)
+                for aff_col, client_id in shard.affinity.items():
+                    if client_id == id(client):
+                        shard.affinity.pop(aff_col)
+                shard.evictions += 1
+                if replacement is not None:
+                    shard.idle_clients[id(replacement)] = replacement
+                # Waiters re-check the shard, and fail if it is now empty
+                shard.cond.notify_all()
+            raise
+        with shard.cond:
+            shard.busy_clients[id(client)] = client
+            shard.col_clients[col_name]["client"] = client
+            shard.affinity[col_name] = id(client)
+            shard.cond.notify_all()
         return client
 
     def release_client(self, client):
@@ -154,18 +362,58 @@ class SDKClientPool(object):
         :param client: Instance of SDKClient object
         :return None:
         """
-        bucket = client.bucket
-        if bucket.name not in self.clients:
+        shard = self.clients.get(client.bucket.name)
+        if shard is None:
             return
         col_name = client.scope_name + client.collection_name
-        self.clients[bucket.name]["lock"].acquire()
-        if self.clients[bucket.name][col_name]["counter"] == 1:
-            self.clients[bucket.name].pop(col_name)
-            self.clients[bucket.name]["busy_clients"].remove(client)
-            self.clients[bucket.name]["idle_clients"].append(client)
-        else:
-            self.clients[bucket.name][col_name]["counter"] -= 1
-        self.clients[bucket.name]["lock"].release()
+        with shard.cond:
+            if shard.col_clients[col_name]["counter"] == 1:
+                shard.col_clients.pop(col_name)
+                shard.busy_clients.pop(id(client), None)
+                shard.idle_clients[id(client)] = client
+                shard.cond.notify_all()
+            else:
+                shard.col_clients[col_name]["counter"] -= 1
+
+    def get_stats(self):
+        """
+        :return dict: Per bucket client counters and utilisation
+        """
+        stats = dict()
+        for bucket_name, shard in self.clients.items():
+            with shard.cond:
+                total = len(shard.idle_clients) + len(shard.busy_clients)
+                stats[bucket_name] = {
+                    "total_clients": total,
+                    "busy_clients": len(shard.busy_clients),
+                    "utilisation": (float(len(shard.busy_clients)) / total
+                                    if total else 0.0),
+                    "acquired": shard.acquired,
+                    "affinity_hits": shard.affinity_hits,
+                    "waits": shard.waits,
+                    "timeouts": shard.timeouts,
+                    "evictions": shard.evictions,
+                    "avg_wait_time": (shard.total_wait_time / shard.waits
+                                      if shard.waits else 0.0),
+                    "max_wait_time": shard.max_wait_time}
+        return stats
+
+    def print_stats(self):
+        stats = self.get_stats()
+        if not stats:
+            return
+        table = TableView(self.log.info)
+        table.set_headers(["Bucket", "Clients", "Busy", "Acquired",
+                           "Affinity hits", "Waits", "Avg wait", "Max wait",
+                           "Timeouts", "Evictions"])
+        for bucket_name, b_stat in stats.items():
+            table.add_row([bucket_name, b_stat["total_clients"],
+                           b_stat["busy_clients"], b_stat["acquired"],
+                           b_stat["affinity_hits"], b_stat["waits"],
+                           "%.3fs" % b_stat["avg_wait_time"],
+                           "%.3fs" % b_stat["max_wait_time"],
+                           b_stat["timeouts"], b_stat["evictions"]])
+        table.display("SDKClientPool stats")
 
 
 class SDKClient(object):
@@ -372,12 +620,21 @@ class SDKClient(object):
             pass
 
     @staticmethod
-    def __translate_upsert_multi_results(data):
-        success = dict()
+    def __translate_upsert_multi_results(data, lean=False):
+        """
+        :param data: Result of bulk insert/upsert/replace from DocOps
+        :param lean: If True, success is returned as the count of
+                     successful keys instead of per key dicts
+        :return: (success, fail)
+        """
+        success = 0 if lean else dict()
         fail = dict()
         if data is None:
             return success, fail
         for result in data:
+            if lean and result['status']:
+                success += 1
+                continue
             key = result['id']
             json_object = result["document"]
             if result['status']:
@@ -395,12 +652,15 @@ class SDKClient(object):
         return success, fail
 
     @staticmethod
-    def __translate_delete_multi_results(data):
-        success = dict()
+    def __translate_delete_multi_results(data, lean=False):
+        success = 0 if lean else dict()
         fail = dict()
         if data is None:
             return success, fail
         for result in data:
+            if lean and result['status']:
+                success += 1
+                continue
             key = result['id']
             if result['status']:
                 success[key] = dict()
@@ -416,12 +676,15 @@ class SDKClient(object):
         return success, fail
 
     @staticmethod
-    def __translate_get_multi_results(data):
-        success = dict()
+    def __translate_get_multi_results(data, lean=False):
+        success = 0 if lean else dict()
         fail = dict()
         if data is None:
             return success, fail
         for result in data:
+            if lean and result['status']:
+                success += 1
+                continue
             key = result['id']
             if result['status']:
                 success[key] = dict()
@@ -1048,7 +1311,8 @@ class SDKClient(object):
     # Bulk CRUD APIs
     def delete_multi(self, keys, persist_to=0, replicate_to=0,
                      timeout=5, time_unit=SDKConstants.TimeUnit.SECONDS,
-                     durability="", sdk_retry_strategy=None):
+                     durability="", sdk_retry_strategy=None,
+                     lean=False):
         options = SDKOptions.get_remove_options(
             persist_to=persist_to, replicate_to=replicate_to,
             timeout=timeout, time_unit=time_unit,
@@ -1056,11 +1320,11 @@ class SDKClient(object):
             sdk_retry_strategy=sdk_retry_strategy)
         result = SDKClient.doc_op.bulkDelete(
             self.collection, keys, options)
-        return self.__translate_delete_multi_results(result)
+        return self.__translate_delete_multi_results(result, lean)
 
     def touch_multi(self, keys, exp=0,
                     timeout=5, time_unit=SDKConstants.TimeUnit.SECONDS,
-                    sdk_retry_strategy=None):
+                    sdk_retry_strategy=None, lean=False):
         touch_options = SDKOptions.get_touch_options(
             timeout, time_unit, sdk_retry_strategy=sdk_retry_strategy)
         exp_duration = \
@@ -1068,12 +1332,13 @@ class SDKClient(object):
         result = SDKClient.doc_op.bulkTouch(
             self.collection, keys, exp,
             touch_options, exp_duration)
-        return self.__translate_delete_multi_results(result)
+        return self.__translate_delete_multi_results(result, lean)
 
     def set_multi(self, items, exp=0, exp_unit=SDKConstants.TimeUnit.SECONDS,
                   persist_to=0, replicate_to=0,
                   timeout=5, time_unit=SDKConstants.TimeUnit.SECONDS,
-                  doc_type="json", durability="", sdk_retry_strategy=None):
+                  doc_type="json", durability="", sdk_retry_strategy=None,
+                  lean=False):
         options = SDKOptions.get_insert_options(
             exp=exp, exp_unit=exp_unit,
             persist_to=persist_to, replicate_to=replicate_to,
@@ -1086,14 +1351,15 @@ class SDKClient(object):
             options = options.transcoder(RawStringTranscoder.INSTANCE)
         result = SDKClient.doc_op.bulkInsert(
             self.collection, items, options)
-        return self.__translate_upsert_multi_results(result)
+        return self.__translate_upsert_multi_results(result, lean)
 
     def upsert_multi(self, docs,
                      exp=0, exp_unit=SDKConstants.TimeUnit.SECONDS,
                      persist_to=0, replicate_to=0,
                      timeout=5, time_unit=SDKConstants.TimeUnit.SECONDS,
                      doc_type="json", durability="",
-                     preserve_expiry=None, sdk_retry_strategy=None):
+                     preserve_expiry=None, sdk_retry_strategy=None,
+                     lean=False):
         options = SDKOptions.get_upsert_options(
             exp=exp, exp_unit=exp_unit,
             persist_to=persist_to, replicate_to=replicate_to,
@@ -1107,14 +1373,15 @@ class SDKClient(object):
             options = options.transcoder(RawStringTranscoder.INSTANCE)
         result = SDKClient.doc_op.bulkUpsert(
             self.collection, docs, options)
-        return self.__translate_upsert_multi_results(result)
+        return self.__translate_upsert_multi_results(result, lean)
 
     def replace_multi(self, docs,
                       exp=0, exp_unit=SDKConstants.TimeUnit.SECONDS,
                       persist_to=0, replicate_to=0,
                       timeout=5, time_unit=SDKConstants.TimeUnit.SECONDS,
                       doc_type="json", durability="",
-                      preserve_expiry=None, sdk_retry_strategy=None):
+                      preserve_expiry=None, sdk_retry_strategy=None,
+                      lean=False):
         options = SDKOptions.get_replace_options(
             exp=exp, exp_unit=exp_unit,
             persist_to=persist_to, replicate_to=replicate_to,
@@ -1128,16 +1395,16 @@ class SDKClient(object):
             options = options.transcoder(RawStringTranscoder.INSTANCE)
         result = SDKClient.doc_op.bulkReplace(
             self.collection, docs, options)
-        return self.__translate_upsert_multi_results(result)
+        return self.__translate_upsert_multi_results(result, lean)
 
     def get_multi(self, keys,
                   timeout=5, time_unit=SDKConstants.TimeUnit.SECONDS,
-                  sdk_retry_strategy=None):
+                  sdk_retry_strategy=None, lean=False):
         read_options = SDKOptions.get_read_options(
             timeout, time_unit,
             sdk_retry_strategy=sdk_retry_strategy)
         result = SDKClient.doc_op.bulkGet(self.collection, keys, read_options)
-        return self.__translate_get_multi_results(result)
+        return self.__translate_get_multi_results(result, lean)
 
     # Bulk CRUDs for sub-doc APIs
     def sub_doc_insert_multi(self, keys,
@@ -1,4 +1,4 @@
-import xml.dom.minidom
+from xml.sax.saxutils import escape
 
 # a junit compatible xml example
 #<?xml version="1.0" encoding="UTF-8"?>
@@ -43,6 +43,8 @@ class XUnitTestResult(object):
 
     def __init__(self):
         self.suites = []
+        # suite name -> XUnitTestSuite, for the lookups from add_test
+        self.__suite_index = {}
 
     def add_test(self, name, time=0, errorType=None, errorMessage=None, status='pass', params=''):
         #Get the classname
@@ -51,44 +53,13 @@ class XUnitTestResult(object):
         if "," in name:
             class_name = name
 
-        matched = False
-        for suite in self.suites:
-            if suite.name == class_name:
-                suite.add_test(name, time, errorType, errorMessage, status, params=params)
-                matched = True
-                break
-        if not matched:
+        suite = self.__suite_index.get(class_name)
+        if suite is None:
             suite = XUnitTestSuite()
             suite.name = class_name
-            suite.add_test(name, time, errorType, errorMessage, status, params=params)
             self.suites.append(suite)
-
-    def to_xml(self, suite):
-        doc = xml.dom.minidom.Document()
-        testsuite = doc.createElement('testsuite')
-        #<testsuite name="nosetests" tests="1" errors="1" failures="0" skip="0">
-        testsuite.setAttribute('name', suite.name)
-        testsuite.setAttribute('errors', str(suite.errors))
-        testsuite.setAttribute('failures', str(suite.failures))
-        testsuite.setAttribute('errors', str(suite.errors))
-        testsuite.setAttribute('tests', str(len(suite.tests)))
-        testsuite.setAttribute('time', str(suite.time))
-        testsuite.setAttribute('skip', str(suite.skips))
-        for testobject in suite.tests:
-            testcase = doc.createElement('testcase')
-            full_name = testobject.name+testobject.params
-            testcase.setAttribute('name', full_name)
-            testcase.setAttribute('time', str(testobject.time))
-            if testobject.error:
-                error = doc.createElement('error')
-                error.setAttribute('type', testobject.error.type)
-                if testobject.error.message:
-                    message = doc.createTextNode(testobject.error.message)
-                    error.appendChild(message)
-                testcase.appendChild(error)
-            testsuite.appendChild(testcase)
-        doc.appendChild(testsuite)
-        return doc.toprettyxml()
+            self.__suite_index[class_name] = suite
+        suite.add_test(name, time, errorType, errorMessage, status, params=params)
 
     def write(self, prefix, params=''):
         for suite in self.suites:
@@ -98,8 +69,10 @@ class XUnitTestResult(object):
                 name = name[:name.find(",")]
 
             report_xml_file = open("{0}-{1}.xml".format(prefix, name), 'w')
-            report_xml_file.write(self.to_xml(suite))
-            report_xml_file.close()
+            try:
+                suite.write_xml(report_xml_file)
+            finally:
+                report_xml_file.close()
 
     def print_summary(self):
         for suite in self.suites:
@@ -149,6 +122,33 @@ class XUnitTestSuite(object):
             self.skips += 1
         self.time += time
 
-
     # generate the junit xml representation from the XUnitTestSuite object
     # todo : create an element for errorMessage and append it to to error node
+    def write_xml(self, fp):
+        """
+        Writes the junit xml of the suite to the file object, test by test
+        """
+        fp.write('<?xml version="1.0" ?>\n')
+        fp.write('<testsuite name=%s errors="%s" failures="%s" tests="%s" '
+                 'time="%s" skip="%s">\n'
+                 % (_quote_attr(self.name), self.errors, self.failures,
+                    len(self.tests), self.time, self.skips))
+        for test in self.tests:
+            fp.write('\t<testcase name=%s time="%s"'
+                     % (_quote_attr(test.name + test.params), test.time))
+            if not test.error:
+                fp.write('/>\n')
+                continue
+            fp.write('>\n\t\t<error type=%s'
+                     % _quote_attr(test.error.type or ''))
+            if test.error.message:
+                fp.write('>%s</error>\n' % escape(test.error.message))
+            else:
+                fp.write('/>\n')
+            fp.write('\t</testcase>\n')
+        fp.write('</testsuite>\n')
+
+
+def _quote_attr(value):
+    return '"%s"' % escape(value, {'"': "&quot;", "\n": "&#10;",
+                                   "\r": "&#13;", "\t": "&#9;"})
@@ -29,8 +29,8 @@ from membase.api.rest_client import RestConnection
 from com.jcraft.jsch import JSchException, JSchAuthCancelException, \
     JSchPartialAuthException, SftpException
 
-from com.jcraft.jsch import JSch
 from org.python.core.util import FileUtil
+from remote.ssh_session_pool import SSHSessionPool
 
 
 class COMMAND:
@@ -129,12 +129,7 @@ class RemoteMachineHelper(object):
 
 
 class RemoteMachineShellConnection:
-    connections = 0
-    disconnections = 0
-
     def __init__(self, serverInfo):
-        RemoteMachineShellConnection.connections += 1
-        self.jsch = None
         self.session = None
         self.input = TestInput.TestInputParser.get_test_input(sys.argv)
         self.log = logger.get("infra")
@@ -172,8 +167,14 @@ class RemoteMachineShellConnection:
 
         self.info = serverInfo.remote_info
         self.connect()
+        if not self.info and self.session is not None:
+            # Reuse the info extracted by other shells of the same host
+            self.info = self.session.remote_info
         if not self.info:
             self.info = self.extract_remote_info()
+            if self.session is not None:
+                self.session.remote_info = self.info
+        if not serverInfo.remote_info:
             serverInfo.remote_info = self.info
             serverInfo.use_sudo = self.use_sudo
         if self.info.type.lower() == Windows.NAME:
@@ -187,22 +188,21 @@ class RemoteMachineShellConnection:
         if not self.remote:
             return
 
-        self.log.debug("Connecting to {0} with username: {1}, password: {2}"
-                       .format(self.ip, self.username, self.password))
-        self.jsch = JSch()
-        self.session = self.jsch.getSession(self.username, self.ip, 22)
-        self.session.setPassword(self.password)
-        self.session.setConfig("StrictHostKeyChecking", "no")
-        self.session.connect()
+        # Shared ssh session from the process wide pool
+        if self.session is not None:
+            SSHSessionPool.release(self.session)
+            self.session = None
+        self.session = SSHSessionPool.acquire(self.ip, self.username,
+                                              self.password)
 
     def disconnect(self):
         # For cluster_run case
-        if not self.remote:
+        if not self.remote or self.session is None:
             return
 
-        self.log.debug("Disconnecting ssh_client for {0}".format(self.ip))
-        self.session.disconnect()
-        RemoteMachineShellConnection.disconnections += 1
+        self.log.debug("Releasing ssh session for {0}".format(self.ip))
+        SSHSessionPool.release(self.session)
+        self.session = None
 
     """
         In case of non root user, we need to switch to root to
@@ -0,0 +1,268 @@
+"""
+Process wide pool of authenticated JSch sessions, keyed by (host, user).
+
+RemoteMachineShellConnection objects for the same host share one ssh
+session and open their exec / sftp channels over it, instead of doing
+the ssh handshake + authentication for every shell object.
+"""
+
+import time
+from threading import Condition, Lock
+
+from com.jcraft.jsch import JSch, JSchException
+
+from global_vars import logger
+
+
+class PooledChannel(object):
+    """
+    Wrapper over a JSch channel which accounts for the channel slot of
+    the session while the channel is connected.
+    All other calls are delegated to the actual channel.
+    """
+    def __init__(self, pooled_session, channel, dedicated_session=None):
+        """
+        :param dedicated_session: JSch session opened only for this
+                                  channel, closed along with the channel
+        """
+        self._pooled_session = pooled_session
+        self._channel = channel
+        self._dedicated_session = dedicated_session
+        self._slot_held = False
+
+    def connect(self, *args):
+        self._pooled_session.reserve_channel_slot(self)
+        self._slot_held = True
+        try:
+            self._channel.connect(*args)
+        except Exception:
+            self.disconnect()
+            raise
+
+    def disconnect(self):
+        self._channel.disconnect()
+        if self._dedicated_session is not None:
+            self._dedicated_session.disconnect()
+            self._dedicated_session = None
+            self._pooled_session.pool.increment_stat("sessions_closed")
+        if self._slot_held:
+            self._slot_held = False
+            self._pooled_session.release_channel_slot(self)
+
+    def is_open(self):
+        return self._slot_held and not self._channel.isClosed()
+
+    def __getattr__(self, name):
+        return getattr(self._channel, name)
+
+
+class PooledSession(object):
+    """
+    Shared ssh session for a (host, user) pair.
+    Re-connects transparently if the underlying session goes down and
+    caps the number of concurrently connected channels.
+    """
+    def __init__(self, pool, host, username, password, max_channels):
+        self.log = logger.get("infra")
+        self.pool = pool
+        self.host = host
+        self.username = username
+        self.password = password
+        self.max_channels = max_channels
+        self.cond = Condition(Lock())
+        self.session = None
+        self.open_channels = set()
+        self.ref_count = 0
+        self.last_used = time.time()
+        # Cached RemoteMachineInfo for the host
+        self.remote_info = None
+
+    def __new_session(self):
+        self.log.debug("Connecting to {0} with username: {1}"
+                       .format(self.host, self.username))
+        session = JSch().getSession(self.username, self.host, 22)
+        session.setPassword(self.password)
+        session.setConfig("StrictHostKeyChecking", "no")
+        session.setServerAliveInterval(SSHSessionPool.keep_alive_interval)
+        session.connect()
+        self.pool.increment_stat("sessions_opened")
+        return session
+
+    def connect(self):
+        self.session = self.__new_session()
+
+    def disconnect(self):
+        with self.cond:
+            if self.session is not None:
+                self.session.disconnect()
+                self.session = None
+                self.pool.increment_stat("sessions_closed")
+            self.open_channels.clear()
+            self.cond.notify_all()
+
+    def is_connected(self):
+        return self.session is not None and self.session.isConnected()
+
+    def __ensure_connected(self):
+        with self.cond:
+            if not self.is_connected():
+                if self.session is not None:
+                    self.log.warning("SSH session to %s is down. Reconnecting"
+                                     % self.host)
+                    self.session.disconnect()
+                    self.pool.increment_stat("reconnects")
+                self.open_channels.clear()
+                self.connect()
+
+    def openChannel(self, channel_type):
+        self.last_used = time.time()
+        self.__ensure_connected()
+        session = self.session
+        try:
+            channel = session.openChannel(channel_type)
+        except JSchException as e:
+            # Other threads may have channels open over the shared
+            # session, so it is replaced only if it is actually down
+            self.__ensure_connected()
+            with self.cond:
+                replaced = self.session is not session
+                session = self.session
+            dedicated_session = None
+            if replaced:
+                self.log.warning("openChannel failed on %s: %s. Retrying "
+                                 "with the new session" % (self.host, e))
+            else:
+                # Session is alive (ex: remote MaxSessions reached), so
+                # only this caller moves to a session of its own
+                self.log.warning("openChannel failed on %s: %s. Retrying "
+                                 "with a dedicated session" % (self.host, e))
+                dedicated_session = self.__new_session()
+                session = dedicated_session
+            try:
+                channel = session.openChannel(channel_type)
+            except JSchException:
+                if dedicated_session is not None:
+                    dedicated_session.disconnect()
+                    self.pool.increment_stat("sessions_closed")
+                raise
+            self.pool.increment_stat("channels_opened")
+            return PooledChannel(self, channel, dedicated_session)
+        self.pool.increment_stat("channels_opened")
+        return PooledChannel(self, channel)
+
+    def reserve_channel_slot(self, channel):
+        """
+        Blocks until the session has less than max_channels open channels.
+        Channels closed by the remote end (like completed exec commands)
+        free up their slot even if the caller never disconnected them
+        """
+        with self.cond:
+            while True:
+                self.open_channels = set(
+                    [c for c in self.open_channels if c.is_open()])
+                if len(self.open_channels) < self.max_channels:
+                    break
+                self.cond.wait(1)
+            self.open_channels.add(channel)
+
+    def release_channel_slot(self, channel):
+        with self.cond:
+            self.open_channels.discard(channel)
+            self.cond.notify()
+
+    # Delegate rest of the JSch session APIs
+    def __getattr__(self, name):
+        self.__ensure_connected()
+        return getattr(self.session, name)
+
+
+class SSHSessionPool(object):
+    """
+    Process wide ssh session pool. Sessions stay open after the last
+    shell using it disconnects, and get closed once idle for
+    idle_timeout seconds or on close_all()
+    """
+    max_channels_per_host = 8
+    idle_timeout = 300
+    keep_alive_interval = 30000  # millis
+
+    __lock = Lock()
+    __sessions = dict()
+    __stats = dict()
+
+    @classmethod
+    def reset_stats(cls):
+        with cls.__lock:
+            cls.__stats = {"sessions_opened": 0, "sessions_reused": 0,
+                           "sessions_closed": 0, "reconnects": 0,
+                           "channels_opened": 0,
+                           "shells_acquired": 0, "shells_released": 0}
+
+    @classmethod
+    def increment_stat(cls, stat_name, value=1):
+        with cls.__lock:
+            cls.__stats[stat_name] = cls.__stats.get(stat_name, 0) + value
+
+    @classmethod
+    def get_stats(cls):
+        with cls.__lock:
+            stats = dict(cls.__stats)
+            stats["open_sessions"] = len(
+                [s for s in cls.__sessions.values() if s.is_connected()])
+        return stats
+
+    @classmethod
+    def acquire(cls, host, username, password):
+        """
+        :return: PooledSession for the (host, username) pair
+        """
+        cls.close_idle_sessions()
+        with cls.__lock:
+            key = (host, username)
+            pooled_session = cls.__sessions.get(key)
+            if pooled_session is None \
+                    or pooled_session.password != password:
+                pooled_session = PooledSession(cls, host, username, password,
+                                               cls.max_channels_per_host)
+                cls.__sessions[key] = pooled_session
+            pooled_session.last_used = time.time()
+        with pooled_session.cond:
+            if pooled_session.is_connected():
+                cls.increment_stat("sessions_reused")
+            else:
+                pooled_session.connect()
+        with cls.__lock:
+            pooled_session.ref_count += 1
+        cls.increment_stat("shells_acquired")
+        return pooled_session
+
+    @classmethod
+    def release(cls, pooled_session):
+        with cls.__lock:
+            pooled_session.ref_count -= 1
+            pooled_session.last_used = time.time()
+        cls.increment_stat("shells_released")
+
+    @classmethod
+    def close_idle_sessions(cls):
+        now = time.time()
+        with cls.__lock:
+            idle_sessions = [
+                (key, session) for key, session in cls.__sessions.items()
+                if session.ref_count <= 0
+                and now - session.last_used > cls.idle_timeout]
+            for key, _ in idle_sessions:
+                cls.__sessions.pop(key)
+        for _, session in idle_sessions:
+            session.disconnect()
+
+    @classmethod
+    def close_all(cls):
+        with cls.__lock:
+            sessions = cls.__sessions.values()
+            cls.__sessions = dict()
+        for session in sessions:
+            session.disconnect()
+
+
+SSHSessionPool.reset_stats()
@@ -5,19 +5,16 @@ Created on 15-Apr-2021
 '''
 import json
 import random
-from threading import Thread
 import threading
 import time
 
 from sdk_client3 import SDKClient
 from com.couchbase.client.java.analytics import AnalyticsOptions,\
     AnalyticsScanConsistency, AnalyticsStatus
-from com.couchbase.client.core.deps.io.netty.handler.timeout import TimeoutException
-from com.couchbase.client.core.error import RequestCanceledException,\
-    CouchbaseException, AmbiguousTimeoutException
-import traceback
 from global_vars import logger
 from Cb_constants.CBServer import CbServer
+from CbasLib.CBASOperations_Rest import CBASHelper
+from couchbase_helper.query_load_engine import QueryBackend, QueryLoadEngine
 
 queries = ['select name from {} where age between 30 and 50 limit 10;',
            'select age, count(*) from {} where marital = "M" group by age order by age limit 10;',
@@ -26,21 +23,54 @@ queries = ['select name from {} where age between 30 and 50 limit 10;',
 datasets = ['create dataset ds{} on {}.{}.{};']
 
 
+class CBASSDKQueryBackend(QueryBackend):
+    """ Runs the analytics queries over SDK using DoctorCBAS """
+    def __init__(self, doctor_cbas):
+        self.doctor_cbas = doctor_cbas
+
+    def run_query(self, query, client_context_id):
+        status, _, _, _, _ = self.doctor_cbas.execute_statement_on_cbas(
+            query, client_context_id=client_context_id)
+        if status == AnalyticsStatus.SUCCESS:
+            return self.SUCCESS
+        return self.FAILED
+
+
+class CBASRestQueryBackend(QueryBackend):
+    """
+    Runs the analytics queries using the /analytics/service REST API,
+    spreading the queries across the given cbas nodes
+    """
+    def __init__(self, cbas_nodes):
+        self.helpers = [CBASHelper(node) for node in cbas_nodes]
+
+    def run_query(self, query, client_context_id):
+        content = random.choice(self.helpers).execute_statement_on_cbas(
+            query, None, client_context_id=client_context_id)
+        if json.loads(content).get("status") == "success":
+            return self.SUCCESS
+        return self.FAILED
+
+    def classify_error(self, exception):
+        if "Request Rejected" in str(exception):
+            return self.REJECTED
+        return super(CBASRestQueryBackend, self).classify_error(exception)
+
+
 class DoctorCBAS():
 
     def __init__(self, cluster, bucket_util,
                  num_idx=10, server_port=8095,
-                 querycount=100, batch_size=50):
+                 querycount=100, batch_size=50, query_qps=None,
+                 query_via_rest=False):
         self.port = server_port
-        self.failed_count = 0
-        self.success_count = 0
-        self.rejected_count = 0
-        self.error_count = 0
-        self.cancel_count = 0
-        self.timeout_count = 0
-        self.total_query_count = 0
         self.concurrent_batch_size = batch_size
         self.total_count = querycount
+        # Target QPS for the query load. None - num_idx concurrent queries
+        self.query_qps = query_qps
+        # Run the query load using the /analytics/service REST endpoint
+        self.query_via_rest = query_via_rest
+        self.query_engine = None
         self.num_datasets = num_idx
         self.bucket_util = bucket_util
         self.cluster = cluster
@@ -71,6 +101,13 @@ class DoctorCBAS():
 
     def discharge_CBAS(self):
         self.stop_run = True
+        if self.query_engine is not None:
+            self.query_engine.stop()
+            self.query_engine.print_stats()
+            failed = self.query_engine.stats.get(QueryBackend.FAILED) \
+                + self.query_engine.stats.get(QueryBackend.ERROR)
+            if failed:
+                self.log.error("CBAS queries failed / errored: %s" % failed)
 
     def create_datasets(self):
         for index in self.datasets.values():
@@ -98,89 +135,20 @@ class DoctorCBAS():
         return status
 
     def start_query_load(self):
-        th = threading.Thread(target=self._run_concurrent_queries,
-                              kwargs=dict(num_queries=self.num_datasets))
-        th.start()
+        if self.query_via_rest:
+            backend = CBASRestQueryBackend(self.cluster.cbas_nodes)
+        else:
+            backend = CBASSDKQueryBackend(self)
+        self.query_engine = QueryLoadEngine(
+            backend, self.queries, num_workers=self.num_datasets,
+            qps=self.query_qps, name="CBAS")
+        self.query_engine.start()
 
         monitor = threading.Thread(target=self.monitor_query_status,
                                    kwargs=dict(duration=0,
                                                print_duration=60))
         monitor.start()
 
-    def _run_concurrent_queries(self, num_queries):
-        threads = []
-        self.total_query_count = 0
-        for _ in range(0, num_queries):
-            self.total_query_count += 1
-            threads.append(Thread(
-                target=self._run_query,
-                name="query_thread_{0}".format(self.total_query_count),
-                args=(random.choice(self.queries), False, 0)))
-
-        i = 0
-        for thread in threads:
-            i += 1
-            if i % self.concurrent_batch_size == 0:
-                time.sleep(5)
-            thread.start()
-
-        i = 0
-        while not self.stop_run:
-            threads = []
-            new_queries_to_run = num_queries - self.total_count
-            for i in range(0, new_queries_to_run):
-                self.total_query_count += 1
-                threads.append(Thread(
-                    target=self._run_query,
-                    name="query_thread_{0}".format(self.total_query_count),
-                    args=(random.choice(self.queries), False, 0)))
-            i = 0
-            self.total_count += new_queries_to_run
-            for thread in threads:
-                i += 1
-                thread.start()
-
-            time.sleep(2)
-        if self.failed_count + self.error_count != 0:
-            raise Exception("Queries Failed:%s , Queries Error Out:%s" %
-                            (self.failed_count, self.error_count))
-
-    def _run_query(self, query, validate_item_count=False, expected_count=0):
-        name = threading.currentThread().getName()
-        client_context_id = name
-        try:
-            status, _, _, results, _ = self.execute_statement_on_cbas(
-                query, client_context_id=client_context_id)
-            if status == AnalyticsStatus.SUCCESS:
-                if validate_item_count:
-                    if results[0]['$1'] != expected_count:
-                        self.failed_count += 1
-                        self.total_count -= 1
-                    else:
-                        self.success_count += 1
-                        self.total_count -= 1
-                else:
-                    self.success_count += 1
-                    self.total_count -= 1
-            else:
-                self.failed_count += 1
-                self.total_count -= 1
-        except Exception as e:
-            if e == AmbiguousTimeoutException:
-                self.timeout_count += 1
-                self.total_count -= 1
-            elif e == RequestCanceledException:
-                self.cancel_count += 1
-                self.total_count -= 1
-            elif e == CouchbaseException:
-                self.rejected_count += 1
-                self.total_count -= 1
-            else:
-                print(e)
-                traceback.print_exc()
-                self.error_count += 1
-                self.total_count -= 1
-
     def execute_statement_on_cbas(self, statement,
                                   client_context_id=None):
         """
@@ -225,59 +193,32 @@ class DoctorCBAS():
             options.clientContextId(client_context_id)
 
         output = {}
+        result = self.cluster_conn.analyticsQuery(statement)
+
+        output["status"] = result.metaData().status()
+        output["metrics"] = result.metaData().metrics()
+
         try:
-            result = self.cluster_conn.analyticsQuery(statement)
-
-            output["status"] = result.metaData().status()
-            output["metrics"] = result.metaData().metrics()
-
-            try:
-                output["results"] = result.rowsAsObject()
-            except:
-                output["results"] = None
-
-            if str(output['status']) == AnalyticsStatus.FATAL:
-                msg = output['errors'][0]['msg']
-                if "Job requirement" in msg and "exceeds capacity" in msg:
-                    raise Exception("Capacity cannot meet job requirement")
-            elif output['status'] == AnalyticsStatus.SUCCESS:
-                output["errors"] = None
-            else:
-                raise Exception("Analytics Service API failed")
-
-        except AmbiguousTimeoutException as e:
-            raise Exception(e)
-        except RequestCanceledException as e:
-            raise Exception(e)
-        except CouchbaseException as e:
-            raise Exception(e)
-        except Exception as e:
-            print(e)
-            traceback.print_exc()
+            output["results"] = result.rowsAsObject()
+        except:
+            output["results"] = None
+
+        if str(output['status']) == AnalyticsStatus.FATAL:
+            msg = output['errors'][0]['msg']
+            if "Job requirement" in msg and "exceeds capacity" in msg:
+                raise Exception("Capacity cannot meet job requirement")
+        elif output['status'] == AnalyticsStatus.SUCCESS:
+            output["errors"] = None
+        else:
+            raise Exception("Analytics Service API failed")
+
         return output
 
     def monitor_query_status(self, duration=0, print_duration=600):
         st_time = time.time()
-        update_time = time.time()
-        if duration == 0:
-            while True:
-                if st_time + print_duration < time.time():
-                    print("%s CBAS queries submitted, %s failed, \
-                        %s passed, %s rejected, \
-                        %s cancelled, %s timeout %s errored" % (
-                        self.total_query_count, self.failed_count,
-                        self.success_count, self.rejected_count,
-                        self.cancel_count, self.timeout_count,
-                        self.error_count))
-                    st_time = time.time()
-        else:
-            while st_time + duration > time.time():
-                if update_time + print_duration < time.time():
-                    print("%s CBAS queries submitted, %s failed, \
-                        %s passed, %s rejected, \
-                        %s cancelled, %s timeout %s errored" % (
-                        self.total_query_count, self.failed_count,
-                        self.success_count, self.rejected_count,
-                        self.cancel_count, self.timeout_count,
-                        self.error_count))
-                    update_time = time.time()
+        while not self.stop_run:
+            if duration and st_time + duration < time.time():
+                break
+            time.sleep(print_duration)
+            if self.query_engine is not None:
+                print("CBAS: %s" % self.query_engine.status_line())
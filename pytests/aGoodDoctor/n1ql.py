@@ -6,23 +6,17 @@ Created on 24-Apr-2021
 
 import json
 import random
-from threading import Thread
 import threading
 import time
 
-from common_lib import sleep
 from sdk_client3 import SDKClient
 from com.couchbase.client.java.query import QueryOptions,\
     QueryScanConsistency, QueryStatus
-from com.couchbase.client.core.deps.io.netty.handler.timeout import TimeoutException
-from com.couchbase.client.core.error import RequestCanceledException,\
-    CouchbaseException, InternalServerFailureException,\
-    AmbiguousTimeoutException
 from string import ascii_uppercase, ascii_lowercase
 from encodings.punycode import digits
 from remote.remote_util import RemoteMachineShellConnection
 from gsiLib.gsiHelper import GsiHelper
-import traceback
+from couchbase_helper.query_load_engine import QueryBackend, QueryLoadEngine
 from global_vars import logger
 
 letters = ascii_uppercase + ascii_lowercase + digits
@@ -39,21 +33,30 @@ indexes = ['create index {}{} on {}.{}.{}(age) where age between 30 and 50 WITH
            'create index {}{} on {}.{}.{}(`gender`,`attributes`.`dimensions`.`weight`, `attributes`.`dimensions`.`height`,`name`) WITH {{ "defer_build": true, "num_replica": 0 }};']
 
 
+class N1QLQueryBackend(QueryBackend):
+    """ Runs the queries over SDK using DoctorN1QL """
+    def __init__(self, doctor_n1ql):
+        self.doctor_n1ql = doctor_n1ql
+
+    def run_query(self, query, client_context_id):
+        status, _, _, _, _ = self.doctor_n1ql.execute_statement_on_n1ql(
+            query, client_context_id=client_context_id)
+        if status == QueryStatus.SUCCESS:
+            return self.SUCCESS
+        return self.FAILED
+
+
 class DoctorN1QL():
 
     def __init__(self, cluster, bucket_util, num_idx=10,
                  server_port=8095,
-                 querycount=100, batch_size=50):
+                 querycount=100, batch_size=50, query_qps=None):
         self.port = server_port
-        self.failed_count = 0
-        self.success_count = 0
-        self.rejected_count = 0
-        self.error_count = 0
-        self.cancel_count = 0
-        self.timeout_count = 0
-        self.total_query_count = 0
         self.concurrent_batch_size = batch_size
         self.total_count = querycount
+        # Target QPS for the query load. None - num_idx concurrent queries
+        self.query_qps = query_qps
+        self.query_engine = None
         self.num_indexes = num_idx
         self.bucket_util = bucket_util
         self.cluster = cluster
@@ -82,6 +85,13 @@ class DoctorN1QL():
 
     def discharge_N1QL(self):
         self.stop_run = True
+        if self.query_engine is not None:
+            self.query_engine.stop()
+            self.query_engine.print_stats()
+            failed = self.query_engine.stats.get(QueryBackend.FAILED) \
+                + self.query_engine.stats.get(QueryBackend.ERROR)
+            if failed:
+                self.log.error("N1QL queries failed / errored: %s" % failed)
 
     def create_indexes(self):
         for index in self.indexes.values():
@@ -121,89 +131,16 @@ class DoctorN1QL():
             self.execute_statement_on_n1ql(build_query)
 
     def start_query_load(self):
-        th = threading.Thread(target=self._run_concurrent_queries,
-                              kwargs=dict(num_queries=self.num_indexes))
-        th.start()
+        self.query_engine = QueryLoadEngine(
+            N1QLQueryBackend(self), self.queries,
+            num_workers=self.num_indexes, qps=self.query_qps, name="N1QL")
+        self.query_engine.start()
 
         monitor = threading.Thread(target=self.monitor_query_status,
                                    kwargs=dict(duration=0,
                                                print_duration=60))
         monitor.start()
 
-    def _run_concurrent_queries(self, num_queries):
-        threads = []
-        self.total_query_count = 0
-        query_count = 0
-        for i in range(0, num_queries):
-            self.total_query_count += 1
-            threads.append(Thread(
-                target=self._run_query,
-                name="query_thread_{0}".format(self.total_query_count),
-                args=(random.choice(self.queries), False, 0)))
-
-        i = 0
-        for thread in threads:
-            i += 1
-            if i % self.concurrent_batch_size == 0:
-                time.sleep(5)
-            thread.start()
-            query_count += 1
-
-        i = 0
-        while not self.stop_run:
-            threads = []
-            new_queries_to_run = num_queries - self.total_count
-            for i in range(0, new_queries_to_run):
-                self.total_query_count += 1
-                threads.append(Thread(
-                    target=self._run_query,
-                    name="query_thread_{0}".format(self.total_query_count),
-                    args=(random.choice(self.queries), False, 0)))
-            i = 0
-            self.total_count += new_queries_to_run
-            for thread in threads:
-                i += 1
-                thread.start()
-
-            time.sleep(2)
-        if self.failed_count + self.error_count != 0:
-            raise Exception("Queries Failed:%s , Queries Error Out:%s" %
-                            (self.failed_count, self.error_count))
-
-    def _run_query(self, query, validate_item_count=False, expected_count=0):
-        name = threading.currentThread().getName()
-        client_context_id = name
-        try:
-            status, _, _, results, _ = self.execute_statement_on_n1ql(
-                query, client_context_id=client_context_id)
-            if status == QueryStatus.SUCCESS:
-                if validate_item_count:
-                    if results[0]['$1'] != expected_count:
-                        self.failed_count += 1
-                        self.total_count -= 1
-                    else:
-                        self.success_count += 1
-                        self.total_count -= 1
-                else:
-                    self.success_count += 1
-                    self.total_count -= 1
-            else:
-                self.failed_count += 1
-                self.total_count -= 1
-        except Exception as e:
-            if e == TimeoutException or e == AmbiguousTimeoutException:
-                self.timeout_count += 1
-                self.total_count -= 1
-            elif e == RequestCanceledException:
-                self.cancel_count += 1
-                self.total_count -= 1
-            elif e == CouchbaseException:
-                self.rejected_count += 1
-                self.total_count -= 1
-            else:
-                self.error_count += 1
-                self.total_count -= 1
-
     def execute_statement_on_n1ql(self, statement,
                                   client_context_id=None):
         """
@@ -252,66 +189,35 @@ class DoctorN1QL():
             options.clientContextId(client_context_id)
 
         output = {}
-        try:
-            result = self.cluster_conn.query(statement)
+        result = self.cluster_conn.query(statement)
 
-            output["status"] = result.metaData().status()
-            output["metrics"] = result.metaData().metrics()
+        output["status"] = result.metaData().status()
+        output["metrics"] = result.metaData().metrics()
+
+        try:
+            output["results"] = result.rowsAsObject()
+        except:
+            output["results"] = None
+
+        if str(output['status']) == QueryStatus.FATAL:
+            msg = output['errors'][0]['msg']
+            if "Job requirement" in msg and "exceeds capacity" in msg:
+                raise Exception("Capacity cannot meet job requirement")
+        elif output['status'] == QueryStatus.SUCCESS:
+            output["errors"] = None
+        else:
+            raise Exception("N1QL query failed")
 
-            try:
-                output["results"] = result.rowsAsObject()
-            except:
-                output["results"] = None
-
-            if str(output['status']) == QueryStatus.FATAL:
-                msg = output['errors'][0]['msg']
-                if "Job requirement" in msg and "exceeds capacity" in msg:
-                    raise Exception("Capacity cannot meet job requirement")
-            elif output['status'] == QueryStatus.SUCCESS:
-                output["errors"] = None
-            else:
-                raise Exception("N1QL query failed")
-
-        except InternalServerFailureException as e:
-            print(e)
-            traceback.print_exc()
-            raise Exception(e)
-        except TimeoutException | AmbiguousTimeoutException as e:
-            raise Exception(e)
-        except RequestCanceledException as e:
-            raise Exception(e)
-        except CouchbaseException as e:
-            raise Exception(e)
-        except Exception as e:
-            print(e)
-            traceback.print_exc()
         return output
 
     def monitor_query_status(self, duration=0, print_duration=600):
         st_time = time.time()
-        update_time = time.time()
-        if duration == 0:
-            while not self.stop_run:
-                if st_time + print_duration < time.time():
-                    print("%s N1QL queries submitted, %s failed, \
-                        %s passed, %s rejected, \
-                        %s cancelled, %s timeout, %s errored" % (
-                        self.total_query_count, self.failed_count,
-                        self.success_count, self.rejected_count,
-                        self.cancel_count, self.timeout_count,
-                        self.error_count))
-                    st_time = time.time()
-        else:
-            while st_time + duration > time.time():
-                if update_time + print_duration < time.time():
-                    print("%s N1QL queries submitted, %s failed, \
-                        %s passed, %s rejected, \
-                        %s cancelled, %s timeout, %s errored" % (
-                        self.total_query_count, self.failed_count,
-                        self.success_count, self.rejected_count,
-                        self.cancel_count, self.timeout_count,
-                        self.error_count))
-                    update_time = time.time()
+        while not self.stop_run:
+            if duration and st_time + duration < time.time():
+                break
+            time.sleep(print_duration)
+            if self.query_engine is not None:
+                print("N1QL: %s" % self.query_engine.status_line())
 
     def crash_index_plasma(self, nodes=None):
         self.crash_count = 0
@@ -59,6 +59,8 @@ class Murphy(BaseTestCase, OPD):
         self.backup_nodes = self.input.param("backup_nodes", 0)
         self.xdcr_remote_nodes = self.input.param("xdcr_remote_nodes", 0)
         self.num_indexes = self.input.param("num_indexes", 0)
+        self.query_qps = self.input.param("query_qps", None)
+        self.query_via_rest = self.input.param("query_via_rest", False)
         self.mutation_perc = 100
         self.doc_ops = self.input.param("doc_ops", "create")
         if self.doc_ops:
@@ -140,14 +142,17 @@ class Murphy(BaseTestCase, OPD):
 
         if self.cluster.cbas_nodes:
             self.drCBAS = DoctorCBAS(self.cluster, self.bucket_util,
-                                     self.num_indexes)
+                                     self.num_indexes,
+                                     query_qps=self.query_qps,
+                                     query_via_rest=self.query_via_rest)
 
         if self.cluster.backup_nodes:
             self.drBackup = DoctorBKRS(self.cluster)
 
         if self.cluster.index_nodes:
             self.drIndex = DoctorN1QL(self.cluster, self.bucket_util,
-                                      self.num_indexes)
+                                      self.num_indexes,
+                                      query_qps=self.query_qps)
         if self.cluster.fts_nodes:
             self.drFTS = DoctorFTS(self.cluster, self.bucket_util,
                                    self.num_indexes)
@@ -6,9 +6,11 @@ from datetime import datetime
 import global_vars
 from BucketLib.bucket import Bucket
 from Cb_constants import CbServer
-from Jython_tasks.task_manager import TaskManager
+from Jython_tasks.task_manager import TaskManager, SchedulerMode
 from SystemEventLogLib.Events import EventHelper
 from TestInput import TestInputSingleton
+from connections.rest_connection_pool import RestConnectionPool
+from connections.topology_cache import ClusterTopologyCache
 from bucket_utils.bucket_ready_functions import DocLoaderUtils
 from common_lib import sleep
 from couchbase_helper.cluster import ServerTasks
@@ -29,7 +31,11 @@ class CouchbaseBaseTest(unittest.TestCase):
                                                 "error").upper()
         self.test_timeout = self.input.param("test_timeout", 3600)
         self.thread_to_use = self.input.param("threads_to_use", 30)
+        self.task_scheduler = self.input.param("task_scheduler",
+                                               SchedulerMode.FIXED)
         self.case_number = self.input.param("case_number", 0)
+        RestConnectionPool.enabled = self.input.param("rest_keep_alive",
+                                                      True)
 
         self.skip_teardown_cleanup = self.input.param("skip_teardown_cleanup",
                                                       False)
@@ -161,7 +167,8 @@ class CouchbaseBaseTest(unittest.TestCase):
         self.sleep = sleep
 
         # Support lib objects for testcase execution
-        self.task_manager = TaskManager(self.thread_to_use)
+        self.task_manager = TaskManager(self.thread_to_use,
+                                        scheduler=self.task_scheduler)
         self.task = ServerTasks(self.task_manager)
         self.node_utils = NodeUtils(self.task_manager)
         # End of library object creation
@@ -228,3 +235,5 @@ class CouchbaseBaseTest(unittest.TestCase):
         self.task_manager.shutdown_task_manager()
         self.task.shutdown(force=True)
         self.task_manager.abort_all_tasks()
+        # Stop the topology stream threads started during the test
+        ClusterTopologyCache.stop_all()
@@ -6,6 +6,7 @@ from gsiLib.gsiHelper import GsiHelper
 from newtuq import QueryTests
 from couchbase_helper.tuq_generators import TuqGenerators
 from couchbase_helper.query_definitions import SQLDefinitionGenerator
+from couchbase_helper.result_diff import ResultDiff
 from membase.api.rest_client import RestConnection
 from remote.remote_util import RemoteMachineShellConnection
 
@@ -678,15 +679,8 @@ class BaseSecondaryIndexingTests(QueryTests):
         return scan_vectors
 
     def check_missing_and_extra(self, actual, expected):
-        missing = []
-        extra = []
-        for item in actual:
-            if not (item in expected):
-                extra.append(item)
-        for item in expected:
-            if not (item in actual):
-                missing.append(item)
-        return missing, extra
+        diff = ResultDiff().add_actual(actual).add_expected(expected)
+        return diff.missing(), diff.extra()
 
     def _verify_results(self, actual_result, expected_result, missing_count=1,
                         extra_count=1):
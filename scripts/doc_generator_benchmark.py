@@ -0,0 +1,56 @@
+"""
+Measures the docs/s generated by BatchedDocumentGenerator for the
+default, deep_copy and fast_mode generation engines.
+
+Needs the Java SDK jars in the classpath, like the testrunner:
+  jython scripts/doc_generator_benchmark.py [num_docs] [batch_size]
+"""
+import sys
+import time
+
+sys.path = [".", "lib", "pytests", "couchbase_utils", "platform_utils",
+            "connections", "constants"] + sys.path
+
+from couchbase_helper.documentgenerator import doc_generator, \
+    BatchedDocumentGenerator
+
+MODES = [("default", dict()),
+         ("deep_copy", {"deep_copy": True}),
+         ("fast", {"fast_mode": True})]
+
+DOC_OPTIONS = [("256B", {"doc_size": 256}),
+               ("4KB", {"doc_size": 4096}),
+               ("4KB random_value", {"doc_size": 4096,
+                                     "randomize_value": True}),
+               ("4KB random_size", {"doc_size": 4096,
+                                    "randomize_doc_size": True,
+                                    "randomize_value": True})]
+
+
+def run(num_docs, batch_size, doc_options, mode_options):
+    kwargs = dict(doc_options)
+    kwargs.update(mode_options)
+    generator = BatchedDocumentGenerator(
+        doc_generator("bench_docs", 0, num_docs, **kwargs), batch_size)
+    start_time = time.time()
+    while generator.has_next():
+        generator.next_batch()
+    return num_docs / max(time.time() - start_time, 1e-6)
+
+
+def main():
+    num_docs = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    # Warm up the JIT before measuring
+    run(min(num_docs, 20000), batch_size, DOC_OPTIONS[0][1], dict())
+
+    print("%-20s %12s %12s %12s"
+          % tuple(["docs/s"] + [mode for mode, _ in MODES]))
+    for doc_name, doc_options in DOC_OPTIONS:
+        rates = [run(num_docs, batch_size, doc_options, mode_options)
+                 for _, mode_options in MODES]
+        print("%-20s %12d %12d %12d" % tuple([doc_name] + rates))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+Micro-benchmark of the MemcachedClient binary protocol engine.
+
+ - encode: requests/s encoded and sent over a socketpair, with one
+           sendall per request (previous _sendMsg) vs one per batch of
+           PIPELINE_BATCH_SIZE requests from the request buffer
+ - decode: responses/s decoded by the recv()/+= loop (previous
+           _recvMsg) vs the buffered recv_into reader, over a socketpair
+ - server: ops/s of per-key set()/get() vs the pipelined
+           setMulti()/getMulti(), only when a memcached host is given
+
+Usage:
+  jython scripts/mc_bin_client_benchmark.py [num_ops] [value_size]
+         [host:port bucket username password]
+"""
+import socket
+import struct
+import sys
+import threading
+import time
+
+sys.path = [".", "lib", "pytests", "couchbase_utils", "platform_utils",
+            "connections", "constants"] + sys.path
+
+import memcacheConstants
+from memcacheConstants import MIN_RECV_PACKET, REQ_MAGIC_BYTE, \
+    REQ_PKT_FMT, RES_MAGIC_BYTE, RES_PKT_FMT
+from mc_bin_client import MemcachedClient, _RequestBuffer, _ResponseReader
+
+
+def legacy_encode(cmd, key, val, opaque, extra_header="", cas=0,
+                  vbucket_id=0):
+    msg = struct.pack(REQ_PKT_FMT, REQ_MAGIC_BYTE, cmd, len(key),
+                      len(extra_header), 0, vbucket_id,
+                      len(key) + len(extra_header) + len(val), opaque, cas)
+    return msg + extra_header + key + val
+
+
+def legacy_recv(sock):
+    response = b""
+    while len(response) < MIN_RECV_PACKET:
+        response += sock.recv(MIN_RECV_PACKET - len(response))
+    _, cmd, keylen, extralen, dtype, errcode, remaining, opaque, cas = \
+        struct.unpack(RES_PKT_FMT, response)
+    rv = b""
+    while remaining > 0:
+        data = sock.recv(remaining)
+        rv += data
+        remaining -= len(data)
+    return cmd, errcode, opaque, cas, keylen, extralen, dtype, rv
+
+
+def rate(num_ops, func):
+    start_time = time.time()
+    func()
+    return num_ops / max(time.time() - start_time, 1e-6)
+
+
+def drain(sock):
+    while sock.recv(1024 * 1024):
+        pass
+
+
+def bench_encode(num_ops, value):
+    extra = struct.pack(memcacheConstants.SET_PKT_FMT, 0, 0)
+    keys = ["key_%d" % index for index in range(num_ops)]
+
+    def send(encode_and_send):
+        writer_sock, reader_sock = socket.socketpair()
+        reader = threading.Thread(target=drain, args=(reader_sock,))
+        reader.start()
+        try:
+            return rate(num_ops, lambda: encode_and_send(writer_sock))
+        finally:
+            writer_sock.close()
+            reader.join()
+            reader_sock.close()
+
+    def legacy(sock):
+        for index, key in enumerate(keys):
+            sock.sendall(legacy_encode(memcacheConstants.CMD_SETQ, key,
+                                       value, index, extra))
+
+    def buffered(sock):
+        requests = _RequestBuffer()
+        for index, key in enumerate(keys):
+            requests.append(memcacheConstants.CMD_SETQ, key, value, index,
+                            extra)
+            if index % MemcachedClient.PIPELINE_BATCH_SIZE == 0 \
+                    or len(requests) >= MemcachedClient.PIPELINE_BATCH_BYTES:
+                sock.sendall(requests.buf)
+                requests.clear()
+        sock.sendall(requests.buf)
+
+    return send(legacy), send(buffered)
+
+
+def bench_decode(num_ops, value):
+    response = struct.pack(RES_PKT_FMT, RES_MAGIC_BYTE,
+                           memcacheConstants.CMD_GETQ, 0, 4, 0, 0,
+                           4 + len(value), 0, 0) + b"\0\0\0\0" + value
+    stream = response * num_ops
+
+    def decode(read_response):
+        reader_sock, writer_sock = socket.socketpair()
+        writer = threading.Thread(target=writer_sock.sendall, args=(stream,))
+        writer.start()
+        try:
+            return rate(num_ops, lambda: read_response(reader_sock))
+        finally:
+            writer.join()
+            reader_sock.close()
+            writer_sock.close()
+
+    def legacy(sock):
+        for _ in range(num_ops):
+            legacy_recv(sock)
+
+    def buffered(sock):
+        reader = _ResponseReader(sock, "socketpair")
+        for _ in range(num_ops):
+            reader.read_response(greedy=True)
+
+    return decode(legacy), decode(buffered)
+
+
+def bench_server(num_ops, value, host, port, bucket, username, password):
+    client = MemcachedClient(host, int(port))
+    client.sasl_auth_plain(username, password)
+    client.bucket_select(bucket)
+    items = dict(("bench_%d" % index, value) for index in range(num_ops))
+
+    def single():
+        for key, val in items.items():
+            client.set(key, 0, 0, val)
+        for key in items:
+            client.get(key)
+
+    def pipelined():
+        client.setMulti(0, 0, items)
+        client.getMulti(items.keys())
+
+    try:
+        return rate(2 * num_ops, single), rate(2 * num_ops, pipelined)
+    finally:
+        client.close()
+
+
+def main():
+    num_ops = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    value = b"v" * (int(sys.argv[2]) if len(sys.argv) > 2 else 256)
+
+    print("%-10s %15s %15s" % ("ops/s", "previous", "pipelined"))
+    print("%-10s %15d %15d" % (("encode",) + bench_encode(num_ops, value)))
+    print("%-10s %15d %15d" % (("decode",) + bench_decode(num_ops, value)))
+    if len(sys.argv) > 6:
+        host, port = sys.argv[3].split(":")
+        print("%-10s %15d %15d"
+              % (("server",) + bench_server(num_ops, value, host, port,
+                                            *sys.argv[4:7])))
+
+
+if __name__ == "__main__":
+    main()
@@ -7,7 +7,7 @@ sys.path = ["lib", "pytests", "pysystests"] + sys.path
 import time
 from xunit import XUnitTestResult
 import glob
-import xml.dom.minidom
+import xml.etree.ElementTree as ElementTree
 import logging
 
 log = logging.getLogger(__name__)
@@ -20,56 +20,43 @@ def filter_fields(testname, run_params=""):
     if "logs_folder:" in testname:
         testwords = testname.split(",")
         line = ""
-        filter_test_params = ['logs_folder', 'conf_file',
-                            'cluster_name:', 'ini:', 'case_number:',
-                            'num_nodes:', 'spec:', 'is_container:']
-        filter_test_params.extend([param.split("=")[0] for param in
-                            run_params.split(',')])
+        filter_test_params = _filter_prefixes(
+            ['logs_folder', 'conf_file', 'cluster_name:', 'ini:',
+             'case_number:', 'num_nodes:', 'spec:', 'is_container:'],
+            run_params)
         for fw in testwords:
-            filter_word = False
-            for filter_words in filter_test_params:
-                if filter_words and fw.startswith(filter_words):
-                    filter_word = True
-            if not filter_word:
+            if not fw.startswith(filter_test_params):
                 line = line + fw.replace(":", "=", 1)
                 if fw != testwords[-1]:
                     line = line + ","
         return line.rstrip(',')
     else:
         testwords = testname.split(",")
-        line = []
-        filter_test_params = ['logs_folder=', 'conf_file=',
-                            'cluster_name=', 'ini=', 'case_number=',
-                            'num_nodes=', 'spec=', 'is_container=']
-        filter_test_params.extend([param.split("=")[0] for param in
-                            run_params.split(',')])
-        for fw in testwords:
-            filter_word = False
-            for filter_words in filter_test_params:
-                if filter_words and fw.startswith(filter_words):
-                    filter_word = True
-            if not filter_word:
-                line.append(fw)
-        return ",".join(line)
+        filter_test_params = _filter_prefixes(
+            ['logs_folder=', 'conf_file=', 'cluster_name=', 'ini=',
+             'case_number=', 'num_nodes=', 'spec=', 'is_container='],
+            run_params)
+        return ",".join([fw for fw in testwords
+                         if not fw.startswith(filter_test_params)])
 
 
-def compare_with_sort(dict, key):
-    key_split = key.split(',')
-    key = '%s,%s' % (key_split[0], ','.join(sorted(key_split[1:])))
-    for k in dict.keys():
-        test_case_split = k.split(',')
-        test_case = "%s,%s" % (test_case_split[0],
-                               ",".join(sorted(test_case_split[1:])))
-        if key == test_case:
-            return True, k
+def _filter_prefixes(filter_test_params, run_params):
+    filter_test_params.extend([param.split("=")[0] for param in
+                               run_params.split(',')])
+    return tuple([param for param in filter_test_params if param])
 
-    return False, None
 
+def canonical_test_id(testname):
+    """
+    :param testname: Filtered test name, 'test_name,param1=v1,param2=v2'
+    :return: Test name with the params sorted, identical for any order
+             of the params
+    """
+    test_split = testname.split(',')
+    return '%s,%s' % (test_split[0], ','.join(sorted(test_split[1:])))
 
-def merge_reports(filespath, run_params=""):
-    log.info("Merging of report files from " + str(filespath))
 
-    testsuites = {}
+def get_xml_files(filespath):
     if not isinstance(filespath, list):
         filespaths = filespath.split(",")
     else:
@@ -79,58 +66,73 @@ def merge_reports(filespath, run_params=""):
         if not isinstance(filespath, list) and filespath.find("*"):
             xml_files.sort(key=os.path.getmtime)
         for xml_file in xml_files:
-            log.info("-- " + xml_file + " --")
-            doc = xml.dom.minidom.parse(xml_file)
-            testsuitelem = doc.getElementsByTagName("testsuite")
-            for ts in testsuitelem:
-                tsname = ts.getAttribute("name")
-                tserros = ts.getAttribute("errors")
-                tsfailures = ts.getAttribute("failures")
-                tsskips = ts.getAttribute("skips")
-                tstime = ts.getAttribute("time")
-                tstests = ts.getAttribute("tests")
-                issuite_existed = False
-                tests = {}
-                testsuite = {}
-                # fill testsuite details
-                if tsname in testsuites.keys():
-                    testsuite = testsuites[tsname]
-                    tests = testsuite['tests']
-                else:
-                    testsuite['name'] = tsname
-                testsuite['errors'] = tserros
-                testsuite['failures'] = tsfailures
-                testsuite['skips'] = tsskips
-                testsuite['time'] = tstime
-                testsuite['testcount'] = tstests
-                issuite_existed = False
-                testcaseelem = ts.getElementsByTagName("testcase")
-                # fill test case details
-                for tc in testcaseelem:
-                    testcase = {}
-                    tcname = tc.getAttribute("name")
-                    tctime = tc.getAttribute("time")
-                    tcerror = tc.getElementsByTagName("error")
-
-                    tcname_filtered = filter_fields(tcname, run_params)
-                    test_case_present, key = compare_with_sort(tests,
-                                                               tcname_filtered)
-                    if test_case_present:
-                        testcase = tests[key]
-                        testcase['name'] = tcname
-                    else:
-                        testcase['name'] = tcname
-                    testcase['time'] = tctime
-                    testcase['error'] = ""
-                    if tcerror:
-                        testcase['error'] = str(
-                            tcerror[0].firstChild.nodeValue)
-                    if test_case_present:
-                        tests[key] = testcase
-                    else:
-                        tests[tcname_filtered] = testcase
-                testsuite['tests'] = tests
+            yield xml_file
+
+
+def merge_xml_file(xml_file, testsuites, test_ids, run_params=""):
+    """
+    Merges the testsuites of the xunit file into 'testsuites'.
+    The file is parsed as a stream and every testcase is dropped once
+    merged, so the memory does not grow with the size of the file.
+    :param xml_file: xunit xml file path
+    :param testsuites: Merged testsuites, as returned by merge_reports()
+    :param test_ids: testsuite name -> {canonical_test_id: key in the
+                     testsuite's tests}, shared across the calls
+    :param run_params: Params to filter out of the test names
+    """
+    suite_stack = []
+    for event, elem in ElementTree.iterparse(xml_file,
+                                             events=("start", "end")):
+        if elem.tag == "testsuite":
+            if event == "end":
+                suite_stack.pop()
+                elem.clear()
+                continue
+            tsname = elem.get("name", "")
+            # fill testsuite details
+            testsuite = testsuites.get(tsname)
+            if testsuite is None:
+                testsuite = {'name': tsname, 'tests': {}}
                 testsuites[tsname] = testsuite
+                test_ids[tsname] = {}
+            testsuite['errors'] = elem.get("errors", "")
+            testsuite['failures'] = elem.get("failures", "")
+            testsuite['skips'] = elem.get("skips", "")
+            testsuite['time'] = elem.get("time", "")
+            testsuite['testcount'] = elem.get("tests", "")
+            suite_stack.append(tsname)
+        elif elem.tag == "testcase" and event == "end":
+            if suite_stack:
+                merge_testcase(elem, testsuites[suite_stack[-1]]['tests'],
+                               test_ids[suite_stack[-1]], run_params)
+            elem.clear()
+
+
+def merge_testcase(tc, tests, test_ids, run_params=""):
+    # fill test case details
+    tcname = tc.get("name", "")
+    tcname_filtered = filter_fields(tcname, run_params)
+    test_id = canonical_test_id(tcname_filtered)
+    key = test_ids.get(test_id)
+    if key is None:
+        key = test_ids[test_id] = tcname_filtered
+    testcase = tests.setdefault(key, {})
+    testcase['name'] = tcname
+    testcase['time'] = tc.get("time", "")
+    testcase['error'] = ""
+    tcerror = tc.find(".//error")
+    if tcerror is not None:
+        testcase['error'] = str(tcerror.text or tcerror.get("type", ""))
+
+
+def merge_reports(filespath, run_params=""):
+    log.info("Merging of report files from " + str(filespath))
+
+    testsuites = {}
+    test_ids = {}
+    for xml_file in get_xml_files(filespath):
+        log.info("-- " + xml_file + " --")
+        merge_xml_file(xml_file, testsuites, test_ids, run_params)
     try:
         abs_path = os.path.dirname(os.path.abspath(sys.argv[0]))
         abs_path = abs_path.rstrip("scripts")
@@ -148,57 +150,65 @@ def merge_reports(filespath, run_params=""):
         log.info("\nTestSuite#" + str(tsindex) + ") " + str(
             tskey) + ", Number of Tests=" + str(
             len(testsuites[tskey]['tests'])))
-        pass_count = 0
-        fail_count = 0
-        tests = testsuites[tskey]['tests']
-        xunit = XUnitTestResult()
-        for testname in tests.keys():
-            testcase = tests[testname]
-            tname = testcase['name']
-            ttime = testcase['time']
-            inttime = float(ttime)
-            terrors = testcase['error']
-            tparams = ""
-            if "," in tname:
-                tparams = tname[tname.find(","):]
-                tname = tname[:tname.find(",")]
-
-            if terrors:
-                failed = True
-                fail_count = fail_count + 1
-                xunit.add_test(name=tname, status='fail', time=inttime,
-                               errorType='membase.error',
-                               errorMessage=str(terrors), params=tparams
-                               )
-            else:
-                passed = True
-                pass_count = pass_count + 1
-                xunit.add_test(name=tname, time=inttime, params=tparams
-                               )
-
-        str_time = time.strftime("%y-%b-%d_%H-%M-%S", time.localtime())
-        root_log_dir = os.path.join(logs_directory,
-                                    "testrunner-{0}".format(
-                                        str_time))
-        if not os.path.exists(root_log_dir):
-            os.makedirs(root_log_dir)
-        logs_folder = os.path.join(root_log_dir, "merged_summary")
-        try:
-            os.mkdir(logs_folder)
-        except:
-            pass
-        output_filepath = "{0}{2}mergedreport-{1}".format(logs_folder,
-                                                          str_time,
-                                                          os.sep).strip()
-
-        xunit.write(output_filepath)
-        xunit.print_summary()
-        log.info(
-            "Summary file is at " + output_filepath + "-" + tsname +
-            ".xml")
+        write_merged_report(testsuites[tskey], logs_directory)
     return testsuites
 
 
+def write_merged_report(testsuite, logs_directory):
+    """
+    Writes the merged testsuite as xunit report(s) under
+    logs_directory/testrunner-<time>/merged_summary
+    :return: Path prefix of the written report files
+    """
+    pass_count = 0
+    fail_count = 0
+    tests = testsuite['tests']
+    xunit = XUnitTestResult()
+    for testname in tests.keys():
+        testcase = tests[testname]
+        tname = testcase['name']
+        ttime = testcase['time']
+        inttime = float(ttime)
+        terrors = testcase['error']
+        tparams = ""
+        if "," in tname:
+            tparams = tname[tname.find(","):]
+            tname = tname[:tname.find(",")]
+
+        if terrors:
+            fail_count = fail_count + 1
+            xunit.add_test(name=tname, status='fail', time=inttime,
+                           errorType='membase.error',
+                           errorMessage=str(terrors), params=tparams
+                           )
+        else:
+            pass_count = pass_count + 1
+            xunit.add_test(name=tname, time=inttime, params=tparams
+                           )
+
+    str_time = time.strftime("%y-%b-%d_%H-%M-%S", time.localtime())
+    root_log_dir = os.path.join(logs_directory,
+                                "testrunner-{0}".format(
+                                    str_time))
+    if not os.path.exists(root_log_dir):
+        os.makedirs(root_log_dir)
+    logs_folder = os.path.join(root_log_dir, "merged_summary")
+    try:
+        os.mkdir(logs_folder)
+    except:
+        pass
+    output_filepath = "{0}{2}mergedreport-{1}".format(logs_folder,
+                                                      str_time,
+                                                      os.sep).strip()
+
+    xunit.write(output_filepath)
+    xunit.print_summary()
+    log.info(
+        "Summary file is at " + output_filepath + "-" + testsuite['name'] +
+        ".xml")
+    return output_filepath
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description='Process some integers.')
@@ -0,0 +1,212 @@
+"""
+Measures merge_reports on synthetic xunit reports: a first run of
+num_tests tests followed by reruns of the failed tests, with the test
+params in a different order and new logs_folder / case_number values.
+
+ - merge: minidom parsing + linear compare_with_sort() lookups (previous
+          merge_reports) vs streaming iterparse + canonical test-id index
+ - write: minidom toprettyxml() (previous XUnitTestResult.to_xml()) vs
+          streaming XUnitTestSuite.write_xml()
+
+The previous implementations are kept here, as legacy_* functions.
+
+The previous merge is quadratic in the number of tests, so it only runs
+for the sizes up to legacy_max_tests.
+
+Usage:
+  python scripts/merge_reports_benchmark.py [num_tests] [reruns]
+         [legacy_max_tests]
+"""
+import glob
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import xml.dom.minidom
+
+sys.path = [".", "lib", "scripts"] + sys.path
+
+import merge_reports
+from merge_reports import canonical_test_id, filter_fields
+from xunit import XUnitTestResult
+
+TESTS_PER_SUITE = 500
+FAILURE_RATE = 0.1
+
+
+def test_name(index):
+    params = ["nodes_init=%d" % (index % 4 + 1), "num_items=%d" % index,
+              "replicas=%d" % (index % 3), "durability=MAJORITY",
+              "doc_size=%d" % (256 * (index % 8 + 1))]
+    return "pytests.suite_%d.Tests.test_%d" % (index // TESTS_PER_SUITE,
+                                               index), params
+
+
+def write_report(file_path, tests, run):
+    xunit = XUnitTestResult()
+    for index in tests:
+        name, params = test_name(index)
+        random.shuffle(params)
+        params = params + ["logs_folder=/tmp/logs/run_%d/test_%d"
+                           % (run, index), "case_number=%d" % index]
+        if random.random() < FAILURE_RATE:
+            xunit.add_test(name=name, status='fail', time=1.5,
+                           errorType='membase.error',
+                           errorMessage="failed in run %d" % run,
+                           params="," + ",".join(params))
+        else:
+            xunit.add_test(name=name, time=1.5, params="," + ",".join(params))
+    xunit.write(file_path)
+    return xunit
+
+
+def generate_reports(directory, num_tests, reruns):
+    tests = list(range(num_tests))
+    for run in range(reruns + 1):
+        xunit = write_report(os.path.join(directory, "report-%d" % run),
+                             tests, run)
+        tests = [int(test.name.rsplit("_", 1)[1])
+                 for suite in xunit.suites for test in suite.tests
+                 if test.error]
+    return [os.path.join(directory, "report-%d-*.xml" % run)
+            for run in range(reruns + 1)]
+
+
+def compare_with_sort(tests, key):
+    test_id = canonical_test_id(key)
+    for k in tests.keys():
+        if canonical_test_id(k) == test_id:
+            return True, k
+    return False, None
+
+
+def legacy_merge(filespaths, run_params=""):
+    testsuites = {}
+    for filepath in filespaths:
+        for xml_file in sorted(glob.glob(filepath)):
+            doc = xml.dom.minidom.parse(xml_file)
+            for ts in doc.getElementsByTagName("testsuite"):
+                tsname = ts.getAttribute("name")
+                testsuite = testsuites.setdefault(tsname, {'name': tsname,
+                                                           'tests': {}})
+                testsuite['errors'] = ts.getAttribute("errors")
+                testsuite['failures'] = ts.getAttribute("failures")
+                testsuite['skips'] = ts.getAttribute("skips")
+                testsuite['time'] = ts.getAttribute("time")
+                testsuite['testcount'] = ts.getAttribute("tests")
+                tests = testsuite['tests']
+                for tc in ts.getElementsByTagName("testcase"):
+                    tcname = tc.getAttribute("name")
+                    tcerror = tc.getElementsByTagName("error")
+                    tcname_filtered = filter_fields(tcname, run_params)
+                    present, key = compare_with_sort(tests, tcname_filtered)
+                    testcase = tests[key] if present else {}
+                    testcase['name'] = tcname
+                    testcase['time'] = tc.getAttribute("time")
+                    testcase['error'] = ""
+                    if tcerror:
+                        testcase['error'] = str(
+                            tcerror[0].firstChild.nodeValue)
+                    tests[key if present else tcname_filtered] = testcase
+    return testsuites
+
+
+def merge(filespaths, run_params=""):
+    testsuites = {}
+    test_ids = {}
+    for filepath in filespaths:
+        for xml_file in sorted(glob.glob(filepath)):
+            merge_reports.merge_xml_file(xml_file, testsuites, test_ids,
+                                         run_params)
+    return testsuites
+
+
+def build_xunit(testsuites):
+    xunit = XUnitTestResult()
+    for testsuite in testsuites.values():
+        for testcase in testsuite['tests'].values():
+            name = testcase['name']
+            status = 'fail' if testcase['error'] else 'pass'
+            xunit.add_test(name=name[:name.find(",")], status=status,
+                           time=float(testcase['time']),
+                           errorType='membase.error',
+                           errorMessage=testcase['error'],
+                           params=name[name.find(","):])
+    return xunit
+
+
+def legacy_to_xml(suite):
+    doc = xml.dom.minidom.Document()
+    testsuite = doc.createElement('testsuite')
+    testsuite.setAttribute('name', suite.name)
+    testsuite.setAttribute('errors', str(suite.errors))
+    testsuite.setAttribute('failures', str(suite.failures))
+    testsuite.setAttribute('tests', str(len(suite.tests)))
+    testsuite.setAttribute('time', str(suite.time))
+    testsuite.setAttribute('skip', str(suite.skips))
+    for testobject in suite.tests:
+        testcase = doc.createElement('testcase')
+        testcase.setAttribute('name', testobject.name + testobject.params)
+        testcase.setAttribute('time', str(testobject.time))
+        if testobject.error:
+            error = doc.createElement('error')
+            error.setAttribute('type', testobject.error.type)
+            if testobject.error.message:
+                message = doc.createTextNode(testobject.error.message)
+                error.appendChild(message)
+            testcase.appendChild(error)
+        testsuite.appendChild(testcase)
+    doc.appendChild(testsuite)
+    return doc.toprettyxml()
+
+
+def legacy_write(xunit, prefix):
+    for suite in xunit.suites:
+        with open("%s-%s.xml" % (prefix, suite.name), "w") as fp:
+            fp.write(legacy_to_xml(suite))
+
+
+def timed(func, *args):
+    start_time = time.time()
+    result = func(*args)
+    return time.time() - start_time, result
+
+
+def main():
+    num_tests = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    reruns = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    legacy_max = int(sys.argv[3]) if len(sys.argv) > 3 else 5000
+
+    print("%-8s %8s %12s %12s %12s %12s"
+          % ("tests", "merged", "merge prev", "merge", "write prev",
+             "write"))
+    for size in sorted(set([min(1000, num_tests), min(legacy_max, num_tests),
+                            num_tests])):
+        directory = tempfile.mkdtemp()
+        try:
+            filespaths = generate_reports(directory, size, reruns)
+            merge_time, testsuites = timed(merge, filespaths)
+            xunit = build_xunit(testsuites)
+            write_time, _ = timed(xunit.write,
+                                  os.path.join(directory, "merged"))
+            legacy_merge_time = legacy_write_time = "-"
+            if size <= legacy_max:
+                legacy_merge_time, legacy_suites = timed(legacy_merge,
+                                                         filespaths)
+                assert legacy_suites == testsuites
+                legacy_merge_time = "%.3f" % legacy_merge_time
+                legacy_write_time = "%.3f" % timed(
+                    legacy_write, xunit, os.path.join(directory, "legacy"))[0]
+            print("%-8d %8d %12s %12.3f %12s %12.3f"
+                  % (size, sum(len(suite['tests'])
+                               for suite in testsuites.values()),
+                     legacy_merge_time, merge_time, legacy_write_time,
+                     write_time))
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Measures the time TuqGenerators takes to compute the expected results
+over JsonGenerator.generate_docs_employee datasets, with the clauses
+compiled once + WHERE indexes vs eval() of the clauses per doc.
+
+Needs the Java SDK jars in the classpath, like the testrunner:
+  jython scripts/tuq_generators_benchmark.py [num_docs]
+"""
+import json
+import sys
+import time
+
+sys.path = [".", "lib", "pytests", "couchbase_utils", "platform_utils",
+            "connections", "constants"] + sys.path
+
+from couchbase_helper.tuq_generators import JsonGenerator, TuqGenerators
+
+QUERIES = [
+    'SELECT * FROM default WHERE job_title = "Sales"',
+    'SELECT name, join_yr FROM default '
+    'WHERE join_yr > 2013 and job_title = "Sales"',
+    'SELECT name FROM default WHERE join_yr >= 2014 ORDER BY name',
+    'SELECT name, join_day FROM default '
+    'WHERE join_day < 5 or job_title = "Support" ORDER BY join_day, name',
+    'SELECT DISTINCT job_title, join_yr FROM default WHERE join_mo = 3',
+    'SELECT job_title, join_yr, COUNT(*) AS cnt FROM default '
+    'GROUP BY job_title, join_yr',
+    'SELECT job_title, MIN(join_day) AS mn FROM default GROUP BY job_title',
+    'SELECT name, vms FROM default UNNEST vms v WHERE join_mo <= 2',
+]
+
+
+class _Log(object):
+    def info(self, msg):
+        pass
+
+
+class EvalTuqGenerators(TuqGenerators):
+    """ Evaluates the clause strings per doc, without indexes """
+    def _compile(self, clause):
+        return lambda doc: eval(clause)
+
+    def _indexed_candidates(self, where_clause):
+        return None
+
+
+def employee_docs(num_docs):
+    docs = list()
+    generator = JsonGenerator().generate_docs_employee(
+        "employee", docs_per_day=num_docs)
+    while generator.has_next():
+        _, value = generator.next()
+        docs.append(json.loads(str(value)))
+    return docs
+
+
+def run(generator_class, docs, query):
+    generator = generator_class(_Log(), docs)
+    generator.generate_query(query)
+    start_time = time.time()
+    result = generator.generate_expected_result(print_expected_result=False)
+    return time.time() - start_time, len(result)
+
+
+def main():
+    num_docs = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    docs = employee_docs(num_docs)
+
+    print("%-8s %10s %10s  %s" % ("rows", "eval (s)", "compiled", "query"))
+    for query in QUERIES:
+        eval_time, num_rows = run(EvalTuqGenerators, docs, query)
+        compiled_time, _ = run(TuqGenerators, docs, query)
+        print("%-8d %10.3f %10.3f  %s"
+              % (num_rows, eval_time, compiled_time, query))
+
+
+if __name__ == "__main__":
+    main()
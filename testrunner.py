@@ -22,7 +22,9 @@ from java.lang import System
 sys.path = [".", "lib", "pytests", "pysystests", "couchbase_utils",
             "platform_utils", "connections", "constants"] + sys.path
 from sdk_client3 import SDKClient
-from remote.remote_util import RemoteMachineShellConnection
+from cb_tools.cbstats import Cbstats
+from connections.rest_connection_pool import RestConnectionPool
+from remote.ssh_session_pool import SSHSessionPool
 from TestInput import TestInputParser, TestInputSingleton
 from xunit import XUnitTestResult
 
@@ -558,10 +560,11 @@ def main():
         start_time = time.time()
 
         # Reset SDK/Shell connection counters
-        RemoteMachineShellConnection.connections = 0
-        RemoteMachineShellConnection.disconnections = 0
+        SSHSessionPool.reset_stats()
         SDKClient.sdk_connections = 0
         SDKClient.sdk_disconnections = 0
+        # Stat connections are not reused across tests
+        Cbstats.close_all_connections()
 
         argument_split = [a.strip()
                           for a in re.split("[,]?([^,=]+)=", name)[1:]]
@@ -655,16 +658,19 @@ def main():
                 print("========TEST WAS STOPPED DUE TO  TIMEOUT=========")
                 result.errors = [(name, "Test was stopped due to timeout")]
         time_taken = time.time() - start_time
+        ssh_stats = SSHSessionPool.get_stats()
         connection_status_msg = \
             "During the test,\n" \
-            "Remote Connections: %s, Disconnections: %s\n" \
+            "Remote Shells: %s, Released: %s\n" \
+            "SSH Sessions opened: %s, reused: %s, reconnects: %s, " \
+            "channels: %s\n" \
             "SDK Connections: %s, Disconnections: %s" \
-            % (RemoteMachineShellConnection.connections,
-               RemoteMachineShellConnection.disconnections,
+            % (ssh_stats["shells_acquired"], ssh_stats["shells_released"],
+               ssh_stats["sessions_opened"], ssh_stats["sessions_reused"],
+               ssh_stats["reconnects"], ssh_stats["channels_opened"],
                SDKClient.sdk_connections, SDKClient.sdk_disconnections)
 
-        if RemoteMachineShellConnection.connections \
-                != RemoteMachineShellConnection.disconnections:
+        if ssh_stats["shells_acquired"] != ssh_stats["shells_released"]:
             connection_status_msg += \
                 "\n!!!!!! CRITICAL :: Shell disconnection mismatch !!!!!"
         if SDKClient.sdk_connections != SDKClient.sdk_disconnections:
@@ -709,6 +715,14 @@ def main():
             print("Test fails, all of the following tests will be skipped!!!")
             break
 
+    # Close the ssh sessions shared across the tests
+    SSHSessionPool.close_all()
+    Cbstats.close_all_connections()
+    # Report the REST latencies and close the pooled keep-alive sockets
+    if RestConnectionPool.enabled:
+        RestConnectionPool.get_pool().print_stats()
+        RestConnectionPool.get_pool().close_all()
+
     if "makefile" in TestInputSingleton.input.test_params:
         # Print fail for those tests which failed and do sys.exit() error code
         fail_count = 0